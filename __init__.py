@@ -21,11 +21,21 @@ import requests
 import socket
 import time
 import traceback
+import uuid
 import io
 from contextlib import redirect_stdout
 
 # 导入文本注记相关的类
 from ai_note import AINODE_Preferences
+# config.json 统一读写器（与后端共享同一实例）
+from config_store import config_store
+# 供后端线程读取的设置快照
+import settings_snapshot
+# 运行指标（节点数据序列化 / 过滤耗时，由后端 /api/metrics 输出）
+import metrics
+# 链路追踪（提问操作符创建根 span，后端的 span 挂在其下）
+from tracing import tracer
+from structured_log import get_logger, log_manager
 from bpy.app.translations import pgettext_iface
 from bpy.props import (
     StringProperty,
@@ -49,6 +59,9 @@ import tempfile
 import sys
 from urllib.parse import urlparse
 
+log = get_logger('addon')
+mcp_log = get_logger('mcp')
+
 # 动态导入后端服务器
 server_manager = None
 
@@ -151,6 +164,7 @@ def _on_provider_update(self, context):
     except Exception as e:
         print(f"更新提供商时出错: {e}")
         pass
+    publish_settings_snapshot(self)
 
 def get_default_question_items(self, context):
     items = []
@@ -388,8 +402,17 @@ def _on_model_update(self, context):
             self.current_model = self.bigmodel_model
     except Exception:
         pass
+    publish_settings_snapshot(self)
 
 def filter_node_description(text, level):
+    """按精细度过滤节点数据，并记录过滤耗时与结果大小"""
+    started = time.perf_counter()
+    filtered = _filter_node_description(text, level)
+    metrics.node_filter_seconds.observe(time.perf_counter() - started, level)
+    metrics.node_payload_bytes.observe(len(filtered.encode('utf-8')) if isinstance(filtered, str) else 0, level)
+    return filtered
+
+def _filter_node_description(text, level):
     try:
         data = json.loads(text)
     except Exception:
@@ -412,9 +435,12 @@ def filter_node_description(text, level):
         if level == 'ULTRA_LITE':
             minimal_name = node.get('name')
             minimal_type = node.get('type')
+            minimal_parent = node.get('parent')
             node.clear()
             node['name'] = minimal_name
             node['type'] = minimal_type
+            if minimal_parent:
+                node['parent'] = minimal_parent
             return
         if level == 'LITE':
             if isinstance(node.get('inputs'), list):
@@ -468,7 +494,7 @@ def send_to_backend(endpoint, data=None, method='GET'):
     """向后端发送请求"""
     global server_manager
     if not server_manager or not server_manager.is_running:
-        print("后端服务器未运行")
+        log.debug("后端服务器未运行", endpoint=endpoint)
         return None
 
     try:
@@ -484,10 +510,10 @@ def send_to_backend(endpoint, data=None, method='GET'):
         if response.status_code == 200:
             return response.json()
         else:
-            print(f"请求失败: {response.status_code} - {response.text}")
+            log.warning("后端请求失败", endpoint=endpoint, status=response.status_code, body=response.text[:500])
             return None
     except Exception as e:
-        print(f"发送请求到后端时出错: {e}")
+        log.warning("发送请求到后端时出错", endpoint=endpoint, error=str(e))
         return None
 
 def push_blender_content_to_server(context=None):
@@ -610,21 +636,17 @@ def _save_ai_params_to_config_from_context(context):
             ain_settings = bpy.data.scenes[0].ainode_analyzer_settings
         else:
             return
-    config_path = os.path.join(os.path.dirname(__file__), 'config.json')
-    existing_config = {}
-    if os.path.exists(config_path):
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                existing_config = json.load(f)
-        except Exception:
-            existing_config = {}
-    if 'ai' not in existing_config:
-        existing_config['ai'] = {}
-    existing_config['ai']['temperature'] = ain_settings.temperature
-    existing_config['ai']['top_p'] = ain_settings.top_p
+    temperature = ain_settings.temperature
+    top_p = ain_settings.top_p
+
+    def apply(existing_config):
+        if 'ai' not in existing_config:
+            existing_config['ai'] = {}
+        existing_config['ai']['temperature'] = temperature
+        existing_config['ai']['top_p'] = top_p
+    # 拖动滑块会连续触发更新，由写入器在合并窗口内合并为一次落盘
     try:
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(existing_config, f, indent=4, ensure_ascii=False)
+        config_store.update(apply, source='blender-ai-params')
     except Exception:
         pass
 
@@ -634,6 +656,39 @@ def _on_temperature_update(self, context):
 def _on_top_p_update(self, context):
     _save_ai_params_to_config_from_context(context)
 
+def build_settings_snapshot(ain_settings):
+    """从设置属性组生成后端使用的普通字典（必须在主线程调用）"""
+    return {
+        'deepseek_api_key': ain_settings.deepseek_api_key,
+        'deepseek_url': ain_settings.deepseek_url,
+        'deepseek_model': ain_settings.deepseek_model,
+        'ollama_url': ain_settings.ollama_url,
+        'ollama_model': ain_settings.ollama_model,
+        'bigmodel_api_key': ain_settings.bigmodel_api_key,
+        'bigmodel_url': ain_settings.bigmodel_url,
+        'bigmodel_model': ain_settings.bigmodel_model,
+        'generic_model': ain_settings.generic_model,
+        'system_prompt': ain_settings.system_prompt,
+        'ai_provider': ain_settings.ai_provider,
+        'default_question': ain_settings.default_question,
+    }
+
+def publish_settings_snapshot(ain_settings=None):
+    """发布设置快照，供后端线程在不访问 bpy 的情况下读取"""
+    try:
+        if ain_settings is None:
+            scene = getattr(bpy.context, 'scene', None)
+            if scene is None or not hasattr(scene, 'ainode_analyzer_settings'):
+                return False
+            ain_settings = scene.ainode_analyzer_settings
+        return settings_snapshot.publish(build_settings_snapshot(ain_settings))
+    except Exception:
+        log.error("发布设置快照失败", exc_info=True)
+        return False
+
+def _on_snapshot_setting_update(self, context):
+    publish_settings_snapshot(self)
+
  
 
 # 插件偏好设置面板
@@ -818,6 +873,17 @@ class NODE_PT_ai_analyzer(Panel):
             status_row = bottom_box.row()
             status_row.label(text=f"状态: {status_text}")
 
+            # 批量分析：对文件中的所有材质 / 节点组执行同一个问题
+            batch_row = bottom_box.row(align=True)
+            batch_row.operator("node.batch_analyze", text="批量分析", icon='SEQ_STRIP_DUPLICATE')
+            if ain_settings.batch_job_id:
+                batch_row.operator("node.batch_control", text="", icon='PAUSE').action = 'PAUSE'
+                batch_row.operator("node.batch_control", text="", icon='PLAY').action = 'RESUME'
+                batch_row.operator("node.batch_control", text="", icon='FILE_REFRESH').action = 'RETRY'
+                batch_row.operator("node.batch_control", text="", icon='X').action = 'CANCEL'
+            if ain_settings.batch_status:
+                bottom_box.label(text=ain_settings.batch_status)
+
             # 帮助提示信息 - 可折叠
             if ain_settings.show_help_text:
                 help_box = bottom_box.box()
@@ -987,7 +1053,7 @@ class BlenderMCPServer:
 
     def start(self):
         if self.running:
-            print("Server is already running")
+            mcp_log.info("MCP 服务器已在运行")
             return
 
         self.running = True
@@ -1004,9 +1070,9 @@ class BlenderMCPServer:
             self.server_thread.daemon = True
             self.server_thread.start()
 
-            print(f"BlenderMCP server started on {self.host}:{self.port}")
+            mcp_log.info("MCP 服务器已启动", host=self.host, port=self.port)
         except Exception as e:
-            print(f"Failed to start server: {str(e)}")
+            mcp_log.error("MCP 服务器启动失败", error=str(e))
             self.stop()
 
     def stop(self):
@@ -1029,11 +1095,11 @@ class BlenderMCPServer:
                 pass
             self.server_thread = None
 
-        print("BlenderMCP server stopped")
+        mcp_log.info("MCP 服务器已停止")
 
     def _server_loop(self):
         """Main server loop in a separate thread"""
-        print("Server thread started")
+        mcp_log.debug("MCP 服务线程已启动")
         self.socket.settimeout(1.0)  # Timeout to allow for stopping
 
         while self.running:
@@ -1041,7 +1107,7 @@ class BlenderMCPServer:
                 # Accept new connection
                 try:
                     client, address = self.socket.accept()
-                    print(f"Connected to client: {address}")
+                    mcp_log.debug("MCP 客户端已连接", address=address)
 
                     # Handle client in a separate thread
                     client_thread = threading.Thread(
@@ -1054,19 +1120,19 @@ class BlenderMCPServer:
                     # Just check running condition
                     continue
                 except Exception as e:
-                    print(f"Error accepting connection: {str(e)}")
+                    mcp_log.warning("接受 MCP 连接出错", error=str(e))
                     time.sleep(0.5)
             except Exception as e:
-                print(f"Error in server loop: {str(e)}")
+                mcp_log.warning("MCP 服务循环出错", error=str(e))
                 if not self.running:
                     break
                 time.sleep(0.5)
 
-        print("Server thread stopped")
+        mcp_log.debug("MCP 服务线程已停止")
 
     def _handle_client(self, client):
         """Handle connected client"""
-        print("Client handler started")
+        mcp_log.debug("MCP 客户端处理开始")
         client.settimeout(None)  # No timeout
         buffer = b''
 
@@ -1076,7 +1142,7 @@ class BlenderMCPServer:
                 try:
                     data = client.recv(8192)
                     if not data:
-                        print("Client disconnected")
+                        mcp_log.debug("MCP 客户端已断开")
                         break
 
                     buffer += data
@@ -1093,10 +1159,9 @@ class BlenderMCPServer:
                                 try:
                                     client.sendall(response_json.encode('utf-8'))
                                 except:
-                                    print("Failed to send response - client disconnected")
+                                    mcp_log.warning("发送 MCP 响应失败，客户端已断开")
                             except Exception as e:
-                                print(f"Error executing command: {str(e)}")
-                                traceback.print_exc()
+                                mcp_log.error("执行 MCP 命令出错", exc_info=True, error=str(e))
                                 try:
                                     error_response = {
                                         "status": "error",
@@ -1113,16 +1178,16 @@ class BlenderMCPServer:
                         # Incomplete data, wait for more
                         pass
                 except Exception as e:
-                    print(f"Error receiving data: {str(e)}")
+                    mcp_log.warning("接收 MCP 数据出错", error=str(e))
                     break
         except Exception as e:
-            print(f"Error in client handler: {str(e)}")
+            mcp_log.warning("MCP 客户端处理出错", error=str(e))
         finally:
             try:
                 client.close()
             except:
                 pass
-            print("Client handler stopped")
+            mcp_log.debug("MCP 客户端处理结束")
 
     def execute_command(self, command):
         """Execute a command in the main Blender thread"""
@@ -1130,8 +1195,7 @@ class BlenderMCPServer:
             return self._execute_command_internal(command)
 
         except Exception as e:
-            print(f"Error executing command: {str(e)}")
-            traceback.print_exc()
+            mcp_log.error("执行 MCP 命令出错", exc_info=True, command=command.get("type"), error=str(e))
             return {"status": "error", "message": str(e)}
 
     def _execute_command_internal(self, command):
@@ -1165,9 +1229,9 @@ class BlenderMCPServer:
         handler = handlers.get(cmd_type)
         if handler:
             try:
-                print(f"Executing handler for {cmd_type}")
+                started = time.perf_counter()
                 result = handler(**params)
-                print(f"Handler execution complete")
+                mcp_log.debug("MCP 命令已执行", command=cmd_type, seconds=round(time.perf_counter() - started, 4))
                 
                 # 检查结果是否包含错误
                 if isinstance(result, dict) and "error" in result:
@@ -1175,8 +1239,7 @@ class BlenderMCPServer:
                 
                 return {"status": "success", "result": result}
             except Exception as e:
-                print(f"Error in handler: {str(e)}")
-                traceback.print_exc()
+                mcp_log.error("MCP 命令处理出错", exc_info=True, command=cmd_type, error=str(e))
                 return {"status": "error", "message": str(e)}
         else:
             return {"status": "error", "message": f"Unknown command type: {cmd_type}"}
@@ -1184,7 +1247,6 @@ class BlenderMCPServer:
     def get_scene_info(self):
         """Get information about the current Blender scene"""
         try:
-            print("Getting scene info...")
             # Simplify the scene info to reduce data size
             scene_info = {
                 "name": bpy.context.scene.name,
@@ -1208,11 +1270,9 @@ class BlenderMCPServer:
                 }
                 scene_info["objects"].append(obj_info)
 
-            print(f"Scene info collected: {len(scene_info['objects'])} objects")
             return scene_info
         except Exception as e:
-            print(f"Error in get_scene_info: {str(e)}")
-            traceback.print_exc()
+            mcp_log.error("获取场景信息出错", exc_info=True, error=str(e))
             return {"error": str(e)}
 
     def get_object_info(self, name):
@@ -1685,8 +1745,7 @@ class BlenderMCPServer:
             if not os.path.exists(config_path):
                 return {"error": "Config file not found"}
             
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            config = config_store.read()
             
             # 根据变量名返回对应的值
             if variable_name == "identity_presets":
@@ -1714,8 +1773,7 @@ class BlenderMCPServer:
             if not os.path.exists(config_path):
                 return {"error": "Config file not found"}
             
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            config = config_store.read()
             
             return {
                 "identity_presets": config.get("system_message_presets", []),
@@ -2262,6 +2320,13 @@ class NODE_OT_copy_text_to_clipboard(bpy.types.Operator):
 
 # 实现节点解析功能
 def parse_node_tree_recursive(node_tree, depth=0, max_depth=10):
+    """解析节点树（见 _parse_node_tree），顶层调用记录序列化耗时"""
+    if depth:
+        return _parse_node_tree(node_tree, depth, max_depth)
+    with metrics.node_serialize_seconds.time('tree'):
+        return _parse_node_tree(node_tree, depth, max_depth)
+
+def _parse_node_tree(node_tree, depth=0, max_depth=10):
     """
     递归解析节点树
     :param node_tree: 要解析的节点树
@@ -2295,6 +2360,9 @@ def parse_node_tree_recursive(node_tree, depth=0, max_depth=10):
             "inputs": [],
             "outputs": [],
         }
+        # 所在的框，后端据此对超大节点树分块 (map-reduce)
+        if node.parent:
+            node_info["parent"] = node.parent.name
 
         # 解析输入端口
         for input_idx, input_socket in enumerate(node.inputs):
@@ -2378,7 +2446,7 @@ def parse_node_tree_recursive(node_tree, depth=0, max_depth=10):
 
         # 如果是节点组，递归解析其内容
         if node.type == 'GROUP' and node.node_tree:
-            node_info["group_content"] = parse_node_tree_recursive(node.node_tree, depth + 1, max_depth)
+            node_info["group_content"] = _parse_node_tree(node.node_tree, depth + 1, max_depth)
             result["groups"][node.name] = node_info["group_content"]
 
         result["nodes"].append(node_info)
@@ -2400,6 +2468,11 @@ def parse_node_tree_recursive(node_tree, depth=0, max_depth=10):
     return result
 
 def get_selected_nodes_description(context):
+    """获取选中节点的描述（见 _selected_nodes_description），并记录序列化耗时"""
+    with metrics.node_serialize_seconds.time('selected'):
+        return _selected_nodes_description(context)
+
+def _selected_nodes_description(context):
     """
     获取选中节点的描述
     :param context: Blender上下文
@@ -2452,6 +2525,9 @@ def get_selected_nodes_description(context):
             "inputs": [],
             "outputs": [],
         }
+        # 所在的框，后端据此对超大节点树分块 (map-reduce)
+        if node.parent:
+            node_info["parent"] = node.parent.name
 
         # 解析输入端口
         for input_idx, input_socket in enumerate(node.inputs):
@@ -2532,7 +2608,7 @@ def get_selected_nodes_description(context):
 
         # 如果是节点组，递归解析其内容
         if node.type == 'GROUP' and node.node_tree:
-            node_info["group_content"] = parse_node_tree_recursive(node.node_tree)
+            node_info["group_content"] = _parse_node_tree(node.node_tree)
 
         result["selected_nodes"].append(node_info)
 
@@ -2586,7 +2662,8 @@ class AINodeAnalyzerSettings(PropertyGroup):
         items=[
             ('DEEPSEEK', "DeepSeek", "DeepSeek"),
             ('OLLAMA', "Ollama", "Ollama"),
-            ('BIGMODEL', "BigModel", "BigModel (智谱AI)")
+            ('BIGMODEL', "BigModel", "BigModel (智谱AI)"),
+            ('AUTO', "自动", "按各提供商的健康状况（首字延迟、速度、错误率）自动选择")
         ],
         default='DEEPSEEK',
         update=_on_provider_update
@@ -2597,14 +2674,16 @@ class AINodeAnalyzerSettings(PropertyGroup):
         name="DeepSeek API密钥",
         description="DeepSeek API密钥用于模型访问",
         subtype='PASSWORD',
-        default=""
+        default="",
+        update=_on_snapshot_setting_update
     )
 
     deepseek_url: StringProperty(
         name="DeepSeek服务地址",
         description="DeepSeek服务的URL地址",
         default="https://api.deepseek.com",
-        maxlen=2048
+        maxlen=2048,
+        update=_on_snapshot_setting_update
     )
 
     deepseek_model: StringProperty(
@@ -2641,7 +2720,8 @@ class AINodeAnalyzerSettings(PropertyGroup):
         name="Ollama服务地址",
         description="Ollama服务的URL地址",
         default="http://localhost:11434",
-        maxlen=2048
+        maxlen=2048,
+        update=_on_snapshot_setting_update
     )
 
     ollama_model: StringProperty(
@@ -2657,14 +2737,16 @@ class AINodeAnalyzerSettings(PropertyGroup):
         name="BigModel API密钥",
         description="BigModel (智谱AI) API密钥用于模型访问",
         subtype='PASSWORD',
-        default=""
+        default="",
+        update=_on_snapshot_setting_update
     )
 
     bigmodel_url: StringProperty(
         name="BigModel服务地址",
         description="BigModel服务的URL地址",
         default="https://open.bigmodel.cn/api/paas/v4",
-        maxlen=2048
+        maxlen=2048,
+        update=_on_snapshot_setting_update
     )
 
     bigmodel_model: StringProperty(
@@ -2680,7 +2762,8 @@ class AINodeAnalyzerSettings(PropertyGroup):
         name="系统提示",
         description="AI助手的系统提示信息",
         default="您是Blender节点的专家。分析以下节点结构并提供见解、优化或解释。",
-        maxlen=2048
+        maxlen=2048,
+        update=_on_snapshot_setting_update
     )
 
 
@@ -2758,7 +2841,8 @@ class AINodeAnalyzerSettings(PropertyGroup):
     default_question: StringProperty(
         name="默认问题",
         description="默认的节点分析问题",
-        default="请分析这些节点的功能和优化建议"
+        default="请分析这些节点的功能和优化建议",
+        update=_on_snapshot_setting_update
     )
 
     # 回答详细程度设置
@@ -2936,6 +3020,26 @@ class AINodeAnalyzerSettings(PropertyGroup):
         default=False
     )
 
+    # 当前请求的 ID，终止时用于通知后端取消
+    current_request_id: StringProperty(
+        name="当前请求ID",
+        description="正在进行的AI请求的ID",
+        default=""
+    )
+
+    # 批量分析：最近一次批量任务的 ID 与进度
+    batch_job_id: StringProperty(
+        name="批量任务ID",
+        description="最近一次批量分析任务的ID",
+        default=""
+    )
+
+    batch_status: StringProperty(
+        name="批量任务状态",
+        description="最近一次批量分析任务的进度",
+        default=""
+    )
+
 class NODE_OT_load_config_from_file(bpy.types.Operator):
     bl_idname = "node.load_config_from_file"
     bl_label = "从文件加载配置"
@@ -2950,8 +3054,7 @@ class NODE_OT_load_config_from_file(bpy.types.Operator):
             return {'CANCELLED'}
             
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            config = config_store.read()
                 
             # Update Blender settings
             if 'port' in config:
@@ -3161,123 +3264,10 @@ class NODE_OT_save_config_to_file(bpy.types.Operator):
 
     def execute(self, context):
         ain_settings = context.scene.ainode_analyzer_settings
-        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
-        
-        try:
-            # Read existing to preserve other fields
-            existing_config = {}
-            if os.path.exists(config_path):
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    existing_config = json.load(f)
-            
-            # Update Port
-            existing_config['port'] = ain_settings.backend_port
-
-            # Update AI section
-            if 'ai' not in existing_config: existing_config['ai'] = {}
-            ai = existing_config['ai']
-
-            # 使用新的provider结构
-            ai['provider'] = {
-                'name': ain_settings.ai_provider,
-                'model': ''
-            }
-
-            # 根据当前提供商设置模型
-            if ain_settings.ai_provider == 'DEEPSEEK':
-                ai['provider']['model'] = ain_settings.deepseek_model
-            elif ain_settings.ai_provider == 'OLLAMA':
-                ai['provider']['model'] = ain_settings.ollama_model
-            elif ain_settings.ai_provider == 'BIGMODEL':
-                ai['provider']['model'] = ain_settings.bigmodel_model
-            else:
-                ai['provider']['model'] = ain_settings.generic_model
-
-            if 'deepseek' not in ai: ai['deepseek'] = {}
-            ai['deepseek']['api_key'] = ain_settings.deepseek_api_key
-            ai['deepseek']['model'] = ain_settings.deepseek_model
-            ai['deepseek']['url'] = ain_settings.deepseek_url
-
-            if 'ollama' not in ai: ai['ollama'] = {}
-            ai['ollama']['url'] = ain_settings.ollama_url
-            ai['ollama']['model'] = ain_settings.ollama_model
-
-            if 'bigmodel' not in ai: ai['bigmodel'] = {}
-            ai['bigmodel']['api_key'] = ain_settings.bigmodel_api_key
-            ai['bigmodel']['model'] = ain_settings.bigmodel_model
-            ai['bigmodel']['url'] = ain_settings.bigmodel_url
-            if bigmodel_models_cache:
-                ai['bigmodel']['models'] = bigmodel_models_cache[:]
-            
-            ai['system_prompt'] = ain_settings.system_prompt
-            ai['temperature'] = ain_settings.temperature
-            ai['top_p'] = ain_settings.top_p
-            # provider_configs writeback
-            if 'provider_configs' not in ai: ai['provider_configs'] = {}
-            sel = ain_settings.ai_provider
-            pcfg = ai['provider_configs'].get(sel, {})
-            
-            # 根据提供商类型设置相应的配置
-            if sel == 'DEEPSEEK':
-                pcfg['base_url'] = ain_settings.deepseek_url
-                pcfg['api_key'] = ain_settings.deepseek_api_key
-                if deepseek_models_cache:
-                    pcfg['models'] = deepseek_models_cache[:]
-            elif sel == 'OLLAMA':
-                pcfg['base_url'] = ain_settings.ollama_url
-                pcfg['api_key'] = ain_settings.generic_api_key  # Ollama通常不需要API密钥
-                if ollama_models_cache:
-                    pcfg['models'] = ollama_models_cache[:]
-            elif sel == 'BIGMODEL':
-                pcfg['base_url'] = ain_settings.bigmodel_url
-                pcfg['api_key'] = ain_settings.bigmodel_api_key
-                if bigmodel_models_cache:
-                    pcfg['models'] = bigmodel_models_cache[:]
-            else:
-                # 对于其他提供商，使用generic字段
-                pcfg['base_url'] = ain_settings.generic_base_url
-                pcfg['api_key'] = ain_settings.generic_api_key
-                if 'models' not in pcfg: pcfg['models'] = []
-                dm = (ain_settings.generic_model or "").strip()
-                if dm and dm not in pcfg['models']:
-                    pcfg['models'].insert(0, dm)
-                pcfg['default_model'] = dm
-            ai['provider_configs'][sel] = pcfg
-
-            # 记忆功能设置
-            if 'memory' not in ai: ai['memory'] = {}
-            ai['memory']['enabled'] = ain_settings.enable_memory
-            ai['memory']['target_k'] = ain_settings.memory_target_k
-            
-            # Update default questions (keep existing list but maybe update first one?)
-            # Or just append? Let's just update the list if empty, or keep as is.
-            # User might want to edit the list in the file manually.
-            # But let's ensure the current default_question is in the list
-            if 'default_questions' not in existing_config: existing_config['default_questions'] = []
-            if ain_settings.default_question and ain_settings.default_question not in existing_config['default_questions']:
-                existing_config['default_questions'].insert(0, ain_settings.default_question)
-
-            # 保存系统消息预设
-            if 'system_message_presets' not in existing_config or not existing_config['system_message_presets']:
-                # 如果配置中没有预设或为空，则使用缓存中的值
-                existing_config['system_message_presets'] = system_message_presets_cache[:]
-
-            # 保存默认问题预设
-            if 'default_question_presets' not in existing_config or not existing_config['default_question_presets']:
-                # 如果配置中没有预设或为空，则使用缓存中的值
-                existing_config['default_question_presets'] = default_question_presets_cache[:]
-
-            # 回答详细程度提示写回（使用统一的 output_detail_presets）
-            existing_config['output_detail_presets'] = {
-                'simple': ain_settings.prompt_simple,
-                'medium': ain_settings.prompt_medium,
-                'detailed': ain_settings.prompt_detailed
-            }
-            existing_config['output_detail_level'] = ain_settings.output_detail_level
-
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(existing_config, f, indent=4, ensure_ascii=False)
 
+        try:
+            # 在写入器内读取-修改-写回，保留其他字段
+            config_store.update(lambda existing_config: self.apply_settings(existing_config, ain_settings), source='blender-save-config')
             self.report({'INFO'}, "配置已保存到文件")
         except Exception as e:
             self.report({'ERROR'}, f"保存配置失败: {e}")
@@ -3294,6 +3284,113 @@ class NODE_OT_save_config_to_file(bpy.types.Operator):
 
         return {'FINISHED'}
 
+    def apply_settings(self, existing_config, ain_settings):
+        """将当前设置写入配置字典"""
+        # Update Port
+        existing_config['port'] = ain_settings.backend_port
+
+        # Update AI section
+        if 'ai' not in existing_config: existing_config['ai'] = {}
+        ai = existing_config['ai']
+
+        # 使用新的provider结构
+        ai['provider'] = {
+            'name': ain_settings.ai_provider,
+            'model': ''
+        }
+
+        # 根据当前提供商设置模型
+        if ain_settings.ai_provider == 'DEEPSEEK':
+            ai['provider']['model'] = ain_settings.deepseek_model
+        elif ain_settings.ai_provider == 'OLLAMA':
+            ai['provider']['model'] = ain_settings.ollama_model
+        elif ain_settings.ai_provider == 'BIGMODEL':
+            ai['provider']['model'] = ain_settings.bigmodel_model
+        else:
+            ai['provider']['model'] = ain_settings.generic_model
+
+        if 'deepseek' not in ai: ai['deepseek'] = {}
+        ai['deepseek']['api_key'] = ain_settings.deepseek_api_key
+        ai['deepseek']['model'] = ain_settings.deepseek_model
+        ai['deepseek']['url'] = ain_settings.deepseek_url
+
+        if 'ollama' not in ai: ai['ollama'] = {}
+        ai['ollama']['url'] = ain_settings.ollama_url
+        ai['ollama']['model'] = ain_settings.ollama_model
+
+        if 'bigmodel' not in ai: ai['bigmodel'] = {}
+        ai['bigmodel']['api_key'] = ain_settings.bigmodel_api_key
+        ai['bigmodel']['model'] = ain_settings.bigmodel_model
+        ai['bigmodel']['url'] = ain_settings.bigmodel_url
+        if bigmodel_models_cache:
+            ai['bigmodel']['models'] = bigmodel_models_cache[:]
+        
+        ai['system_prompt'] = ain_settings.system_prompt
+        ai['temperature'] = ain_settings.temperature
+        ai['top_p'] = ain_settings.top_p
+        # provider_configs writeback
+        if 'provider_configs' not in ai: ai['provider_configs'] = {}
+        sel = ain_settings.ai_provider
+        pcfg = ai['provider_configs'].get(sel, {})
+        
+        # 根据提供商类型设置相应的配置
+        if sel == 'DEEPSEEK':
+            pcfg['base_url'] = ain_settings.deepseek_url
+            pcfg['api_key'] = ain_settings.deepseek_api_key
+            if deepseek_models_cache:
+                pcfg['models'] = deepseek_models_cache[:]
+        elif sel == 'OLLAMA':
+            pcfg['base_url'] = ain_settings.ollama_url
+            pcfg['api_key'] = ain_settings.generic_api_key  # Ollama通常不需要API密钥
+            if ollama_models_cache:
+                pcfg['models'] = ollama_models_cache[:]
+        elif sel == 'BIGMODEL':
+            pcfg['base_url'] = ain_settings.bigmodel_url
+            pcfg['api_key'] = ain_settings.bigmodel_api_key
+            if bigmodel_models_cache:
+                pcfg['models'] = bigmodel_models_cache[:]
+        else:
+            # 对于其他提供商，使用generic字段
+            pcfg['base_url'] = ain_settings.generic_base_url
+            pcfg['api_key'] = ain_settings.generic_api_key
+            if 'models' not in pcfg: pcfg['models'] = []
+            dm = (ain_settings.generic_model or "").strip()
+            if dm and dm not in pcfg['models']:
+                pcfg['models'].insert(0, dm)
+            pcfg['default_model'] = dm
+        ai['provider_configs'][sel] = pcfg
+
+        # 记忆功能设置
+        if 'memory' not in ai: ai['memory'] = {}
+        ai['memory']['enabled'] = ain_settings.enable_memory
+        ai['memory']['target_k'] = ain_settings.memory_target_k
+        
+        # Update default questions (keep existing list but maybe update first one?)
+        # Or just append? Let's just update the list if empty, or keep as is.
+        # User might want to edit the list in the file manually.
+        # But let's ensure the current default_question is in the list
+        if 'default_questions' not in existing_config: existing_config['default_questions'] = []
+        if ain_settings.default_question and ain_settings.default_question not in existing_config['default_questions']:
+            existing_config['default_questions'].insert(0, ain_settings.default_question)
+
+        # 保存系统消息预设
+        if 'system_message_presets' not in existing_config or not existing_config['system_message_presets']:
+            # 如果配置中没有预设或为空，则使用缓存中的值
+            existing_config['system_message_presets'] = system_message_presets_cache[:]
+
+        # 保存默认问题预设
+        if 'default_question_presets' not in existing_config or not existing_config['default_question_presets']:
+            # 如果配置中没有预设或为空，则使用缓存中的值
+            existing_config['default_question_presets'] = default_question_presets_cache[:]
+
+        # 回答详细程度提示写回（使用统一的 output_detail_presets）
+        existing_config['output_detail_presets'] = {
+            'simple': ain_settings.prompt_simple,
+            'medium': ain_settings.prompt_medium,
+            'detailed': ain_settings.prompt_detailed
+        }
+        existing_config['output_detail_level'] = ain_settings.output_detail_level
+
 # 设置弹窗面板
 class AINodeAnalyzerSettingsPopup(bpy.types.Operator):
     bl_idname = "node.settings_popup"
@@ -3343,6 +3440,8 @@ class AINodeAnalyzerSettingsPopup(bpy.types.Operator):
                 current_model = ain_settings.ollama_model
             elif ain_settings.ai_provider == 'BIGMODEL':
                 current_model = ain_settings.bigmodel_model
+            elif ain_settings.ai_provider == 'AUTO':
+                current_model = "自动选择"
             else:
                 current_model = ain_settings.generic_model
         except:
@@ -3913,6 +4012,13 @@ class NODE_OT_test_provider_status_disabled(bpy.types.Operator):
         self.report({'WARNING'}, "后端服务器未启动，请先启动后端服务器")
         return {'CANCELLED'}
 
+def _post_cancel_request(url, request_id):
+    """在后台线程中调用 /api/cancel，避免阻塞界面"""
+    try:
+        requests.post(url, json={"requestId": request_id}, timeout=5)
+    except Exception:
+        log.warning("通知后端取消请求失败", exc_info=True, request_id=request_id)
+
 class NODE_OT_stop_ai_request(bpy.types.Operator):
     bl_idname = "node.stop_ai_request"
     bl_label = "终止AI请求"
@@ -3926,9 +4032,256 @@ class NODE_OT_stop_ai_request(bpy.types.Operator):
         ain_settings.can_terminate_request = False
         ain_settings.current_status = "请求已终止"
 
+        # 通知后端立即关闭提供商连接，不再继续读取和计费
+        request_id = ain_settings.current_request_id
+        ain_settings.current_request_id = ""
+        if request_id and server_manager and server_manager.is_running:
+            url = f"http://127.0.0.1:{server_manager.port}/api/cancel"
+            threading.Thread(target=_post_cancel_request, args=(url, request_id), daemon=True).start()
+
         self.report({'INFO'}, "AI请求已终止")
         return {'FINISHED'}
 
+def _collect_batch_trees(scope, filter_level):
+    """
+    在主线程中收集批量分析的节点树：scope 为 ALL / MATERIALS / NODE_GROUPS。
+    返回 [{id, name, kind, content}]，content 为按当前精细度过滤后的完整节点树描述。
+    """
+    trees = []
+    if scope in ('ALL', 'MATERIALS'):
+        for material in bpy.data.materials:
+            if material.use_nodes and material.node_tree and len(material.node_tree.nodes):
+                trees.append(('MATERIAL', material.name, material.node_tree))
+    if scope in ('ALL', 'NODE_GROUPS'):
+        for group in bpy.data.node_groups:
+            if len(group.nodes):
+                trees.append(('NODE_GROUP', group.name, group))
+    items = []
+    for kind, name, tree in trees:
+        try:
+            description = json.dumps(parse_node_tree_recursive(tree), indent=2, ensure_ascii=False)
+        except Exception:
+            log.error("解析节点树失败，已跳过", exc_info=True, tree=name)
+            continue
+        items.append({
+            "id": f"{kind}:{name}",
+            "name": name,
+            "kind": kind,
+            "content": filter_node_description(description, filter_level),
+        })
+    return items
+
+def _batch_status_text(job):
+    counts = job.get('counts') or {}
+    state = {
+        'running': "进行中",
+        'paused': "已暂停",
+        'completed': "已完成",
+        'cancelled': "已取消",
+    }.get(job.get('state'), job.get('state', ''))
+    text = f"批量分析{state}: {counts.get('done', 0)}/{job.get('total', 0)} 完成"
+    if counts.get('failed'):
+        text += f"，{counts['failed']} 失败"
+    return text
+
+def _write_batch_results(job):
+    """把批量任务的结果写入文本块 AINodeBatchResults（每个节点树一节）"""
+    text_block = bpy.data.texts.get("AINodeBatchResults") or bpy.data.texts.new(name="AINodeBatchResults")
+    text_block.clear()
+    text_block.write(f"# 批量分析: {job.get('question', '')}\n\n")
+    for item in job.get('items') or []:
+        kind = "材质" if item.get('kind') == 'MATERIAL' else "节点组"
+        text_block.write(f"## [{kind}] {item.get('name')}\n\n")
+        if item.get('status') == 'done':
+            text_block.write((item.get('answer') or '') + "\n\n")
+        else:
+            text_block.write(f"({item.get('status')}) {item.get('error') or ''}\n\n")
+
+# 后台线程创建批量任务：token 标识最近一次提交，result 为 (job, error)，由 _poll_batch_job 在主线程中取走
+_batch_creation = {'token': None, 'result': None}
+_batch_creation_lock = threading.Lock()
+
+def _create_batch_job(url, payload, token):
+    """在后台线程中 POST /api/batch-analyze，避免收集完节点树后界面还要等后端建好任务"""
+    try:
+        r = requests.post(url, json=payload, timeout=30)
+        data = r.json()
+        if r.status_code != 200 or data.get('status') != 'Success':
+            result = (None, data.get('message') or f"后端错误: {r.status_code}")
+        else:
+            result = (data.get('data') or {}, None)
+    except Exception as e:
+        log.warning("创建批量任务失败", exc_info=True)
+        result = (None, str(e))
+    with _batch_creation_lock:
+        if _batch_creation['token'] == token:
+            _batch_creation['result'] = result
+
+def _batch_creating():
+    with _batch_creation_lock:
+        return _batch_creation['token'] is not None
+
+def _take_batch_created():
+    """取走已完成的创建结果；仍在创建或没有提交时返回 None"""
+    with _batch_creation_lock:
+        result = _batch_creation['result']
+        if result is not None:
+            _batch_creation['token'] = None
+            _batch_creation['result'] = None
+        return result
+
+def _fetch_batch_job(job_id, include_results, timeout):
+    """GET /api/batch-analyze/<id>；include_results=False 时只取任务概要与各项状态"""
+    query = "" if include_results else "?results=0"
+    r = requests.get(f"http://127.0.0.1:{server_manager.port}/api/batch-analyze/{job_id}{query}", timeout=timeout)
+    return r.json().get('data') if r.status_code == 200 else None
+
+def _poll_batch_job():
+    """bpy.app.timers 回调：在主线程中轮询批量任务进度（只取概要），结束后取一次完整结果并写出"""
+    try:
+        ain_settings = bpy.context.scene.ainode_analyzer_settings
+    except Exception:
+        return None
+    created = _take_batch_created()
+    if created is not None:
+        job, error = created
+        if error:
+            ain_settings.batch_status = f"创建批量任务失败: {error}"
+            return None
+        ain_settings.batch_job_id = job.get('jobId', '')
+        ain_settings.batch_status = _batch_status_text(job)
+    job_id = ain_settings.batch_job_id
+    if not (server_manager and server_manager.is_running):
+        return None
+    if not job_id:
+        # 任务仍在后台线程中创建
+        return 0.5 if _batch_creating() else None
+    try:
+        job = _fetch_batch_job(job_id, include_results=False, timeout=2)
+    except Exception:
+        log.warning("查询批量任务失败", exc_info=True, job=job_id)
+        return 5.0
+    if not job:
+        ain_settings.batch_status = "批量任务不存在"
+        return None
+    ain_settings.batch_status = _batch_status_text(job)
+    if job.get('state') in ('completed', 'cancelled'):
+        try:
+            job = _fetch_batch_job(job_id, include_results=True, timeout=10)
+        except Exception:
+            log.warning("读取批量任务结果失败", exc_info=True, job=job_id)
+            return 5.0
+        if job:
+            _write_batch_results(job)
+        return None
+    return 2.0 if job.get('state') == 'running' else 5.0
+
+def _start_batch_polling(first_interval=1.0):
+    if not bpy.app.timers.is_registered(_poll_batch_job):
+        bpy.app.timers.register(_poll_batch_job, first_interval=first_interval)
+
+class NODE_OT_batch_analyze(bpy.types.Operator):
+    bl_idname = "node.batch_analyze"
+    bl_label = "批量分析"
+    bl_description = "对文件中的所有材质 / 节点组执行同一个问题，结果写入文本块 AINodeBatchResults"
+
+    scope: EnumProperty(
+        name="范围",
+        items=[
+            ('ALL', "全部", "所有材质和节点组"),
+            ('MATERIALS', "材质", "所有使用节点的材质"),
+            ('NODE_GROUPS', "节点组", "所有节点组"),
+        ],
+        default='ALL'
+    )
+
+    question: StringProperty(
+        name="问题",
+        default="请检查这个节点树的性能问题，并给出优化建议。"
+    )
+
+    parallelism: IntProperty(
+        name="并行数",
+        description="同时分析的节点树数量（仍受提供商并发上限约束）",
+        default=2,
+        min=1,
+        max=8
+    )
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self, width=420)
+
+    def execute(self, context):
+        ain_settings = context.scene.ainode_analyzer_settings
+        if not (server_manager and server_manager.is_running):
+            self.report({'ERROR'}, "后端未启动，请先启动后端服务器")
+            return {'CANCELLED'}
+        if not self.question.strip():
+            self.report({'ERROR'}, "请输入问题")
+            return {'CANCELLED'}
+        items = _collect_batch_trees(self.scope, ain_settings.filter_level)
+        if not items:
+            self.report({'WARNING'}, "没有可分析的节点树")
+            return {'CANCELLED'}
+        payload = {
+            "question": (get_output_detail_instruction(ain_settings) + "\n\n" + self.question).strip(),
+            "items": items,
+            "ai_provider": ain_settings.ai_provider,
+            "ai_model": ain_settings.deepseek_model if ain_settings.ai_provider == 'DEEPSEEK' else (ain_settings.ollama_model if ain_settings.ai_provider == 'OLLAMA' else (ain_settings.bigmodel_model if ain_settings.ai_provider == 'BIGMODEL' else ain_settings.generic_model)),
+            "parallelism": self.parallelism,
+        }
+        # 在后台线程中创建任务，任务编号由 _poll_batch_job 取回，避免阻塞界面
+        token = uuid.uuid4().hex
+        with _batch_creation_lock:
+            _batch_creation['token'] = token
+            _batch_creation['result'] = None
+        ain_settings.batch_job_id = ""
+        ain_settings.batch_status = "正在创建批量任务…"
+        url = f"http://127.0.0.1:{server_manager.port}/api/batch-analyze"
+        threading.Thread(target=_create_batch_job, args=(url, payload, token), daemon=True).start()
+        _start_batch_polling(first_interval=0.2)
+        self.report({'INFO'}, f"正在提交 {len(items)} 个节点树的批量分析")
+        return {'FINISHED'}
+
+class NODE_OT_batch_control(bpy.types.Operator):
+    bl_idname = "node.batch_control"
+    bl_label = "批量任务控制"
+    bl_description = "暂停、继续、重试失败项或取消最近的批量分析任务"
+
+    action: EnumProperty(
+        name="操作",
+        items=[
+            ('PAUSE', "暂停", "进行中的项完成后不再开始新项"),
+            ('RESUME', "继续", "继续未完成的项"),
+            ('RETRY', "重试失败项", "重新分析失败或被取消的项"),
+            ('CANCEL', "取消", "取消任务并中断进行中的项"),
+        ],
+        default='PAUSE'
+    )
+
+    def execute(self, context):
+        ain_settings = context.scene.ainode_analyzer_settings
+        job_id = ain_settings.batch_job_id
+        if not job_id:
+            self.report({'WARNING'}, "没有批量任务")
+            return {'CANCELLED'}
+        if not (server_manager and server_manager.is_running):
+            self.report({'ERROR'}, "后端未启动，请先启动后端服务器")
+            return {'CANCELLED'}
+        url = f"http://127.0.0.1:{server_manager.port}/api/batch-analyze/{job_id}/{self.action.lower()}"
+        try:
+            r = requests.post(url, json={}, timeout=5)
+            data = r.json()
+        except Exception as e:
+            self.report({'ERROR'}, f"操作失败: {e}")
+            return {'CANCELLED'}
+        if r.status_code != 200 or data.get('status') != 'Success':
+            self.report({'ERROR'}, data.get('message') or f"后端错误: {r.status_code}")
+            return {'CANCELLED'}
+        ain_settings.batch_status = _batch_status_text(data.get('data') or {})
+        _start_batch_polling()
+        return {'FINISHED'}
+
 class NODE_OT_reset_provider_url(bpy.types.Operator):
     bl_idname = "node.reset_provider_url"
     bl_label = "重置服务地址"
@@ -3988,52 +4341,48 @@ class NODE_OT_refresh_models(bpy.types.Operator):
 
             # 更新配置文件中的模型列表
             config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+            def apply(config):
+                if 'ai' not in config:
+                    config['ai'] = {}
+
+                # 更新相应的模型列表到对应的服务商配置中
+                if prov == 'DEEPSEEK':
+                    if 'deepseek' not in config['ai']:
+                        config['ai']['deepseek'] = {}
+                    config['ai']['deepseek']['models'] = models
+                    # 同时更新provider中的模型（如果当前使用的是此提供商）
+                    if (config['ai']['provider']['name'] == 'DEEPSEEK' and
+                        models and
+                        config['ai']['provider']['model'] not in models):
+                        config['ai']['provider']['model'] = models[0] if models else config['ai']['provider']['model']  # 设置第一个模型为当前模型
+                elif prov == 'OLLAMA':
+                    if 'ollama' not in config['ai']:
+                        config['ai']['ollama'] = {}
+                    config['ai']['ollama']['models'] = models
+                    # 同时更新provider中的模型（如果当前使用的是此提供商）
+                    if (config['ai']['provider']['name'] == 'OLLAMA' and
+                        models and
+                        config['ai']['provider']['model'] not in models):
+                        config['ai']['provider']['model'] = models[0] if models else config['ai']['provider']['model']  # 设置第一个模型为当前模型
+                elif prov == 'BIGMODEL':
+                    if 'bigmodel' not in config['ai']:
+                        config['ai']['bigmodel'] = {}
+                    config['ai']['bigmodel']['models'] = models
+                    # 同时更新provider中的模型（如果当前使用的是此提供商）
+                    if (config['ai']['provider']['name'] == 'BIGMODEL' and
+                        models and
+                        config['ai']['provider']['model'] not in models):
+                        config['ai']['provider']['model'] = models[0] if models else config['ai']['provider']['model']  # 设置第一个模型为当前模型
+                else:
+                    # 对于其他提供商，可以添加到generic配置中
+                    if 'generic' not in config['ai']:
+                        config['ai']['generic'] = {}
+                    config['ai']['generic']['models'] = models
+
+            # 后端 provider-list-models 也会写回同一文件，由写入器合并为一次落盘
             if os.path.exists(config_path):
                 try:
-                    with open(config_path, 'r', encoding='utf-8') as f:
-                        config = json.load(f)
-
-                    if 'ai' not in config:
-                        config['ai'] = {}
-
-                    # 更新相应的模型列表到对应的服务商配置中
-                    if prov == 'DEEPSEEK':
-                        if 'deepseek' not in config['ai']:
-                            config['ai']['deepseek'] = {}
-                        config['ai']['deepseek']['models'] = models
-                        # 同时更新provider中的模型（如果当前使用的是此提供商）
-                        if (config['ai']['provider']['name'] == 'DEEPSEEK' and
-                            models and
-                            config['ai']['provider']['model'] not in models):
-                            config['ai']['provider']['model'] = models[0] if models else config['ai']['provider']['model']  # 设置第一个模型为当前模型
-                    elif prov == 'OLLAMA':
-                        if 'ollama' not in config['ai']:
-                            config['ai']['ollama'] = {}
-                        config['ai']['ollama']['models'] = models
-                        # 同时更新provider中的模型（如果当前使用的是此提供商）
-                        if (config['ai']['provider']['name'] == 'OLLAMA' and
-                            models and
-                            config['ai']['provider']['model'] not in models):
-                            config['ai']['provider']['model'] = models[0] if models else config['ai']['provider']['model']  # 设置第一个模型为当前模型
-                    elif prov == 'BIGMODEL':
-                        if 'bigmodel' not in config['ai']:
-                            config['ai']['bigmodel'] = {}
-                        config['ai']['bigmodel']['models'] = models
-                        # 同时更新provider中的模型（如果当前使用的是此提供商）
-                        if (config['ai']['provider']['name'] == 'BIGMODEL' and
-                            models and
-                            config['ai']['provider']['model'] not in models):
-                            config['ai']['provider']['model'] = models[0] if models else config['ai']['provider']['model']  # 设置第一个模型为当前模型
-                    else:
-                        # 对于其他提供商，可以添加到generic配置中
-                        if 'generic' not in config['ai']:
-                            config['ai']['generic'] = {}
-                        config['ai']['generic']['models'] = models
-
-                    # 保存更新后的配置
-                    with open(config_path, 'w', encoding='utf-8') as f:
-                        json.dump(config, f, indent=4, ensure_ascii=False)
-
+                    config_store.update(apply, source='blender-refresh-models')
                 except Exception as e:
                     print(f"更新配置文件中的模型列表时出错: {e}")
 
@@ -4718,6 +5067,7 @@ class NODE_OT_ask_ai(AIBaseOperator, Operator):
         ain_settings.current_status = "正在向AI提问..."
         ain_settings.ai_question_status = 'PROCESSING'
         ain_settings.can_terminate_request = True
+        self.trace = tracer.start('ask', operator=self.bl_idname, provider=ain_settings.ai_provider, filter_level=ain_settings.filter_level)
 
         # 直接在主线程中执行，获取当前节点信息
         # 首先检查当前上下文是否有有效的节点编辑器
@@ -4757,8 +5107,9 @@ class NODE_OT_ask_ai(AIBaseOperator, Operator):
             'active_node': selected_nodes[0] if selected_nodes else None
         })()
 
-        node_description = get_selected_nodes_description(fake_context)
-        filtered_desc = filter_node_description(node_description, ain_settings.filter_level)
+        with self.trace.child('preview', nodes=len(selected_nodes)):
+            node_description = get_selected_nodes_description(fake_context)
+            filtered_desc = filter_node_description(node_description, ain_settings.filter_level)
         instr = get_output_detail_instruction(ain_settings)
         hdr = f"详细程度:\n{instr}\n\n" if instr else ""
         preview_content = f"{hdr}系统提示:\n{ain_settings.system_prompt}\n\n问题:\n{user_question}\n\n节点结构:\n{filtered_desc}"
@@ -4806,16 +5157,19 @@ class NODE_OT_ask_ai(AIBaseOperator, Operator):
                     'active_node': self.active_node
                 })()
 
-                node_description = get_selected_nodes_description(fake_context)
-                filtered_desc = filter_node_description(node_description, ain_settings.filter_level)
+                with self.trace.child('serialize', nodes=len(selected_nodes)):
+                    node_description = get_selected_nodes_description(fake_context)
+                with self.trace.child('filter', level=ain_settings.filter_level, chars=len(node_description)):
+                    filtered_desc = filter_node_description(node_description, ain_settings.filter_level)
 
             # 创建文本块以显示结果
-            text_block_name = "AINodeAnalysisResult"
-            if text_block_name in bpy.data.texts:
-                text_block = bpy.data.texts[text_block_name]
-                text_block.clear()
-            else:
-                text_block = bpy.data.texts.new(name=text_block_name)
+            with self.trace.child('text_block'):
+                text_block_name = "AINodeAnalysisResult"
+                if text_block_name in bpy.data.texts:
+                    text_block = bpy.data.texts[text_block_name]
+                    text_block.clear()
+                else:
+                    text_block = bpy.data.texts.new(name=text_block_name)
 
             base_url = f"http://127.0.0.1:{server_manager.port}" if (server_manager and server_manager.is_running) else ""
             if not base_url:
@@ -4823,6 +5177,8 @@ class NODE_OT_ask_ai(AIBaseOperator, Operator):
                 ain_settings.ai_question_status = 'ERROR'
                 ain_settings.can_terminate_request = False
                 return {'CANCELLED'}
+            request_id = uuid.uuid4().hex
+            ain_settings.current_request_id = request_id
             payload = {
                 "question": (get_output_detail_instruction(ain_settings) + "\n\n" + self.user_question).strip(),
                 "content": filtered_desc,
@@ -4833,7 +5189,13 @@ class NODE_OT_ask_ai(AIBaseOperator, Operator):
                     "networking": {"enabled": True},
                     "memory": {"enabled": bool(getattr(ain_settings, 'enable_memory', True)), "target_k": getattr(ain_settings, 'memory_target_k', 4)}
                 },
-                "nodeContextActive": True
+                "nodeContextActive": True,
+                # 终止请求时据此通知后端关闭提供商连接
+                "requestId": request_id,
+                # 链路追踪：后端的 span 挂在本次提问的根 span 下
+                **self.trace.context(),
+                # 面板提问优先于后台摘要与诊断请求
+                "priority": "interactive"
             }
             
             # 对于BigModel，如果启用深度思考，在问题中添加深度思考指令
@@ -4842,8 +5204,21 @@ class NODE_OT_ask_ai(AIBaseOperator, Operator):
                 payload["question"] = thinking_instruction + "\n\n" + payload["question"]
             
             url = base_url + "/api/stream-analyze"
+            # 链路追踪：http 到响应头返回为止；stream 为读取 SSE 并写入文本块，text_block.write 的耗时单独累计
+            http_span = self.trace.child('http', path='/api/stream-analyze', payload_chars=len(filtered_desc))
+            stream_span = None
+            text_writes = [0, 0.0]
+
+            def write_text(text):
+                started = time.perf_counter()
+                text_block.write(text)
+                text_writes[0] += 1
+                text_writes[1] += time.perf_counter() - started
+
             try:
                 with requests.post(url, json=payload, timeout=300, stream=True) as r:
+                    http_span.end(status=r.status_code)
+                    stream_span = self.trace.child('stream')
                     if r.status_code != 200:
                         self.report({'ERROR'}, f"后端错误: {r.status_code}")
                         ain_settings.ai_question_status = 'ERROR'
@@ -4874,18 +5249,31 @@ class NODE_OT_ask_ai(AIBaseOperator, Operator):
                                     ain_settings.can_terminate_request = False
                                     return {'CANCELLED'}
 
+                                if t in ('thinking', 'chunk') and 'first_token' not in stream_span.attrs:
+                                    stream_span.attrs['first_token'] = round(time.time() - self.trace.start, 6)
                                 if t == 'thinking':
                                     if not wrote_thinking_header:
-                                        text_block.write(f"\n\n[思考]\n")
+                                        write_text(f"\n\n[思考]\n")
                                         wrote_thinking_header = True
                                     # 直接写入增量，不额外换行
-                                    text_block.write(c)
+                                    write_text(c)
                                 elif t == 'chunk':
-                                    text_block.write(c)
+                                    write_text(c)
+                                elif t == 'web_search':
+                                    write_text(f"\n[联网搜索]\n{c}\n")
+                                elif t == 'map_reduce':
+                                    # 节点树过大时后端先分块分析，再汇总回答
+                                    stage = j.get('stage')
+                                    if stage == 'partition':
+                                        ain_settings.current_status = f"节点树过大，拆分为 {j.get('chunks', 0)} 部分分析..."
+                                    elif stage == 'map':
+                                        ain_settings.current_status = f"分块分析 {j.get('done', 0)}/{j.get('total', 0)}..."
+                                    elif stage == 'reduce':
+                                        ain_settings.current_status = "正在汇总各部分的分析..."
                                 elif t == 'error':
                                     self.report({'ERROR'}, c)
                             except Exception:
-                                text_block.write(s + "\n")
+                                write_text(s + "\n")
 
                     # 检查是否是因用户终止而结束
                     if ain_settings.ai_question_status != 'STOPPED':
@@ -4893,7 +5281,8 @@ class NODE_OT_ask_ai(AIBaseOperator, Operator):
                         ain_settings.ai_question_status = 'IDLE'
 
                         # 将结果保存为注释节点
-                        self.create_annotation_node(context, text_block.as_string())
+                        with self.trace.child('annotation'):
+                            self.create_annotation_node(context, text_block.as_string())
 
                         self.report({'INFO'}, f"问题已回答。结果已保存为注释节点。")
 
@@ -4903,6 +5292,11 @@ class NODE_OT_ask_ai(AIBaseOperator, Operator):
                 ain_settings.ai_question_status = 'ERROR'
                 ain_settings.can_terminate_request = False
                 return {'CANCELLED'}
+            finally:
+                http_span.end()
+                if stream_span is not None:
+                    stream_span.end(text_writes=text_writes[0], text_write_seconds=round(text_writes[1], 6))
+                self.trace.end(status=ain_settings.ai_question_status, request_id=request_id)
 
         except Exception as e:
             self.report({'ERROR'}, f"AI分析过程中出现错误: {str(e)}")
@@ -5261,6 +5655,8 @@ class NODE_OT_ask_ai_context(bpy.types.Operator):
         ain_settings.ai_question_status = 'PROCESSING'
         ain_settings.can_terminate_request = True
         ain_settings.current_status = "正在向AI提问..."
+        self.trace = tracer.start('ask', operator=self.bl_idname, provider=ain_settings.ai_provider,
+                                  filter_level=ain_settings.filter_level, node_scope=self.node_scope)
 
         # 如果没有要分析的节点，但选择了节点范围，则报告错误
         if self.node_scope != 'NONE' and not nodes_to_analyze:
@@ -5282,8 +5678,10 @@ class NODE_OT_ask_ai_context(bpy.types.Operator):
                 'active_node': nodes_to_analyze[0] if nodes_to_analyze else None
             })()
 
-            node_description = get_selected_nodes_description(fake_context)
-            node_description = filter_node_description(node_description, ain_settings.filter_level)
+            with self.trace.child('serialize', nodes=len(nodes_to_analyze)):
+                node_description = get_selected_nodes_description(fake_context)
+            with self.trace.child('filter', level=ain_settings.filter_level, chars=len(node_description)):
+                node_description = filter_node_description(node_description, ain_settings.filter_level)
 
         # 在后台线程中运行，以避免阻塞UI
         import threading
@@ -5324,17 +5722,20 @@ class NODE_OT_ask_ai_context(bpy.types.Operator):
             # 获取节点描述
             filtered_desc = self.node_description
 
-            text_block_name = "AINodeAnalysisResult"
-            if text_block_name in bpy.data.texts:
-                text_block = bpy.data.texts[text_block_name]
-            else:
-                text_block = bpy.data.texts.new(name=text_block_name)
+            with self.trace.child('text_block'):
+                text_block_name = "AINodeAnalysisResult"
+                if text_block_name in bpy.data.texts:
+                    text_block = bpy.data.texts[text_block_name]
+                else:
+                    text_block = bpy.data.texts.new(name=text_block_name)
             base_url = f"http://127.0.0.1:{server_manager.port}" if (server_manager and server_manager.is_running) else ""
             if not base_url:
                 self.report({'ERROR'}, "后端未启动，请先启动后端服务器")
                 ain_settings.ai_question_status = 'ERROR'
                 ain_settings.can_terminate_request = False
                 return {'CANCELLED'}
+            request_id = uuid.uuid4().hex
+            ain_settings.current_request_id = request_id
             payload = {
                 "question": (get_output_detail_instruction(ain_settings) + "\n\n" + self.user_question).strip(),
                 "content": filtered_desc,
@@ -5345,7 +5746,13 @@ class NODE_OT_ask_ai_context(bpy.types.Operator):
                     "networking": {"enabled": True},
                     "memory": {"enabled": bool(getattr(ain_settings, 'enable_memory', True)), "target_k": getattr(ain_settings, 'memory_target_k', 4)}
                 },
-                "nodeContextActive": True
+                "nodeContextActive": True,
+                # 终止请求时据此通知后端关闭提供商连接
+                "requestId": request_id,
+                # 链路追踪：后端的 span 挂在本次提问的根 span 下
+                **self.trace.context(),
+                # 面板提问优先于后台摘要与诊断请求
+                "priority": "interactive"
             }
             
             # 对于BigModel，如果启用深度思考，在问题中添加深度思考指令
@@ -5354,8 +5761,21 @@ class NODE_OT_ask_ai_context(bpy.types.Operator):
                 payload["question"] = thinking_instruction + "\n\n" + payload["question"]
             
             url = base_url + "/api/stream-analyze"
+            # 链路追踪：http 到响应头返回为止；stream 为读取 SSE 并写入文本块，text_block.write 的耗时单独累计
+            http_span = self.trace.child('http', path='/api/stream-analyze', payload_chars=len(filtered_desc))
+            stream_span = None
+            text_writes = [0, 0.0]
+
+            def write_text(text):
+                started = time.perf_counter()
+                text_block.write(text)
+                text_writes[0] += 1
+                text_writes[1] += time.perf_counter() - started
+
             try:
                 with requests.post(url, json=payload, timeout=300, stream=True) as r:
+                    http_span.end(status=r.status_code)
+                    stream_span = self.trace.child('stream')
                     if r.status_code != 200:
                         self.report({'ERROR'}, f"后端错误: {r.status_code}")
                         ain_settings.ai_question_status = 'ERROR'
@@ -5386,18 +5806,31 @@ class NODE_OT_ask_ai_context(bpy.types.Operator):
                                     ain_settings.can_terminate_request = False
                                     return {'CANCELLED'}
 
+                                if t in ('thinking', 'chunk') and 'first_token' not in stream_span.attrs:
+                                    stream_span.attrs['first_token'] = round(time.time() - self.trace.start, 6)
                                 if t == 'thinking':
                                     if not wrote_thinking_header:
-                                        text_block.write(f"\n\n[思考]\n")
+                                        write_text(f"\n\n[思考]\n")
                                         wrote_thinking_header = True
                                     # 直接写入增量，不额外换行
-                                    text_block.write(c)
+                                    write_text(c)
                                 elif t == 'chunk':
-                                    text_block.write(c)
+                                    write_text(c)
+                                elif t == 'web_search':
+                                    write_text(f"\n[联网搜索]\n{c}\n")
+                                elif t == 'map_reduce':
+                                    # 节点树过大时后端先分块分析，再汇总回答
+                                    stage = j.get('stage')
+                                    if stage == 'partition':
+                                        ain_settings.current_status = f"节点树过大，拆分为 {j.get('chunks', 0)} 部分分析..."
+                                    elif stage == 'map':
+                                        ain_settings.current_status = f"分块分析 {j.get('done', 0)}/{j.get('total', 0)}..."
+                                    elif stage == 'reduce':
+                                        ain_settings.current_status = "正在汇总各部分的分析..."
                                 elif t == 'error':
                                     self.report({'ERROR'}, c)
                             except Exception:
-                                text_block.write(s + "\n")
+                                write_text(s + "\n")
 
                     # 检查是否是因用户终止而结束
                     if ain_settings.ai_question_status != 'STOPPED':
@@ -5405,7 +5838,8 @@ class NODE_OT_ask_ai_context(bpy.types.Operator):
                         ain_settings.ai_question_status = 'IDLE'
 
                         # 将结果保存为注释节点
-                        self.create_annotation_node(context, text_block.as_string())
+                        with self.trace.child('annotation'):
+                            self.create_annotation_node(context, text_block.as_string())
 
                         self.report({'INFO'}, f"问题已回答。结果已保存为注释节点。")
 
@@ -5415,6 +5849,11 @@ class NODE_OT_ask_ai_context(bpy.types.Operator):
                 ain_settings.ai_question_status = 'ERROR'
                 ain_settings.can_terminate_request = False
                 return {'CANCELLED'}
+            finally:
+                http_span.end()
+                if stream_span is not None:
+                    stream_span.end(text_writes=text_writes[0], text_write_seconds=round(text_writes[1], 6))
+                self.trace.end(status=ain_settings.ai_question_status, request_id=request_id)
 
         except Exception as e:
             self.report({'ERROR'}, f"AI分析过程中出现错误: {str(e)}")
@@ -5527,6 +5966,8 @@ class NODE_OT_cancel_question_input(bpy.types.Operator):
 # 注册函数
 def register():
     print("开始注册AI Node Analyzer插件...")
+    # 插件重新启用时后端模块不会重新导入，重新启动上次注销时停止的日志线程
+    log_manager.configure()
     
     # 注册快速复制相关类（必须在AINodeAnalyzerSettings之前）
     bpy.utils.register_class(SelectedTextPartItem)
@@ -5562,6 +6003,8 @@ def register():
     bpy.utils.register_class(NODE_OT_test_provider_status)
     bpy.utils.register_class(NODE_OT_test_provider_status_disabled)
     bpy.utils.register_class(NODE_OT_stop_ai_request)
+    bpy.utils.register_class(NODE_OT_batch_analyze)
+    bpy.utils.register_class(NODE_OT_batch_control)
     bpy.utils.register_class(NODE_OT_reset_provider_url)
     bpy.utils.register_class(NODE_OT_refresh_models)
     bpy.utils.register_class(NODE_OT_refresh_models_disabled)
@@ -5677,6 +6120,8 @@ def draw_ainode_menu(self, context):
 def refresh_checker():
     """定时检查是否有来自前端的请求（包括刷新请求和内容推送）"""
     global server_manager
+    # 在主线程同步设置快照（内容未变化时不会替换），覆盖未触发更新回调的修改（如切换场景、加载文件）
+    publish_settings_snapshot()
     if server_manager and server_manager.is_running:
         try:
             # 检查是否有来自前端的刷新请求
@@ -5691,7 +6136,7 @@ def refresh_checker():
 
             if data and data.get('requested', False):
                 # 如果有刷新请求，执行Blender中的刷新操作
-                print("检测到前端刷新请求，正在执行Blender刷新操作...")
+                log.info("收到前端刷新请求")
 
                 # 找到合适的工作区域来执行操作
                 # 遍历所有窗口和区域找到节点编辑器
@@ -5720,17 +6165,17 @@ def refresh_checker():
                                     }
                                     bpy.ops.node.refresh_to_text(override)
                                     
-                                print("Blender刷新操作执行完成")
+                                log.debug("Blender 刷新操作已完成")
                                 found_node_editor = True
                             except Exception as e:
-                                print(f"执行刷新操作失败: {e}")
+                                log.warning("执行刷新操作失败", error=str(e))
                             
                             break
                     if found_node_editor:
                         break
                 
                 if not found_node_editor:
-                    print("未找到节点编辑器，尝试使用通用上下文刷新或提示用户")
+                    log.info("未找到节点编辑器，推送无节点状态")
                     # 即使没有节点编辑器，我们也应该尝试更新文本块，告诉前端没有选中节点
                     try:
                         text_block_name = "AINodeRefreshContent"
@@ -5744,18 +6189,18 @@ def refresh_checker():
                         
                         # 推送更新到后端
                         push_blender_content_to_server()
-                        print("已推送无节点状态到后端")
+                        log.debug("已推送无节点状态到后端")
                     except Exception as e:
-                        print(f"处理无节点编辑器状态时出错: {e}")
+                        log.warning("处理无节点编辑器状态时出错", error=str(e))
             
             # 处理设置更新
             if data and data.get('updates'):
                 updates = data['updates']
-                print(f"收到设置更新: {updates}")
+                log.info("收到设置更新", keys=sorted(updates))
                 
                 # Check for reload_config flag
                 if updates.get('reload_config'):
-                    print("Received reload config request")
+                    log.info("收到重新加载配置请求")
                     try:
                         # 尝试找到节点编辑器
                         found_editor = False
@@ -5782,11 +6227,11 @@ def refresh_checker():
                                             bpy.ops.node.load_config_from_file()
                                     else:
                                         bpy.ops.node.load_config_from_file(override)
-                                    print("已通过通用上下文重新加载配置")
+                                    log.debug("已通过通用上下文重新加载配置")
                                 except Exception as e:
-                                    print(f"通用上下文加载配置失败: {e}")
+                                    log.warning("通用上下文加载配置失败", error=str(e))
                     except Exception as e:
-                        print(f"Failed to auto-reload config: {e}")
+                        log.warning("自动重新加载配置失败", error=str(e))
                 
                 for scene in bpy.data.scenes:
                     settings = scene.ainode_analyzer_settings
@@ -5794,7 +6239,7 @@ def refresh_checker():
                         settings.system_prompt = updates['system_prompt']
                     if 'default_question' in updates:
                         settings.default_question = updates['default_question']
-                print("设置更新已应用")
+                log.debug("设置更新已应用")
 
             # 检查是否有从Web推送的内容需要处理
             content_response = send_to_backend('/api/get-web-content', method='GET')
@@ -5802,14 +6247,13 @@ def refresh_checker():
                 content = content_response.get('content', '')
                 question = content_response.get('question', '')
 
-                print("检测到从Web推送的内容，正在处理...")
+                log.info("收到从网页推送的内容", content_chars=len(content), question_chars=len(question))
 
                 # 更新当前场景的AINodeAnalyzer设置
                 for scene in bpy.data.scenes:
                     ain_settings = scene.ainode_analyzer_settings
                     if question:
                         ain_settings.user_input = question  # 更新问题输入框
-                        print(f"已更新问题输入框为: {question[:50]}...")
 
                 # 如果有内容，更新AINodeRefreshContent文本块
                 # 如果同时有节点内容和问题，将它们组合起来
@@ -5831,7 +6275,7 @@ def refresh_checker():
                     else:
                         text_block = bpy.data.texts.new(name=text_block_name)
                         text_block.write(combined_content)
-                    print(f"已更新AINodeRefreshContent文本块")
+                    log.debug("已更新 AINodeRefreshContent 文本块")
 
                     # 同时推送到后端服务器，确保前端获取到的是最新内容
                     # 尝试构建上下文
@@ -5845,7 +6289,7 @@ def refresh_checker():
                     push_blender_content_to_server(ctx)
 
         except Exception as e:
-            print(f"检查前端请求时出错: {e}")
+            log.warning("检查前端请求时出错", error=str(e))
 
         try:
             analysis_response = send_to_backend('/api/get-analysis-result', method='GET')
@@ -5894,7 +6338,7 @@ def refresh_checker():
                                     ain_settings.system_prompt = system_message_presets_cache[auto_identity_idx].get('value', '')
                     break
     except Exception as e:
-        print(f"自动切换身份预设时出错: {e}")
+        log.warning("自动切换身份预设时出错", error=str(e))
 
     # 继续下一次检查 - 每1秒检查一次，以提高响应速度
     return 1.0
@@ -5920,11 +6364,19 @@ def unregister():
     print("开始注销AI Node Analyzer插件...")
     # 停止刷新检查器
     stop_refresh_checker()
+    # 停止批量任务进度轮询
+    if bpy.app.timers.is_registered(_poll_batch_job):
+        bpy.app.timers.unregister(_poll_batch_job)
     # 停止后端服务器
     global server_manager
     if server_manager and server_manager.is_running:
         server_manager.stop_server()
         print("后端服务器已停止")
+    # 落盘尚未写入的配置修改
+    try:
+        config_store.stop()
+    except Exception:
+        log.error("写入配置文件时出错", exc_info=True)
 
     # 注销运算符
     bpy.utils.unregister_class(NODE_OT_create_analysis_frame)
@@ -5946,6 +6398,8 @@ def unregister():
     bpy.utils.unregister_class(NODE_OT_test_provider_status)
     bpy.utils.unregister_class(NODE_OT_test_provider_status_disabled)
     bpy.utils.unregister_class(NODE_OT_stop_ai_request)
+    bpy.utils.unregister_class(NODE_OT_batch_analyze)
+    bpy.utils.unregister_class(NODE_OT_batch_control)
     bpy.utils.unregister_class(NODE_OT_reset_provider_url)
     bpy.utils.unregister_class(NODE_OT_refresh_models)
     bpy.utils.unregister_class(NODE_OT_refresh_models_disabled)
@@ -6015,6 +6469,8 @@ def unregister():
     bpy.utils.unregister_class(SelectedTextPartItem)
     
     print("插件已注销完成")
+    # 写完队列中剩余的日志并停止日志线程
+    log_manager.shutdown()
 
 
 if __name__ == "__main__":
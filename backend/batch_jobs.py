@@ -0,0 +1,361 @@
+"""
+批量分析任务
+
+对文件中的每个材质 / 节点组执行同一个问题（例如整晚跑一遍“性能优化”），不再需要逐个手动提问。
+节点数据由 Blender 插件在主线程中收集后随任务提交（后端不访问 bpy），这里负责：
+- 按任务的并行度 (parallelism) 启动工作线程，每一项经提供商层（调度器 batch 优先级、限流、健康度）生成；
+- 每完成一项把结果写入 cache/batch/<job_id>.json，重启后任务恢复为暂停状态，可继续；
+- 暂停（进行中的项完成后不再开始新项）、继续、重试失败项、取消（立即中断进行中的项）；
+- 通过 version 计数通知进度订阅者 (wait_for_update)，供 /api/batch-analyze/<id>/events 推送进度。
+
+实际的生成由 server 通过 set_generator(fn) 注入：fn(job, item, scope) 返回 (answer, meta)，失败时抛出异常。
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from cancellation import CancelScope
+from structured_log import get_logger
+
+log = get_logger('batch_jobs')
+
+# 任务状态
+RUNNING = 'running'
+PAUSED = 'paused'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+
+# 单项状态
+ITEM_PENDING = 'pending'
+ITEM_RUNNING = 'running'
+ITEM_DONE = 'done'
+ITEM_FAILED = 'failed'
+ITEM_CANCELLED = 'cancelled'
+
+addon_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BatchJob:
+    """一个批量任务：问题、待分析的节点树列表及各项结果"""
+
+    def __init__(self, job_id, question, items, options=None, parallelism=2, created_at=None):
+        self.id = job_id
+        self.question = question
+        self.items = items
+        self.options = options or {}
+        self.parallelism = parallelism
+        self.state = RUNNING
+        self.created_at = created_at or time.time()
+        self.updated_at = self.created_at
+        self.version = 0
+        self.workers = 0
+        self.scopes = {}
+
+    def counts(self):
+        result = {ITEM_PENDING: 0, ITEM_RUNNING: 0, ITEM_DONE: 0, ITEM_FAILED: 0, ITEM_CANCELLED: 0}
+        for item in self.items:
+            result[item['status']] = result.get(item['status'], 0) + 1
+        return result
+
+    def summary(self):
+        return {
+            'jobId': self.id,
+            'question': self.question,
+            'state': self.state,
+            'parallelism': self.parallelism,
+            'total': len(self.items),
+            'counts': self.counts(),
+            'createdAt': self.created_at,
+            'updatedAt': self.updated_at,
+            'version': self.version,
+        }
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'question': self.question,
+            'options': self.options,
+            'parallelism': self.parallelism,
+            'state': self.state,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'items': self.items,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['id'], data.get('question', ''), data.get('items') or [], data.get('options') or {},
+                  data.get('parallelism', 2), data.get('created_at'))
+        job.state = data.get('state', PAUSED)
+        job.updated_at = data.get('updated_at', job.created_at)
+        return job
+
+
+def _item_view(item, include_content=False):
+    view = {k: v for k, v in item.items() if k != 'content' or include_content}
+    if not include_content:
+        view['contentChars'] = len(item.get('content') or '')
+    return view
+
+
+class BatchRunner:
+    """批量任务的执行、持久化与进度通知"""
+
+    def __init__(self, directory, max_parallel=4, default_parallel=2):
+        self.directory = directory
+        self.max_parallel = max_parallel
+        self.default_parallel = default_parallel
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._generator = None
+        self._loaded = False
+
+    def configure(self, max_parallel=None, default_parallel=None):
+        with self._cond:
+            if max_parallel is not None:
+                self.max_parallel = max(1, int(max_parallel))
+            if default_parallel is not None:
+                self.default_parallel = max(1, int(default_parallel))
+
+    def set_generator(self, generator):
+        self._generator = generator
+
+    # ---------- 持久化 ----------
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _persist(self, job):
+        """写入任务文件（调用方持有锁；先写临时文件再替换，避免中断时留下半个文件）"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(job.id)
+            tmp = path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(job.to_dict(), f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError:
+            log.error("保存批量任务失败", exc_info=True, job=job.id)
+
+    def _ensure_loaded(self):
+        """首次访问时读取已保存的任务；上次未完成的任务恢复为暂停"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    job = BatchJob.from_dict(json.load(f))
+            except (OSError, ValueError, KeyError):
+                log.warning("读取批量任务失败，已跳过", exc_info=True, file=name)
+                continue
+            for item in job.items:
+                if item['status'] == ITEM_RUNNING:
+                    item['status'] = ITEM_PENDING
+            if job.state == RUNNING:
+                job.state = PAUSED
+            self._jobs[job.id] = job
+
+    def _touch(self, job, persist=True):
+        """记录变化并唤醒进度订阅者（调用方持有锁）"""
+        job.version += 1
+        job.updated_at = time.time()
+        if persist:
+            self._persist(job)
+        self._cond.notify_all()
+
+    # ---------- 执行 ----------
+
+    def create(self, question, items, options=None, parallelism=None):
+        """
+        创建并启动任务。items 为 [{id, name, kind, content}]，返回 BatchJob。
+        """
+        normalized = []
+        seen = set()
+        for index, raw in enumerate(items):
+            item_id = str(raw.get('id') or raw.get('name') or index)
+            if item_id in seen:
+                item_id = f"{item_id}#{index}"
+            seen.add(item_id)
+            normalized.append({
+                'id': item_id,
+                'name': str(raw.get('name') or item_id),
+                'kind': str(raw.get('kind') or ''),
+                'content': str(raw.get('content') or ''),
+                'status': ITEM_PENDING,
+                'attempts': 0,
+                'answer': '',
+                'error': '',
+                'meta': {},
+                'started_at': None,
+                'finished_at': None,
+            })
+        with self._cond:
+            self._ensure_loaded()
+            parallelism = int(parallelism or self.default_parallel)
+            job = BatchJob(uuid.uuid4().hex[:12], question, normalized, options, max(1, min(parallelism, self.max_parallel)))
+            self._jobs[job.id] = job
+            self._touch(job)
+            self._start_workers(job)
+        return job
+
+    def _start_workers(self, job):
+        """按并行度补足工作线程（调用方持有锁）"""
+        pending = sum(1 for item in job.items if item['status'] == ITEM_PENDING)
+        while job.state == RUNNING and job.workers < min(job.parallelism, pending + job.workers):
+            job.workers += 1
+            threading.Thread(target=self._worker, args=(job,), name=f'ainode-batch-{job.id}', daemon=True).start()
+            pending -= 1
+
+    def _next_item(self, job):
+        for item in job.items:
+            if item['status'] == ITEM_PENDING:
+                return item
+        return None
+
+    def _worker(self, job):
+        while True:
+            with self._cond:
+                item = self._next_item(job) if job.state == RUNNING else None
+                if item is None:
+                    job.workers -= 1
+                    if job.workers == 0 and job.state == RUNNING and not any(
+                            i['status'] in (ITEM_PENDING, ITEM_RUNNING) for i in job.items):
+                        job.state = COMPLETED
+                        self._touch(job)
+                    return
+                item['status'] = ITEM_RUNNING
+                item['attempts'] += 1
+                item['started_at'] = time.time()
+                item['error'] = ''
+                scope = job.scopes[item['id']] = CancelScope()
+                self._touch(job, persist=False)
+            try:
+                if self._generator is None:
+                    raise RuntimeError("批量分析未初始化")
+                answer, meta = self._generator(job, item, scope)
+                status, error = ITEM_DONE, ''
+            except Exception as e:
+                answer, meta = '', {}
+                status, error = ITEM_FAILED, str(e) or type(e).__name__
+            with self._cond:
+                job.scopes.pop(item['id'], None)
+                if scope.cancelled:
+                    # 被取消或暂停中断：取消的项保持 cancelled，可重试
+                    status, error = ITEM_CANCELLED, error or '已取消'
+                item['status'] = status
+                item['answer'] = answer
+                item['error'] = error
+                item['meta'] = meta or {}
+                item['finished_at'] = time.time()
+                self._touch(job)
+
+    # ---------- 控制 ----------
+
+    def get(self, job_id):
+        with self._cond:
+            self._ensure_loaded()
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._cond:
+            self._ensure_loaded()
+            return [job.summary() for job in sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)]
+
+    def pause(self, job_id):
+        """暂停：进行中的项继续完成，不再开始新项"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.state != RUNNING:
+                return job
+            job.state = PAUSED
+            self._touch(job)
+            return job
+
+    def resume(self, job_id):
+        with self._cond:
+            self._ensure_loaded()
+            job = self._jobs.get(job_id)
+            if job is None or job.state not in (PAUSED, COMPLETED):
+                return job
+            job.state = RUNNING
+            self._touch(job)
+            self._start_workers(job)
+            if job.workers == 0:
+                job.state = COMPLETED
+                self._touch(job)
+            return job
+
+    def retry(self, job_id, item_ids=None):
+        """把失败（或被取消）的项重新放回队列并继续任务"""
+        with self._cond:
+            self._ensure_loaded()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            wanted = set(item_ids or [])
+            for item in job.items:
+                if item['status'] in (ITEM_FAILED, ITEM_CANCELLED) and (not wanted or item['id'] in wanted):
+                    item['status'] = ITEM_PENDING
+                    item['error'] = ''
+            job.state = RUNNING
+            self._touch(job)
+            self._start_workers(job)
+            if job.workers == 0:
+                job.state = COMPLETED
+                self._touch(job)
+            return job
+
+    def cancel(self, job_id):
+        """取消任务：未开始的项标记为 cancelled，进行中的项立即中断"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.state = CANCELLED
+            for item in job.items:
+                if item['status'] == ITEM_PENDING:
+                    item['status'] = ITEM_CANCELLED
+            scopes = list(job.scopes.values())
+            self._touch(job)
+        for scope in scopes:
+            scope.cancel()
+        return job
+
+    def snapshot(self, job, include_results=True, include_content=False):
+        with self._cond:
+            data = job.summary()
+            if include_results:
+                data['items'] = [_item_view(item, include_content) for item in job.items]
+            else:
+                data['items'] = [
+                    {k: item[k] for k in ('id', 'name', 'kind', 'status', 'attempts', 'error')}
+                    for item in job.items
+                ]
+            return data
+
+    def wait_for_update(self, job, version, timeout=15.0):
+        """等待任务版本超过 version，返回当前版本（超时则不变）"""
+        with self._cond:
+            if job.version <= version:
+                self._cond.wait_for(lambda: job.version > version, timeout)
+            return job.version
+
+    def info(self):
+        with self._cond:
+            states = {}
+            for job in self._jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            return {"jobs": len(self._jobs), "states": states, "max_parallel": self.max_parallel}
+
+
+# 全局批量任务
+batch_jobs = BatchRunner(os.path.join(addon_dir, 'cache', 'batch'))
@@ -0,0 +1,154 @@
+"""
+请求取消
+
+Blender 的“终止AI请求”原来只把 ai_question_status 置为 STOPPED，后端仍会把提供商的流读完（并继续计费）。
+这里提供：
+- CancelScope：可取消的作用域，cancel() 依次调用注册的回调（中断上游连接、唤醒等待中的订阅者）；
+  子作用域随父作用域一起取消（对冲请求的每一路）；
+- RequestRegistry：按 requestId / conversationId 登记进行中的 /api/stream-analyze，供 /api/cancel 取消；
+- DisconnectWatch：线程模式下检测客户端是否已断开（对端关闭后套接字可读且读到 0 字节）。
+
+取消的传递：会话作用域 -> 订阅者退订 single_flight -> 最后一个订阅者离开时取消 Flight 的作用域
+-> server._call_provider 关闭上游 HTTP 连接 / stream_gateway 取消上游任务。
+"""
+import select
+import socket
+import threading
+import time
+import uuid
+
+from structured_log import get_logger
+
+log = get_logger('cancellation')
+
+
+class CancelScope:
+    """可取消的作用域"""
+
+    def __init__(self, parent=None):
+        self.cancelled = False
+        self.reason = ''
+        self._callbacks = []
+        self._lock = threading.Lock()
+        if parent is not None:
+            parent.add(self.cancel)
+
+    def add(self, callback):
+        """注册取消回调并返回它；已取消时立即调用"""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return callback
+        callback()
+        return callback
+
+    def remove(self, callback):
+        with self._lock:
+            try:
+                self._callbacks.remove(callback)
+            except ValueError:
+                pass
+
+    def cancel(self, reason='cancelled'):
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                log.error("取消回调出错", exc_info=True)
+        return True
+
+    def child(self):
+        return CancelScope(self)
+
+
+def abort_socket(sock):
+    """从另一个线程中断阻塞在 recv 上的读取：shutdown 会立即唤醒读取方，close 则不会"""
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class DisconnectWatch:
+    """检测客户端是否已关闭连接；每 interval 秒最多检查一次"""
+
+    def __init__(self, sock, interval=0.5):
+        self.sock = sock
+        self.interval = interval
+        self._checked_at = 0.0
+        self.closed = False
+
+    def check(self):
+        if self.closed or self.sock is None:
+            return self.closed
+        now = time.monotonic()
+        if now - self._checked_at < self.interval:
+            return False
+        self._checked_at = now
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable and not self.sock.recv(1, socket.MSG_PEEK):
+                self.closed = True
+        except (OSError, ValueError):
+            self.closed = True
+        return self.closed
+
+
+class RequestRegistry:
+    """进行中的生成请求：requestId -> (conversationId, 作用域)"""
+
+    def __init__(self):
+        self._requests = {}
+        self._lock = threading.Lock()
+        self.stats = {"registered": 0, "cancelled": 0, "disconnected": 0}
+
+    def register(self, request_id=None, conversation_id=None):
+        """登记一个请求，返回 (request_id, scope)；request_id 为空时自动生成"""
+        request_id = str(request_id or uuid.uuid4())
+        scope = CancelScope()
+        with self._lock:
+            previous = self._requests.get(request_id)
+            self._requests[request_id] = (conversation_id, scope)
+            self.stats["registered"] += 1
+        if previous is not None:
+            # 客户端重用了 requestId：旧请求不会再被读取
+            previous[1].cancel('replaced')
+        return request_id, scope
+
+    def unregister(self, request_id, scope=None):
+        with self._lock:
+            entry = self._requests.get(request_id)
+            if entry is not None and (scope is None or entry[1] is scope):
+                del self._requests[request_id]
+
+    def cancel(self, request_id=None, conversation_id=None, reason='cancelled'):
+        """按 requestId 或 conversationId 取消，返回被取消的 requestId 列表"""
+        with self._lock:
+            targets = [
+                (rid, scope) for rid, (cid, scope) in self._requests.items()
+                if (request_id and rid == request_id) or (conversation_id and cid == conversation_id)
+            ]
+        cancelled = [rid for rid, scope in targets if scope.cancel(reason)]
+        with self._lock:
+            self.stats["cancelled"] += len(cancelled)
+        return cancelled
+
+    def record_disconnect(self):
+        with self._lock:
+            self.stats["disconnected"] += 1
+
+    def info(self):
+        with self._lock:
+            return {"active": len(self._requests), **self.stats}
+
+
+# 全局进行中请求登记表
+active_requests = RequestRegistry()
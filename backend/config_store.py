@@ -0,0 +1,213 @@
+"""
+config.json 统一读写器
+
+所有对 config.json 的修改都经由同一个 ConfigStore 实例完成：
+- 修改先作用于内存中的配置并登记到写回日志（版本号递增），立即对读取方可见；
+- 后台写线程在短暂的合并窗口内合并多次修改，只落盘一次；
+- 落盘采用 临时文件 + fsync + os.replace，不会留下写了一半的文件；
+- 每次落盘后通知订阅者 (version, config)。
+"""
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+
+from structured_log import get_logger
+
+log = get_logger('config_store')
+
+addon_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ConfigStore:
+    """带写回合并的 config.json 存储"""
+
+    def __init__(self, path, flush_delay=0.25):
+        self.path = path
+        self.flush_delay = flush_delay
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(self._lock)
+        self._data = None
+        self._mtime = None
+        # 写回日志：尚未落盘的修改 (version, 来源)
+        self._journal = []
+        self._version = 0
+        self._written_version = 0
+        self._subscribers = []
+        self._writer = None
+        self._stopping = False
+        self.read_count = 0
+        self.write_count = 0
+        # read() / get() 的调用次数（大多由内存中的配置满足，read_count 为实际读取文件的次数）
+        self.access_count = 0
+
+    # ---------- 读取 ----------
+
+    def _file_mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def _ensure_loaded(self):
+        """加载或在文件被外部修改且无待写内容时重新加载"""
+        mtime = self._file_mtime()
+        if self._data is not None and (self._journal or mtime == self._mtime):
+            return
+        data = {}
+        if mtime is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.read_count += 1
+            except Exception:
+                log.error("读取配置文件失败", exc_info=True, path=self.path)
+                if self._data is not None:
+                    return
+                data = {}
+        self._data = data if isinstance(data, dict) else {}
+        self._mtime = mtime
+
+    def read(self):
+        """返回当前配置的深拷贝（包含尚未落盘的修改）"""
+        with self._lock:
+            self.access_count += 1
+            self._ensure_loaded()
+            return copy.deepcopy(self._data)
+
+    def get(self, *keys, default=None):
+        """按路径读取单个值，例如 get('ai', 'memory', default={})"""
+        with self._lock:
+            self.access_count += 1
+            self._ensure_loaded()
+            node = self._data
+            for k in keys:
+                if not isinstance(node, dict) or k not in node:
+                    return default
+                node = node[k]
+            return copy.deepcopy(node)
+
+    @property
+    def version(self):
+        return self._version
+
+    # ---------- 写入 ----------
+
+    def update(self, mutator, source=''):
+        """
+        在锁内对配置执行 mutator(config)，并安排一次合并写回。
+        mutator 直接修改传入的字典；mutator 抛出异常时配置保持不变。
+        返回本次修改的版本号。
+        """
+        with self._lock:
+            self._ensure_loaded()
+            data = copy.deepcopy(self._data)
+            mutator(data)
+            self._data = data
+            self._version += 1
+            self._journal.append((self._version, source))
+            self._start_writer()
+            self._cond.notify_all()
+            return self._version
+
+    def flush(self, version=None, timeout=5.0):
+        """等待指定版本（默认当前版本）落盘，返回是否成功"""
+        deadline = time.time() + timeout
+        with self._lock:
+            target = self._version if version is None else version
+            if self._journal:
+                self._start_writer()
+                self._cond.notify_all()
+            while self._written_version < target:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def subscribe(self, callback):
+        """订阅落盘事件，callback(version, config)"""
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def stop(self):
+        """落盘所有待写内容并停止写线程"""
+        self.flush()
+        with self._lock:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._writer:
+            self._writer.join(timeout=2.0)
+        with self._lock:
+            self._writer = None
+            self._stopping = False
+
+    def _start_writer(self):
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._writer_loop, name='ainode-config-writer', daemon=True)
+            self._writer.start()
+
+    def _writer_loop(self):
+        while True:
+            with self._lock:
+                while not self._journal and not self._stopping:
+                    self._cond.wait()
+                if not self._journal and self._stopping:
+                    return
+            # 合并窗口：窗口内的后续修改会一起落盘
+            time.sleep(self.flush_delay)
+            with self._lock:
+                if not self._journal:
+                    continue
+                version = self._version
+                payload = json.dumps(self._data, indent=4, ensure_ascii=False)
+                snapshot = copy.deepcopy(self._data)
+            try:
+                self._write_atomic(payload)
+            except Exception:
+                log.error("写入配置文件失败", exc_info=True, path=self.path)
+                with self._lock:
+                    if self._stopping:
+                        return
+                time.sleep(1.0)
+                continue
+            with self._lock:
+                self._journal = [j for j in self._journal if j[0] > version]
+                self._written_version = version
+                self._mtime = self._file_mtime()
+                self.write_count += 1
+                subscribers = list(self._subscribers)
+                self._cond.notify_all()
+            for cb in subscribers:
+                try:
+                    cb(version, snapshot)
+                except Exception:
+                    log.error("配置订阅回调出错", exc_info=True, version=version)
+
+    def _write_atomic(self, payload):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix='.config.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+# 全局配置存储实例
+config_store = ConfigStore(os.path.join(addon_dir, 'config.json'))
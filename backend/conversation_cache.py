@@ -0,0 +1,385 @@
+"""
+有界对话缓存
+
+替代 server.py 中无上限的 conversations / conversation_memory / conversation_stats 字典：
+- 按最近使用顺序 (LRU) 保存对话，超过对话数上限、内存上限或 TTL 的对话被淘汰；
+- 节点数据 (node_content) 按内容哈希只保存一份，消息中只记录前后缀与哈希引用，读取时再拼接；
+- usage() 返回内存占用统计，供 /api/memory-usage 监控；
+- 关联 ConversationDB 后所有修改同步写入数据库，缓存未命中（被淘汰或重启后）时从数据库回填。
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from structured_log import get_logger
+
+log = get_logger('conversation_cache')
+
+
+class NodeContextStore:
+    """按 sha256 去重保存节点数据，引用计数归零时释放"""
+
+    def __init__(self):
+        self._blobs = {}
+        self.bytes = 0
+        self.dedup_hits = 0
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def intern(self, text):
+        key = self.key(text)
+        entry = self._blobs.get(key)
+        if entry is None:
+            self._blobs[key] = [text, 1]
+            self.bytes += len(text)
+        else:
+            entry[1] += 1
+            self.dedup_hits += 1
+        return key
+
+    def release(self, key):
+        entry = self._blobs.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._blobs[key]
+            self.bytes -= len(entry[0])
+
+    def get(self, key):
+        entry = self._blobs.get(key)
+        return entry[0] if entry else ''
+
+    def lookup(self, key):
+        """与 get 相同，但没有这份节点数据时返回 None"""
+        entry = self._blobs.get(key)
+        return entry[0] if entry else None
+
+    def usage(self):
+        return {
+            "node_contexts": len(self._blobs),
+            "node_context_bytes": self.bytes,
+            "dedup_hits": self.dedup_hits,
+        }
+
+
+class _Conversation:
+    __slots__ = ('messages', 'summary', 'summary_upto', 'stats', 'created_at', 'updated_at', 'bytes')
+
+    def __init__(self):
+        # 消息记录: {'role', 'content'} 或 {'role', 'prefix', 'node_ref', 'suffix'}
+        self.messages = []
+        self.summary = ''
+        # 滚动摘要已覆盖的消息数（messages[:summary_upto] 已并入摘要）
+        self.summary_upto = 0
+        self.stats = {}
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.bytes = 0
+
+
+def _record_bytes(record):
+    return len(record.get('content', '')) + len(record.get('prefix', '')) + len(record.get('suffix', ''))
+
+
+class ConversationCache:
+    """带 LRU / TTL / 内存上限的对话缓存（线程安全）"""
+
+    def __init__(self, max_conversations=200, max_bytes=64 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nodes = NodeContextStore()
+        self._conversations = OrderedDict()
+        self._lock = threading.RLock()
+        self._message_bytes = 0
+        self.evictions = 0
+        self.db = None
+        self.db_loads = 0
+
+    def attach(self, db):
+        """关联持久化存储 (ConversationDB)"""
+        with self._lock:
+            self.db = db
+
+    def configure(self, max_conversations=None, max_bytes=None, ttl=None):
+        with self._lock:
+            if max_conversations is not None:
+                self.max_conversations = max(1, int(max_conversations))
+            if max_bytes is not None:
+                self.max_bytes = max(1, int(max_bytes))
+            if ttl is not None:
+                self.ttl = float(ttl)
+            self._evict()
+
+    # ---------- 内部 ----------
+
+    def _touch(self, cid, create=False):
+        conv = self._conversations.get(cid)
+        if conv is None:
+            conv = self._load(cid)
+        if conv is None:
+            if not create:
+                return None
+            conv = _Conversation()
+            self._conversations[cid] = conv
+            if self.db:
+                self.db.create(cid)
+        else:
+            self._conversations.move_to_end(cid)
+        conv.updated_at = time.time()
+        return conv
+
+    def _lookup(self, cid):
+        """缓存中的对话；被淘汰或重启后不在缓存中时与 messages 一样从数据库回填"""
+        loaded = cid not in self._conversations
+        conv = self._touch(cid)
+        if conv is not None and loaded:
+            self._evict(keep=cid)
+        return conv
+
+    def _make_record(self, role, content, node_text=None):
+        """node_text 出现在 content 中时，把它替换为内容哈希引用"""
+        if node_text and node_text in content:
+            prefix, _, suffix = content.partition(node_text)
+            return {'role': role, 'prefix': prefix, 'node_ref': self.nodes.intern(node_text), 'suffix': suffix}
+        return {'role': role, 'content': content}
+
+    def _load(self, cid):
+        """从数据库回填一个对话到缓存"""
+        if not self.db or not cid:
+            return None
+        try:
+            data = self.db.load_conversation(cid)
+        except Exception:
+            log.error("读取对话数据库失败", exc_info=True, conversation=cid)
+            return None
+        if data is None:
+            return None
+        conv = _Conversation()
+        conv.created_at = data['created_at']
+        conv.summary = data['summary'] or ''
+        conv.summary_upto = data.get('summary_upto', 0) or 0
+        conv.stats = data['stats']
+        missing = 0
+        for row in data['messages']:
+            node_text = row['node_text']
+            if row['node_ref'] and node_text is None:
+                # node_contexts 中缺少引用的节点数据：其他对话仍在内存中持有时补写数据库
+                node_text = self.nodes.lookup(row['node_ref'])
+                if node_text is not None:
+                    self.db.save_node_context(row['node_ref'], node_text)
+                else:
+                    missing += 1
+            if row['node_ref'] and node_text is not None:
+                record = {'role': row['role'], 'prefix': row['content'], 'node_ref': self.nodes.intern(node_text), 'suffix': row['suffix']}
+            else:
+                record = {'role': row['role'], 'content': row['content'] + (row['suffix'] or '')}
+            conv.messages.append(record)
+            self._add_record(conv, record)
+        if missing:
+            log.warning("对话引用的节点数据在数据库中缺失，这些消息按不含节点数据加载", conversation=cid, messages=missing)
+        self._message_bytes += len(conv.summary)
+        self._conversations[cid] = conv
+        self.db_loads += 1
+        return conv
+
+    def _materialize(self, record):
+        if 'node_ref' in record:
+            return {'role': record['role'], 'content': record['prefix'] + self.nodes.get(record['node_ref']) + record['suffix']}
+        return {'role': record['role'], 'content': record['content']}
+
+    def _head(self, record, length):
+        """只拼接预览需要的前 length 个字符，避免复制整份节点数据"""
+        if 'node_ref' not in record:
+            return record['content'][:length]
+        text = record['prefix'][:length]
+        if len(text) < length:
+            text += self.nodes.get(record['node_ref'])[:length - len(text)]
+        if len(text) < length:
+            text += record['suffix'][:length - len(text)]
+        return text
+
+    def _drop_record(self, conv, record):
+        size = _record_bytes(record)
+        conv.bytes -= size
+        self._message_bytes -= size
+        if 'node_ref' in record:
+            self.nodes.release(record['node_ref'])
+
+    def _add_record(self, conv, record):
+        size = _record_bytes(record)
+        conv.bytes += size
+        self._message_bytes += size
+
+    def _remove(self, cid):
+        conv = self._conversations.pop(cid, None)
+        if conv is None:
+            return
+        for record in conv.messages:
+            self._drop_record(conv, record)
+        self._message_bytes -= len(conv.summary)
+
+    def _total_bytes(self):
+        return self._message_bytes + self.nodes.bytes
+
+    def _evict(self, keep=None):
+        now = time.time()
+        if self.ttl and self.ttl > 0:
+            for cid in [c for c, conv in self._conversations.items() if now - conv.updated_at > self.ttl and c != keep]:
+                self._remove(cid)
+                self.evictions += 1
+        while len(self._conversations) > self.max_conversations or self._total_bytes() > self.max_bytes:
+            oldest = next((c for c in self._conversations if c != keep), None)
+            if oldest is None:
+                break
+            self._remove(oldest)
+            self.evictions += 1
+
+    # ---------- 对话 ----------
+
+    def contains(self, cid):
+        with self._lock:
+            if cid in self._conversations:
+                return True
+            if self._load(cid) is not None:
+                self._evict(keep=cid)
+                return True
+            return False
+
+    def create(self, cid):
+        with self._lock:
+            self._touch(cid, create=True)
+            self._evict(keep=cid)
+
+    def messages(self, cid, collapse_node=None, placeholder=''):
+        """
+        返回完整消息列表（新的字典，修改不影响缓存）。
+        collapse_node 为节点数据的内容哈希时，引用该节点数据的消息用 placeholder 代替节点数据。
+        """
+        with self._lock:
+            conv = self._touch(cid)
+            if conv is None:
+                return []
+            result = []
+            for r in conv.messages:
+                if collapse_node and r.get('node_ref') == collapse_node:
+                    result.append({'role': r['role'], 'content': r['prefix'] + placeholder + r['suffix']})
+                else:
+                    result.append(self._materialize(r))
+            return result
+
+    def node_context(self, cid):
+        """对话第一条系统消息引用的节点数据（没有时返回空字符串）"""
+        with self._lock:
+            conv = self._touch(cid)
+            if conv is None:
+                return ''
+            for r in conv.messages:
+                if r['role'] == 'system':
+                    return self.nodes.get(r['node_ref']) if 'node_ref' in r else ''
+            return ''
+
+    def count_role(self, cid, role):
+        with self._lock:
+            conv = self._lookup(cid)
+            if conv is None:
+                return 0
+            return len([r for r in conv.messages if r['role'] == role])
+
+    def append(self, cid, role, content, node_text=None):
+        with self._lock:
+            conv = self._touch(cid, create=True)
+            record = self._make_record(role, content, node_text)
+            conv.messages.append(record)
+            self._add_record(conv, record)
+            if self.db:
+                self.db.append_message(cid, record, node_text)
+            self._evict(keep=cid)
+
+    def replace_system(self, cid, content, node_text=None):
+        """替换第一条系统消息，没有系统消息时返回 False"""
+        with self._lock:
+            conv = self._touch(cid)
+            if conv is None:
+                return False
+            for i, old in enumerate(conv.messages):
+                if old['role'] == 'system':
+                    record = self._make_record('system', content, node_text)
+                    self._drop_record(conv, old)
+                    conv.messages[i] = record
+                    self._add_record(conv, record)
+                    if self.db:
+                        self.db.replace_system(cid, record, node_text)
+                    self._evict(keep=cid)
+                    return True
+            return False
+
+    def get_summary(self, cid):
+        with self._lock:
+            conv = self._lookup(cid)
+            return conv.summary if conv else ''
+
+    def get_summary_state(self, cid):
+        """返回 (摘要, 已并入摘要的消息数)"""
+        with self._lock:
+            conv = self._lookup(cid)
+            return (conv.summary, conv.summary_upto) if conv else ('', 0)
+
+    def set_summary(self, cid, summary, upto=None):
+        with self._lock:
+            conv = self._touch(cid, create=True)
+            self._message_bytes += len(summary) - len(conv.summary)
+            conv.summary = summary
+            if upto is not None:
+                conv.summary_upto = upto
+            if self.db:
+                self.db.set_summary(cid, summary, conv.summary_upto)
+            self._evict(keep=cid)
+
+    def get_stats(self, cid):
+        with self._lock:
+            conv = self._lookup(cid)
+            return dict(conv.stats) if conv else {}
+
+    def set_stats(self, cid, stats):
+        with self._lock:
+            conv = self._touch(cid, create=True)
+            conv.stats = dict(stats)
+            if self.db:
+                self.db.set_stats(cid, conv.stats)
+
+    def previews(self, length=50):
+        """侧边栏预览：(cid, 第一条用户消息, 最后一条助手回复, 更新时间)，按最近使用倒序"""
+        with self._lock:
+            result = []
+            for cid, conv in reversed(self._conversations.items()):
+                user = next((r for r in conv.messages if r['role'] == 'user'), None)
+                assistant = next((r for r in reversed(conv.messages) if r['role'] == 'assistant'), None)
+                user_text = self._head(user, length + 1) if user else "New Chat"
+                assistant_text = self._head(assistant, length + 1) if assistant else ""
+                result.append((cid, user_text, assistant_text, conv.updated_at))
+            return result
+
+    def usage(self):
+        with self._lock:
+            usage = {
+                "conversations": len(self._conversations),
+                "messages": sum(len(c.messages) for c in self._conversations.values()),
+                "message_bytes": self._message_bytes,
+                **self.nodes.usage(),
+                "max_conversations": self.max_conversations,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "evictions": self.evictions,
+                "db_loads": self.db_loads,
+            }
+            usage["total_bytes"] = usage["message_bytes"] + usage["node_context_bytes"]
+            return usage
+
+
+# 全局对话缓存实例
+conversation_cache = ConversationCache()
@@ -0,0 +1,345 @@
+"""
+对话持久化存储 (SQLite, WAL)
+
+保存对话、消息、统计与摘要，Blender 重启后对话仍可继续：
+- conversations 表冗余保存标题 / 最后回复预览 / 消息数，并按 (updated_at, id) 建索引，
+  侧边栏列表只读这张表，用游标分页，耗时与历史总量无关；
+- messages 表按 (conversation_id, seq) 存储，消息正文按需分页读取；
+- 节点数据按内容哈希保存在 node_contexts 表，消息只记录前后缀与哈希。
+
+写入由单独的写线程串行执行（WAL 下读写互不阻塞），读取使用每线程一个连接。
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from structured_log import get_logger
+
+log = get_logger('conversation_db')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL DEFAULT '',
+    preview TEXT NOT NULL DEFAULT '',
+    message_count INTEGER NOT NULL DEFAULT 0,
+    summary TEXT NOT NULL DEFAULT '',
+    summary_upto INTEGER NOT NULL DEFAULT 0,
+    stats TEXT NOT NULL DEFAULT '{}',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_activity ON conversations (updated_at DESC, id DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL DEFAULT '',
+    node_ref TEXT,
+    suffix TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    PRIMARY KEY (conversation_id, seq)
+);
+CREATE TABLE IF NOT EXISTS node_contexts (
+    hash TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+PREVIEW_LENGTH = 51
+
+
+def _encode_cursor(updated_at, cid):
+    return f"{updated_at!r}|{cid}"
+
+
+def _decode_cursor(cursor):
+    updated_at, _, cid = cursor.partition('|')
+    return float(updated_at), cid
+
+
+class ConversationDB:
+    """对话的 SQLite 存储"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._initialized = False
+        self._known_nodes = set()
+        self.write_errors = 0
+
+    # ---------- 连接 ----------
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self._ensure_schema()
+            conn = self._connect()
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        with self._writer_lock:
+            if self._initialized:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = self._connect()
+            try:
+                conn.executescript(_SCHEMA)
+                # 旧版本数据库补充新增列
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(conversations)")}
+                if 'summary_upto' not in columns:
+                    conn.execute("ALTER TABLE conversations ADD COLUMN summary_upto INTEGER NOT NULL DEFAULT 0")
+                conn.commit()
+            finally:
+                conn.close()
+            self._initialized = True
+
+    # ---------- 写线程 ----------
+
+    def _submit(self, fn, *args):
+        """排队一次写操作，按提交顺序执行"""
+        self._ensure_schema()
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._writer_loop, name='ainode-conversation-db', daemon=True)
+                self._writer.start()
+        self._queue.put((fn, args))
+
+    def _writer_loop(self):
+        conn = self._connect()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                # 合并已排队的写操作为一个事务
+                while len(batch) < 256:
+                    try:
+                        nxt = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if nxt is None:
+                        self._queue.put(None)
+                        break
+                    batch.append(nxt)
+                try:
+                    with conn:
+                        for fn, args in batch:
+                            fn(conn, *args)
+                except Exception:
+                    self.write_errors += 1
+                    # 事务已回滚，其中的节点数据需要重新写入
+                    self._known_nodes.clear()
+                    log.error("写入对话数据库失败", exc_info=True, operations=len(batch))
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        finally:
+            conn.close()
+
+    def flush(self, timeout=5.0):
+        """等待已排队的写操作完成"""
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+        return not self._queue.unfinished_tasks
+
+    def close(self):
+        self.flush()
+        with self._writer_lock:
+            if self._writer and self._writer.is_alive():
+                self._queue.put(None)
+                self._writer.join(timeout=2.0)
+            self._writer = None
+
+    # ---------- 写操作 ----------
+
+    @staticmethod
+    def _touch(conn, cid, now):
+        conn.execute(
+            "INSERT INTO conversations (id, created_at, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at",
+            (cid, now, now)
+        )
+
+    def create(self, cid):
+        self._submit(self._touch, cid, time.time())
+
+    def _node_text_for_write(self, record, node_text):
+        """同一份节点数据只写入一次"""
+        node_ref = record.get('node_ref')
+        if not node_ref or node_text is None or node_ref in self._known_nodes:
+            return None
+        self._known_nodes.add(node_ref)
+        return node_text
+
+    def append_message(self, cid, record, node_text=None):
+        content = record.get('content', record.get('prefix', ''))
+        head = content[:PREVIEW_LENGTH]
+        if record.get('node_ref') and len(head) < PREVIEW_LENGTH:
+            head = (head + (node_text or '')[:PREVIEW_LENGTH] + record.get('suffix', '')[:PREVIEW_LENGTH])[:PREVIEW_LENGTH]
+        self._submit(self._append_message, cid, dict(record), self._node_text_for_write(record, node_text), head, time.time())
+
+    def _append_message(self, conn, cid, record, node_text, head, now):
+        self._touch(conn, cid, now)
+        if node_text is not None:
+            conn.execute("INSERT OR IGNORE INTO node_contexts (hash, content, size, created_at) VALUES (?, ?, ?, ?)",
+                         (record['node_ref'], node_text, len(node_text), now))
+        seq = conn.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM messages WHERE conversation_id = ?", (cid,)).fetchone()[0]
+        content = record.get('content', record.get('prefix', ''))
+        conn.execute(
+            "INSERT INTO messages (conversation_id, seq, role, content, node_ref, suffix, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (cid, seq, record['role'], content, record.get('node_ref'), record.get('suffix', ''), now)
+        )
+        conn.execute("UPDATE conversations SET message_count = message_count + 1 WHERE id = ?", (cid,))
+        if record['role'] == 'user':
+            conn.execute("UPDATE conversations SET title = ? WHERE id = ? AND title = ''", (head, cid))
+        elif record['role'] == 'assistant':
+            conn.execute("UPDATE conversations SET preview = ? WHERE id = ?", (head, cid))
+
+    def replace_system(self, cid, record, node_text=None):
+        self._submit(self._replace_system, cid, dict(record), self._node_text_for_write(record, node_text), time.time())
+
+    def _replace_system(self, conn, cid, record, node_text, now):
+        self._touch(conn, cid, now)
+        if node_text is not None:
+            conn.execute("INSERT OR IGNORE INTO node_contexts (hash, content, size, created_at) VALUES (?, ?, ?, ?)",
+                         (record['node_ref'], node_text, len(node_text), now))
+        row = conn.execute("SELECT seq FROM messages WHERE conversation_id = ? AND role = 'system' ORDER BY seq LIMIT 1", (cid,)).fetchone()
+        if row is None:
+            return
+        conn.execute(
+            "UPDATE messages SET content = ?, node_ref = ?, suffix = ? WHERE conversation_id = ? AND seq = ?",
+            (record.get('content', record.get('prefix', '')), record.get('node_ref'), record.get('suffix', ''), cid, row[0])
+        )
+
+    def save_node_context(self, node_ref, node_text):
+        """补写一份节点数据（node_contexts 中缺失时由缓存回填调用）"""
+        self._known_nodes.add(node_ref)
+        self._submit(lambda conn, h, t, now: conn.execute(
+            "INSERT OR IGNORE INTO node_contexts (hash, content, size, created_at) VALUES (?, ?, ?, ?)",
+            (h, t, len(t), now)), node_ref, node_text, time.time())
+
+    def set_summary(self, cid, summary, upto=0):
+        self._submit(lambda conn, c, s, u: conn.execute("UPDATE conversations SET summary = ?, summary_upto = ? WHERE id = ?", (s, u, c)), cid, summary, upto)
+
+    def set_stats(self, cid, stats):
+        self._submit(lambda conn, c, s: conn.execute("UPDATE conversations SET stats = ? WHERE id = ?", (s, c)), cid, json.dumps(stats))
+
+    def delete(self, cid):
+        def run(conn, c):
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (c,))
+            conn.execute("DELETE FROM conversations WHERE id = ?", (c,))
+            conn.execute("DELETE FROM node_contexts WHERE hash NOT IN (SELECT node_ref FROM messages WHERE node_ref IS NOT NULL)")
+        self._known_nodes.clear()
+        self._submit(run, cid)
+
+    # ---------- 读操作 ----------
+
+    def list_conversations(self, limit=50, cursor=None):
+        """按最近活动时间倒序分页，返回 (items, next_cursor)"""
+        conn = self._reader()
+        limit = max(1, min(int(limit), 200))
+        if cursor:
+            updated_at, cid = _decode_cursor(cursor)
+            rows = conn.execute(
+                "SELECT id, title, preview, message_count, created_at, updated_at FROM conversations "
+                "WHERE updated_at < ? OR (updated_at = ? AND id < ?) "
+                "ORDER BY updated_at DESC, id DESC LIMIT ?",
+                (updated_at, updated_at, cid, limit + 1)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, title, preview, message_count, created_at, updated_at FROM conversations "
+                "ORDER BY updated_at DESC, id DESC LIMIT ?",
+                (limit + 1,)
+            ).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1]['updated_at'], rows[-1]['id'])
+        return [dict(row) for row in rows], next_cursor
+
+    def get_messages_page(self, cid, before=None, limit=50):
+        """
+        按 seq 倒序取一页消息（不展开节点数据），返回 (按时间正序的消息, next_cursor)。
+        next_cursor 为更早一页的 before 参数。
+        """
+        conn = self._reader()
+        limit = max(1, min(int(limit), 200))
+        if before is None:
+            rows = conn.execute(
+                "SELECT seq, role, content, node_ref, suffix, created_at FROM messages WHERE conversation_id = ? "
+                "ORDER BY seq DESC LIMIT ?", (cid, limit + 1)).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT seq, role, content, node_ref, suffix, created_at FROM messages WHERE conversation_id = ? AND seq < ? "
+                "ORDER BY seq DESC LIMIT ?", (cid, int(before), limit + 1)).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1]['seq']
+        return [dict(row) for row in reversed(rows)], next_cursor
+
+    def get_node_context(self, node_ref):
+        row = self._reader().execute("SELECT content FROM node_contexts WHERE hash = ?", (node_ref,)).fetchone()
+        return row[0] if row else None
+
+    def load_conversation(self, cid):
+        """加载完整对话，供缓存未命中时回填；不存在时返回 None"""
+        conn = self._reader()
+        conv = conn.execute("SELECT summary, summary_upto, stats, created_at, updated_at FROM conversations WHERE id = ?", (cid,)).fetchone()
+        if conv is None:
+            return None
+        rows = conn.execute(
+            "SELECT m.role, m.content, m.node_ref, m.suffix, n.content AS node_text FROM messages m "
+            "LEFT JOIN node_contexts n ON n.hash = m.node_ref WHERE m.conversation_id = ? ORDER BY m.seq",
+            (cid,)
+        ).fetchall()
+        try:
+            stats = json.loads(conv['stats'] or '{}')
+        except Exception:
+            stats = {}
+        return {
+            'summary': conv['summary'],
+            'summary_upto': conv['summary_upto'],
+            'stats': stats,
+            'created_at': conv['created_at'],
+            'updated_at': conv['updated_at'],
+            'messages': [dict(row) for row in rows],
+        }
+
+    def exists(self, cid):
+        return self._reader().execute("SELECT 1 FROM conversations WHERE id = ?", (cid,)).fetchone() is not None
+
+    def usage(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return {"path": self.path, "file_bytes": size, "pending_writes": self._queue.unfinished_tasks, "write_errors": self.write_errors}
+
+
+addon_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 全局对话数据库实例
+conversation_db = ConversationDB(os.path.join(addon_dir, 'conversations.db'))
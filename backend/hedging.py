@@ -0,0 +1,169 @@
+"""
+对冲请求 (hedged requests)
+
+主提供商在 delay 秒内没有输出第一个 token 时（或在此之前就失败），再向备用提供商/模型发起同样的请求，
+先输出 token 的一方胜出，另一方立即取消。胜出后输出一条
+kind 为 'hedge' 的事件（data: winner / ttft {名称: 秒} / cancelled / cancelled_after），之后只转发胜者的输出。
+
+HedgeRace 只负责判定；hedge_sync / hedge_async 分别用线程和事件循环任务驱动上游，
+upstreams[i]() 返回 server._call_provider / stream_gateway.stream_provider 这类输出生成器；
+同步版本的工厂接收该路的 CancelScope，被取消（落败或整个请求取消）时立即关闭上游连接。
+"""
+import asyncio
+import queue
+import threading
+import time
+
+import stream_events
+from cancellation import CancelScope
+from stream_events import StreamEvent
+
+_END = object()
+
+
+class HedgeRace:
+    """主/备两路上游的竞速判定"""
+
+    def __init__(self, names, delay):
+        self.names = names
+        self.delay = delay
+        self.started_at = {}
+        self.ttft = {}
+        self.pending = {0: [], 1: []}
+        self.errors = {0: [], 1: []}
+        self.finished = set()
+        self.winner = None
+
+    def start(self, idx):
+        self.started_at[idx] = time.time()
+
+    def should_hedge(self):
+        if self.winner is not None or 1 in self.started_at or len(self.names) < 2:
+            return False
+        return 0 in self.finished or time.time() - self.started_at[0] >= self.delay
+
+    def timeout(self):
+        """距离启动备用请求的剩余秒数；不再需要计时时返回 None"""
+        if self.winner is not None or 1 in self.started_at or len(self.names) < 2:
+            return None
+        return max(0.0, self.started_at[0] + self.delay - time.time())
+
+    def _report(self, loser):
+        report = {
+            'winner': self.names[self.winner],
+            'hedged': 1 in self.started_at,
+            'ttft': {self.names[i]: round(t, 3) for i, t in self.ttft.items()},
+        }
+        if loser is not None:
+            report['cancelled'] = self.names[loser]
+            report['cancelled_after'] = round(time.time() - self.started_at[loser], 3)
+        return StreamEvent(stream_events.HEDGE, '', report)
+
+    def feed(self, idx, item):
+        """
+        处理 idx 路的一条输出（item 为 _END 表示该路结束）。
+        返回 (outputs, cancel_idx, done)：要转发的输出、需要取消的一路、整个竞速是否结束。
+        """
+        if item is _END:
+            self.finished.add(idx)
+            if self.winner is not None:
+                return [], None, idx == self.winner
+            if self.finished >= set(self.started_at) and (1 in self.started_at or len(self.names) < 2):
+                # 两路都没有输出 token：转发各自的错误
+                return self.errors[0] + self.errors[1], None, True
+            return [], None, False
+        if self.winner is not None:
+            return ([item] if idx == self.winner else []), None, False
+        if item.kind == stream_events.ERROR:
+            self.errors[idx].append(item)
+            return [], None, False
+        if not item.is_token:
+            self.pending[idx].append(item)
+            return [], None, False
+        self.winner = idx
+        self.ttft[idx] = time.time() - self.started_at[idx]
+        loser = 1 - idx if (1 - idx) in self.started_at and (1 - idx) not in self.finished else None
+        return [self._report(loser)] + self.pending[idx] + [item], loser, False
+
+
+def hedge_sync(upstreams, names, delay, scope=None):
+    """同步驱动：每一路在后台线程中迭代 upstreams[idx](该路的作用域)；scope 取消时两路一起取消"""
+    race = HedgeRace(names, delay)
+    items = queue.Queue()
+    scopes = {}
+
+    def run(idx):
+        upstream = upstreams[idx](scopes[idx])
+        try:
+            for item in upstream:
+                if scopes[idx].cancelled:
+                    break
+                items.put((idx, item))
+        finally:
+            upstream.close()
+            items.put((idx, _END))
+
+    def start(idx):
+        race.start(idx)
+        scopes[idx] = scope.child() if scope is not None else CancelScope()
+        threading.Thread(target=run, args=(idx,), name=f'ainode-hedge-{idx}', daemon=True).start()
+
+    start(0)
+    try:
+        while True:
+            if race.should_hedge():
+                start(1)
+            try:
+                idx, item = items.get(timeout=race.timeout())
+            except queue.Empty:
+                continue
+            outputs, loser, done = race.feed(idx, item)
+            if loser is not None:
+                scopes[loser].cancel('hedge_loser')
+            for output in outputs:
+                yield output
+            if done:
+                return
+    finally:
+        for child in list(scopes.values()):
+            child.cancel()
+
+
+async def hedge_async(upstreams, names, delay):
+    """异步驱动：每一路是一个事件循环任务，upstreams[idx]() 返回异步生成器"""
+    race = HedgeRace(names, delay)
+    items = asyncio.Queue()
+    tasks = {}
+
+    async def run(idx):
+        upstream = upstreams[idx]()
+        try:
+            async for item in upstream:
+                items.put_nowait((idx, item))
+        finally:
+            await upstream.aclose()
+            items.put_nowait((idx, _END))
+
+    def start(idx):
+        race.start(idx)
+        tasks[idx] = asyncio.get_running_loop().create_task(run(idx))
+
+    start(0)
+    try:
+        while True:
+            if race.should_hedge():
+                start(1)
+            try:
+                idx, item = await asyncio.wait_for(items.get(), race.timeout())
+            except asyncio.TimeoutError:
+                continue
+            outputs, loser, done = race.feed(idx, item)
+            if loser is not None:
+                tasks[loser].cancel()
+            for output in outputs:
+                yield output
+            if done:
+                return
+    finally:
+        for task in tasks.values():
+            task.cancel()
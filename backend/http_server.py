@@ -0,0 +1,313 @@
+"""
+嵌入式 HTTP 服务器
+
+替代 Flask 开发服务器 (app.run)，用于在 Blender 进程内承载后端：
+- 固定大小的工作线程池处理连接，等待队列有上限，超出连接上限时直接返回 503；
+- HTTP/1.1 keep-alive，空闲连接超时关闭；有连接排队时，处理完当前请求即关闭空闲连接，避免占用工作线程；
+- 流式接口 (SSE) 单独限额，始终为普通请求（插件自身的状态轮询、设置同步等）保留工作线程；
+- stop() 停止接受新连接，通知进行中的流尽快收尾，在超时内等待其结束，超时后强制关闭剩余连接并释放端口。
+"""
+import queue
+import socket
+import threading
+import time
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from structured_log import get_logger
+
+log = get_logger('http_server')
+
+
+class _NullWriter:
+    """连接被分离后替换 wfile，丢弃 werkzeug 之后写出的响应"""
+
+    closed = False
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class _RequestHandler(WSGIRequestHandler):
+    """支持 keep-alive 与连接分离的请求处理器"""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        # StreamRequestHandler 会对连接设置该超时，用作 keep-alive 空闲超时
+        self.timeout = self.server.keepalive_timeout
+        super().setup()
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ['ainode.detach'] = lambda callback: self.detach(callback, environ)
+        return environ
+
+    def detach(self, callback, environ=None):
+        """
+        把客户端连接交给其他组件（如 stream_gateway）继续写出响应。
+        当前请求结束后工作线程不再关闭该连接，而是调用 callback(sock)；
+        应用返回的响应会被丢弃，占用的流名额立即释放。
+        """
+        slot = (environ or {}).get('ainode.stream_slot')
+        if slot:
+            slot.release()
+        self.server.register_detached(self.connection, callback)
+        self.wfile = _NullWriter()
+        self.close_connection = True
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        # 有连接在排队或正在关闭时，不再保持当前连接
+        if self.server.draining.is_set() or self.server.pending_connections() > 0:
+            self.close_connection = True
+
+    def log_request(self, code="-", size="-"):
+        pass
+
+
+class _StreamSlot:
+    """一个流名额，release 可重复调用"""
+
+    def __init__(self, release):
+        self._release = release
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._release()
+
+
+class _StreamGuard:
+    """包装流式响应，迭代结束或关闭时释放流名额"""
+
+    def __init__(self, iterable, slot):
+        self._iterable = iterable
+        self._iterator = iter(iterable)
+        self._slot = slot
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def close(self):
+        try:
+            close = getattr(self._iterable, 'close', None)
+            if close:
+                close()
+        finally:
+            self._slot.release()
+
+
+class EmbeddedHTTPServer(BaseWSGIServer):
+    """带有限工作线程池与优雅关闭的 WSGI 服务器"""
+
+    def __init__(self, host, port, app, workers=16, max_connections=64,
+                 max_streams=None, keepalive_timeout=5.0, stream_wait=2.0,
+                 stream_paths=('/api/stream-analyze',)):
+        self.workers = max(2, int(workers))
+        self.max_connections = max(self.workers, int(max_connections))
+        # 默认至少保留 2 个工作线程给非流式请求
+        if max_streams is None:
+            max_streams = self.workers - 2
+        self.max_streams = max(1, min(int(max_streams), self.workers - 1))
+        self.keepalive_timeout = float(keepalive_timeout)
+        self.stream_wait = float(stream_wait)
+        self.stream_paths = tuple(stream_paths)
+        self.draining = threading.Event()
+
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queue = queue.Queue()
+        self._active = set()
+        self._queued = 0
+        self._streams = 0
+        self._threads = []
+        self._detached = {}
+        self._serving = False
+        self.stats = {
+            "accepted": 0,
+            "rejected": 0,
+            "stream_rejected": 0,
+            "completed": 0,
+            "detached": 0,
+        }
+        super().__init__(host, port, self._wrap_app(app), handler=_RequestHandler)
+
+    # ---------- 连接调度 ----------
+
+    def pending_connections(self):
+        return self._queued
+
+    def start_workers(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f'ainode-http-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def serve_forever(self, poll_interval=0.5):
+        self._serving = True
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._serving = False
+
+    def process_request(self, request, client_address):
+        """由 accept 循环调用：把连接交给工作线程池"""
+        with self._lock:
+            overloaded = len(self._active) + self._queued >= self.max_connections
+            if not overloaded and not self.draining.is_set():
+                self._queued += 1
+                self.stats["accepted"] += 1
+                self._queue.put((request, client_address))
+                return
+            self.stats["rejected"] += 1
+        self._reject(request)
+
+    def _reject(self, request):
+        try:
+            request.sendall(b"HTTP/1.1 503 Service Unavailable\r\n"
+                            b"Content-Type: text/plain; charset=utf-8\r\n"
+                            b"Content-Length: 11\r\nRetry-After: 1\r\nConnection: close\r\n\r\n"
+                            b"Server busy")
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _worker_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            with self._lock:
+                self._queued -= 1
+                self._active.add(request)
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                with self._lock:
+                    callback = self._detached.pop(request, None)
+                if callback is None:
+                    self.shutdown_request(request)
+                else:
+                    self._hand_over(request, callback)
+                with self._lock:
+                    self._active.discard(request)
+                    self.stats["completed"] += 1
+                    self._idle.notify_all()
+
+    def register_detached(self, request, callback):
+        with self._lock:
+            self._detached[request] = callback
+            self.stats["detached"] += 1
+
+    def _hand_over(self, request, callback):
+        try:
+            callback(request)
+        except Exception:
+            log.error("移交连接失败", exc_info=True)
+            self.shutdown_request(request)
+
+    # ---------- 流式请求限额 ----------
+
+    def _wrap_app(self, app):
+        def wrapped(environ, start_response):
+            path = environ.get('PATH_INFO', '')
+            if self.draining.is_set():
+                start_response('503 Service Unavailable', [('Content-Type', 'text/plain; charset=utf-8'), ('Retry-After', '1'), ('Connection', 'close')])
+                return [b"Server is shutting down"]
+            if not path.startswith(self.stream_paths):
+                return app(environ, start_response)
+            # 名额已满时短暂等待（分离到网关的流很快就会释放名额），仍满则返回 503
+            deadline = time.time() + self.stream_wait
+            with self._lock:
+                while self._streams >= self.max_streams:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._idle.wait(remaining)
+                if self._streams >= self.max_streams:
+                    self.stats["stream_rejected"] += 1
+                    allowed = False
+                else:
+                    self._streams += 1
+                    allowed = True
+            if not allowed:
+                start_response('503 Service Unavailable', [('Content-Type', 'text/plain; charset=utf-8'), ('Retry-After', '2')])
+                return [b"Too many concurrent streams"]
+            slot = _StreamSlot(self._release_stream)
+            environ['ainode.stream_slot'] = slot
+            try:
+                return _StreamGuard(app(environ, start_response), slot)
+            except Exception:
+                slot.release()
+                raise
+        return wrapped
+
+    def _release_stream(self):
+        with self._lock:
+            self._streams -= 1
+            self._idle.notify_all()
+
+    # ---------- 关闭 ----------
+
+    def stop(self, drain_timeout=5.0):
+        """停止接受新连接，等待进行中的请求（含 SSE 流）结束，超时后强制断开"""
+        self.draining.set()
+        if self._serving:
+            self.shutdown()
+        deadline = time.time() + drain_timeout
+        with self._lock:
+            while self._active or self._queued:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._idle.wait(remaining)
+            leftover = list(self._active)
+        for sock in leftover:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        # 丢弃仍在排队的连接并结束工作线程
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                with self._lock:
+                    self._queued -= 1
+                self.shutdown_request(item[0])
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join(timeout=1.0)
+        self._threads = []
+        self.server_close()
+        return not leftover
+
+    def info(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_connections": self.max_connections,
+                "max_streams": self.max_streams,
+                "active_connections": len(self._active),
+                "queued_connections": self._queued,
+                "active_streams": self._streams,
+                "draining": self.draining.is_set(),
+                **self.stats,
+            }
@@ -0,0 +1,317 @@
+"""
+超大节点树的分块分析 (map-reduce)
+
+巨大的几何节点树即使按 ULTRA_LITE 精细度也放不进任何模型的上下文。节点数据超过 threshold_chars 时：
+- partition：沿框 (NodeFrame)、节点组和弱连通分量把节点树拆成若干内容连贯的分块，每块不超过 chunk_chars；
+  同一个顶层框中的节点在同一块，未分框的节点按连线合并为连通分量，过大的节点组按其内部结构继续拆分，
+  相邻的小单元按原顺序打包到同一块；跨分块的连线单独记录；
+- run_map：按 parallelism 并发分析各分块（每块经提供商层调用），逐块输出 PROGRESS 事件；
+- Plan.overview：把各分块的分析结果与跨分块连线整理为 reduce 步骤的节点上下文，代替原始节点数据。
+
+节点数据为 Blender 插件生成的 JSON：整棵树 {nodes, links, groups} 或选中节点 {selected_nodes, connections}，
+节点的 parent 字段为所在框的名称。
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import stream_events
+
+
+def _size(value):
+    return len(json.dumps(value, ensure_ascii=False))
+
+
+def _link_ends(link):
+    return link.get('from_node'), link.get('to_node')
+
+
+def _describe_link(link, from_label, to_label):
+    return (f"[{from_label}] {link.get('from_node')}.{link.get('from_socket')}"
+            f" -> [{to_label}] {link.get('to_node')}.{link.get('to_socket')}")
+
+
+class Chunk:
+    """一个分块：一组节点、块内连线及与其他分块相连的连线"""
+
+    __slots__ = ('index', 'label', 'nodes', 'links', 'external_links', 'tree_type')
+
+    def __init__(self, label, nodes, tree_type):
+        self.index = 0
+        self.label = label
+        self.nodes = nodes
+        self.links = []
+        self.external_links = []
+        self.tree_type = tree_type
+
+    def to_text(self, total):
+        return json.dumps({
+            'tree_type': self.tree_type,
+            'part': f"{self.index + 1}/{total}",
+            'label': self.label,
+            'nodes': self.nodes,
+            'links': self.links,
+            'external_links': self.external_links,
+        }, ensure_ascii=False)
+
+
+class Plan:
+    """分块结果"""
+
+    def __init__(self, chunks, cross_links, total_nodes, tree_type):
+        self.chunks = chunks
+        self.cross_links = cross_links  # [(from_chunk, link, to_chunk)]
+        self.total_nodes = total_nodes
+        self.tree_type = tree_type
+
+    def overview(self, results, max_links=200):
+        """reduce 步骤的节点上下文：results 为 {分块序号: (摘要, 错误)}"""
+        total = len(self.chunks)
+        parts = [
+            f"(节点树过大，已拆分为 {total} 个部分分别分析，共 {self.total_nodes} 个节点；以下是各部分的分析结果与跨部分连线)"
+        ]
+        for chunk in self.chunks:
+            summary, error = results.get(chunk.index, ('', '未完成'))
+            body = summary.strip() if summary and summary.strip() else f"(该部分分析失败: {error})"
+            parts.append(f"## Part {chunk.index + 1}/{total} - {chunk.label} ({len(chunk.nodes)} nodes)\n{body}")
+        if self.cross_links:
+            lines = [
+                _describe_link(link, f"Part {a.index + 1}", f"Part {b.index + 1}")
+                for a, link, b in self.cross_links[:max_links]
+            ]
+            if len(self.cross_links) > max_links:
+                lines.append(f"... 另有 {len(self.cross_links) - max_links} 条跨部分连线")
+            parts.append("## Cross-part links\n" + "\n".join(lines))
+        return "\n\n".join(parts)
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[rb] = ra
+
+
+def _top_frame(name, parents):
+    """节点所在的顶层框（不在框中时为 None）"""
+    frame = parents.get(name)
+    seen = set()
+    while frame and parents.get(frame) and frame not in seen:
+        seen.add(frame)
+        frame = parents[frame]
+    return frame
+
+
+def _units(nodes, links):
+    """按顶层框与弱连通分量把节点分为若干单元，返回 [(标签, [节点])]，保持节点的原始顺序"""
+    names = {n.get('name') for n in nodes}
+    parents = {n.get('name'): n.get('parent') for n in nodes if n.get('parent') in names}
+    frame_of = {}
+    for node in nodes:
+        name = node.get('name')
+        if node.get('type') == 'NodeFrame' and not parents.get(name):
+            frame_of[name] = name
+        else:
+            frame_of[name] = _top_frame(name, parents)
+    uf = _UnionFind()
+    for link in links:
+        a, b = _link_ends(link)
+        if a in names and b in names and frame_of.get(a) is None and frame_of.get(b) is None:
+            uf.union(a, b)
+    labels = {n.get('name'): (n.get('label') or n.get('name')) for n in nodes}
+    units = {}
+    for node in nodes:
+        name = node.get('name')
+        frame = frame_of.get(name)
+        key = ('frame', frame) if frame else ('component', uf.find(name))
+        if key not in units:
+            label = f"框 {labels.get(frame, frame)}" if frame else "未分框节点"
+            units[key] = (label, [])
+        units[key][1].append(node)
+    return list(units.values())
+
+
+def _ordered(nodes, links):
+    """按连线的广度优先顺序排列节点，切分过大的单元时尽量让相连的节点留在同一块"""
+    names = [n.get('name') for n in nodes]
+    by_name = {n.get('name'): n for n in nodes}
+    neighbours = {name: [] for name in names}
+    for link in links:
+        a, b = _link_ends(link)
+        if a in neighbours and b in neighbours:
+            neighbours[a].append(b)
+            neighbours[b].append(a)
+    order, seen = [], set()
+    for start in names:
+        if start in seen:
+            continue
+        seen.add(start)
+        queue = [start]
+        while queue:
+            name = queue.pop(0)
+            order.append(by_name[name])
+            for other in neighbours[name]:
+                if other not in seen:
+                    seen.add(other)
+                    queue.append(other)
+    return order
+
+
+def _weights(nodes, links):
+    """每个节点在分块中占用的字符数：节点本身加上连入它的连线"""
+    weights = {n.get('name'): _size(n) for n in nodes}
+    for link in links:
+        a, b = _link_ends(link)
+        target = b if b in weights else a
+        if target in weights:
+            weights[target] += _size(link)
+    return weights
+
+
+def _split(label, nodes, links, chunk_chars, weights):
+    """把过大的单元按顺序切成不超过 chunk_chars 的若干段"""
+    pieces, current, size = [], [], 0
+    for node in _ordered(nodes, links):
+        node_size = weights.get(node.get('name'), 0)
+        if current and size + node_size > chunk_chars:
+            pieces.append(current)
+            current, size = [], 0
+        current.append(node)
+        size += node_size
+    if current:
+        pieces.append(current)
+    if len(pieces) == 1:
+        return [(label, pieces[0])]
+    return [(f"{label} ({i + 1}/{len(pieces)})", piece) for i, piece in enumerate(pieces)]
+
+
+def _partition_tree(nodes, links, chunk_chars, tree_type, prefix, chunks, cross_links):
+    """拆分一层节点树，分块追加到 chunks，跨分块连线追加到 cross_links"""
+    weights = _weights(nodes, links)
+
+    def measure(piece_nodes):
+        return sum(weights.get(n.get('name'), 0) for n in piece_nodes)
+
+    pieces = []
+    for label, unit_nodes in _units(nodes, links):
+        if measure(unit_nodes) <= chunk_chars:
+            pieces.append((label, unit_nodes))
+            continue
+        rest = []
+        for node in unit_nodes:
+            content = node.get('group_content')
+            if isinstance(content, dict) and _size(node) > chunk_chars and isinstance(content.get('nodes'), list):
+                # 过大的节点组：组节点本身留在当前层，组内按其自身结构继续拆分
+                group_label = f"{prefix}组 {node.get('label') or node.get('name')}"
+                _partition_tree(content['nodes'], content.get('links') or [], chunk_chars,
+                                content.get('tree_type', tree_type), group_label + " / ", chunks, cross_links)
+                node = dict(node)
+                node['group_content'] = {'partitioned': True, 'see_parts': group_label}
+                weights[node.get('name')] = _size(node)
+            rest.append(node)
+        pieces.extend(_split(label, rest, links, chunk_chars, weights))
+
+    # 相邻的小单元按原顺序打包
+    packed = []
+    for label, piece_nodes in pieces:
+        size = measure(piece_nodes)
+        if packed and packed[-1][2] + size <= chunk_chars:
+            labels, piece_list, total = packed[-1]
+            labels.append(label)
+            piece_list.extend(piece_nodes)
+            packed[-1] = (labels, piece_list, total + size)
+        else:
+            packed.append(([label], list(piece_nodes), size))
+
+    owner = {}
+    level_chunks = []
+    for labels, piece_nodes, _ in packed:
+        unique = list(dict.fromkeys(labels))
+        label = prefix + "、".join(unique[:3]) + (f" 等 {len(unique)} 个单元" if len(unique) > 3 else "")
+        chunk = Chunk(label, piece_nodes, tree_type)
+        for node in piece_nodes:
+            owner[node.get('name')] = chunk
+        level_chunks.append(chunk)
+        chunks.append(chunk)
+
+    for link in links:
+        a, b = _link_ends(link)
+        chunk_a, chunk_b = owner.get(a), owner.get(b)
+        if chunk_a is not None and chunk_a is chunk_b:
+            chunk_a.links.append(link)
+        elif chunk_a is not None and chunk_b is not None:
+            chunk_a.external_links.append(link)
+            chunk_b.external_links.append(link)
+            cross_links.append((chunk_a, link, chunk_b))
+        elif chunk_a is not None or chunk_b is not None:
+            # 另一端不在本次数据中（例如未选中的节点）
+            (chunk_a or chunk_b).links.append(link)
+    return level_chunks
+
+
+def partition(text, chunk_chars=12000, max_chunks=16):
+    """
+    把节点数据 JSON 拆分为分块，返回 Plan；无法解析或拆分后只有一块时返回 None。
+    分块数超过 max_chunks 时逐步放大 chunk_chars 重新拆分。
+    """
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    nodes = data.get('selected_nodes') or data.get('nodes')
+    links = data.get('connections') or data.get('links') or []
+    if not isinstance(nodes, list) or not nodes:
+        return None
+    tree_type = data.get('node_tree_type') or data.get('tree_type') or ''
+    chunk_chars = max(1000, int(chunk_chars))
+    for _ in range(8):
+        chunks, cross_links = [], []
+        _partition_tree(nodes, links, chunk_chars, tree_type, '', chunks, cross_links)
+        if len(chunks) <= max(2, max_chunks):
+            break
+        chunk_chars = int(chunk_chars * 1.5)
+    if len(chunks) < 2:
+        return None
+    for index, chunk in enumerate(chunks):
+        chunk.index = index
+    total_nodes = sum(len(chunk.nodes) for chunk in chunks)
+    return Plan(chunks, cross_links, total_nodes, tree_type)
+
+
+def run_map(plan, analyze, parallelism=3, scope=None):
+    """
+    按 parallelism 并发调用 analyze(chunk, scope) -> 摘要文本，按完成顺序输出 PROGRESS 事件：
+    data = {index, total, label, summary, error}。scope 被取消时不再开始新的分块。
+    """
+    total = len(plan.chunks)
+    executor = ThreadPoolExecutor(max_workers=max(1, min(int(parallelism), total)), thread_name_prefix='ainode-map')
+    futures = {executor.submit(analyze, chunk, scope): chunk for chunk in plan.chunks}
+    try:
+        for future in as_completed(futures):
+            if scope is not None and scope.cancelled:
+                return
+            chunk = futures[future]
+            try:
+                summary, error = future.result() or '', ''
+            except Exception as e:
+                summary, error = '', str(e) or type(e).__name__
+            yield stream_events.progress({
+                'index': chunk.index,
+                'total': total,
+                'label': chunk.label,
+                'summary': summary,
+                'error': error,
+            })
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
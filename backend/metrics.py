@@ -0,0 +1,213 @@
+"""
+运行指标（Prometheus 文本格式）
+
+后端原来只在各模块的 info() 中保存零散的统计，无法观察延迟分布。这里提供常驻开启的轻量指标：
+- Counter / Histogram：热路径上只做一次字典查找和一次加法（直方图再加一次二分查找），各自一把锁；
+- collector：抓取时才调用的回调，把已有模块的统计（调度队列、缓存命中、活动流等）转成指标，平时零开销；
+- render() 输出 Prometheus text exposition format 0.0.4，供 /api/metrics 返回。
+
+标签值以元组保存，顺序与 labelnames 一致。
+"""
+import bisect
+import threading
+import time
+
+from structured_log import get_logger
+
+log = get_logger('metrics')
+
+# 延迟类直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 节点数据序列化 / 过滤的分桶（秒）
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# 生成速度的分桶（token/s）
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500)
+# 字节数的分桶
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增的计数"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _labels(self.labelnames, labels), value) for labels, value in items]
+
+
+class Histogram:
+    """固定分桶的直方图"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [各桶计数..., +Inf 计数, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def time(self, *labels):
+        """with metrics_x.time(label): ... 记录代码块的耗时"""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(entry)) for labels, entry in self._values.items()]
+        result = []
+        for labels, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry[:-1]):
+                cumulative += count
+                result.append((f"{self.name}_bucket", _labels(self.labelnames, labels, f'le="{_number(float(bound))}"'), cumulative))
+            result.append((f"{self.name}_sum", _labels(self.labelnames, labels), round(entry[-1], 6)))
+            result.append((f"{self.name}_count", _labels(self.labelnames, labels), cumulative))
+        return result
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class _Collected:
+    """抓取时由回调产生的指标：callback() 返回 {标签值元组: 数值}"""
+
+    def __init__(self, name, help_text, kind, labelnames, callback):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        values = self.callback() or {}
+        return [(self.name, _labels(self.labelnames, labels), value) for labels, value in values.items()]
+
+
+class Registry:
+    """指标登记表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # 模块重新加载时沿用已有的指标
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def collector(self, name, help_text, kind='gauge', labelnames=(), callback=None):
+        """登记抓取时计算的指标；重复登记时替换回调"""
+        with self._lock:
+            self._metrics[name] = _Collected(name, help_text, kind, labelnames, callback)
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                log.error("采集指标出错", exc_info=True, metric=metric.name)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+# 全局指标登记表
+metrics = Registry()
+
+# ---------- 热路径指标（各模块直接引用） ----------
+
+http_request_seconds = metrics.histogram(
+    'ainode_http_request_seconds', 'HTTP 请求处理耗时（流式响应为返回响应头之前的耗时）', ('method', 'route', 'status'))
+http_request_bytes = metrics.histogram(
+    'ainode_http_request_bytes', 'HTTP 请求体字节数', ('route',), SIZE_BUCKETS)
+sse_bytes = metrics.counter(
+    'ainode_sse_bytes_total', '写出的 SSE 字节数', ('transport',))
+sse_frames = metrics.counter(
+    'ainode_sse_frames_total', '写出的 SSE 帧数', ('transport',))
+stream_seconds = metrics.histogram(
+    'ainode_stream_seconds', '/api/stream-analyze 从开始到结束的耗时', ('transport', 'outcome'))
+provider_ttft_seconds = metrics.histogram(
+    'ainode_provider_ttft_seconds', '提供商首个 token 的延迟', ('provider', 'model'))
+provider_tokens_per_second = metrics.histogram(
+    'ainode_provider_tokens_per_second', '提供商生成速度（首 token 之后）', ('provider', 'model'), RATE_BUCKETS)
+provider_tokens = metrics.counter(
+    'ainode_provider_completion_tokens_total', '提供商生成的 token 数（无用量时按字数估算）', ('provider', 'model'))
+provider_requests = metrics.counter(
+    'ainode_provider_requests_total', '提供商调用次数', ('provider', 'model', 'outcome'))
+node_serialize_seconds = metrics.histogram(
+    'ainode_node_serialize_seconds', 'Blender 节点数据序列化耗时', ('scope',), FAST_BUCKETS)
+node_filter_seconds = metrics.histogram(
+    'ainode_node_filter_seconds', '节点数据按精细度过滤的耗时', ('level',), FAST_BUCKETS)
+node_payload_bytes = metrics.histogram(
+    'ainode_node_payload_bytes', '过滤后的节点数据字节数', ('level',), SIZE_BUCKETS)
@@ -0,0 +1,180 @@
+"""
+近似重复问题检测（本地 MinHash / LSH）
+
+很多提问只在空白、标点或措辞上与预设问题略有不同，例如
+"请分析这些节点的功能和优化建议" 与 "分析一下这些节点功能并给优化建议"。
+这里为已完成的回答建立 (问题, 节点快照哈希) 索引：
+- 问题去掉空白与标点后取 1~2 字符的 shingle（中文按字、英文按字母），计算 MinHash 签名；
+- LSH 分桶找候选，再用 shingle 集合的精确 Jaccard 相似度过滤；
+- scope 为 'node' 时只匹配同一份节点数据上的问题，'global' 时不限节点；
+- 不依赖任何外部向量服务，索引只保存在内存中，条目数有上限。
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 64) - 1
+
+
+def shingles(text, sizes=(1, 2)):
+    """规范化后的字符 shingle 集合"""
+    text = _NON_WORD.sub('', (text or '').lower())
+    if not text:
+        return set()
+    result = set()
+    for k in sizes:
+        if len(text) < k:
+            continue
+        result.update(text[i:i + k] for i in range(len(text) - k + 1))
+    return result or {text}
+
+
+def _base_hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class MinHashIndex:
+    """MinHash 签名 + LSH 分桶的近似重复索引（线程安全）"""
+
+    def __init__(self, num_perm=64, bands=32, threshold=0.45, scope='node', max_entries=2000,
+                 shingle_sizes=(1, 2), enabled=True):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.scope = scope
+        self.max_entries = max_entries
+        self.shingle_sizes = tuple(shingle_sizes)
+        self.enabled = enabled
+        rng = random.Random(0x41494e)
+        self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {"added": 0, "queries": 0, "matches": 0, "evictions": 0}
+
+    def configure(self, enabled=None, threshold=None, scope=None, max_entries=None):
+        with self._lock:
+            if enabled is not None:
+                self.enabled = bool(enabled)
+            if threshold is not None:
+                self.threshold = min(1.0, max(0.0, float(threshold)))
+            if scope in ('node', 'global'):
+                self.scope = scope
+            if max_entries is not None:
+                self.max_entries = max(1, int(max_entries))
+            self._evict()
+
+    def signature(self, shingle_set):
+        hashes = [_base_hash(s) for s in shingle_set]
+        if not hashes:
+            return (_MAX_HASH,) * self.num_perm
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self._perms)
+
+    def _band_keys(self, signature):
+        return [(i, signature[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for band_key in self._band_keys(entry['signature']):
+            bucket = self._buckets.get(band_key)
+            if bucket:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def add(self, question, node_hash, answer, conversation_id=None):
+        """记录一次已完成的回答；同一节点上的相同问题只保留最新回答"""
+        if not self.enabled or not answer:
+            return
+        shingle_set = shingles(question, self.shingle_sizes)
+        if not shingle_set:
+            return
+        signature = self.signature(shingle_set)
+        with self._lock:
+            # 相同的 shingle 集合签名相同，一定落在同一个桶里
+            for entry_id in list(self._buckets.get(self._band_keys(signature)[0], ())):
+                entry = self._entries[entry_id]
+                if entry['node_hash'] == node_hash and entry['shingles'] == shingle_set:
+                    self._remove(entry_id)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                'question': question,
+                'node_hash': node_hash,
+                'answer': answer,
+                'conversation_id': conversation_id,
+                'timestamp': time.time(),
+                'shingles': shingle_set,
+                'signature': signature,
+            }
+            for band_key in self._band_keys(signature):
+                self._buckets.setdefault(band_key, set()).add(entry_id)
+            self.stats["added"] += 1
+            self._evict()
+
+    def query(self, question, node_hash=None, limit=3, threshold=None, scope=None):
+        """返回相似度不低于阈值的已有回答，按相似度倒序"""
+        if not self.enabled:
+            return []
+        shingle_set = shingles(question, self.shingle_sizes)
+        if not shingle_set:
+            return []
+        signature = self.signature(shingle_set)
+        threshold = self.threshold if threshold is None else threshold
+        scope = scope or self.scope
+        with self._lock:
+            self.stats["queries"] += 1
+            candidates = set()
+            for band_key in self._band_keys(signature):
+                candidates.update(self._buckets.get(band_key, ()))
+            matches = []
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if scope == 'node' and entry['node_hash'] != node_hash:
+                    continue
+                union = len(shingle_set | entry['shingles'])
+                similarity = len(shingle_set & entry['shingles']) / union if union else 0.0
+                if similarity >= threshold:
+                    matches.append((similarity, entry))
+            matches.sort(key=lambda m: (m[0], m[1]['timestamp']), reverse=True)
+            if matches:
+                self.stats["matches"] += 1
+            return [{
+                'question': entry['question'],
+                'answer': entry['answer'],
+                'similarity': round(similarity, 4),
+                'conversationId': entry['conversation_id'],
+                'timestamp': entry['timestamp'],
+                'sameNode': entry['node_hash'] == node_hash,
+            } for similarity, entry in matches[:limit]]
+
+    def info(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "buckets": len(self._buckets),
+                "threshold": self.threshold,
+                "scope": self.scope,
+                **self.stats,
+            }
+
+
+# 全局近似重复索引
+near_duplicates = MinHashIndex()
@@ -0,0 +1,308 @@
+"""
+提供商健康度与自动路由
+
+/api/provider-connectivity 只在用户点击时探测一次；这里根据真实请求持续统计每个 提供商/模型：
+- 首 token 时间 (TTFT)、输出速度 (tokens/s) 与错误率的指数加权移动平均 (EWMA)，以及 429 次数；
+- 熔断器：连续失败达到阈值或错误率过高时熔断 (open)，冷却期后放行一个探测请求 (half_open)，
+  探测成功恢复 (closed)，失败重新熔断；
+- ai_provider 为 'AUTO' 时按 fallback_order 中已配置的提供商打分，选择未熔断且得分最好的一个。
+
+track_sync / track_async 包装 server._call_provider / stream_gateway.stream_provider 的输出，
+不改变输出内容，只记录统计；被取消的请求不计为失败。
+"""
+import threading
+import time
+
+import metrics
+import providers
+import stream_events
+
+AUTO = 'AUTO'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class _Health:
+    __slots__ = ('ttft', 'tps', 'error_rate', 'requests', 'errors', 'rate_limited',
+                 'consecutive_failures', 'state', 'opened_at', 'probing', 'last_error', 'updated_at')
+
+    def __init__(self):
+        self.ttft = None
+        self.tps = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.last_error = ''
+        self.updated_at = 0.0
+
+
+class ProviderHealth:
+    """按 提供商/模型 统计健康度，并提供熔断与自动路由"""
+
+    def __init__(self, alpha=0.3, failure_threshold=3, error_rate_threshold=0.5, cooldown=30.0,
+                 fallback_order=('DEEPSEEK', 'BIGMODEL', 'OLLAMA')):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.cooldown = cooldown
+        self.fallback_order = list(fallback_order)
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def configure(self, alpha=None, failure_threshold=None, error_rate_threshold=None, cooldown=None, fallback_order=None):
+        with self._lock:
+            if alpha is not None:
+                self.alpha = min(1.0, max(0.01, float(alpha)))
+            if failure_threshold is not None:
+                self.failure_threshold = max(1, int(failure_threshold))
+            if error_rate_threshold is not None:
+                self.error_rate_threshold = min(1.0, max(0.0, float(error_rate_threshold)))
+            if cooldown is not None:
+                self.cooldown = max(0.0, float(cooldown))
+            if isinstance(fallback_order, (list, tuple)) and fallback_order:
+                self.fallback_order = [str(p).upper() for p in fallback_order]
+
+    @staticmethod
+    def key(provider, settings):
+        return f"{provider}/{providers.model_name(provider, settings)}"
+
+    def _get(self, key):
+        health = self._health.get(key)
+        if health is None:
+            health = self._health[key] = _Health()
+        return health
+
+    def _ewma(self, old, value):
+        return value if old is None else old + self.alpha * (value - old)
+
+    # ---------- 记录 ----------
+
+    def record_ttft(self, key, seconds):
+        with self._lock:
+            health = self._get(key)
+            health.ttft = self._ewma(health.ttft, seconds)
+
+    def record_success(self, key, tokens_per_second=None):
+        with self._lock:
+            health = self._get(key)
+            health.requests += 1
+            health.error_rate = self._ewma(health.error_rate, 0.0)
+            if tokens_per_second:
+                health.tps = self._ewma(health.tps, tokens_per_second)
+            health.consecutive_failures = 0
+            health.state = CLOSED
+            health.probing = False
+            health.updated_at = time.time()
+
+    def record_failure(self, key, message='', rate_limited=False):
+        with self._lock:
+            health = self._get(key)
+            health.requests += 1
+            health.errors += 1
+            if rate_limited:
+                health.rate_limited += 1
+            health.error_rate = self._ewma(health.error_rate, 1.0)
+            health.consecutive_failures += 1
+            health.last_error = message[:200]
+            health.updated_at = time.time()
+            if (health.state == HALF_OPEN
+                    or health.consecutive_failures >= self.failure_threshold
+                    or (health.requests >= self.failure_threshold and health.error_rate >= self.error_rate_threshold)):
+                health.state = OPEN
+                health.opened_at = time.time()
+            health.probing = False
+
+    def record_probe(self, key, ok, message=''):
+        """连通性探测结果也计入健康度（不计 TTFT）"""
+        if ok:
+            self.record_success(key)
+        else:
+            self.record_failure(key, message)
+
+    def _release(self, key):
+        """请求被取消：不计入统计，但释放半开状态的探测名额"""
+        metrics.provider_requests.inc(*(tuple(key.split('/', 1)) if '/' in key else (key, '')), 'cancelled')
+        with self._lock:
+            health = self._health.get(key)
+            if health is not None:
+                health.probing = False
+
+    # ---------- 熔断 ----------
+
+    def _available(self, health, now):
+        if health.state == OPEN and now - health.opened_at >= self.cooldown:
+            health.state = HALF_OPEN
+            health.probing = False
+        if health.state == OPEN:
+            return False
+        if health.state == HALF_OPEN:
+            return not health.probing
+        return True
+
+    def _score(self, health):
+        """越小越好：TTFT 为主，错误率与 429 加罚，速度越快略有加分"""
+        ttft = health.ttft if health.ttft is not None else 2.0
+        score = ttft + health.error_rate * 30.0 + min(health.rate_limited, 10) * 0.5
+        if health.tps:
+            score -= min(health.tps, 200.0) / 100.0
+        return score
+
+    def _configured(self, provider, settings):
+        if provider == 'DEEPSEEK':
+            return bool((settings.get('deepseek_api_key') or '').strip())
+        if provider == 'BIGMODEL':
+            return bool((settings.get('bigmodel_api_key') or '').strip())
+        if provider == 'OLLAMA':
+            return True
+        return False
+
+    def choose(self, settings):
+        """
+        为 AUTO 选择提供商，返回 (provider, 原因)。
+        只考虑已配置的提供商；都处于熔断时选择最早恢复的一个。
+        """
+        now = time.time()
+        candidates = [p for p in self.fallback_order if self._configured(p, settings)] or list(self.fallback_order)
+        with self._lock:
+            best = None
+            for order, provider in enumerate(candidates):
+                health = self._get(self.key(provider, settings))
+                if not self._available(health, now):
+                    continue
+                score = (self._score(health), order)
+                if best is None or score < best[0]:
+                    best = (score, provider, health)
+            if best is not None:
+                _, provider, health = best
+                if health.state == HALF_OPEN:
+                    health.probing = True
+                    return provider, 'half_open_probe'
+                return provider, 'healthy'
+            provider = min(candidates, key=lambda p: self._get(self.key(p, settings)).opened_at)
+            return provider, 'all_open'
+
+    # ---------- 包装上游 ----------
+
+    def _finish(self, key, started, first_token_at, tokens, chars, error):
+        labels = tuple(key.split('/', 1)) if '/' in key else (key, '')
+        if error is not None:
+            metrics.provider_requests.inc(*labels, 'error')
+            self.record_failure(key, error, rate_limited=' 429' in error or 'rate limit' in error.lower())
+            return
+        if first_token_at is None:
+            metrics.provider_requests.inc(*labels, 'empty')
+            self.record_failure(key, 'empty response')
+            return
+        duration = time.time() - first_token_at
+        tokens = tokens or chars / 3.0
+        metrics.provider_requests.inc(*labels, 'ok')
+        metrics.provider_ttft_seconds.observe(first_token_at - started, *labels)
+        metrics.provider_tokens.inc(*labels, amount=round(tokens))
+        if duration > 0:
+            metrics.provider_tokens_per_second.observe(tokens / duration, *labels)
+        self.record_success(key, tokens / duration if duration > 0 else None)
+
+    def _end_span(self, span, first_token_at, tokens, chars, error, completed):
+        if span is None:
+            return
+        attrs = {'chars': chars}
+        if first_token_at is not None:
+            attrs['ttft'] = round(first_token_at - span.start, 6)
+        if tokens:
+            attrs['tokens'] = tokens
+        if error is not None:
+            attrs['error'] = error[:200]
+        elif not completed:
+            attrs['cancelled'] = True
+        span.end(**attrs)
+
+    def track_sync(self, key, upstream, scope=None, trace=None):
+        """trace 为上级 span 时记录一个 provider span（首 token 延迟、token 数、结果）"""
+        started = time.time()
+        span = trace.child('provider', provider=key) if trace is not None else None
+        first_token_at = None
+        tokens = 0
+        chars = 0
+        error = None
+        completed = False
+        try:
+            for item in upstream:
+                if item.is_token:
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                        self.record_ttft(key, first_token_at - started)
+                    chars += len(item.content)
+                elif item.kind == stream_events.ERROR:
+                    error = item.content
+                elif item.kind == stream_events.USAGE:
+                    tokens = (item.data or {}).get('completion_tokens', 0)
+                yield item
+            completed = True
+        finally:
+            upstream.close()
+            completed = completed and not (scope is not None and scope.cancelled)
+            if completed:
+                self._finish(key, started, first_token_at, tokens, chars, error)
+            else:
+                self._release(key)
+            self._end_span(span, first_token_at, tokens, chars, error, completed)
+
+    async def track_async(self, key, upstream, trace=None):
+        started = time.time()
+        span = trace.child('provider', provider=key) if trace is not None else None
+        first_token_at = None
+        tokens = 0
+        chars = 0
+        error = None
+        completed = False
+        try:
+            async for item in upstream:
+                if item.is_token:
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                        self.record_ttft(key, first_token_at - started)
+                    chars += len(item.content)
+                elif item.kind == stream_events.ERROR:
+                    error = item.content
+                elif item.kind == stream_events.USAGE:
+                    tokens = (item.data or {}).get('completion_tokens', 0)
+                yield item
+            completed = True
+        finally:
+            await upstream.aclose()
+            if completed:
+                self._finish(key, started, first_token_at, tokens, chars, error)
+            else:
+                self._release(key)
+            self._end_span(span, first_token_at, tokens, chars, error, completed)
+
+    def info(self):
+        now = time.time()
+        with self._lock:
+            result = {}
+            for key, health in self._health.items():
+                self._available(health, now)
+                result[key] = {
+                    "state": health.state,
+                    "ttft": round(health.ttft, 3) if health.ttft is not None else None,
+                    "tokens_per_second": round(health.tps, 1) if health.tps is not None else None,
+                    "error_rate": round(health.error_rate, 3),
+                    "requests": health.requests,
+                    "errors": health.errors,
+                    "rate_limited": health.rate_limited,
+                    "consecutive_failures": health.consecutive_failures,
+                    "last_error": health.last_error,
+                    "score": round(self._score(health), 3),
+                }
+            return {"providers": result, "fallback_order": self.fallback_order}
+
+
+# 全局提供商健康度
+provider_health = ProviderHealth()
@@ -0,0 +1,274 @@
+"""
+LLM 提供商请求描述
+
+把 DeepSeek / Ollama / BigModel 的请求构造与流式响应行解析独立出来，
+同步调用 (server._call_*) 和异步流式网关 (stream_gateway) 共用同一份逻辑，只是传输层不同。
+
+build_request(provider, messages, settings) 返回 (spec, error)：
+- error 非空时表示无需发起请求，直接把该字符串作为回复输出；
+- spec 包含 url / headers / json / timeout / name / provider（限流按 provider + API Key 计），响应格式 format ('sse' / 'ndjson')，
+  以及 parse_event(data) -> (outputs, done)：data 为一个 SSE 事件的数据或一行 NDJSON，
+  分帧与解码由 stream_parser.ProviderStream 完成。
+outputs 为 stream_events.StreamEvent 列表（正文、思考、联网搜索、用量），只在写出 SSE 帧时编码。
+传输层出错时输出 error_output(...)，kind 为 'error'。
+"""
+import json
+
+import stream_events
+from stream_events import StreamEvent
+from structured_log import get_logger
+
+log = get_logger('providers')
+
+_decode_json = json.JSONDecoder().decode
+
+
+def normalize_usage(usage):
+    """
+    统一各提供商的用量字段：
+    DeepSeek: prompt_cache_hit_tokens / prompt_cache_miss_tokens
+    OpenAI 兼容 (BigModel): prompt_tokens_details.cached_tokens
+    Ollama: prompt_eval_count / eval_count（无缓存信息）
+    """
+    prompt_tokens = int(usage.get('prompt_tokens', usage.get('prompt_eval_count', 0)) or 0)
+    completion_tokens = int(usage.get('completion_tokens', usage.get('eval_count', 0)) or 0)
+    if 'prompt_cache_hit_tokens' in usage or 'prompt_cache_miss_tokens' in usage:
+        hit = int(usage.get('prompt_cache_hit_tokens') or 0)
+        miss = int(usage.get('prompt_cache_miss_tokens') or 0)
+    else:
+        details = usage.get('prompt_tokens_details') or {}
+        hit = int(details.get('cached_tokens') or 0)
+        miss = max(0, prompt_tokens - hit)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'cache_hit_tokens': hit,
+        'cache_miss_tokens': miss,
+    }
+
+
+def _usage_output(usage):
+    return StreamEvent(stream_events.USAGE, '', normalize_usage(usage))
+
+
+def error_output(message):
+    """请求失败时的输出：客户端仍按普通文本显示，调用方可据此判断生成失败（例如不写入回复缓存）"""
+    return stream_events.error(message)
+
+
+def _parse_openai_event(data, thinking_enabled=False, web_search=False):
+    """解析 OpenAI 兼容的 SSE 事件数据（DeepSeek / BigModel）"""
+    if data == '[DONE]':
+        return [], True
+    j = _decode_json(data)
+    choices = j.get('choices')
+    usage = j.get('usage')
+    if choices and not usage:
+        delta = choices[0].get('delta') or {}
+        if not delta.get('reasoning_content') and not delta.get('tool_calls'):
+            # 快速路径：只含正文增量的数据块
+            content = delta.get('content')
+            return ([StreamEvent(stream_events.CHUNK, content)] if content else []), False
+    outputs = []
+    # 最后一个数据块携带本次请求的用量（含上下文缓存命中）
+    if isinstance(usage, dict):
+        outputs.append(_usage_output(usage))
+    if choices:
+        delta = choices[0].get('delta') or {}
+        if thinking_enabled and delta.get('reasoning_content'):
+            outputs.append(StreamEvent(stream_events.THINKING, delta['reasoning_content']))
+        if delta.get('content'):
+            outputs.append(StreamEvent(stream_events.CHUNK, delta['content']))
+        # 处理工具调用结果（联网搜索）
+        if web_search and 'tool_calls' in delta and delta['tool_calls']:
+            for tool_call in delta['tool_calls']:
+                if tool_call.get('type') == 'web_search':
+                    search_result = tool_call.get('web_search', {}).get('result', '')
+                    if search_result:
+                        outputs.append(StreamEvent(stream_events.WEB_SEARCH, search_result))
+    return outputs, False
+
+
+def _parse_ollama_event(line):
+    """解析 Ollama NDJSON 行"""
+    outputs = []
+    j = _decode_json(line)
+    content = (j.get('message') or {}).get('content')
+    if content:
+        outputs.append(StreamEvent(stream_events.CHUNK, content))
+    if j.get('done') and 'prompt_eval_count' in j:
+        outputs.append(_usage_output(j))
+    return outputs, bool(j.get('done', False))
+
+
+def deepseek_request(messages, settings):
+    if not bool(settings.get('networking_enabled', True)):
+        return None, "Error: 联网已关闭，无法调用在线模型。请启用联网。"
+    api_key = (settings.get('deepseek_api_key') or '').strip()
+    model = (settings.get('deepseek_model') or 'deepseek-chat').strip()
+    base_url = (settings.get('deepseek_url') or 'https://api.deepseek.com').strip()
+
+    if not api_key:
+        return None, "Error: 未配置 DeepSeek API Key。请在 Blender 插件设置中配置。"
+
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {api_key}'
+    }
+
+    data = {
+        'model': model,
+        'messages': messages,
+        'temperature': settings.get('temperature', 0.7) or 0.7,
+        'max_tokens': 4096,
+        'stream': True,
+        # 在最后一个数据块中返回用量（含 prompt_cache_hit_tokens / prompt_cache_miss_tokens）
+        'stream_options': {'include_usage': True}
+    }
+    thinking_enabled = bool(settings.get('thinking_enabled'))
+    if thinking_enabled and model != 'deepseek-reasoner':
+        data['thinking'] = {'type': 'enabled'}
+
+    return {
+        'name': 'DeepSeek',
+        'provider': 'DEEPSEEK',
+        'url': f"{base_url.rstrip('/')}/chat/completions",
+        'headers': headers,
+        'json': data,
+        'timeout': 300,
+        'format': 'sse',
+        'parse_event': lambda data: _parse_openai_event(data, thinking_enabled=thinking_enabled),
+    }, None
+
+
+def ollama_request(messages, settings):
+    base_url = (settings.get('ollama_url') or 'http://localhost:11434').rstrip('/')
+    model = (settings.get('ollama_model') or 'llama2').strip()
+
+    data = {
+        'model': model,
+        'messages': messages,
+        'stream': True
+    }
+
+    return {
+        'name': 'Ollama',
+        'provider': 'OLLAMA',
+        'url': f"{base_url}/api/chat",
+        'headers': {'Content-Type': 'application/json'},
+        'json': data,
+        'timeout': 120,
+        'format': 'ndjson',
+        'parse_event': _parse_ollama_event,
+    }, None
+
+
+def bigmodel_request(messages, settings):
+    if not bool(settings.get('networking_enabled', True)):
+        return None, "Error: 联网已关闭，无法调用在线模型。请启用联网。"
+
+    api_key = (settings.get('bigmodel_api_key') or '').strip()
+    model = (settings.get('bigmodel_model') or 'glm-4').strip()
+    base_url = (settings.get('bigmodel_url') or 'https://open.bigmodel.cn/api/paas/v4').strip()
+
+    if not api_key:
+        return None, "Error: 未配置 BigModel API Key。请在 Blender 插件设置中配置。"
+
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {api_key}'
+    }
+
+    # 根据模型类型调整参数
+    # GLM-4.7系列可能需要不同的参数格式
+    is_glm47 = model.startswith('glm-4.7')
+
+    # 基础参数
+    data = {
+        'model': model,
+        'messages': messages,
+        'stream': True
+    }
+
+    # 添加可选参数（某些模型可能不支持）
+    if not is_glm47:
+        # GLM-4系列支持temperature和top_p
+        data['temperature'] = float(settings.get('temperature', 0.7) or 0.7)
+        data['top_p'] = float(settings.get('top_p', 1.0) or 1.0)
+
+    # 注意：BigModel GLM-4系列模型不支持max_tokens参数
+    # BigModel 没有显式的 thinking 参数，深度思考是模型本身的能力
+    thinking_enabled = bool(settings.get('thinking_enabled', False))
+
+    # 添加联网搜索支持
+    web_search_enabled = bool(settings.get('web_search_enabled', False))
+    if web_search_enabled:
+        # BigModel 支持通过 tools 参数进行联网搜索
+        data['tools'] = [{
+            'type': 'web_search',
+            'web_search': {
+                'enable': True,
+                'search_result': True
+            }
+        }]
+
+    url = f"{base_url.rstrip('/')}/chat/completions"
+
+    # 调试日志只记录请求概要：不输出请求头（含 API Key）与消息内容
+    log.debug("BigModel 请求", url=url, model=model, thinking=thinking_enabled, web_search=web_search_enabled,
+              messages=len(messages), options=sorted(k for k in data if k != 'messages'))
+
+    # 验证messages格式
+    for i, msg in enumerate(messages):
+        if not isinstance(msg, dict):
+            log.warning("BigModel 消息格式错误：不是字典", index=i, type=type(msg).__name__)
+        elif 'role' not in msg:
+            log.warning("BigModel 消息格式错误：缺少 role", index=i)
+        elif 'content' not in msg:
+            log.warning("BigModel 消息格式错误：缺少 content", index=i, role=msg.get('role'))
+
+    return {
+        'name': 'BigModel',
+        'provider': 'BIGMODEL',
+        'url': url,
+        'headers': headers,
+        'json': data,
+        'timeout': 300,
+        'format': 'sse',
+        'parse_event': lambda data: _parse_openai_event(data, web_search=True),
+    }, None
+
+
+_BUILDERS = {
+    'DEEPSEEK': deepseek_request,
+    'OLLAMA': ollama_request,
+    'BIGMODEL': bigmodel_request,
+}
+
+# 各提供商在 settings 中的模型字段与默认模型
+MODEL_FIELDS = {
+    'DEEPSEEK': ('deepseek_model', 'deepseek-chat'),
+    'OLLAMA': ('ollama_model', 'llama2'),
+    'BIGMODEL': ('bigmodel_model', 'glm-4'),
+}
+
+
+def model_name(provider, settings):
+    field, default = MODEL_FIELDS.get(provider, ('generic_model', ''))
+    return (settings.get(field) or default).strip()
+
+
+def with_model(provider, settings, model):
+    """返回把 provider 的模型替换为 model 的设置副本"""
+    result = dict(settings)
+    result['ai_provider'] = provider
+    if model:
+        result[MODEL_FIELDS.get(provider, ('generic_model', ''))[0]] = model
+    return result
+
+
+def build_request(provider, messages, settings):
+    builder = _BUILDERS.get(provider)
+    if builder is None:
+        return None, f"Error: 不支持的AI提供商 {provider}。当前仅支持 DeepSeek、Ollama 和 BigModel。"
+    return builder(messages, settings)
@@ -0,0 +1,318 @@
+"""
+按 API Key 的速率限制
+
+高峰期 DeepSeek / BigModel 会返回 429，原来直接作为普通错误输出（"DeepSeek API error: 429 - ..."）。这里：
+- 每个 提供商 + API Key 一组令牌桶：每分钟请求数 (rpm) 与每分钟 token 数 (tpm)，按 ai.rate_limits 配置；
+- 请求前按估算的提示词 token 数预占额度 (admit)，额度不足时先在本地等待，而不是撞上提供商的限流；
+  收到用量后按实际 token 数修正 (settle)；
+- 解析响应的 Retry-After 与 x-ratelimit-* 头：剩余额度为 0 时暂停到重置时间，提供商给出的上限低于配置时采用之；
+  429 时降低本地速率，之后的成功请求逐步恢复；
+- 429 / 503 在输出任何内容之前按 Retry-After 或指数退避重试 (retry_delay)，重试用尽才输出错误。
+
+没有配置上限的提供商（如本地 Ollama）只做重试，不限速。
+"""
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+RETRY_STATUSES = (429, 503)
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：非 ASCII 字符（中文等）约 1 token/字，ASCII 约 4 字符/token"""
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return max(1, non_ascii + (len(text) - non_ascii) // 4)
+
+
+def estimate_request_tokens(spec):
+    messages = (spec.get('json') or {}).get('messages') or []
+    return sum(estimate_tokens(m.get('content') or '') for m in messages if isinstance(m, dict)) + 4 * len(messages)
+
+
+def parse_duration(value):
+    """解析 '20'、'1.5'、'6m0s'、'250ms' 这类时长，返回秒；无法解析时返回 None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+    return sum(float(n) * scale[unit] for n, unit in parts)
+
+
+def parse_retry_after(headers):
+    """Retry-After：秒数或 HTTP 日期"""
+    value = _header(headers, 'retry-after')
+    if value is None:
+        return None
+    seconds = parse_duration(value)
+    if seconds is not None:
+        return seconds
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _header(headers, name):
+    if not headers:
+        return None
+    value = headers.get(name)
+    if value is None:
+        value = headers.get(name.title())
+    return value
+
+
+def _int_header(headers, name):
+    try:
+        return int(float(_header(headers, name)))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """每分钟 per_minute 的令牌桶；允许预占成负数，负数部分即需要等待的时间"""
+
+    def __init__(self, per_minute):
+        self.per_minute = float(per_minute)
+        self.tokens = self.per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.per_minute, self.tokens + elapsed * self.per_minute / 60.0)
+            self.updated = now
+
+    def reserve(self, amount, now):
+        """预占 amount，返回需要等待的秒数"""
+        self._refill(now)
+        self.tokens -= min(float(amount), self.per_minute)
+        return 0.0 if self.tokens >= 0 else -self.tokens * 60.0 / self.per_minute
+
+    def adjust(self, delta, now):
+        """按实际用量修正（delta > 0 表示多用了）"""
+        self._refill(now)
+        self.tokens = min(self.per_minute, self.tokens - delta)
+
+    def limit_remaining(self, remaining, now):
+        """提供商告知的剩余额度比本地少时以提供商为准"""
+        self._refill(now)
+        self.tokens = min(self.tokens, float(remaining))
+
+    def set_rate(self, per_minute):
+        per_minute = max(1.0, float(per_minute))
+        if per_minute < self.per_minute:
+            self.tokens = min(self.tokens, per_minute)
+        self.per_minute = per_minute
+
+
+class _KeyState:
+    """一个 提供商 + API Key 的限流状态"""
+
+    def __init__(self, label, rpm, tpm):
+        self.label = label
+        self.rpm_limit = rpm
+        self.tpm_limit = tpm
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        # 429 后的降速系数，成功请求逐步恢复到 1
+        self.factor = 1.0
+        self.blocked_until = 0.0
+        self.stats = {"admitted": 0, "throttled": 0, "waited_seconds": 0.0, "rate_limited": 0, "retries": 0}
+
+    def apply_factor(self):
+        if self.requests is not None:
+            self.requests.set_rate(self.rpm_limit * self.factor)
+        if self.tokens is not None:
+            self.tokens.set_rate(self.tpm_limit * self.factor)
+
+
+class RateLimiter:
+    """按 提供商 + API Key 的令牌桶、限流头解析与重试退避"""
+
+    def __init__(self, limits=None, enabled=True, max_retries=3, backoff_base=1.0, backoff_max=30.0, max_wait=60.0):
+        self.limits = dict(limits or {})
+        self.enabled = enabled
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def configure(self, limits=None, enabled=None, max_retries=None, backoff_base=None, backoff_max=None, max_wait=None):
+        with self._lock:
+            if isinstance(limits, dict):
+                self.limits = {str(k).upper(): v for k, v in limits.items() if isinstance(v, dict)}
+                # 上限变化后重新建桶
+                self._keys.clear()
+            if enabled is not None:
+                self.enabled = bool(enabled)
+            if max_retries is not None:
+                self.max_retries = max(0, int(max_retries))
+            if backoff_base is not None:
+                self.backoff_base = max(0.0, float(backoff_base))
+            if backoff_max is not None:
+                self.backoff_max = max(0.0, float(backoff_max))
+            if max_wait is not None:
+                self.max_wait = max(0.0, float(max_wait))
+
+    @staticmethod
+    def _api_key(spec):
+        auth = (spec.get('headers') or {}).get('Authorization') or ''
+        return auth[7:] if auth.startswith('Bearer ') else auth
+
+    def _state(self, spec):
+        """spec 对应的限流状态（须持有锁）；该提供商未配置上限时返回 None"""
+        provider = spec.get('provider') or ''
+        cfg = self.limits.get(provider)
+        if not self.enabled or not cfg:
+            return None
+        api_key = self._api_key(spec)
+        digest = hashlib.sha256(f"{provider}\0{api_key}".encode('utf-8')).hexdigest()[:16]
+        state = self._keys.get(digest)
+        if state is None:
+            label = f"{provider}/…{api_key[-4:]}" if api_key else provider
+            rpm = int(cfg.get('rpm') or 0)
+            tpm = int(cfg.get('tpm') or 0)
+            state = self._keys[digest] = _KeyState(label, rpm, tpm)
+        return state
+
+    # ---------- 准入 ----------
+
+    def _reserve(self, spec, estimated_tokens):
+        """预占一次请求的额度，返回需要等待的秒数（最多 max_wait）"""
+        with self._lock:
+            state = self._state(spec)
+            if state is None:
+                return 0.0
+            now = time.monotonic()
+            wait = max(0.0, state.blocked_until - now)
+            if state.requests is not None:
+                wait = max(wait, state.requests.reserve(1, now))
+            if state.tokens is not None:
+                wait = max(wait, state.tokens.reserve(estimated_tokens, now))
+            wait = min(wait, self.max_wait)
+            state.stats["admitted"] += 1
+            if wait > 0:
+                state.stats["throttled"] += 1
+                state.stats["waited_seconds"] += wait
+            return wait
+
+    def admit(self, spec, estimated_tokens, scope=None):
+        """同步准入：额度不足时等待；等待期间 scope 被取消返回 False"""
+        return wait(self._reserve(spec, estimated_tokens), scope)
+
+    async def admit_async(self, spec, estimated_tokens):
+        delay = self._reserve(spec, estimated_tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def settle(self, spec, estimated_tokens, actual_tokens):
+        """收到用量后按实际 token 数修正 tpm 桶"""
+        if not actual_tokens:
+            return
+        with self._lock:
+            state = self._state(spec)
+            if state is not None and state.tokens is not None:
+                state.tokens.adjust(actual_tokens - estimated_tokens, time.monotonic())
+
+    # ---------- 响应 ----------
+
+    def observe(self, spec, status, headers):
+        """根据响应状态与限流头调整本地额度"""
+        with self._lock:
+            state = self._state(spec)
+            if state is None:
+                return
+            now = time.monotonic()
+            limit_requests = _int_header(headers, 'x-ratelimit-limit-requests')
+            if limit_requests and state.rpm_limit and limit_requests < state.rpm_limit:
+                state.rpm_limit = limit_requests
+                state.apply_factor()
+            limit_tokens = _int_header(headers, 'x-ratelimit-limit-tokens')
+            if limit_tokens and state.tpm_limit and limit_tokens < state.tpm_limit:
+                state.tpm_limit = limit_tokens
+                state.apply_factor()
+            for kind, bucket in (('requests', state.requests), ('tokens', state.tokens)):
+                remaining = _int_header(headers, f'x-ratelimit-remaining-{kind}')
+                if remaining is None:
+                    continue
+                reset = parse_duration(_header(headers, f'x-ratelimit-reset-{kind}')) if remaining <= 0 else None
+                if reset:
+                    # 额度用完且给出了重置时间：暂停到重置，不再额外清空本地桶
+                    state.blocked_until = max(state.blocked_until, now + reset)
+                elif bucket is not None:
+                    bucket.limit_remaining(remaining, now)
+            if status == 429:
+                state.stats["rate_limited"] += 1
+                state.factor = max(0.1, state.factor * 0.5)
+                state.apply_factor()
+                retry_after = parse_retry_after(headers)
+                if retry_after:
+                    state.blocked_until = max(state.blocked_until, now + retry_after)
+            elif status == 200 and state.factor < 1.0:
+                state.factor = min(1.0, state.factor + 0.05)
+                state.apply_factor()
+
+    def retry_delay(self, spec, status, headers, attempt):
+        """需要重试时返回等待秒数（Retry-After 优先，否则指数退避加抖动），否则返回 None"""
+        if status not in RETRY_STATUSES or attempt >= self.max_retries:
+            return None
+        delay = parse_retry_after(headers)
+        if delay is None:
+            delay = min(self.backoff_max, self.backoff_base * (2 ** attempt)) + random.uniform(0, self.backoff_base)
+        delay = min(delay, self.max_wait)
+        with self._lock:
+            state = self._state(spec)
+            if state is not None:
+                state.stats["retries"] += 1
+        return delay
+
+    def info(self):
+        now = time.monotonic()
+        with self._lock:
+            keys = {}
+            for state in self._keys.values():
+                keys[state.label] = {
+                    "rpm": round(state.requests.per_minute, 1) if state.requests else None,
+                    "tpm": round(state.tokens.per_minute, 1) if state.tokens else None,
+                    "factor": round(state.factor, 2),
+                    "blocked_for": round(max(0.0, state.blocked_until - now), 3),
+                    **{k: round(v, 3) if isinstance(v, float) else v for k, v in state.stats.items()},
+                }
+            return {"enabled": self.enabled, "max_retries": self.max_retries, "keys": keys}
+
+
+def wait(seconds, scope=None):
+    """等待 seconds 秒；scope 被取消时提前返回 False"""
+    if seconds <= 0:
+        return not (scope is not None and scope.cancelled)
+    if scope is None:
+        time.sleep(seconds)
+        return True
+    event = threading.Event()
+    wake = scope.add(event.set)
+    try:
+        event.wait(seconds)
+    finally:
+        scope.remove(wake)
+    return not scope.cancelled
+
+
+# 全局速率限制器
+rate_limiter = RateLimiter()
@@ -0,0 +1,253 @@
+"""
+LLM 回复缓存（精确匹配）
+
+以 (provider, model, temperature, top_p, 能力开关, 规范化后的消息) 的哈希为键，缓存一次完整生成的
+提供商输出序列（StreamEvent，写盘时转为字典）。命中时按原顺序回放这些输出，
+经过同一套 SSE 帧生成逻辑，客户端看到的流与真实生成一致，只是立即完成。
+
+- 内存层：LRU，条目数与字节数上限；
+- 磁盘层：每个键一个 JSON 文件，总大小上限，按修改时间淘汰（写入时累计总大小，超过上限才扫描目录）；
+- 两层都有 TTL；失败或被中断的生成不缓存。
+"""
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import providers
+from stream_events import StreamEvent
+from structured_log import get_logger
+
+log = get_logger('response_cache')
+
+_WHITESPACE = re.compile(r'[ \t]+')
+
+# 未超过总大小上限时，也每隔这么久扫描一次磁盘层，删除过期文件
+_SWEEP_INTERVAL = 3600.0
+
+
+def _normalize_content(content):
+    content = (content or '').replace('\r\n', '\n')
+    lines = [_WHITESPACE.sub(' ', line).rstrip() for line in content.split('\n')]
+    return '\n'.join(lines).strip()
+
+
+def make_key(provider, settings, messages):
+    """生成缓存键：提供商、模型、采样参数与规范化后的消息"""
+    payload = {
+        'provider': provider,
+        'model': providers.model_name(provider, settings),
+        'temperature': settings.get('temperature'),
+        'top_p': settings.get('top_p'),
+        'thinking': bool(settings.get('thinking_enabled')),
+        'web_search': bool(settings.get('web_search_enabled')),
+        'messages': [[m.get('role', ''), _normalize_content(m.get('content'))] for m in messages],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """内存 LRU + 磁盘两层回复缓存"""
+
+    def __init__(self, directory, ttl=24 * 3600, max_entries=256, max_bytes=32 * 1024 * 1024,
+                 disk_max_bytes=256 * 1024 * 1024, enabled=True):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.enabled = enabled
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._writes = queue.Queue()
+        self._writer = None
+        # 磁盘层各文件的大小（键 -> 字节数）与总大小；首次写入时扫描目录建立
+        self._disk_sizes = None
+        self._disk_bytes = 0
+        self._disk_scanned_at = 0.0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def configure(self, enabled=None, ttl=None, max_entries=None, max_bytes=None, disk_max_bytes=None):
+        with self._lock:
+            if enabled is not None:
+                self.enabled = bool(enabled)
+            if ttl is not None:
+                self.ttl = float(ttl)
+            if max_entries is not None:
+                self.max_entries = max(1, int(max_entries))
+            if max_bytes is not None:
+                self.max_bytes = max(1, int(max_bytes))
+            if disk_max_bytes is not None:
+                self.disk_max_bytes = max(0, int(disk_max_bytes))
+            self._evict_memory()
+
+    # ---------- 内存层 ----------
+
+    def _evict_memory(self):
+        while self._memory and (len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes):
+            _, (_, _, size) = self._memory.popitem(last=False)
+            self._memory_bytes -= size
+            self.stats["evictions"] += 1
+
+    def _remember(self, key, created_at, outputs):
+        size = sum(o.size() for o in outputs)
+        if size > self.max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old:
+            self._memory_bytes -= old[2]
+        self._memory[key] = (created_at, outputs, size)
+        self._memory_bytes += size
+        self._evict_memory()
+
+    # ---------- 磁盘层 ----------
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            return entry.get('created_at', 0), [StreamEvent.from_legacy(o) for o in entry.get('outputs') or []]
+        except (OSError, ValueError):
+            return None
+
+    def _start_writer(self):
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._writer_loop, name='ainode-response-cache', daemon=True)
+            self._writer.start()
+
+    def _writer_loop(self):
+        while True:
+            key, entry = self._writes.get()
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = self._path(key) + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp_path, self._path(key))
+                self._account_disk(key, os.path.getsize(self._path(key)))
+            except Exception:
+                log.error("写入回复缓存失败", exc_info=True)
+
+    def _account_disk(self, key, size):
+        """累计写入后的磁盘层大小；超过总大小上限或到了定期清理时间才扫描目录"""
+        with self._lock:
+            if self._disk_sizes is not None:
+                self._disk_bytes += size - self._disk_sizes.get(key, 0)
+                self._disk_sizes[key] = size
+                if self._disk_bytes <= self.disk_max_bytes and time.time() - self._disk_scanned_at < _SWEEP_INTERVAL:
+                    return
+        self._prune_disk()
+
+    def _prune_disk(self):
+        """删除过期文件，并在超过总大小上限时按修改时间从旧到新删除；重建磁盘层的大小统计"""
+        try:
+            files = []
+            now = time.time()
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.directory, name)
+                st = os.stat(path)
+                if self.ttl and now - st.st_mtime > self.ttl:
+                    os.remove(path)
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+            files.sort()
+            total = sum(size for _, size, _ in files)
+            # 超过上限时多删一些（降到 90%），避免之后每次写入都重新扫描目录
+            target = self.disk_max_bytes * 0.9 if total > self.disk_max_bytes else total
+            removed = 0
+            for _, size, path in files:
+                if total <= target:
+                    break
+                os.remove(path)
+                total -= size
+                removed += 1
+            files = files[removed:]
+        except OSError:
+            log.warning("清理回复缓存目录失败", exc_info=True, directory=self.directory)
+            with self._lock:
+                self._disk_sizes = None
+            return
+        with self._lock:
+            self._disk_sizes = {os.path.basename(path)[:-len('.json')]: size for _, size, path in files}
+            self._disk_bytes = total
+            self._disk_scanned_at = now
+
+    # ---------- 读写 ----------
+
+    def get(self, key):
+        """返回缓存的输出序列，未命中或已过期时返回 None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self.ttl or now - entry[0] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return list(entry[1])
+                self._memory.pop(key)
+                self._memory_bytes -= entry[2]
+        disk = self._read_disk(key)
+        if disk is not None and (not self.ttl or now - disk[0] <= self.ttl):
+            with self._lock:
+                self._remember(key, disk[0], disk[1])
+                self.stats["disk_hits"] += 1
+            return list(disk[1])
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key, outputs, meta=None):
+        if not self.enabled or not outputs:
+            return
+        created_at = time.time()
+        outputs = list(outputs)
+        with self._lock:
+            self._remember(key, created_at, outputs)
+            self.stats["stores"] += 1
+        if self.disk_max_bytes > 0:
+            self._writes.put((key, {'created_at': created_at, 'meta': meta or {}, 'outputs': [o.to_dict() for o in outputs]}))
+            self._start_writer()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._disk_sizes = None
+            self._disk_bytes = 0
+        try:
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def info(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk_sizes or ()),
+                "disk_bytes": self._disk_bytes,
+                "ttl": self.ttl,
+                **self.stats,
+            }
+
+
+addon_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 全局回复缓存实例
+response_cache = ResponseCache(os.path.join(addon_dir, 'cache', 'responses'))
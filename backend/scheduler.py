@@ -0,0 +1,332 @@
+"""
+提供商请求调度
+
+Blender 面板提问、网页对话、后台摘要与模型列表刷新原来各自直接请求提供商，网页端的一阵突发请求
+会拖慢 Blender 中的交互提问。所有提供商调用都先经过这里取得执行名额：
+- 每个提供商有并发上限 (limits / default_limit)，超出的请求排队；
+- 队列按优先级出队：interactive（交互提问）> summarization（后台摘要）> diagnostics（连通性测试、模型列表等）
+  > batch（批量分析，见 batch_jobs），同一优先级先到先得；
+- 背压：队列满时新请求被拒绝 (SchedulerBusy)，若新请求优先级更高，则挤掉队尾优先级最低的请求；
+  排队超过 queue_timeout 秒同样拒绝；
+- 统计各提供商的并发数、各优先级的队列深度与排队等待时间。
+
+流式生成用 wrap_sync / wrap_async 包装上游（排队时间不计入提供商健康度的 TTFT），
+一次性调用用 with provider_scheduler.slot(provider, priority)。
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import providers
+
+INTERACTIVE = 'interactive'
+SUMMARIZATION = 'summarization'
+DIAGNOSTICS = 'diagnostics'
+BATCH = 'batch'
+
+# 数值越小越先出队
+PRIORITIES = {INTERACTIVE: 0, SUMMARIZATION: 1, DIAGNOSTICS: 2, BATCH: 3}
+
+
+class SchedulerBusy(Exception):
+    """队列已满或排队超时"""
+
+
+def normalize_priority(priority):
+    priority = str(priority or INTERACTIVE).lower()
+    return priority if priority in PRIORITIES else INTERACTIVE
+
+
+class _Waiter:
+    __slots__ = ('priority', 'enqueued_at', 'notify', 'granted', 'rejected')
+
+    def __init__(self, priority, notify):
+        self.priority = priority
+        self.enqueued_at = time.time()
+        self.notify = notify
+        self.granted = False
+        self.rejected = False
+
+
+class _ClassStats:
+    __slots__ = ('granted', 'rejected', 'cancelled', 'wait_total', 'wait_max')
+
+    def __init__(self):
+        self.granted = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class _Lane:
+    """单个提供商的并发名额与等待队列"""
+
+    def __init__(self):
+        self.active = 0
+        self.queue = []  # (优先级, 序号, _Waiter)
+        self.peak_queue = 0
+        self.stats = {name: _ClassStats() for name in PRIORITIES}
+
+
+class ProviderScheduler:
+    """按提供商限制并发、按优先级排队"""
+
+    def __init__(self, limits=None, default_limit=2, max_queue=32, queue_timeout=60.0, enabled=True):
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.enabled = enabled
+        self._lanes = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def configure(self, limits=None, default_limit=None, max_queue=None, queue_timeout=None, enabled=None):
+        with self._lock:
+            if isinstance(limits, dict):
+                self.limits = {str(k).upper(): max(1, int(v)) for k, v in limits.items()}
+            if default_limit is not None:
+                self.default_limit = max(1, int(default_limit))
+            if max_queue is not None:
+                self.max_queue = max(0, int(max_queue))
+            if queue_timeout is not None:
+                self.queue_timeout = max(0.0, float(queue_timeout))
+            if enabled is not None:
+                self.enabled = bool(enabled)
+            # 上限调大后立即放行排队中的请求
+            for lane_name, lane in self._lanes.items():
+                self._grant_next(lane_name, lane)
+
+    def _limit(self, provider):
+        return self.limits.get(provider, self.default_limit)
+
+    def _lane(self, provider):
+        lane = self._lanes.get(provider)
+        if lane is None:
+            lane = self._lanes[provider] = _Lane()
+        return lane
+
+    def _record_grant(self, lane, waiter):
+        waited = time.time() - waiter.enqueued_at
+        stats = lane.stats[waiter.priority]
+        stats.granted += 1
+        stats.wait_total += waited
+        stats.wait_max = max(stats.wait_max, waited)
+
+    def _grant_next(self, provider, lane):
+        """有空闲名额时按优先级放行排队的请求（须持有锁）"""
+        while lane.queue and lane.active < self._limit(provider):
+            _, _, waiter = heapq.heappop(lane.queue)
+            lane.active += 1
+            waiter.granted = True
+            self._record_grant(lane, waiter)
+            waiter.notify()
+
+    def _enqueue(self, provider, priority, notify):
+        """
+        申请名额：可立即执行时返回 None（已占用名额），否则返回排队中的 _Waiter。
+        队列已满且无法挤掉更低优先级的请求时抛出 SchedulerBusy。
+        """
+        with self._lock:
+            lane = self._lane(provider)
+            waiter = _Waiter(priority, notify)
+            if not lane.queue and lane.active < self._limit(provider):
+                lane.active += 1
+                self._record_grant(lane, waiter)
+                return None
+            rank = PRIORITIES[priority]
+            if len(lane.queue) >= self.max_queue:
+                worst = max(lane.queue, default=None)
+                if worst is None or worst[0] <= rank:
+                    lane.stats[priority].rejected += 1
+                    raise SchedulerBusy(f"{provider} 请求队列已满（{self.max_queue}），请稍后重试")
+                # 挤掉队尾优先级最低、最晚到达的请求
+                lane.queue.remove(worst)
+                heapq.heapify(lane.queue)
+                evicted = worst[2]
+                evicted.rejected = True
+                lane.stats[evicted.priority].rejected += 1
+                evicted.notify()
+            heapq.heappush(lane.queue, (rank, next(self._seq), waiter))
+            lane.peak_queue = max(lane.peak_queue, len(lane.queue))
+            return waiter
+
+    def _abandon(self, provider, waiter, cancelled):
+        """
+        等待结束但没有拿到名额（超时或取消）。
+        返回 True 表示其实已被放行（调用方需要使用或释放名额）。
+        """
+        with self._lock:
+            if waiter.granted:
+                return True
+            lane = self._lane(provider)
+            for entry in lane.queue:
+                if entry[2] is waiter:
+                    lane.queue.remove(entry)
+                    heapq.heapify(lane.queue)
+                    break
+            if waiter.rejected:
+                return False
+            if cancelled:
+                lane.stats[waiter.priority].cancelled += 1
+            else:
+                lane.stats[waiter.priority].rejected += 1
+            return False
+
+    def release(self, provider):
+        with self._lock:
+            lane = self._lane(provider)
+            lane.active = max(0, lane.active - 1)
+            self._grant_next(provider, lane)
+
+    # ---------- 同步 ----------
+
+    def acquire(self, provider, priority=INTERACTIVE, scope=None):
+        """
+        阻塞直到取得名额，返回 True；scope 被取消时返回 False。
+        队列已满、被更高优先级挤掉或排队超时抛出 SchedulerBusy。用完必须调用 release(provider)。
+        """
+        if not self.enabled:
+            return True
+        priority = normalize_priority(priority)
+        event = threading.Event()
+        waiter = self._enqueue(provider, priority, event.set)
+        if waiter is None:
+            return True
+        wake = scope.add(event.set) if scope is not None else None
+        try:
+            event.wait(self.queue_timeout or None)
+        finally:
+            if wake is not None:
+                scope.remove(wake)
+        if waiter.granted:
+            return True
+        cancelled = scope is not None and scope.cancelled
+        if self._abandon(provider, waiter, cancelled):
+            return True
+        if cancelled:
+            return False
+        raise SchedulerBusy(f"{provider} 请求排队超时，请稍后重试" if not waiter.rejected else f"{provider} 请求队列已满，已让位给更高优先级的请求")
+
+    @contextmanager
+    def slot(self, provider, priority=INTERACTIVE):
+        """一次性调用（摘要、连通性测试、模型列表）的名额"""
+        provider = str(provider).upper()
+        counted = self.enabled
+        self.acquire(provider, priority)
+        try:
+            yield
+        finally:
+            if counted:
+                self.release(provider)
+
+    def wrap_sync(self, provider, priority, factory, scope=None):
+        """取得名额后再创建并迭代上游 factory()；排队失败时输出错误，取消时不输出"""
+        provider = str(provider).upper()
+        counted = self.enabled
+        try:
+            if not self.acquire(provider, priority, scope):
+                return
+        except SchedulerBusy as e:
+            yield providers.error_output(f"Error: {e}")
+            return
+        try:
+            upstream = factory()
+            try:
+                yield from upstream
+            finally:
+                upstream.close()
+        finally:
+            if counted:
+                self.release(provider)
+
+    # ---------- 异步 ----------
+
+    async def acquire_async(self, provider, priority=INTERACTIVE):
+        """acquire 的协程版本；任务被取消时放弃排队并传播 CancelledError"""
+        if not self.enabled:
+            return True
+        priority = normalize_priority(priority)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enqueue(provider, priority, notify)
+        if waiter is None:
+            return True
+        try:
+            await asyncio.wait_for(future, self.queue_timeout or None)
+        except asyncio.CancelledError:
+            if self._abandon(provider, waiter, True):
+                self.release(provider)
+            raise
+        except asyncio.TimeoutError:
+            pass
+        if waiter.granted or self._abandon(provider, waiter, False):
+            return True
+        raise SchedulerBusy(f"{provider} 请求排队超时，请稍后重试" if not waiter.rejected else f"{provider} 请求队列已满，已让位给更高优先级的请求")
+
+    async def wrap_async(self, provider, priority, factory):
+        """wrap_sync 的异步版本，factory() 返回异步生成器"""
+        provider = str(provider).upper()
+        counted = self.enabled
+        try:
+            await self.acquire_async(provider, priority)
+        except SchedulerBusy as e:
+            yield providers.error_output(f"Error: {e}")
+            return
+        try:
+            upstream = factory()
+            try:
+                async for item in upstream:
+                    yield item
+            finally:
+                await upstream.aclose()
+        finally:
+            if counted:
+                self.release(provider)
+
+    def info(self):
+        now = time.time()
+        with self._lock:
+            result = {}
+            for provider, lane in self._lanes.items():
+                depth = {name: 0 for name in PRIORITIES}
+                oldest = {}
+                for _, _, waiter in lane.queue:
+                    depth[waiter.priority] += 1
+                    oldest[waiter.priority] = max(oldest.get(waiter.priority, 0.0), now - waiter.enqueued_at)
+                classes = {}
+                for name, stats in lane.stats.items():
+                    classes[name] = {
+                        "queued": depth[name],
+                        "oldest_wait": round(oldest.get(name, 0.0), 3),
+                        "granted": stats.granted,
+                        "rejected": stats.rejected,
+                        "cancelled": stats.cancelled,
+                        "avg_wait": round(stats.wait_total / stats.granted, 3) if stats.granted else 0.0,
+                        "max_wait": round(stats.wait_max, 3),
+                    }
+                result[provider] = {
+                    "limit": self._limit(provider),
+                    "active": lane.active,
+                    "queue_depth": len(lane.queue),
+                    "peak_queue": lane.peak_queue,
+                    "classes": classes,
+                }
+            return {
+                "enabled": self.enabled,
+                "max_queue": self.max_queue,
+                "queue_timeout": self.queue_timeout,
+                "providers": result,
+            }
+
+
+# 全局提供商调度器
+provider_scheduler = ProviderScheduler(limits={'DEEPSEEK': 4, 'BIGMODEL': 2, 'OLLAMA': 1})
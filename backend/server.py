@@ -12,7 +12,8 @@ try:
     from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
     from flask_cors import CORS
 except ImportError:
-    print("正在安装Flask依赖...")
+    from structured_log import get_logger
+    get_logger('server').warning("正在安装 Flask 依赖")
     import subprocess
     # 获取Blender的Python执行路径
     blender_python_path = sys.executable
@@ -22,6 +23,33 @@ except ImportError:
 
 import bpy
 
+from config_store import config_store
+import settings_snapshot
+from http_server import EmbeddedHTTPServer
+import providers
+from stream_parser import ProviderStream
+import stream_events
+from stream_events import StreamEvent
+from stream_gateway import stream_gateway
+from conversation_cache import conversation_cache
+from conversation_db import conversation_db
+from summary_jobs import summary_jobs
+from response_cache import response_cache, make_key as response_cache_key
+from near_duplicate import near_duplicates
+from single_flight import single_flight
+from cancellation import active_requests, abort_socket, DisconnectWatch
+from scheduler import provider_scheduler, normalize_priority, SUMMARIZATION, DIAGNOSTICS, BATCH
+from rate_limiter import rate_limiter, estimate_request_tokens, wait as rate_limit_wait
+from batch_jobs import batch_jobs
+import hedging
+import map_reduce
+from provider_health import provider_health, AUTO as AUTO_PROVIDER
+import metrics
+from tracing import tracer
+from structured_log import get_logger, log_manager
+
+log = get_logger('server')
+
 # 获取插件的根目录，然后确定前端静态文件的路径
 addon_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 static_folder_path = os.path.join(addon_dir, 'chatgpt-web', 'dist')
@@ -33,7 +61,7 @@ def initialize_config_file():
 
     # 检查config.json是否存在
     if not os.path.exists(config_path):
-        print("配置文件不存在，正在从example文件创建默认配置...")
+        log.info("配置文件不存在，正在从 example 文件创建默认配置")
         # 检查example文件是否存在
         if os.path.exists(example_config_path):
             # 读取example配置文件
@@ -43,9 +71,9 @@ def initialize_config_file():
             # 写入到config.json
             with open(config_path, 'w', encoding='utf-8') as config_file:
                 json.dump(example_config, config_file, indent=4, ensure_ascii=False)
-            print("已创建默认配置文件 config.json")
+            log.info("已创建默认配置文件", path=config_path)
         else:
-            print("警告：config.example.json 文件不存在")
+            log.warning("config.example.json 文件不存在", path=example_config_path)
 
 # 初始化配置文件
 initialize_config_file()
@@ -69,82 +97,159 @@ blender_data = {
 pending_updates = {}
 refresh_flag = False
 
-# 存储对话历史
-# Format: { 'conversation_id': [ {role, content}, ... ] }
-conversations = {}
+# 对话历史、摘要与统计保存在有界缓存中（LRU / TTL / 内存上限，节点数据按内容哈希去重）
 current_conversation_id = None
-conversation_memory = {}
-conversation_stats = {}
+
+def _apply_conversation_cache(memory):
+    """ai.memory：对话缓存的上限"""
+    conversation_cache.configure(
+        max_conversations=memory.get('max_conversations', 200),
+        max_bytes=float(memory.get('max_mb', 64)) * 1024 * 1024,
+        ttl=float(memory.get('ttl_hours', 168)) * 3600
+    )
+
+def _apply_response_cache(cfg):
+    """ai.response_cache：回复缓存"""
+    response_cache.configure(
+        enabled=cfg.get('enabled', True),
+        ttl=float(cfg.get('ttl_hours', 24)) * 3600,
+        max_entries=cfg.get('max_entries', 256),
+        max_bytes=float(cfg.get('max_mb', 32)) * 1024 * 1024,
+        disk_max_bytes=float(cfg.get('disk_max_mb', 256)) * 1024 * 1024
+    )
+
+def _apply_near_duplicates(cfg):
+    """ai.near_duplicate：近似重复问题索引（阈值、范围 node/global、条目上限）"""
+    near_duplicates.configure(
+        enabled=cfg.get('enabled', True),
+        threshold=cfg.get('threshold', 0.45),
+        scope=cfg.get('scope', 'node'),
+        max_entries=cfg.get('max_entries', 2000)
+    )
+
+def _apply_provider_health(cfg):
+    """ai.routing：健康度统计、熔断与 AUTO 的候选顺序"""
+    provider_health.configure(
+        alpha=cfg.get('ewma_alpha', 0.3),
+        failure_threshold=cfg.get('failure_threshold', 3),
+        error_rate_threshold=cfg.get('error_rate_threshold', 0.5),
+        cooldown=cfg.get('cooldown_seconds', 30),
+        fallback_order=cfg.get('fallback_order')
+    )
+
+def _apply_scheduler(cfg):
+    """ai.scheduler：各提供商的并发上限与排队"""
+    provider_scheduler.configure(
+        limits=cfg.get('limits'),
+        default_limit=cfg.get('default_limit', 2),
+        max_queue=cfg.get('max_queue', 32),
+        queue_timeout=cfg.get('queue_timeout_seconds', 60),
+        enabled=cfg.get('enabled', True)
+    )
+
+def _apply_rate_limits(cfg):
+    """ai.rate_limits：各提供商每个 API Key 的 rpm / tpm 与重试"""
+    rate_limiter.configure(
+        limits=cfg.get('providers') or {},
+        enabled=cfg.get('enabled', True),
+        max_retries=cfg.get('max_retries', 3),
+        backoff_base=cfg.get('backoff_base_seconds', 1.0),
+        backoff_max=cfg.get('backoff_max_seconds', 30),
+        max_wait=cfg.get('max_wait_seconds', 60)
+    )
+
+def _apply_batch_jobs(cfg):
+    """ai.batch：批量分析的默认 / 最大并行度"""
+    batch_jobs.configure(
+        max_parallel=cfg.get('max_parallel', 4),
+        default_parallel=cfg.get('parallelism', 2)
+    )
+
+def _apply_tracing(cfg):
+    """ai.tracing：是否记录链路、追踪文件轮换的大小"""
+    tracer.configure(enabled=cfg.get('enabled', True), max_bytes=cfg.get('max_bytes', 5 * 1024 * 1024))
+
+def _apply_logging(cfg):
+    """ai.logging：日志级别、是否写入日志文件、重复日志的限流"""
+    log_manager.configure(
+        level=cfg.get('level', 'INFO'),
+        file_enabled=cfg.get('file', False),
+        burst=cfg.get('burst', 5),
+        window=cfg.get('window', 10),
+        max_bytes=cfg.get('max_bytes', 5 * 1024 * 1024),
+    )
+
+# ai 下的配置节 -> 应用函数（参数为该节的 dict）
+CONFIG_SECTIONS = (
+    ('logging', _apply_logging),
+    ('memory', _apply_conversation_cache),
+    ('response_cache', _apply_response_cache),
+    ('near_duplicate', _apply_near_duplicates),
+    ('routing', _apply_provider_health),
+    ('scheduler', _apply_scheduler),
+    ('rate_limits', _apply_rate_limits),
+    ('batch', _apply_batch_jobs),
+    ('tracing', _apply_tracing),
+)
+
+def _configure_section(section, apply_fn):
+    """立即按 ai.<section> 应用一次配置，并在每次配置落盘后重新应用"""
+    def configure(version=None, config=None):
+        if config is None:
+            config = config_store.read()
+        cfg = (config.get('ai') or {}).get(section) or {}
+        if not isinstance(cfg, dict):
+            return
+        try:
+            apply_fn(cfg)
+        except Exception:
+            log.error("应用配置出错", exc_info=True, section=f"ai.{section}")
+
+    configure()
+    config_store.subscribe(configure)
+    return configure
+
+for _section, _apply in CONFIG_SECTIONS:
+    _configure_section(_section, _apply)
+
+# 对话同时写入本地 SQLite，缓存淘汰或重启后从数据库回填
+conversation_cache.attach(conversation_db)
 
 def get_settings():
-    """从Blender获取设置"""
+    """获取设置：Blender 主线程发布的设置快照 + 配置文件（不访问 bpy，可在任意线程调用）"""
     settings = {}
     try:
-        import bpy
-        # 尝试获取当前场景
-        scene = None
-        if hasattr(bpy, 'context') and hasattr(bpy.context, 'scene'):
-            scene = bpy.context.scene
-        
-        # 如果上下文不可用（例如在后台线程），尝试获取第一个场景
-        if not scene and hasattr(bpy, 'data') and hasattr(bpy.data, 'scenes') and len(bpy.data.scenes) > 0:
-            scene = bpy.data.scenes[0]
-        
-        if scene and hasattr(scene, 'ainode_analyzer_settings'):
-            s = scene.ainode_analyzer_settings
-            settings['deepseek_api_key'] = s.deepseek_api_key
-            settings['deepseek_model'] = s.deepseek_model
-            settings['ollama_url'] = s.ollama_url
-            settings['ollama_model'] = s.ollama_model
-            settings['bigmodel_api_key'] = s.bigmodel_api_key
-            settings['bigmodel_url'] = s.bigmodel_url
-            settings['bigmodel_model'] = s.bigmodel_model
-            settings['system_prompt'] = s.system_prompt
-            settings['ai_provider'] = s.ai_provider
-            if hasattr(s, 'enable_web_search'):
-                settings['enable_web_search'] = s.enable_web_search
-            if hasattr(s, 'search_api'):
-                settings['search_api'] = s.search_api
-            if hasattr(s, 'tavily_api_key'):
-                settings['tavily_api_key'] = s.tavily_api_key
-            # 联网复合开关
-            if hasattr(s, 'enable_networking'):
-                settings['networking_enabled'] = bool(s.enable_networking)
-            # Add default_question
-            if hasattr(s, 'default_question'):
-                settings['default_question'] = s.default_question
+        # 快照由插件在主线程发布，这里只做一次字典拷贝
+        settings.update(settings_snapshot.current())
         # 从配置文件合并设置
         try:
-            config_path = os.path.join(addon_dir, 'config.json')
-            if os.path.exists(config_path):
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    cfg = json.load(f)
-                    ai = cfg.get('ai', {})
-                    if 'provider' in ai: settings['ai_provider'] = ai.get('provider', settings.get('ai_provider'))
-                    ds = ai.get('deepseek', {})
-                    if 'api_key' in ds: settings['deepseek_api_key'] = ds.get('api_key', settings.get('deepseek_api_key'))
-                    if 'model' in ds: settings['deepseek_model'] = ds.get('model', settings.get('deepseek_model'))
-                    ol = ai.get('ollama', {})
-                    if 'url' in ol: settings['ollama_url'] = ol.get('url', settings.get('ollama_url'))
-                    if 'model' in ol: settings['ollama_model'] = ol.get('model', settings.get('ollama_model'))
-                    bm = ai.get('bigmodel', {})
-                    if 'api_key' in bm: settings['bigmodel_api_key'] = bm.get('api_key', settings.get('bigmodel_api_key'))
-                    if 'url' in bm: settings['bigmodel_url'] = bm.get('url', settings.get('bigmodel_url'))
-                    if 'model' in bm: settings['bigmodel_model'] = bm.get('model', settings.get('bigmodel_model'))
-                    if 'system_prompt' in ai: settings['system_prompt'] = ai.get('system_prompt', settings.get('system_prompt'))
-                    if 'temperature' in ai: settings['temperature'] = ai.get('temperature')
-                    if 'top_p' in ai: settings['top_p'] = ai.get('top_p')
-                    thinking = ai.get('thinking', {})
-                    if isinstance(thinking, dict) and 'enabled' in thinking:
-                        settings['thinking_enabled'] = bool(thinking.get('enabled'))
-                    # networking = ai.get('networking', {})
-                    # if isinstance(networking, dict) and 'enabled' in networking:
-                    #    settings['networking_enabled'] = bool(networking.get('enabled'))
-                    
+            ai = config_store.get('ai', default={})
+            if 'provider' in ai: settings['ai_provider'] = ai.get('provider', settings.get('ai_provider'))
+            ds = ai.get('deepseek', {})
+            if 'api_key' in ds: settings['deepseek_api_key'] = ds.get('api_key', settings.get('deepseek_api_key'))
+            if 'model' in ds: settings['deepseek_model'] = ds.get('model', settings.get('deepseek_model'))
+            if 'url' in ds: settings['deepseek_url'] = ds.get('url', settings.get('deepseek_url'))
+            ol = ai.get('ollama', {})
+            if 'url' in ol: settings['ollama_url'] = ol.get('url', settings.get('ollama_url'))
+            if 'model' in ol: settings['ollama_model'] = ol.get('model', settings.get('ollama_model'))
+            bm = ai.get('bigmodel', {})
+            if 'api_key' in bm: settings['bigmodel_api_key'] = bm.get('api_key', settings.get('bigmodel_api_key'))
+            if 'url' in bm: settings['bigmodel_url'] = bm.get('url', settings.get('bigmodel_url'))
+            if 'model' in bm: settings['bigmodel_model'] = bm.get('model', settings.get('bigmodel_model'))
+            if 'system_prompt' in ai: settings['system_prompt'] = ai.get('system_prompt', settings.get('system_prompt'))
+            if 'temperature' in ai: settings['temperature'] = ai.get('temperature')
+            if 'top_p' in ai: settings['top_p'] = ai.get('top_p')
+            thinking = ai.get('thinking', {})
+            if isinstance(thinking, dict) and 'enabled' in thinking:
+                settings['thinking_enabled'] = bool(thinking.get('enabled'))
+            # networking = ai.get('networking', {})
+            # if isinstance(networking, dict) and 'enabled' in networking:
+            #    settings['networking_enabled'] = bool(networking.get('enabled'))
+            
         except Exception:
             pass
-    except Exception as e:
-        print(f"Error getting settings from Blender: {e}")
+    except Exception:
+        log.error("读取设置出错", exc_info=True)
     return settings
 
 @app.route('/', defaults={'path': ''})
@@ -182,6 +287,21 @@ def error_response(message="Error", code=400):
         "data": None
     }), code
 
+@app.before_request
+def _metrics_start():
+    request.environ['ainode.started'] = time.perf_counter()
+
+@app.after_request
+def _metrics_record(response):
+    """按路由模板记录请求耗时与请求体大小（流式响应只计到返回响应头为止，整段耗时见 ainode_stream_seconds）"""
+    started = request.environ.get('ainode.started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.http_request_seconds.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+        if request.content_length:
+            metrics.http_request_bytes.observe(request.content_length, route)
+    return response
+
 @app.route('/api/test-networking', methods=['GET'])
 def test_networking():
     urls = [
@@ -212,7 +332,8 @@ def get_status():
     return success_response({
         "status": blender_data["status"],
         "connected": blender_data["status"] == "connected",
-        "timestamp": "unknown"
+        "timestamp": "unknown",
+        "server": server_manager.info()
     })
 
 @app.route('/api/session', methods=['POST'])
@@ -228,16 +349,15 @@ def verify():
 
 @app.route('/api/config', methods=['POST'])
 def config():
-    global current_conversation_id, conversations
+    global current_conversation_id
     settings = get_settings()
     thinking_enabled = bool(settings.get('thinking_enabled'))
     # Calculate rounds for current conversation (assistant message count)
     rounds = 0
     cid = current_conversation_id
-    if cid and cid in conversations:
+    if cid:
         try:
-            msgs = conversations.get(cid, [])
-            rounds = len([m for m in msgs if m.get('role') == 'assistant'])
+            rounds = conversation_cache.count_role(cid, 'assistant')
         except Exception:
             rounds = 0
     return success_response({
@@ -299,52 +419,50 @@ def get_ui_config():
     # Load from file
     if os.path.exists(config_path):
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                file_config = json.load(f)
-
-                # Handle the new provider structure properly
-                if 'ai' in file_config and 'provider' in file_config['ai']:
-                    # If the file has the new provider structure, use it as-is
-                    if isinstance(file_config['ai']['provider'], dict):
-                        config['ai']['provider'] = file_config['ai']['provider']
-                    else:
-                        # If it's the old structure, convert it to new structure
-                        config['ai']['provider'] = {
-                            "name": file_config['ai']['provider'],
-                            "model": file_config['ai'].get('model', 'deepseek-chat')
-                        }
-
-                # Perform selective merge to avoid duplication
-                for key, value in file_config.items():
-                    if key == 'ai' and isinstance(value, dict):
-                        # Special handling for 'ai' section to prevent duplication
-                        for ai_key, ai_value in value.items():
-                            if ai_key == 'provider_configs':
-                                # Merge provider_configs separately
-                                if 'provider_configs' in config['ai']:
-                                    config['ai']['provider_configs'].update(ai_value)
-                                else:
-                                    config['ai']['provider_configs'] = ai_value
-                            elif ai_key == 'deepseek' and isinstance(ai_value, dict):
-                                # Merge deepseek settings
-                                if 'deepseek' in config['ai']:
-                                    config['ai']['deepseek'].update(ai_value)
-                                else:
-                                    config['ai']['deepseek'] = ai_value
-                            elif ai_key == 'ollama' and isinstance(ai_value, dict):
-                                # Merge ollama settings
-                                if 'ollama' in config['ai']:
-                                    config['ai']['ollama'].update(ai_value)
-                                else:
-                                    config['ai']['ollama'] = ai_value
+            file_config = config_store.read()
+            # Handle the new provider structure properly
+            if 'ai' in file_config and 'provider' in file_config['ai']:
+                # If the file has the new provider structure, use it as-is
+                if isinstance(file_config['ai']['provider'], dict):
+                    config['ai']['provider'] = file_config['ai']['provider']
+                else:
+                    # If it's the old structure, convert it to new structure
+                    config['ai']['provider'] = {
+                        "name": file_config['ai']['provider'],
+                        "model": file_config['ai'].get('model', 'deepseek-chat')
+                    }
+
+            # Perform selective merge to avoid duplication
+            for key, value in file_config.items():
+                if key == 'ai' and isinstance(value, dict):
+                    # Special handling for 'ai' section to prevent duplication
+                    for ai_key, ai_value in value.items():
+                        if ai_key == 'provider_configs':
+                            # Merge provider_configs separately
+                            if 'provider_configs' in config['ai']:
+                                config['ai']['provider_configs'].update(ai_value)
                             else:
-                                # Direct assignment for other keys
-                                config['ai'][ai_key] = ai_value
-                    else:
-                        # For non-'ai' sections, direct assignment
-                        config[key] = value
-        except Exception as e:
-            print(f"Error reading config.json: {e}")
+                                config['ai']['provider_configs'] = ai_value
+                        elif ai_key == 'deepseek' and isinstance(ai_value, dict):
+                            # Merge deepseek settings
+                            if 'deepseek' in config['ai']:
+                                config['ai']['deepseek'].update(ai_value)
+                            else:
+                                config['ai']['deepseek'] = ai_value
+                        elif ai_key == 'ollama' and isinstance(ai_value, dict):
+                            # Merge ollama settings
+                            if 'ollama' in config['ai']:
+                                config['ai']['ollama'].update(ai_value)
+                            else:
+                                config['ai']['ollama'] = ai_value
+                        else:
+                            # Direct assignment for other keys
+                            config['ai'][ai_key] = ai_value
+                else:
+                    # For non-'ai' sections, direct assignment
+                    config[key] = value
+        except Exception:
+            log.error("读取 config.json 出错", exc_info=True)
 
     # Smart Fallbacks for Simplified Config
     # 1. If default_questions is empty, populate from presets
@@ -386,56 +504,58 @@ def _estimate_messages_tokens(messages):
         total += _estimate_tokens(m.get('content', ''))
     return total
 
-def _summarize(messages, settings):
-    provider = settings.get('ai_provider', 'DEEPSEEK')
-    content = "\n\n".join([m.get('content', '') for m in messages][-8:])
-    prompt = "请用要点总结上述对话，提炼用户目标、关键事实、上下文与约束，长度尽量精炼，用中文。"
-    if provider == 'OLLAMA':
-        base_url = (settings.get('ollama_url') or 'http://localhost:11434').rstrip('/')
-        url = f"{base_url}/api/chat"
-        data = {
-            'model': (settings.get('ollama_model') or 'llama2').strip(),
-            'messages': [
-                {'role': 'system', 'content': '你是对话总结器。'},
-                {'role': 'user', 'content': content + "\n\n" + prompt}
-            ],
-            'stream': False
-        }
-        try:
-            r = requests.post(url, json=data, timeout=60)
-            if r.status_code == 200:
-                j = r.json()
-                msg = j.get('message', {})
-                return msg.get('content', '')
-        except Exception:
-            return ''
+def _select_summary_input(messages, upto, max_chars=6000, per_message_chars=2000):
+    """
+    选出下一步要并入滚动摘要的消息：从 messages[upto] 开始按顺序取，
+    单条消息截断到 per_message_chars，总长度不超过 max_chars。
+    返回 (消息文本列表, 新的 upto)。
+    """
+    parts = []
+    total = 0
+    index = upto
+    while index < len(messages):
+        m = messages[index]
+        if m.get('role') in ('user', 'assistant'):
+            text = f"{m.get('role')}: {(m.get('content') or '')[:per_message_chars]}"
+            if parts and total + len(text) > max_chars:
+                break
+            parts.append(text)
+            total += len(text)
+        index += 1
+    return parts, index
+
+def _summarize(previous_summary, new_parts, settings):
+    """把新增的对话内容并入已有摘要（滚动摘要），每次输入长度有上限"""
+    provider = 'OLLAMA' if settings.get('ai_provider', 'DEEPSEEK') == 'OLLAMA' else 'DEEPSEEK'
+    content = f"已有摘要：\n{previous_summary or '（无）'}\n\n新增对话：\n" + "\n\n".join(new_parts)
+    prompt = "请把新增对话并入已有摘要，输出更新后的完整摘要：用要点提炼用户目标、关键事实、上下文与约束，长度尽量精炼，用中文。"
+    messages = [
+        {'role': 'system', 'content': '你是对话总结器。'},
+        {'role': 'user', 'content': content + "\n\n" + prompt}
+    ]
+    # 地址、密钥与模型沿用 providers 的请求描述（含 ai.deepseek.url），只替换为非流式的短输出参数
+    spec, error = providers.build_request(provider, messages, settings)
+    if error:
+        log.warning("无法生成摘要", provider=provider, error=error)
         return ''
+    if provider == 'OLLAMA':
+        # 限制摘要长度，保证下一步的输入有上限
+        spec['json'] = {'model': spec['json']['model'], 'messages': messages, 'options': {'num_predict': 512}, 'stream': False}
     else:
-        api_key = (settings.get('deepseek_api_key') or '').strip()
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {api_key}'
-        }
-        data = {
-            'model': (settings.get('deepseek_model') or 'deepseek-chat').strip(),
-            'messages': [
-                {'role': 'system', 'content': '你是对话总结器。'},
-                {'role': 'user', 'content': content + "\n\n" + prompt}
-            ],
-            'temperature': 0.2,
-            'max_tokens': 512,
-            'stream': False
-        }
-        try:
-            r = requests.post('https://api.deepseek.com/chat/completions', headers=headers, json=data, timeout=60)
-            if r.status_code == 200:
-                j = r.json()
-                ch = j.get('choices', [])
-                if ch:
-                    msg = ch[0].get('message', {})
-                    return msg.get('content', '')
-        except Exception:
+        spec['json'] = {'model': spec['json']['model'], 'messages': messages, 'temperature': 0.2, 'max_tokens': 512, 'stream': False}
+    spec['timeout'] = 60
+    try:
+        r = _limited_request(spec, SUMMARIZATION)
+        if r.status_code != 200:
+            log.warning("生成摘要失败", provider=provider, status=r.status_code)
             return ''
+        j = r.json()
+        if provider == 'OLLAMA':
+            return j.get('message', {}).get('content', '')
+        ch = j.get('choices', [])
+        return ch[0].get('message', {}).get('content', '') if ch else ''
+    except Exception:
+        log.warning("生成摘要出错", exc_info=True, provider=provider)
         return ''
 
 @app.route('/api/save-ui-config', methods=['POST'])
@@ -465,19 +585,8 @@ def save_ui_config():
             if ai:
                 data['ai'] = ai
 
-        config_path = os.path.join(addon_dir, 'config.json')
-
-        # Read existing to preserve fields not in request
-        existing_config = {}
-        if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                existing_config = json.load(f)
-
-        # Deep Merge
-        deep_update(existing_config, data)
-
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(existing_config, f, indent=4, ensure_ascii=False)
+        # Deep Merge（由统一写入器合并写回，保留请求中未包含的字段）
+        config_store.update(lambda cfg: deep_update(cfg, data), source='save-ui-config')
 
         # Trigger Blender to reload these settings
         global pending_updates
@@ -485,9 +594,7 @@ def save_ui_config():
 
         return success_response(None, "Configuration saved")
     except Exception as e:
-        import traceback
-        print(f"Error saving config: {e}")
-        print(traceback.format_exc())
+        log.error("Error saving config", exc_info=True)
         return error_response(f"Error saving config: {e}")
 
 
@@ -644,45 +751,33 @@ def update_settings():
     
     # Sync to config.json
     try:
-        config_path = os.path.join(addon_dir, 'config.json')
-        existing_config = {}
-        if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                existing_config = json.load(f)
-        
-        updated = False
-        # Support deep 'ai' partial updates from web
-        if 'ai' in data and isinstance(data['ai'], dict):
-            if 'ai' not in existing_config: existing_config['ai'] = {}
-            deep_update(existing_config['ai'], data['ai'])
-            updated = True
-        if 'system_prompt' in data:
-            if 'ai' not in existing_config: existing_config['ai'] = {}
-            existing_config['ai']['system_prompt'] = data['system_prompt']
-            updated = True
-            
-        if 'default_questions' in data:
-            existing_config['default_questions'] = data['default_questions']
-            updated = True
-            
-        if 'temperature' in data:
-            if 'ai' not in existing_config: existing_config['ai'] = {}
-            existing_config['ai']['temperature'] = data['temperature']
-            updated = True
-            
-        if 'top_p' in data:
-            if 'ai' not in existing_config: existing_config['ai'] = {}
-            existing_config['ai']['top_p'] = data['top_p']
-            updated = True
+        updated = any(k in data for k in ('system_prompt', 'default_questions', 'temperature', 'top_p')) or \
+            ('ai' in data and isinstance(data['ai'], dict))
+
+        def apply(existing_config):
+            # Support deep 'ai' partial updates from web
+            if 'ai' in data and isinstance(data['ai'], dict):
+                if 'ai' not in existing_config: existing_config['ai'] = {}
+                deep_update(existing_config['ai'], data['ai'])
+            if 'system_prompt' in data:
+                if 'ai' not in existing_config: existing_config['ai'] = {}
+                existing_config['ai']['system_prompt'] = data['system_prompt']
+            if 'default_questions' in data:
+                existing_config['default_questions'] = data['default_questions']
+            if 'temperature' in data:
+                if 'ai' not in existing_config: existing_config['ai'] = {}
+                existing_config['ai']['temperature'] = data['temperature']
+            if 'top_p' in data:
+                if 'ai' not in existing_config: existing_config['ai'] = {}
+                existing_config['ai']['top_p'] = data['top_p']
 
         if updated:
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(existing_config, f, indent=4, ensure_ascii=False)
+            config_store.update(apply, source='update-settings')
             # Trigger reload flag so Blender re-reads the file if needed
             pending_updates['reload_config'] = True
             
-    except Exception as e:
-        print(f"Failed to sync update to file: {e}")
+    except Exception:
+        log.error("设置同步到配置文件失败", exc_info=True)
     
     return success_response(None, "Settings update queued")
 
@@ -718,6 +813,22 @@ def clean_node_data(content):
     # If no JSON found, return empty
     return ""
 
+def canonical_node_data(content):
+    """
+    节点数据的统一形式：系统消息、问题中的 {{Current Node Data}}、对话缓存与近似重复查询都使用它，
+    同一份节点数据只按一个内容哈希保存。已经是 JSON 的内容原样保留（去掉首尾空白），
+    否则取 clean_node_data 的结果，提取不到 JSON 时保留原文。
+    """
+    if not content:
+        return ""
+    stripped = content.strip()
+    if stripped[:1] in ('{', '['):
+        return stripped
+    try:
+        return clean_node_data(content) or content
+    except Exception:
+        return content
+
 @app.route('/api/clean-markdown', methods=['POST'])
 def api_clean_markdown():
     """Reuse web-side cleaning method to filter content format"""
@@ -814,222 +925,205 @@ def set_blender_data():
     except Exception as e:
         return error_response(str(e))
 
-# DeepSeek Call
-def _call_deepseek(messages, settings):
-    if not bool(settings.get('networking_enabled', True)):
-        yield "Error: 联网已关闭，无法调用在线模型。请启用联网。"
+def _response_socket(r):
+    """requests 流式响应底层的套接字（取不到时返回 None）"""
+    raw = getattr(r, 'raw', None)
+    conn = getattr(raw, '_connection', None) or getattr(raw, 'connection', None)
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        fp = getattr(getattr(raw, '_fp', None), 'fp', None)
+        sock = getattr(getattr(fp, 'raw', None), '_sock', None)
+    return sock
+
+def _call_provider(spec, error, scope=None):
+    """
+    按 providers 生成的请求描述同步调用提供商，逐条输出解析结果。
+    请求前经 rate_limiter 按 API Key 的 rpm / tpm 准入；429 / 503 按 Retry-After 或退避重试。
+    scope 被取消时立即中断上游连接（阻塞中的读取随之返回），不再继续读取和计费；
+    响应头返回之前的取消在响应头到达后生效。
+    """
+    if error:
+        yield providers.error_output(error)
         return
-    api_key = (settings.get('deepseek_api_key') or '').strip()
-    model = (settings.get('deepseek_model') or 'deepseek-chat').strip()
-    
-    if not api_key:
-        yield "Error: 未配置 DeepSeek API Key。请在 Blender 插件设置中配置。"
+    if scope is not None and scope.cancelled:
         return
-
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {api_key}'
-    }
-    
-    data = {
-        'model': model,
-        'messages': messages,
-        'temperature': settings.get('temperature', 0.7) or 0.7,
-        'max_tokens': 4096,
-        'stream': True
-    }
-    thinking_enabled = bool(settings.get('thinking_enabled'))
-    if thinking_enabled and model != 'deepseek-reasoner':
-        data['thinking'] = {'type': 'enabled'}
-    
+    name = spec['name']
+    abort = None
+    estimated = estimate_request_tokens(spec)
+    attempt = 0
+    delay = 0.0
     try:
-        with requests.post('https://api.deepseek.com/chat/completions', headers=headers, json=data, timeout=300, stream=True) as r:
-            if r.status_code != 200:
-                yield f"DeepSeek API error: {r.status_code} - {r.text}"
+        while True:
+            if delay and not rate_limit_wait(delay, scope):
+                return
+            if not rate_limiter.admit(spec, estimated, scope):
+                return
+            with requests.post(spec['url'], headers=spec['headers'], json=spec['json'], timeout=spec['timeout'], stream=True) as r:
+                if scope is not None:
+                    if abort is not None:
+                        scope.remove(abort)
+                    abort = scope.add(lambda: abort_socket(_response_socket(r)))
+                    if scope.cancelled:
+                        return
+                log.debug("提供商响应", provider=name, status=r.status_code)
+                rate_limiter.observe(spec, r.status_code, r.headers)
+                if r.status_code != 200:
+                    error_text = r.text
+                    log.warning("提供商返回错误", provider=name, status=r.status_code, body=error_text[:500])
+                    delay = rate_limiter.retry_delay(spec, r.status_code, r.headers, attempt)
+                    if delay is not None:
+                        attempt += 1
+                        log.info("提供商限流，稍后重试", provider=name, status=r.status_code, delay=round(delay, 1), attempt=attempt)
+                        continue
+                    retried = f"（已重试 {attempt} 次）" if attempt else ""
+                    yield providers.error_output(f"{name} API error: {r.status_code} - {error_text}{retried}")
+                    return
+
+                stream = ProviderStream(spec)
+                done = False
+                for data in r.iter_content(chunk_size=None):
+                    if scope is not None and scope.cancelled:
+                        return
+                    outputs, done = stream.feed(data)
+                    for item in outputs:
+                        if item.kind == stream_events.USAGE:
+                            usage = item.data or {}
+                            rate_limiter.settle(spec, estimated, usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0))
+                        yield item
+                    if done:
+                        break
+                if not done:
+                    for item in stream.close()[0]:
+                        yield item
                 return
-
-            for line in r.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        if line == 'data: [DONE]':
-                            break
-                        try:
-                            json_str = line[6:]
-                            j = json.loads(json_str)
-                            if 'choices' in j and j['choices']:
-                                delta = j['choices'][0].get('delta', {})
-                                if 'reasoning_content' in delta and delta['reasoning_content'] and thinking_enabled:
-                                    yield json.dumps({'kind': 'thinking', 'content': delta.get('reasoning_content')})
-                                if 'content' in delta and delta['content']:
-                                    yield json.dumps({'kind': 'chunk', 'content': delta['content']})
-                        except Exception:
-                            pass
     except Exception as e:
-        yield f"Error calling DeepSeek API: {str(e)}"
+        if scope is not None and scope.cancelled:
+            # 连接是被取消中断的，不是上游错误
+            return
+        log.warning("调用提供商出错", exc_info=True, provider=name, error=str(e))
+        yield providers.error_output(f"Error calling {name} API: {str(e)}")
+    finally:
+        if abort is not None:
+            scope.remove(abort)
+
+def _limited_request(spec, priority, method='POST'):
+    """
+    摘要、连通性测试、模型列表等非流式请求：与 _call_provider 相同，按 API Key 的 rpm / tpm 准入，
+    429 / 503 按 Retry-After 或退避重试；每次发送期间占用 priority 的调度名额（等待重试时不占）。
+    返回最后一次响应，由调用方检查状态码；网络错误照常抛出。
+    """
+    estimated = estimate_request_tokens(spec)
+    attempt = 0
+    while True:
+        rate_limiter.admit(spec, estimated)
+        with provider_scheduler.slot(spec['provider'], priority):
+            r = requests.request(method, spec['url'], headers=spec.get('headers'), json=spec.get('json'), timeout=spec['timeout'])
+        rate_limiter.observe(spec, r.status_code, r.headers)
+        if r.status_code == 200:
+            if spec.get('json') is not None:
+                try:
+                    # OpenAI 兼容接口在 usage 中返回用量，Ollama 直接放在顶层
+                    j = r.json()
+                    usage = providers.normalize_usage(j.get('usage') or j)
+                    rate_limiter.settle(spec, estimated, usage['prompt_tokens'] + usage['completion_tokens'])
+                except Exception:
+                    pass
+            return r
+        delay = rate_limiter.retry_delay(spec, r.status_code, r.headers, attempt)
+        if delay is None:
+            return r
+        attempt += 1
+        log.info("提供商限流，稍后重试", provider=spec['name'], status=r.status_code, delay=round(delay, 1), attempt=attempt)
+        rate_limit_wait(delay)
+
+def _scheduled_call(session, provider_request, name, scope=None):
+    """经调度器取得 name（"提供商/模型"）的并发名额后调用提供商，并计入提供商健康度；排队与生成记入会话的 trace"""
+    queued = time.time()
+
+    def call():
+        session.trace.record('queue', queued, time.time(), provider=name, priority=session.priority)
+        return provider_health.track_sync(name, _call_provider(*provider_request, scope), scope, trace=session.trace)
+
+    return provider_scheduler.wrap_sync(name.split('/', 1)[0], session.priority, call, scope)
+
+def _run_map_phase(session, scope=None):
+    """map 阶段的上游：并发分析各分块（每块经调度器、限流与提供商健康度），逐块输出 PROGRESS 事件"""
+    cfg = session.settings.get('map_reduce') or {}
+    settings = session.map_settings()
+
+    def analyze(chunk, chunk_scope):
+        parent = session._map_span or session.trace
+        with parent.child('map_chunk', index=chunk.index, label=chunk.label) as span:
+            return _collect_answer(session.provider, settings, session.map_messages(chunk), session.priority, chunk_scope, span)[0]
+
+    return map_reduce.run_map(session.map_plan, analyze, cfg.get('parallelism', 3), scope)
+
+def _open_upstream(session, scope=None):
+    """会话的同步上游：单一提供商，或启用对冲时的主/备竞速；每一路都经过调度器并计入提供商健康度，scope 取消时关闭上游"""
+    requests_, names, delay = session.provider_requests()
+    upstreams = [lambda s=None, r=r, n=n: _scheduled_call(session, r, n, s) for r, n in zip(requests_, names)]
+    if len(upstreams) == 1:
+        return upstreams[0](scope)
+    return hedging.hedge_sync(upstreams, names, delay, scope)
+
+def _collect_answer(provider, settings, messages, priority, scope, trace=None):
+    """
+    非流式地取得一次完整回答（批量分析、map-reduce 的分块分析），经调度器、限流与提供商健康度调用提供商；
+    相同的请求直接使用回复缓存。返回 (回答, 元数据)，提供商返回错误、被取消或没有内容时抛出异常。
+    trace 为上级 span 时记录提供商调用的 span。
+    """
+    name = provider_health.key(provider, settings)
+    meta = {'provider': provider, 'model': providers.model_name(provider, settings)}
+    cache_key = response_cache_key(provider, settings, messages)
+    outputs = response_cache.get(cache_key)
+    if outputs is not None:
+        meta['response_cached'] = True
+    else:
+        spec, error = providers.build_request(provider, messages, settings)
+        outputs = []
+        upstream = provider_scheduler.wrap_sync(
+            provider, priority,
+            lambda: provider_health.track_sync(name, _call_provider(spec, error, scope), scope, trace=trace),
+            scope
+        )
+        try:
+            for event in upstream:
+                outputs.append(event if isinstance(event, StreamEvent) else StreamEvent.from_legacy(event))
+        finally:
+            upstream.close()
+    parts = []
+    for event in outputs:
+        if event.kind == stream_events.ERROR:
+            raise RuntimeError(event.content)
+        if event.kind == stream_events.USAGE:
+            meta['usage'] = event.data or {}
+        elif event.kind == stream_events.CHUNK:
+            parts.append(event.content or '')
+    answer = ''.join(parts)
+    if scope is not None and scope.cancelled:
+        raise RuntimeError('已取消')
+    if not answer.strip():
+        raise RuntimeError(f"{name} 没有返回内容")
+    if not meta.get('response_cached'):
+        response_cache.put(cache_key, outputs, meta={'provider': provider})
+    return answer, meta
+
+# DeepSeek Call
+def _call_deepseek(messages, settings):
+    return _call_provider(*providers.deepseek_request(messages, settings))
 
 # Ollama Call
 def _call_ollama(messages, settings):
-    base_url = (settings.get('ollama_url') or 'http://localhost:11434').rstrip('/')
-    model = (settings.get('ollama_model') or 'llama2').strip()
-    
-    url = f"{base_url}/api/chat"
-    
-    data = {
-        'model': model,
-        'messages': messages,
-        'stream': True
-    }
-    
-    try:
-        with requests.post(url, json=data, timeout=120, stream=True) as r:
-            if r.status_code != 200:
-                yield f"Ollama API error: {r.status_code} - {r.text}"
-                return
-
-            for line in r.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    try:
-                        j = json.loads(line)
-                        if 'message' in j and 'content' in j['message']:
-                            yield j['message']['content']
-                        if j.get('done', False):
-                            break
-                    except Exception:
-                        pass
-    except Exception as e:
-        yield f"Error calling Ollama API: {str(e)}"
+    return _call_provider(*providers.ollama_request(messages, settings))
 
 def _call_openai_compatible(messages, settings):
     provider = settings.get('ai_provider', '')
-    yield f"Error: 不支持的AI提供商 {provider}。当前仅支持 DeepSeek 和 Ollama。"
+    yield providers.error_output(f"Error: 不支持的AI提供商 {provider}。当前仅支持 DeepSeek 和 Ollama。")
     return
 
 # BigModel Call (智谱AI)
 def _call_bigmodel(messages, settings):
-    if not bool(settings.get('networking_enabled', True)):
-        yield "Error: 联网已关闭，无法调用在线模型。请启用联网。"
-        return
-
-    api_key = (settings.get('bigmodel_api_key') or '').strip()
-    model = (settings.get('bigmodel_model') or 'glm-4').strip()
-    base_url = (settings.get('bigmodel_url') or 'https://open.bigmodel.cn/api/paas/v4').strip()
-
-    if not api_key:
-        yield "Error: 未配置 BigModel API Key。请在 Blender 插件设置中配置。"
-        return
-
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {api_key}'
-    }
-
-    # 根据模型类型调整参数
-    # GLM-4.7系列可能需要不同的参数格式
-    is_glm47 = model.startswith('glm-4.7')
-    
-    # 基础参数
-    data = {
-        'model': model,
-        'messages': messages,
-        'stream': True
-    }
-    
-    # 添加可选参数（某些模型可能不支持）
-    if not is_glm47:
-        # GLM-4系列支持temperature和top_p
-        data['temperature'] = float(settings.get('temperature', 0.7) or 0.7)
-        data['top_p'] = float(settings.get('top_p', 1.0) or 1.0)
-    
-    # 注意：BigModel GLM-4系列模型不支持max_tokens参数
-    # 如果需要限制输出长度，可以在系统提示中说明
-
-    # BigModel的深度思考功能
-    # 注意：BigModel可能没有显式的thinking参数，深度思考是模型本身的能力
-    # 如果需要启用深度思考，可以在系统提示中添加相关指令
-    thinking_enabled = bool(settings.get('thinking_enabled', False))
-    if thinking_enabled:
-        # 在系统提示中添加深度思考指令
-        # 注意：这需要在使用时在系统提示中添加
-        pass
-
-    # 添加联网搜索支持
-    web_search_enabled = bool(settings.get('web_search_enabled', False))
-    if web_search_enabled:
-        # BigModel 支持通过 tools 参数进行联网搜索
-        data['tools'] = [{
-            'type': 'web_search',
-            'web_search': {
-                'enable': True,
-                'search_result': True
-            }
-        }]
-
-    try:
-        url = f"{base_url.rstrip('/')}/chat/completions"
-        
-        # 添加详细的调试日志
-        print(f"[BigModel] API Request URL: {url}")
-        print(f"[BigModel] API Request Model: {model}")
-        print(f"[BigModel] API Request Headers: {headers}")
-        print(f"[BigModel] API Request Data (without messages): { {k: v for k, v in data.items() if k != 'messages'} }")
-        print(f"[BigModel] Thinking Enabled: {thinking_enabled}")
-        print(f"[BigModel] Web Search Enabled: {web_search_enabled}")
-        
-        # 检查messages格式
-        print(f"[BigModel] Messages count: {len(messages)}")
-        if messages:
-            print(f"[BigModel] First message: {messages[0]}")
-            print(f"[BigModel] Last message: {messages[-1]}")
-        
-        # 验证messages格式
-        for i, msg in enumerate(messages):
-            if not isinstance(msg, dict):
-                print(f"[BigModel] ERROR: Message {i} is not a dict: {type(msg)}")
-            elif 'role' not in msg:
-                print(f"[BigModel] ERROR: Message {i} missing 'role': {msg}")
-            elif 'content' not in msg:
-                print(f"[BigModel] ERROR: Message {i} missing 'content': {msg}")
-        
-        with requests.post(url, headers=headers, json=data, timeout=300, stream=True) as r:
-            print(f"[BigModel] API Response Status: {r.status_code}")
-            if r.status_code != 200:
-                error_text = r.text
-                print(f"[BigModel] API Error Response: {error_text}")
-                yield f"BigModel API error: {r.status_code} - {error_text}"
-                return
-
-            for line in r.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        if line == 'data: [DONE]':
-                            break
-                        try:
-                            json_str = line[6:]
-                            j = json.loads(json_str)
-                            if 'choices' in j and j['choices']:
-                                delta = j['choices'][0].get('delta', {})
-                                # 处理普通内容
-                                if 'content' in delta and delta['content']:
-                                    yield json.dumps({'kind': 'chunk', 'content': delta['content']})
-                                # 处理工具调用结果（联网搜索）
-                                if 'tool_calls' in delta and delta['tool_calls']:
-                                    tool_calls = delta['tool_calls']
-                                    for tool_call in tool_calls:
-                                        if tool_call.get('type') == 'web_search':
-                                            search_result = tool_call.get('web_search', {}).get('result', '')
-                                            if search_result:
-                                                yield json.dumps({'kind': 'web_search', 'content': search_result})
-                        except Exception as e:
-                            print(f"Error parsing BigModel response line: {e}")
-                            pass
-    except Exception as e:
-        print(f"Error calling BigModel API: {e}")
-        import traceback
-        print(traceback.format_exc())
-        yield f"Error calling BigModel API: {str(e)}"
+    return _call_provider(*providers.bigmodel_request(messages, settings))
 
 def _get_provider_config(provider):
     """Read provider base_url, api_key and models from config.json"""
@@ -1037,35 +1131,31 @@ def _get_provider_config(provider):
     api_key = ''
     models = []
     try:
-        config_path = os.path.join(addon_dir, 'config.json')
-        if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                cfg = json.load(f)
-                ai = cfg.get('ai', {})
-
-                # 根据新的配置结构获取API密钥和URL
-                if provider == 'DEEPSEEK':
-                    deepseek_cfg = ai.get('deepseek', {})
-                    api_key = (deepseek_cfg.get('api_key') or '').strip()
-                    base_url = (deepseek_cfg.get('url') or 'https://api.deepseek.com').strip()
-                    models = deepseek_cfg.get('models', [])
-                elif provider == 'OLLAMA':
-                    ollama_cfg = ai.get('ollama', {})
-                    api_key = (ollama_cfg.get('api_key') or '').strip()
-                    base_url = (ollama_cfg.get('url') or 'http://localhost:11434').strip()
-                    models = ollama_cfg.get('models', [])
-                elif provider == 'BIGMODEL':
-                    bigmodel_cfg = ai.get('bigmodel', {})
-                    api_key = (bigmodel_cfg.get('api_key') or '').strip()
-                    base_url = (bigmodel_cfg.get('url') or 'https://open.bigmodel.cn/api/paas/v4').strip()
-                    models = bigmodel_cfg.get('models', [])
-                else:
-                    # 为了向后兼容，仍然检查provider_configs
-                    pconfs = ai.get('provider_configs', {})
-                    pcfg = pconfs.get(provider, {}) if isinstance(pconfs, dict) else {}
-                    base_url = (pcfg.get('base_url') or '').strip()
-                    api_key = (pcfg.get('api_key') or '').strip()
-                    models = pcfg.get('models') or []
+        ai = config_store.get('ai', default={})
+
+        # 根据新的配置结构获取API密钥和URL
+        if provider == 'DEEPSEEK':
+            deepseek_cfg = ai.get('deepseek', {})
+            api_key = (deepseek_cfg.get('api_key') or '').strip()
+            base_url = (deepseek_cfg.get('url') or 'https://api.deepseek.com').strip()
+            models = deepseek_cfg.get('models', [])
+        elif provider == 'OLLAMA':
+            ollama_cfg = ai.get('ollama', {})
+            api_key = (ollama_cfg.get('api_key') or '').strip()
+            base_url = (ollama_cfg.get('url') or 'http://localhost:11434').strip()
+            models = ollama_cfg.get('models', [])
+        elif provider == 'BIGMODEL':
+            bigmodel_cfg = ai.get('bigmodel', {})
+            api_key = (bigmodel_cfg.get('api_key') or '').strip()
+            base_url = (bigmodel_cfg.get('url') or 'https://open.bigmodel.cn/api/paas/v4').strip()
+            models = bigmodel_cfg.get('models', [])
+        else:
+            # 为了向后兼容，仍然检查provider_configs
+            pconfs = ai.get('provider_configs', {})
+            pcfg = pconfs.get(provider, {}) if isinstance(pconfs, dict) else {}
+            base_url = (pcfg.get('base_url') or '').strip()
+            api_key = (pcfg.get('api_key') or '').strip()
+            models = pcfg.get('models') or []
     except Exception:
         pass
     return {'base_url': base_url, 'api_key': api_key, 'models': models}
@@ -1084,16 +1174,16 @@ def provider_connectivity():
         if provider == 'OLLAMA':
             url = f"{(get_settings().get('ollama_url') or 'http://localhost:11434').rstrip('/')}/api/tags"
             try:
-                r = requests.get(url, timeout=8)
+                r = _limited_request({'name': provider, 'provider': provider, 'url': url, 'headers': {}, 'timeout': 8}, DIAGNOSTICS, 'GET')
                 status = r.status_code
                 ok = (status == 200)
             except Exception:
                 ok = False
         elif provider == 'DEEPSEEK':
-            url = "https://api.deepseek.com/models"
+            url = f"{base_url.rstrip('/')}/models"
             headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
             try:
-                r = requests.get(url, headers=headers, timeout=8)
+                r = _limited_request({'name': provider, 'provider': provider, 'url': url, 'headers': headers, 'timeout': 8}, DIAGNOSTICS, 'GET')
                 status = r.status_code
                 ok = (status == 200)
             except Exception:
@@ -1102,7 +1192,7 @@ def provider_connectivity():
             url = f"{base_url.rstrip('/')}/models"
             headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
             try:
-                r = requests.get(url, headers=headers, timeout=8)
+                r = _limited_request({'name': provider, 'provider': provider, 'url': url, 'headers': headers, 'timeout': 8}, DIAGNOSTICS, 'GET')
                 status = r.status_code
                 ok = (status == 200)
             except Exception:
@@ -1111,6 +1201,8 @@ def provider_connectivity():
             # For other providers, we'll skip the connectivity test
             ok = True  # Assume connectivity for other providers
             status = 0
+        if provider in providers.MODEL_FIELDS:
+            provider_health.record_probe(provider_health.key(provider, get_settings()), ok, f"connectivity status {status}")
         return success_response({"ok": ok, "status": status})
     except Exception as e:
         return error_response(f"Connectivity test error: {e}")
@@ -1127,7 +1219,7 @@ def provider_list_models():
         models = []
         if provider == 'OLLAMA':
             url = f"{(get_settings().get('ollama_url') or 'http://localhost:11434').rstrip('/')}/api/tags"
-            r = requests.get(url, timeout=10)
+            r = _limited_request({'name': provider, 'provider': provider, 'url': url, 'headers': {}, 'timeout': 10}, DIAGNOSTICS, 'GET')
             if r.status_code == 200:
                 j = r.json()
                 arr = j.get('models') or j.get('tags') or []
@@ -1137,9 +1229,9 @@ def provider_list_models():
                     if isinstance(mid, str):
                         models.append(mid)
         elif provider == 'DEEPSEEK':
-            url = "https://api.deepseek.com/models"
+            url = f"{base_url.rstrip('/')}/models"
             headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
-            r = requests.get(url, headers=headers, timeout=10)
+            r = _limited_request({'name': provider, 'provider': provider, 'url': url, 'headers': headers, 'timeout': 10}, DIAGNOSTICS, 'GET')
             if r.status_code == 200:
                 j = r.json()
                 arr = j.get('data') or []
@@ -1151,7 +1243,7 @@ def provider_list_models():
             url = f"{base_url.rstrip('/')}/models"
             headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
             try:
-                r = requests.get(url, headers=headers, timeout=10)
+                r = _limited_request({'name': provider, 'provider': provider, 'url': url, 'headers': headers, 'timeout': 10}, DIAGNOSTICS, 'GET')
                 if r.status_code == 200:
                     j = r.json()
                     arr = j.get('data') or []
@@ -1159,50 +1251,34 @@ def provider_list_models():
                         mid = m.get('id') or m.get('name')
                         if isinstance(mid, str):
                             models.append(mid)
-                    # 如果API返回了模型列表，更新配置文件
-                    if models:
-                        config_path = os.path.join(addon_dir, 'config.json')
-                        if os.path.exists(config_path):
-                            try:
-                                with open(config_path, 'r', encoding='utf-8') as f:
-                                    existing = json.load(f)
-                                if 'ai' not in existing: existing['ai'] = {}
-                                if 'bigmodel' not in existing['ai']: existing['ai']['bigmodel'] = {}
-                                existing['ai']['bigmodel']['models'] = models
-                                with open(config_path, 'w', encoding='utf-8') as f:
-                                    json.dump(existing, f, indent=4, ensure_ascii=False)
-                            except Exception as e:
-                                print(f"更新BigModel模型列表到配置文件失败: {e}")
                 else:
                     # 如果API调用失败，使用配置文件中的模型列表
-                    print(f"BigModel API返回错误: {r.status_code}, 使用配置文件中的模型列表")
+                    log.warning("BigModel 模型列表请求失败，使用配置文件中的模型列表", status=r.status_code)
                     cfg = _get_provider_config(provider)
                     models = cfg.get('models', [])
-            except Exception as e:
-                print(f"获取BigModel模型列表失败: {e}, 使用配置文件中的模型列表")
+            except Exception:
+                log.warning("获取 BigModel 模型列表出错，使用配置文件中的模型列表", exc_info=True)
                 cfg = _get_provider_config(provider)
                 models = cfg.get('models', [])
         else:
             # For other providers, return empty models list
             models = []
         # Update config file cache (optional)
+        # BigModel 的模型列表同时写回 ai.bigmodel.models，与 provider_configs 合并为一次写入
         try:
             if models:
-                config_path = os.path.join(addon_dir, 'config.json')
-                if os.path.exists(config_path):
-                    with open(config_path, 'r', encoding='utf-8') as f:
-                        existing = json.load(f)
-                else:
-                    existing = {}
-                if 'ai' not in existing: existing['ai'] = {}
-                if 'provider_configs' not in existing['ai']: existing['ai']['provider_configs'] = {}
-                pcfg = existing['ai']['provider_configs'].get(provider, {})
-                pcfg['models'] = models
-                existing['ai']['provider_configs'][provider] = pcfg
-                with open(config_path, 'w', encoding='utf-8') as f:
-                    json.dump(existing, f, indent=4, ensure_ascii=False)
+                def apply(existing):
+                    if 'ai' not in existing: existing['ai'] = {}
+                    if provider == 'BIGMODEL':
+                        if 'bigmodel' not in existing['ai']: existing['ai']['bigmodel'] = {}
+                        existing['ai']['bigmodel']['models'] = models
+                    if 'provider_configs' not in existing['ai']: existing['ai']['provider_configs'] = {}
+                    pcfg = existing['ai']['provider_configs'].get(provider, {})
+                    pcfg['models'] = models
+                    existing['ai']['provider_configs'][provider] = pcfg
+                config_store.update(apply, source='provider-list-models')
         except Exception:
-            pass
+            log.error("更新模型列表到配置文件失败", exc_info=True)
         return success_response({"models": models})
     except Exception as e:
         return error_response(f"List models error: {e}")
@@ -1228,6 +1304,7 @@ def test_thinking():
         if provider == 'DEEPSEEK':
             api_key = (settings.get('deepseek_api_key') or '').strip()
             headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {api_key}'} if api_key else {'Content-Type': 'application/json'}
+            url = f"{(settings.get('deepseek_url') or 'https://api.deepseek.com').strip().rstrip('/')}/chat/completions"
             body = {
                 'model': model,
                 'messages': [
@@ -1238,7 +1315,7 @@ def test_thinking():
                 'stream': False
             }
             try:
-                r = requests.post('https://api.deepseek.com/chat/completions', headers=headers, json=body, timeout=20)
+                r = _limited_request({'name': provider, 'provider': provider, 'url': url, 'headers': headers, 'json': body, 'timeout': 20}, DIAGNOSTICS)
                 if r.status_code == 200:
                     j = r.json()
                     ch = j.get('choices') or []
@@ -1269,7 +1346,7 @@ def test_thinking():
                 'stream': False
             }
             try:
-                r = requests.post(url, headers=headers, json=body, timeout=20)
+                r = _limited_request({'name': provider, 'provider': provider, 'url': url, 'headers': headers, 'json': body, 'timeout': 20}, DIAGNOSTICS)
                 supported = (r.status_code == 200)
             except Exception:
                 supported = False
@@ -1277,11 +1354,528 @@ def test_thinking():
     except Exception as e:
         return error_response(f"Thinking test error: {e}")
 
+# 各提供商累计的上下文缓存命中情况: provider -> {requests, prompt_tokens, cache_hit_tokens, cache_miss_tokens}
+prompt_cache_totals = {}
+_prompt_cache_lock = threading.Lock()
+
+def _record_prompt_cache_usage(provider, usage):
+    with _prompt_cache_lock:
+        totals = prompt_cache_totals.setdefault(provider, {'requests': 0, 'prompt_tokens': 0, 'cache_hit_tokens': 0, 'cache_miss_tokens': 0})
+        totals['requests'] += 1
+        for key in ('prompt_tokens', 'cache_hit_tokens', 'cache_miss_tokens'):
+            totals[key] += int(usage.get(key, 0) or 0)
+
+# 发送给模型的历史窗口（条数）与窗口前移的步长
+HISTORY_WINDOW = 16
+HISTORY_BLOCK = 8
+
+def _sse(payload):
+    return "data: " + json.dumps(payload) + "\n\n"
+
+class AnalyzeStream:
+    """
+    一次 /api/stream-analyze 生成过程的状态与 SSE 帧。
+    传输无关：同步生成器 (线程模式) 与 stream_gateway (异步模式) 按相同顺序调用：
+    start_frames -> provider_request -> handle_chunk* (上游空闲时 tick_frames) -> finish_frames -> summary_frames -> complete_frames
+    节点数据过大时 start_frames 之后 map_plan 非 None：先订阅 map 阶段（_run_map_phase，按 map_key 合并），
+    其 PROGRESS 事件同样交给 handle_chunk，结束后调用 reduce_frames 构造消息，再继续上面的流程。
+    cached_outputs() 非 None 时（回复缓存命中）用它代替 provider_request 的输出；
+    否则通过 single_flight 订阅上游，相同的并发请求共用一次生成。
+    会话按 request_id 登记在 active_requests 中，可通过 /api/cancel 取消；结束时须调用 release()。
+    """
+
+    def __init__(self, conversation_id, provider, settings, memory_cfg, final_question, node_content, node_context_active, system_prompt='', bypass_cache=False, question=None, route=None, request_id=None, trace=None):
+        self.conversation_id = conversation_id
+        self.request_id, self.cancel_scope = active_requests.register(request_id, conversation_id)
+        # 链路追踪：trace 为客户端传入的 {traceId, parentSpanId}，没有时开始新的 trace
+        trace = trace or {}
+        self.trace = tracer.start('stream-analyze', trace.get('traceId'), trace.get('parentSpanId'),
+                                  request_id=self.request_id, provider=provider,
+                                  model=providers.model_name(provider, settings))
+        self._map_span = None
+        # 线程模式下检测客户端断开（见 watch_client）
+        self.disconnect_watch = None
+        # 用户原始问题（未替换节点数据），用于近似重复索引
+        self.question = final_question if question is None else question
+        self.node_key = None
+        self.node_message = None
+        # map-reduce：节点数据过大时的分块计划与各分块的分析结果 {序号: (摘要, 错误)}
+        self.map_plan = None
+        self.map_results = {}
+        self.system_prompt = system_prompt or 'You are an expert in Blender nodes.'
+        self.usage = {}
+        self.provider = provider
+        self.settings = settings
+        self.memory_cfg = memory_cfg
+        self.final_question = final_question
+        self.node_content = node_content
+        self.node_context_active = node_context_active
+        self.full_response = ""
+        self.msgs = []
+        self.effective_messages = []
+        # 回复缓存：bypass_cache 时不读取缓存，但仍用新结果刷新缓存
+        self.bypass_cache = bypass_cache
+        self.cache_key = None
+        self.cached = None
+        self.outputs = []
+        self.failed = False
+        # 是否订阅了其他请求发起的同一生成
+        self.coalesced = False
+        # 对冲请求的胜出报告
+        self.hedge = None
+        # AUTO 路由的选择结果
+        self.route = route
+        # 调度优先级（interactive / summarization / diagnostics）
+        self.priority = normalize_priority(self.settings.get('priority'))
+        # 帧合并：settings['streaming'] 的 coalesce_ms / coalesce_chars
+        streaming = self.settings.get('streaming') or {}
+        try:
+            self.coalesce_interval = max(0.0, float(streaming.get('coalesce_ms', 30)) / 1000.0)
+            self.coalesce_chars = max(1, int(streaming.get('coalesce_chars', 256)))
+        except (TypeError, ValueError, AttributeError):
+            self.coalesce_interval, self.coalesce_chars = 0.03, 256
+        self._pending = []
+        self._pending_type = None
+        self._pending_chars = 0
+        self._pending_since = 0.0
+        self._first_sent = False
+        self._first_frame_at = None
+        # 是否以 error 帧结束（用于 ainode_stream_seconds 的 outcome）
+        self.errored = False
+
+    def start_frames(self):
+        with self.trace.child('prompt') as span:
+            frames = self._start_frames()
+            span.set(messages=len(self.effective_messages), cached=self.cached is not None)
+        if self.map_plan is not None:
+            self._map_span = self.trace.child('map', chunks=len(self.map_plan.chunks))
+        return frames
+
+    def _start_frames(self):
+        global current_conversation_id
+        conversation_id = self.conversation_id
+        frames = [_sse({'type': 'start', 'conversationId': conversation_id, 'requestId': self.request_id, 'traceId': self.trace.trace_id})]
+        current_conversation_id = conversation_id
+        if self.route:
+            frames.append(_sse({'type': 'route', 'conversationId': conversation_id, **self.route}))
+
+        # 构造发送消息，保持前缀在多轮之间不变，便于提供商的上下文缓存（如 DeepSeek 硬盘缓存）命中：
+        #   1. 固定的系统提示词
+        #   2. 节点数据（内容不变时前缀不变）
+        #   3. 对话历史（已并入摘要的部分不再发送；窗口按块前移）
+        #   4. 易变部分：对话摘要，放在最后一条用户消息之前
+        node_source = self.node_content or conversation_cache.node_context(conversation_id)
+        if node_source:
+            node_text = canonical_node_data(node_source)
+            self.node_key = conversation_cache.nodes.key(node_text)
+            self.node_message = {'role': 'system', 'content': f'Current Blender Node Data:\n{node_text}'}
+            # 节点数据超出上下文预算时先分块分析 (map)，reduce_frames 中再构造消息
+            self.map_plan = self._map_plan(node_text)
+            if self.map_plan is not None:
+                frames.append(_sse({'type': 'map_reduce', 'stage': 'partition', 'conversationId': conversation_id, 'chunks': len(self.map_plan.chunks), 'nodes': self.map_plan.total_nodes, 'crossLinks': len(self.map_plan.cross_links)}))
+                return frames
+        return frames + self._context_frames()
+
+    def _context_frames(self):
+        conversation_id = self.conversation_id
+        frames = []
+        msgs = conversation_cache.messages(conversation_id)
+        self.msgs = msgs
+        effective_messages = [{'role': 'system', 'content': self.system_prompt}]
+        node_key = self.node_key
+        if self.node_message is not None:
+            effective_messages.append(self.node_message)
+
+        # 历史中嵌入的同一份节点数据用占位文本代替，节点数据只在前缀中出现一次
+        history_msgs = conversation_cache.messages(conversation_id, collapse_node=node_key, placeholder='(见系统消息 Current Blender Node Data)') if node_key else msgs
+        summary, summary_upto = conversation_cache.get_summary_state(conversation_id)
+        history = [m for m in history_msgs[summary_upto:] if m.get('role') in ('user', 'assistant')]
+        if len(history) > HISTORY_WINDOW:
+            # 按 HISTORY_BLOCK 条为单位丢弃最早的消息，窗口起点在多轮之间保持不变
+            drop = len(history) - HISTORY_WINDOW
+            drop = ((drop + HISTORY_BLOCK - 1) // HISTORY_BLOCK) * HISTORY_BLOCK
+            history = history[drop:]
+        if summary:
+            summary_msg = {'role': 'system', 'content': f'Conversation Memory Summary:\n{summary}'}
+            if history and history[-1].get('role') == 'user':
+                history = history[:-1] + [summary_msg, history[-1]]
+            else:
+                history = history + [summary_msg]
+        effective_messages.extend(history)
+        self.effective_messages = effective_messages
+        ctx_tokens = _estimate_messages_tokens(effective_messages)
+        st = {'sent_tokens': 0, 'recv_tokens': 0, 'context_tokens': ctx_tokens}
+        # 保留累计的上下文缓存统计
+        previous = conversation_cache.get_stats(conversation_id)
+        for key in ('total_cache_hit_tokens', 'total_cache_miss_tokens'):
+            if key in previous:
+                st[key] = previous[key]
+        conversation_cache.set_stats(conversation_id, st)
+        try:
+            tk = int(self.memory_cfg.get('target_k', 4))
+        except Exception:
+            tk = 4
+        threshold = tk * 1024
+        if ctx_tokens >= int(0.8 * threshold) and ctx_tokens < threshold:
+            frames.append(_sse({'type': 'compression_pending', 'conversationId': conversation_id, 'context_tokens': ctx_tokens, 'target_tokens': threshold}))
+        frames.append(_sse({'type': 'stats', 'conversationId': conversation_id, 'context_tokens': ctx_tokens, 'sent_tokens': st.get('sent_tokens', 0), 'recv_tokens': st.get('recv_tokens', 0)}))
+
+        # 同一个键既用于回复缓存，也用于合并并发的相同请求
+        self.cache_key = response_cache_key(self.provider, self.settings, effective_messages)
+        if response_cache.enabled and not self.bypass_cache:
+            self.cached = response_cache.get(self.cache_key)
+        return frames
+
+    # ---------- map-reduce ----------
+
+    def map_upstream(self, scope=None):
+        """map 阶段的同步上游；两种传输都在后台线程中运行它（Flight.start_thread）"""
+        return _run_map_phase(self, scope)
+
+    def _map_plan(self, node_text):
+        cfg = self.settings.get('map_reduce') or {}
+        if not isinstance(cfg, dict) or not cfg.get('enabled', True):
+            return None
+        try:
+            threshold = int(cfg.get('threshold_chars', 30000))
+            chunk_chars = int(cfg.get('chunk_chars', 12000))
+            max_chunks = int(cfg.get('max_chunks', 16))
+        except (TypeError, ValueError):
+            threshold, chunk_chars, max_chunks = 30000, 12000, 16
+        if len(node_text) <= threshold:
+            return None
+        return map_reduce.partition(node_text, chunk_chars, max_chunks)
+
+    def map_key(self):
+        """map 阶段的 single_flight 键：相同问题、相同节点数据的并发请求共用一次分块分析"""
+        return 'map:' + response_cache_key(self.provider, self.settings, [
+            {'role': 'system', 'content': self.node_key or ''},
+            {'role': 'user', 'content': self.question},
+        ])
+
+    def map_messages(self, chunk):
+        """一个分块的分析请求：系统提示词 + 分块节点数据 + 针对问题的分析要求"""
+        cfg = self.settings.get('map_reduce') or {}
+        total = len(self.map_plan.chunks)
+        question = self.question.replace('{{Current Node Data}}', '').replace('Current Node Data', '').strip()
+        return [
+            {'role': 'system', 'content': self.system_prompt},
+            {'role': 'system', 'content': f'Current Blender Node Data (part {chunk.index + 1}/{total} of a larger node tree):\n{chunk.to_text(total)}'},
+            {'role': 'user', 'content': (
+                f"这是一个过大而被拆分的节点树的第 {chunk.index + 1}/{total} 部分（{chunk.label}）。"
+                "请围绕下面的问题分析这一部分：概括它的功能与数据流，列出关键节点和与问题相关的发现，"
+                "并说明它通过 external_links 与其他部分交换了什么数据。只输出要点，"
+                f"不超过 {cfg.get('summary_chars', 800)} 字。\n\n问题：{question}"
+            )},
+        ]
+
+    def map_settings(self):
+        """分块分析不需要思考过程和联网搜索"""
+        settings = dict(self.settings)
+        settings['thinking_enabled'] = False
+        settings['web_search_enabled'] = False
+        return settings
+
+    def _map_progress(self, data):
+        data = data or {}
+        self.map_results[data.get('index')] = (data.get('summary') or '', data.get('error') or '')
+        frame = {
+            'type': 'map_reduce', 'stage': 'map', 'conversationId': self.conversation_id,
+            'done': len(self.map_results), 'total': data.get('total', len(self.map_plan.chunks)),
+            'part': data.get('label', ''),
+        }
+        if data.get('error'):
+            frame['error'] = data['error']
+        return [_sse(frame)]
+
+    def reduce_frames(self):
+        """map 阶段结束：用各分块的分析结果与跨分块连线代替原始节点数据，继续常规的生成 (reduce)"""
+        if not any(summary.strip() for summary, _ in self.map_results.values()):
+            errors = [error for _, error in self.map_results.values() if error]
+            raise RuntimeError(f"分块分析全部失败: {errors[0] if errors else '没有结果'}")
+        overview = self.map_plan.overview(self.map_results)
+        if self._map_span is not None:
+            self._map_span.end(failed=sum(1 for _, error in self.map_results.values() if error))
+        self.node_message = {'role': 'system', 'content': f'Current Blender Node Data:\n{overview}'}
+        frame = {'type': 'map_reduce', 'stage': 'reduce', 'conversationId': self.conversation_id,
+                 'done': len(self.map_results), 'total': len(self.map_plan.chunks),
+                 'failed': sum(1 for _, error in self.map_results.values() if error)}
+        return [_sse(frame)] + self._context_frames()
+
+    def cached_outputs(self):
+        """回复缓存命中时返回缓存的提供商输出序列，否则返回 None"""
+        return self.cached
+
+    def provider_request(self):
+        """返回 (spec, error)，由调用方选择同步或异步传输"""
+        return providers.build_request(self.provider, self.effective_messages, self.settings)
+
+    def provider_requests(self):
+        """
+        返回 (requests, names, delay)：requests 为 [(spec, error), ...]。
+        settings['hedging'] 启用且备用提供商/模型与主提供商不同时追加备用请求，delay 秒内主请求没有首个 token 则启动备用请求。
+        """
+        primary = self.provider_request()
+        names = [f"{self.provider}/{providers.model_name(self.provider, self.settings)}"]
+        hedge_cfg = self.settings.get('hedging') or {}
+        if not isinstance(hedge_cfg, dict) or not hedge_cfg.get('enabled'):
+            return [primary], names, 0.0
+        secondary_provider = str(hedge_cfg.get('provider') or 'OLLAMA').upper()
+        secondary_settings = providers.with_model(secondary_provider, self.settings, hedge_cfg.get('model'))
+        secondary_name = f"{secondary_provider}/{providers.model_name(secondary_provider, secondary_settings)}"
+        if secondary_name == names[0]:
+            return [primary], names, 0.0
+        try:
+            delay = max(0.0, float(hedge_cfg.get('delay_ms', 3000)) / 1000.0)
+        except (TypeError, ValueError):
+            delay = 3.0
+        secondary = providers.build_request(secondary_provider, self.effective_messages, secondary_settings)
+        return [primary, secondary], names + [secondary_name], delay
+
+    def handle_chunk(self, event):
+        """把一条 StreamEvent 转为 SSE 帧；正文与思考内容按时间/字数合并后再写出"""
+        try:
+            if not isinstance(event, StreamEvent):
+                event = StreamEvent.from_legacy(event)
+            kind = event.kind
+            if kind == stream_events.PROGRESS:
+                return self._map_progress(event.data)
+            if kind == stream_events.USAGE:
+                # 提供商返回的用量（含上下文缓存命中/未命中 token 数），在 finish_frames 中汇总
+                self.usage = event.data or {}
+                return []
+            if kind == stream_events.HEDGE:
+                # 对冲请求的胜出方与各自的首 token 时间
+                self.hedge = dict(event.data or {})
+                return self.flush_frames() + [_sse({'type': 'hedge', 'conversationId': self.conversation_id, **self.hedge})]
+            if kind == stream_events.WEB_SEARCH:
+                self.outputs.append(event)
+                return self.flush_frames() + [_sse({'type': 'web_search', 'content': event.content})]
+            if kind == stream_events.THINKING:
+                self.outputs.append(event)
+                return self._coalesce('thinking', event.content)
+            if kind == stream_events.ERROR:
+                # 与正文一样显示，但本次生成不写入回复缓存
+                self.failed = True
+            else:
+                self.outputs.append(event)
+            self.full_response += event.content
+            return self._coalesce('chunk', event.content)
+        except Exception as e:
+            log.warning("处理流式片段出错", error=str(e))
+            return []
+
+    def _coalesce(self, frame_type, text):
+        """
+        合并连续的同类文本：第一个 token 立即发送，之后满 coalesce_ms 或 coalesce_chars 才写出一帧，
+        减少客户端（以及 Blender 的 text_block.write 循环）需要处理的帧数。
+        """
+        if not text:
+            return []
+        frames = self.flush_frames() if self._pending_type not in (None, frame_type) else []
+        now = time.time()
+        if not self._pending:
+            self._pending_since = now
+        self._pending_type = frame_type
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if (not self._first_sent or self.coalesce_interval <= 0 or self._pending_chars >= self.coalesce_chars
+                or now - self._pending_since >= self.coalesce_interval):
+            self._first_sent = True
+            frames.extend(self.flush_frames())
+        return frames
+
+    def flush_frames(self):
+        """立即写出合并中的文本"""
+        if not self._pending:
+            return []
+        if self._first_frame_at is None:
+            self._first_frame_at = time.time()
+        frame = _sse({'type': self._pending_type, 'content': ''.join(self._pending)})
+        self._pending = []
+        self._pending_chars = 0
+        self._pending_type = None
+        return [frame]
+
+    def tick_frames(self):
+        """上游暂时没有新输出时调用：合并中的文本已到时间则写出"""
+        if self._pending and time.time() - self._pending_since >= self.coalesce_interval:
+            return self.flush_frames()
+        return []
+
+    def tick_interval(self):
+        """传输层等待上游时的唤醒间隔（秒），不合并时返回 None"""
+        return self.coalesce_interval if self.coalesce_interval > 0 else None
+
+    def watch_client(self, sock):
+        """线程模式：等待上游期间定期检查客户端连接，断开后取消本次请求"""
+        self.disconnect_watch = DisconnectWatch(sock) if sock is not None else None
+
+    def cancel(self, reason='cancelled'):
+        if self.cancel_scope.cancel(reason) and reason == 'disconnected':
+            active_requests.record_disconnect()
+
+    def interrupted(self):
+        """服务器正在关闭、请求被取消或客户端已断开时，流应尽快收尾"""
+        if self.disconnect_watch is not None and self.disconnect_watch.check():
+            self.cancel('disconnected')
+        return self.cancel_scope.cancelled or server_manager.is_draining()
+
+    def interrupt_frames(self):
+        if self.cancel_scope.reason == 'disconnected':
+            return []
+        if self.cancel_scope.cancelled:
+            return self.flush_frames() + [
+                _sse({'type': 'cancelled', 'message': '请求已取消', 'conversationId': self.conversation_id, 'requestId': self.request_id}),
+                "data: [DONE]\n\n"
+            ]
+        return self.flush_frames() + [
+            _sse({'type': 'error', 'message': '服务器正在关闭，回答已中断', 'conversationId': self.conversation_id}),
+            "data: [DONE]\n\n"
+        ]
+
+    def release(self):
+        """请求结束（完成、取消或出错）后从 active_requests 注销，并结束会话的 span"""
+        active_requests.unregister(self.request_id, self.cancel_scope)
+        if self._map_span is not None:
+            self._map_span.end()
+        attrs = {'chars': len(self.full_response), 'coalesced': self.coalesced, 'cached': self.cached is not None}
+        if self._first_frame_at is not None:
+            attrs['first_frame'] = round(self._first_frame_at - self.trace.start, 6)
+        if self.errored:
+            attrs['error'] = True
+        elif self.cancel_scope.cancelled:
+            attrs['cancelled'] = self.cancel_scope.reason
+        self.trace.end(**attrs)
+
+    def finish_frames(self):
+        conversation_id = self.conversation_id
+        frames = self.flush_frames()
+        # 对冲请求由备用提供商胜出时，回复与用量都属于备用提供商
+        winner = (self.hedge or {}).get('winner')
+        hedge_won = bool(winner) and winner != f"{self.provider}/{providers.model_name(self.provider, self.settings)}"
+        served_by = winner.split('/', 1)[0] if hedge_won else self.provider
+        # Save assistant response to history
+        conversation_cache.append(conversation_id, 'assistant', self.full_response)
+        turn_sent = _estimate_tokens(self.final_question)
+        turn_recv = _estimate_tokens(self.full_response)
+        previous = conversation_cache.get_stats(conversation_id)
+        st = {'sent_tokens': turn_sent, 'recv_tokens': turn_recv, 'context_tokens': previous.get('context_tokens', 0)}
+        if self.usage:
+            hit = self.usage.get('cache_hit_tokens', 0)
+            miss = self.usage.get('cache_miss_tokens', 0)
+            st.update({
+                'prompt_tokens': self.usage.get('prompt_tokens', 0),
+                'completion_tokens': self.usage.get('completion_tokens', 0),
+                'cache_hit_tokens': hit,
+                'cache_miss_tokens': miss,
+                'total_cache_hit_tokens': previous.get('total_cache_hit_tokens', 0) + hit,
+                'total_cache_miss_tokens': previous.get('total_cache_miss_tokens', 0) + miss,
+            })
+            if not self.coalesced:
+                # 合并的请求共用一份用量，只由发起者计入全局统计
+                _record_prompt_cache_usage(served_by, self.usage)
+        conversation_cache.set_stats(conversation_id, st)
+        # 缓存键按主提供商/模型计算：备用提供商的回复不写入，避免之后对主模型的相同请求回放其他模型的回答
+        if self.cached is None and not self.coalesced and not self.failed and not hedge_won and self.full_response.strip():
+            response_cache.put(self.cache_key, self.outputs, meta={'provider': self.provider})
+            near_duplicates.add(self.question, self.node_key, self.full_response, conversation_id)
+        frame = {'type': 'stats', 'conversationId': conversation_id, 'context_tokens': st.get('context_tokens', 0), 'sent_tokens': st.get('sent_tokens', 0), 'recv_tokens': st.get('recv_tokens', 0)}
+        if self.usage:
+            frame.update({k: st[k] for k in ('prompt_tokens', 'completion_tokens', 'cache_hit_tokens', 'cache_miss_tokens')})
+        if self.cached is not None:
+            frame['response_cached'] = True
+        if self.coalesced:
+            frame['coalesced'] = True
+        if self.hedge:
+            frame['hedge'] = self.hedge
+        return frames + [_sse(frame)]
+
+    def needs_summary(self):
+        try:
+            if bool(self.memory_cfg.get('enabled', True)):
+                target_k = int(self.memory_cfg.get('target_k', 4))
+                st = conversation_cache.get_stats(self.conversation_id)
+                return st.get('context_tokens', 0) > target_k * 1024
+        except Exception:
+            pass
+        return False
+
+    def summarize(self):
+        """
+        滚动摘要（在后台摘要线程中执行）：只把上次摘要之后的新消息并入已有摘要，
+        单步输入长度有上限；超出部分由下一步继续并入。
+        """
+        conversation_id = self.conversation_id
+        msgs = conversation_cache.messages(conversation_id) or self.msgs
+        previous, upto = conversation_cache.get_summary_state(conversation_id)
+        try:
+            max_chars = int(self.memory_cfg.get('summary_input_chars', 6000))
+        except Exception:
+            max_chars = 6000
+        parts, new_upto = _select_summary_input(msgs, upto, max_chars=max_chars, per_message_chars=max(200, max_chars // 3))
+        if not parts:
+            return previous
+        summary = _summarize(previous[:max_chars], parts, self.settings)
+        if summary:
+            conversation_cache.set_summary(conversation_id, summary, new_upto)
+            if new_upto < len(msgs):
+                # 还有未并入的消息，排队继续
+                summary_jobs.submit(conversation_id, self.summarize)
+        return summary
+
+    def summary_frames(self):
+        """需要压缩时把摘要任务放入后台队列，不等待结果"""
+        if not self.needs_summary():
+            return []
+        summary_jobs.submit(self.conversation_id, self.summarize)
+        return [_sse({'type': 'compression_queued', 'conversationId': self.conversation_id})]
+
+    def complete_frames(self):
+        return [
+            _sse({'type': 'complete', 'conversationId': self.conversation_id}),
+            "data: [DONE]\n\n"
+        ]
+
+    def error_frame(self, e):
+        self.errored = True
+        return _sse({'type': 'error', 'message': str(e), 'conversationId': self.conversation_id})
+
+def _latest_system_prompt(settings):
+    """每次调用时重新获取最新的系统提示词：优先使用 Blender 设置快照，没有则从配置文件获取"""
+    latest_system_prompt = settings_snapshot.current().get('system_prompt')
+    if not latest_system_prompt:
+        try:
+            latest_system_prompt = config_store.get('ai', 'system_prompt', default='You are an expert in Blender nodes.')
+        except Exception:
+            log.error("从配置文件读取系统提示词出错", exc_info=True)
+            latest_system_prompt = 'You are an expert in Blender nodes.'
+    return latest_system_prompt if latest_system_prompt else settings.get('system_prompt', 'You are an expert in Blender nodes.')
+
+def _metered_stream(session, frames):
+    """线程模式下统计写出的 SSE 帧数、字节数与整段流的耗时"""
+    started = time.perf_counter()
+    outcome = 'disconnected'
+    try:
+        for frame in frames:
+            metrics.sse_frames.inc('thread')
+            # _sse 输出的 JSON 为 ASCII，字符数即字节数
+            metrics.sse_bytes.inc('thread', amount=len(frame))
+            yield frame
+        if session.errored:
+            outcome = 'error'
+        elif session.cancel_scope.cancelled or server_manager.is_draining():
+            outcome = 'interrupted'
+        else:
+            outcome = 'ok'
+    finally:
+        metrics.stream_seconds.observe(time.perf_counter() - started, 'thread', outcome)
+
 @app.route('/api/stream-analyze', methods=['POST'])
 def stream_analyze():
     payload = request.get_json(force=True) or {}
     question = payload.get('question', '')
-    node_content = payload.get('content', '')
+    node_content = canonical_node_data(payload.get('content', ''))
     conversation_id = payload.get('conversationId')
     req_provider = payload.get('ai_provider')
     req_model = payload.get('ai_model')
@@ -1316,51 +1910,20 @@ def stream_analyze():
         else:
             settings['generic_model'] = req_model
     provider = settings.get('ai_provider', 'DEEPSEEK')
+    # AUTO：按提供商健康度选择未熔断且得分最好的提供商
+    route = None
+    if str(provider).upper() == AUTO_PROVIDER:
+        provider, reason = provider_health.choose(settings)
+        settings['ai_provider'] = provider
+        route = {'provider': provider, 'model': providers.model_name(provider, settings), 'reason': reason}
     
-    # 每次调用时重新获取最新的系统提示词（从Blender设置或配置文件）
-    # 优先从Blender设置获取，如果没有则从配置文件获取
-    latest_system_prompt = None
-    try:
-        # 尝试从Blender设置获取
-        import bpy
-        scene = None
-        if hasattr(bpy, 'context') and hasattr(bpy.context, 'scene'):
-            scene = bpy.context.scene
-        elif hasattr(bpy, 'data') and hasattr(bpy.data, 'scenes') and len(bpy.data.scenes) > 0:
-            scene = bpy.data.scenes[0]
-        
-        if scene and hasattr(scene, 'ainode_analyzer_settings'):
-            ain_settings = scene.ainode_analyzer_settings
-            latest_system_prompt = ain_settings.system_prompt
-    except Exception as e:
-        print(f"Error getting system prompt from Blender settings: {e}")
-    
-    # 如果Blender设置中没有，从配置文件获取
-    if not latest_system_prompt:
-        try:
-            config_path = os.path.join(addon_dir, 'config.json')
-            if os.path.exists(config_path):
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    cfg = json.load(f)
-                    ai = cfg.get('ai', {})
-                    latest_system_prompt = ai.get('system_prompt', 'You are an expert in Blender nodes.')
-        except Exception as e:
-            print(f"Error getting system prompt from config file: {e}")
-            latest_system_prompt = 'You are an expert in Blender nodes.'
-    
-    # 使用最新的系统提示词
-    system_prompt = latest_system_prompt if latest_system_prompt else settings.get('system_prompt', 'You are an expert in Blender nodes.')
-    
+    system_prompt = _latest_system_prompt(settings)
+
     memory_cfg = {}
     try:
-        config_path = os.path.join(addon_dir, 'config.json')
-        if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                cfg = json.load(f)
-                ai = cfg.get('ai', {})
-                memory = ai.get('memory', {})
-                if isinstance(memory, dict):
-                    memory_cfg = memory
+        memory = config_store.get('ai', 'memory', default={})
+        if isinstance(memory, dict):
+            memory_cfg = memory
     except Exception:
         memory_cfg = {}
 
@@ -1368,35 +1931,43 @@ def stream_analyze():
     if not conversation_id:
         conversation_id = str(uuid.uuid4())
     
-    if conversation_id not in conversations:
-        conversations[conversation_id] = []
-        # 如果是新对话，添加系统提示和初始节点上下文
-        if node_content:
-            context_msg = f"Current Blender Node Data:\n{node_content}\n\nPlease analyze this when asked."
-            conversations[conversation_id].append({'role': 'system', 'content': f"{system_prompt}\n\n{context_msg}"})
-        else:
-            conversations[conversation_id].append({'role': 'system', 'content': system_prompt})
+    # 系统提示 + 初始节点上下文；节点数据在缓存中按内容哈希只保存一份
+    if node_content:
+        context_msg = f"Current Blender Node Data:\n{node_content}\n\nPlease analyze this when asked."
+        system_content = f"{system_prompt}\n\n{context_msg}"
     else:
-        # 如果是对话已存在，更新系统提示词（确保使用最新的系统提示词）
-        # 找到第一条系统消息并更新它
-        for i, msg in enumerate(conversations[conversation_id]):
-            if msg.get('role') == 'system':
-                # 如果有节点内容，保留节点上下文
-                if node_content:
-                    context_msg = f"Current Blender Node Data:\n{node_content}\n\nPlease analyze this when asked."
-                    conversations[conversation_id][i] = {'role': 'system', 'content': f"{system_prompt}\n\n{context_msg}"}
-                else:
-                    conversations[conversation_id][i] = {'role': 'system', 'content': system_prompt}
-                break
+        system_content = system_prompt
+    if not conversation_cache.contains(conversation_id):
+        conversation_cache.create(conversation_id)
+        conversation_cache.append(conversation_id, 'system', system_content, node_text=node_content)
+    else:
+        # 如果是对话已存在，更新第一条系统消息（确保使用最新的系统提示词）
+        conversation_cache.replace_system(conversation_id, system_content, node_text=node_content)
+
+    # map-reduce：ai.map_reduce 配置，可被请求体 ai.map_reduce 覆盖
+    map_cfg = config_store.get('ai', 'map_reduce', default={})
+    map_cfg = dict(map_cfg) if isinstance(map_cfg, dict) else {}
+    if isinstance(req_ai, dict) and isinstance(req_ai.get('map_reduce'), dict):
+        map_cfg.update(req_ai['map_reduce'])
+    settings['map_reduce'] = map_cfg
+    # 节点数据将按 map-reduce 分块分析时不再内联到问题中（否则问题本身就超出上下文）
+    try:
+        oversized = bool(node_content) and map_cfg.get('enabled', True) and len(node_content) > int(map_cfg.get('threshold_chars', 30000))
+    except (TypeError, ValueError):
+        oversized = False
 
     # 添加用户消息
     # Check for {{Current Node Data}} variable and replace it with actual content
     final_question = question
+    if oversized:
+        for variable in ("{{Current Node Data}}", "Current Node Data"):
+            final_question = final_question.replace(variable, "(见系统消息 Current Blender Node Data)")
+    cleaned_content = None
     # Priority 1: Check for explicit variable with braces
     if "{{Current Node Data}}" in final_question:
         if node_content:
-            # Clean metadata first
-            cleaned_content = clean_node_data(node_content)
+            # 与系统消息使用同一形式，对话缓存中只保存一份
+            cleaned_content = node_content
             # Replace with explicit XML-like tag block for clear separation
             replacement = f"\n<Node Data>\n{cleaned_content}\n</Node Data>\n"
             final_question = final_question.replace("{{Current Node Data}}", replacement)
@@ -1405,134 +1976,448 @@ def stream_analyze():
     # Priority 2: Check for variable name without braces (common user case)
     elif "Current Node Data" in final_question:
         if node_content:
-            cleaned_content = clean_node_data(node_content)
+            cleaned_content = node_content
             replacement = f"\n<Node Data>\n{cleaned_content}\n</Node Data>\n"
             final_question = final_question.replace("Current Node Data", replacement)
         else:
             final_question = final_question.replace("Current Node Data", "[No Node Data Available]")
 
-    conversations[conversation_id].append({'role': 'user', 'content': final_question})
+    conversation_cache.append(conversation_id, 'user', final_question, node_text=cleaned_content)
+
+    # 对冲请求：ai.hedging 配置，可被请求体 ai.hedging 覆盖
+    hedge_cfg = config_store.get('ai', 'hedging', default={})
+    hedge_cfg = dict(hedge_cfg) if isinstance(hedge_cfg, dict) else {}
+    if isinstance(req_ai, dict) and isinstance(req_ai.get('hedging'), dict):
+        hedge_cfg.update(req_ai['hedging'])
+    settings['hedging'] = hedge_cfg
+
+    # 帧合并：ai.streaming 配置，可被请求体 ai.streaming 覆盖
+    streaming_cfg = config_store.get('ai', 'streaming', default={})
+    streaming_cfg = dict(streaming_cfg) if isinstance(streaming_cfg, dict) else {}
+    if isinstance(req_ai, dict) and isinstance(req_ai.get('streaming'), dict):
+        streaming_cfg.update(req_ai['streaming'])
+    settings['streaming'] = streaming_cfg
+    # 调度优先级：请求体 priority，默认 interactive
+    settings['priority'] = normalize_priority(payload.get('priority'))
+
+    # 跳过回复缓存：请求体 noCache: true 或 ai.cache.enabled: false
+    bypass_cache = bool(payload.get('noCache'))
+    if isinstance(req_ai, dict) and isinstance(req_ai.get('cache'), dict) and req_ai['cache'].get('enabled') is False:
+        bypass_cache = True
+
+    trace = {'traceId': payload.get('traceId'), 'parentSpanId': payload.get('parentSpanId')} if payload.get('traceId') else None
+    session = AnalyzeStream(conversation_id, provider, settings, memory_cfg, final_question, node_content, node_context_active, system_prompt, bypass_cache, question, route, payload.get('requestId'), trace)
+
+    # 优先交给异步流式网关：当前工作线程立即返回，连接由事件循环继续写出
+    detach = request.environ.get('ainode.detach')
+    if detach and stream_gateway.accepting():
+        detach(lambda sock: stream_gateway.submit(sock, session))
+        return Response('', mimetype='text/event-stream')
+
+    session.watch_client(request.environ.get('werkzeug.socket'))
+
+    def follow(key, upstream, main=True):
+        """订阅 key 对应的共享生成（没有时启动 upstream）并输出帧；被中断时返回 True"""
+        flight, leader = single_flight.join(key, lambda f: f.start_thread(upstream, session, f.scope))
+        if main:
+            session.coalesced = not leader
+        # 取消时唤醒订阅循环，不必等到下一条输出
+        wake = session.cancel_scope.add(flight.wake)
+        try:
+            for event in flight.iter_sync(tick=session.tick_interval()):
+                if session.interrupted():
+                    yield from session.interrupt_frames()
+                    return True
+                for frame in (session.tick_frames() if event is None else session.handle_chunk(event)):
+                    yield frame
+        finally:
+            # 客户端断开时生成器被关闭，同样在这里退订；最后一个订阅者离开时取消上游
+            session.cancel_scope.remove(wake)
+            single_flight.leave(flight)
+        return False
 
     def generate():
-        full_response = ""
         try:
-            yield "data: " + json.dumps({'type': 'start', 'conversationId': conversation_id}) + "\n\n"
-            global current_conversation_id
-            current_conversation_id = conversation_id
-            
-            generator = None
-            # 构造发送消息：保留系统消息 + 最近若干轮，避免上下文过长
-            msgs = conversations[conversation_id]
-            if msgs and msgs[0].get('role') == 'system':
-                base = [msgs[0]]
-                tail = msgs[1:][-16:]
-                effective_messages = base + tail
-            else:
-                effective_messages = msgs[-16:]
-            mem = conversation_memory.get(conversation_id, '')
-            if mem:
-                effective_messages = [effective_messages[0], {'role': 'system', 'content': f'Conversation Memory Summary:\n{mem}'}] + effective_messages[1:]
-            if node_context_active and node_content:
-                try:
-                    cleaned_content = clean_node_data(node_content)
-                except Exception:
-                    cleaned_content = node_content
-                nd_msg = {'role': 'system', 'content': f'Current Blender Node Data:\n{cleaned_content}'}
-                if effective_messages and effective_messages[0].get('role') == 'system':
-                    effective_messages = [effective_messages[0], nd_msg] + effective_messages[1:]
-                else:
-                    effective_messages = [nd_msg] + effective_messages
-            ctx_tokens = _estimate_messages_tokens(effective_messages)
-            st = {'sent_tokens': 0, 'recv_tokens': 0, 'context_tokens': ctx_tokens}
-            conversation_stats[conversation_id] = st
-            try:
-                tk = int(memory_cfg.get('target_k', 4))
-            except Exception:
-                tk = 4
-            threshold = tk * 1024
-            if ctx_tokens >= int(0.8 * threshold) and ctx_tokens < threshold:
-                yield "data: " + json.dumps({'type': 'compression_pending', 'conversationId': conversation_id, 'context_tokens': ctx_tokens, 'target_tokens': threshold}) + "\n\n"
-            yield "data: " + json.dumps({'type': 'stats', 'conversationId': conversation_id, 'context_tokens': ctx_tokens, 'sent_tokens': st.get('sent_tokens', 0), 'recv_tokens': st.get('recv_tokens', 0)}) + "\n\n"
-            if provider == 'OLLAMA':
-                generator = _call_ollama(effective_messages, settings)
-            elif provider == 'DEEPSEEK':
-                generator = _call_deepseek(effective_messages, settings)
-            elif provider == 'BIGMODEL':
-                generator = _call_bigmodel(effective_messages, settings)
+            for frame in session.start_frames():
+                yield frame
+            if session.map_plan is not None:
+                if (yield from follow(session.map_key(), _run_map_phase, main=False)):
+                    return
+                for frame in session.reduce_frames():
+                    yield frame
+            cached = session.cached_outputs()
+            if cached is not None:
+                for chunk in cached:
+                    yield from session.handle_chunk(chunk)
             else:
-                # For unsupported providers, return an error message
-                def unsupported_provider_generator():
-                    yield f"Error: 不支持的AI提供商 {provider}。当前仅支持 DeepSeek、Ollama 和 BigModel。"
-                generator = unsupported_provider_generator()
-            
-            for chunk in generator:
-                try:
-                    # Try to parse as JSON first (for DeepSeek wrapper)
-                    try:
-                        j = json.loads(chunk)
-                        kind = j.get('kind')
-                        content = j.get('content') or ''
-                        
-                        if kind == 'thinking':
-                            yield "data: " + json.dumps({'type': 'thinking', 'content': content}) + "\n\n"
-                        elif kind == 'chunk':
-                            full_response += content
-                            yield "data: " + json.dumps({'type': 'chunk', 'content': content}) + "\n\n"
-                        else:
-                            # Not our wrapper format, maybe direct JSON? treat as string
-                            raise ValueError("Unknown kind")
-                    except (json.JSONDecodeError, ValueError, TypeError):
-                        # If parsing fails or structure doesn't match, treat as raw string (for Ollama or errors)
-                        s_chunk = str(chunk)
-                        full_response += s_chunk
-                        yield "data: " + json.dumps({'type': 'chunk', 'content': s_chunk}) + "\n\n"
-                except Exception as e:
-                    print(f"Error processing chunk: {e}")
+                if (yield from follow(session.cache_key, _open_upstream)):
+                    return
+            for frame in session.finish_frames():
+                yield frame
+            for frame in session.summary_frames():
+                yield frame
+            for frame in session.complete_frames():
+                yield frame
+        except Exception as e:
+            yield session.error_frame(e)
 
-            
-            # Save assistant response to history
-            conversations[conversation_id].append({'role': 'assistant', 'content': full_response})
-            turn_sent = _estimate_tokens(final_question)
-            turn_recv = _estimate_tokens(full_response)
-            st = {'sent_tokens': turn_sent, 'recv_tokens': turn_recv, 'context_tokens': conversation_stats.get(conversation_id, {}).get('context_tokens', 0)}
-            conversation_stats[conversation_id] = st
-            yield "data: " + json.dumps({'type': 'stats', 'conversationId': conversation_id, 'context_tokens': st.get('context_tokens', 0), 'sent_tokens': st.get('sent_tokens', 0), 'recv_tokens': st.get('recv_tokens', 0)}) + "\n\n"
-            try:
-                if bool(memory_cfg.get('enabled', True)):
-                    target_k = int(memory_cfg.get('target_k', 4))
-                    if st.get('context_tokens', 0) > target_k * 1024:
-                        yield "data: " + json.dumps({'type': 'compression_start', 'conversationId': conversation_id}) + "\n\n"
-                        summary = _summarize(msgs, settings)
-                        if summary:
-                            conversation_memory[conversation_id] = summary
-                            yield "data: " + json.dumps({'type': 'compression_end', 'conversationId': conversation_id, 'summary_tokens': _estimate_tokens(summary)}) + "\n\n"
-            except Exception:
-                pass
+    response = Response(stream_with_context(_metered_stream(session, generate())), mimetype='text/event-stream')
+    # 客户端在第一帧之前断开时生成器不会运行，注销放在响应关闭时
+    response.call_on_close(session.release)
+    return response
 
-            yield "data: " + json.dumps({'type': 'complete', 'conversationId': conversation_id}) + "\n\n"
-            yield "data: [DONE]\n\n"
-            
-        except Exception as e:
-            yield "data: " + json.dumps({'type': 'error', 'message': str(e), 'conversationId': conversation_id}) + "\n\n"
+@app.route('/api/prompt-cache-stats', methods=['GET'])
+def get_prompt_cache_stats():
+    """各提供商的上下文缓存命中统计；conversationId 参数可查询单个对话"""
+    with _prompt_cache_lock:
+        providers_stats = {}
+        for provider, totals in prompt_cache_totals.items():
+            seen = totals['cache_hit_tokens'] + totals['cache_miss_tokens']
+            providers_stats[provider] = {**totals, 'hit_ratio': round(totals['cache_hit_tokens'] / seen, 4) if seen else 0.0}
+    data = {'providers': providers_stats}
+    conversation_id = request.args.get('conversationId')
+    if conversation_id:
+        data['conversation'] = conversation_cache.get_stats(conversation_id)
+    return success_response(data)
+
+@app.route('/api/cancel', methods=['POST'])
+def cancel_request():
+    """
+    取消进行中的生成：请求体 requestId（/api/stream-analyze 的 start 帧中返回）或 conversationId。
+    后端立即关闭提供商连接，客户端收到 type 为 'cancelled' 的帧。
+    """
+    payload = request.get_json(force=True, silent=True) or {}
+    request_id = payload.get('requestId')
+    conversation_id = payload.get('conversationId')
+    if not request_id and not conversation_id:
+        return error_response("缺少 requestId 或 conversationId", 400)
+    cancelled = active_requests.cancel(request_id=request_id, conversation_id=conversation_id)
+    return success_response({'cancelled': cancelled}, f"已取消 {len(cancelled)} 个请求" if cancelled else "没有匹配的进行中请求")
+
+@app.route('/api/scheduler', methods=['GET'])
+def scheduler_stats():
+    """提供商调度统计：各提供商的并发、各优先级的队列深度与排队等待时间，以及各 API Key 的限流状态"""
+    return success_response({**provider_scheduler.info(), "rate_limits": rate_limiter.info()})
+
+def _collect_active_streams():
+    result = {('gateway',): stream_gateway.info().get('active_streams', 0)}
+    server = server_manager.server
+    result[('thread',)] = server.info().get('active_streams', 0) if server else 0
+    return result
+
+def _collect_scheduler_queue():
+    result = {}
+    for provider, lane in provider_scheduler.info().get('providers', {}).items():
+        for priority, stats in lane.get('classes', {}).items():
+            result[(provider, priority)] = stats.get('queued', 0)
+    return result
+
+def _collect_scheduler_active():
+    return {(provider,): lane.get('active', 0) for provider, lane in provider_scheduler.info().get('providers', {}).items()}
+
+def _collect_response_cache():
+    stats = response_cache.info()
+    return {(kind,): stats.get(key, 0) for kind, key in (('memory_hit', 'memory_hits'), ('disk_hit', 'disk_hits'), ('miss', 'misses'))}
+
+def _collect_response_cache_ratio():
+    stats = response_cache.info()
+    hits = stats.get('memory_hits', 0) + stats.get('disk_hits', 0)
+    lookups = hits + stats.get('misses', 0)
+    return {(): round(hits / lookups, 4) if lookups else 0.0}
+
+def _collect_prompt_cache():
+    result = {}
+    with _prompt_cache_lock:
+        for provider, totals in prompt_cache_totals.items():
+            result[(provider, 'hit')] = totals['cache_hit_tokens']
+            result[(provider, 'miss')] = totals['cache_miss_tokens']
+    return result
+
+def _collect_single_flight():
+    stats = single_flight.info()
+    return {(kind,): stats.get(kind, 0) for kind in ('started', 'coalesced', 'cancelled')}
+
+def _collect_near_duplicates():
+    stats = near_duplicates.info()
+    return {(kind,): stats.get(kind, 0) for kind in ('queries', 'matches')}
+
+def _collect_config_reads():
+    return {('file',): config_store.read_count, ('access',): config_store.access_count}
+
+def _collect_rate_limited():
+    result = {}
+    for label, state in rate_limiter.info().get('keys', {}).items():
+        result[(label, 'throttled')] = state.get('throttled', 0)
+        result[(label, 'rate_limited')] = state.get('rate_limited', 0)
+        result[(label, 'retries')] = state.get('retries', 0)
+    return result
+
+metrics.metrics.collector('ainode_active_streams', '进行中的 SSE 流', 'gauge', ('transport',), _collect_active_streams)
+metrics.metrics.collector('ainode_active_requests', '登记在 active_requests 中的生成', 'gauge', (), lambda: {(): active_requests.info().get('active', 0)})
+metrics.metrics.collector('ainode_scheduler_queue_depth', '提供商调度队列中等待的请求', 'gauge', ('provider', 'priority'), _collect_scheduler_queue)
+metrics.metrics.collector('ainode_scheduler_active', '提供商进行中的调用', 'gauge', ('provider',), _collect_scheduler_active)
+metrics.metrics.collector('ainode_response_cache_lookups_total', '回复缓存查询结果', 'counter', ('result',), _collect_response_cache)
+metrics.metrics.collector('ainode_response_cache_hit_ratio', '回复缓存命中率（内存 + 硬盘）', 'gauge', (), _collect_response_cache_ratio)
+metrics.metrics.collector('ainode_prompt_cache_tokens_total', '提供商上下文缓存命中 / 未命中的提示词 token', 'counter', ('provider', 'result'), _collect_prompt_cache)
+metrics.metrics.collector('ainode_single_flight_total', '共享生成的发起 / 合并 / 取消次数', 'counter', ('kind',), _collect_single_flight)
+metrics.metrics.collector('ainode_near_duplicate_total', '近似重复问题的查询与命中次数', 'counter', ('kind',), _collect_near_duplicates)
+metrics.metrics.collector('ainode_config_reads_total', '配置读取次数（file 为实际读取文件）', 'counter', ('source',), _collect_config_reads)
+metrics.metrics.collector('ainode_config_writes_total', '配置文件写入次数', 'counter', (), lambda: {(): config_store.write_count})
+metrics.metrics.collector('ainode_rate_limit_total', '按 API Key 的本地限流、429 与重试次数', 'counter', ('key', 'kind'), _collect_rate_limited)
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 文本格式的运行指标"""
+    return Response(metrics.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/traces', methods=['GET'])
+def list_traces():
+    """最近的请求链路概要（limit 参数，默认 30）"""
+    try:
+        limit = int(request.args.get('limit', 30))
+    except ValueError:
+        limit = 30
+    tracer.flush(0.5)
+    return success_response({'traces': tracer.recent(limit), **tracer.info()})
+
+@app.route('/api/traces/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    """一个请求链路的全部 span，供网页的瀑布图显示"""
+    tracer.flush(0.5)
+    spans = tracer.get(trace_id)
+    if not spans:
+        return error_response("没有找到该链路", 404)
+    return success_response({'traceId': trace_id, 'spans': spans})
+
+def _batch_generate(job, item, scope):
+    """
+    批量任务中一项的生成：系统提示词 + 节点数据 + 问题，经调度器（batch 优先级）调用提供商。
+    返回 (回答, 元数据)；提供商返回错误时抛出异常，该项标记为失败，可重试。
+    """
+    settings = get_settings()
+    options = job.options or {}
+    provider = options.get('ai_provider') or settings.get('ai_provider', 'DEEPSEEK')
+    if isinstance(provider, dict):
+        # ai.provider 的新结构：{"name": ..., "model": ...}
+        provider = provider.get('name') or 'DEEPSEEK'
+    provider = str(provider).upper()
+    route = None
+    if provider == AUTO_PROVIDER:
+        provider, route = provider_health.choose(settings)
+    settings = providers.with_model(provider, settings, options.get('ai_model'))
+    try:
+        node_text = clean_node_data(item.get('content') or '')
+    except Exception:
+        node_text = item.get('content') or ''
+    messages = [{'role': 'system', 'content': _latest_system_prompt(settings)}]
+    if node_text:
+        messages.append({'role': 'system', 'content': f'Current Blender Node Data:\n{node_text}'})
+    messages.append({'role': 'user', 'content': job.question})
+    answer, meta = _collect_answer(provider, settings, messages, BATCH, scope)
+    if route:
+        meta['route'] = route
+    return answer, meta
+
+batch_jobs.set_generator(_batch_generate)
+
+@app.route('/api/batch-analyze', methods=['GET', 'POST'])
+def batch_analyze():
+    """
+    批量分析：POST 创建任务，请求体
+        {question, items: [{id, name, kind, content}], ai_provider?, ai_model?, parallelism?}
+    items 由 Blender 插件收集（每个材质 / 节点组一项）。GET 列出全部任务。
+    """
+    if request.method == 'GET':
+        return success_response({'jobs': batch_jobs.list()})
+    payload = request.get_json(force=True, silent=True) or {}
+    question = str(payload.get('question') or '').strip()
+    items = payload.get('items')
+    if not question:
+        return error_response("缺少 question", 400)
+    if not isinstance(items, list) or not items or not all(isinstance(i, dict) for i in items):
+        return error_response("items 必须是非空的节点树列表", 400)
+    if not bool(get_settings().get('networking_enabled', True)):
+        return error_response("联网已关闭，请在设置中启用", 400)
+    options = {k: payload[k] for k in ('ai_provider', 'ai_model') if isinstance(payload.get(k), str) and payload.get(k)}
+    try:
+        parallelism = int(payload['parallelism']) if payload.get('parallelism') else None
+    except (TypeError, ValueError):
+        return error_response("parallelism 必须是整数", 400)
+    job = batch_jobs.create(question, items, options, parallelism)
+    return success_response(batch_jobs.snapshot(job, include_results=False), f"已创建批量任务，共 {len(job.items)} 项")
+
+@app.route('/api/batch-analyze/<job_id>', methods=['GET'])
+def batch_analyze_job(job_id):
+    """任务详情及每项结果；results=0 时只返回概要与各项状态（供轮询），content=1 时同时返回提交的节点数据"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return error_response("批量任务不存在", 404)
+    return success_response(batch_jobs.snapshot(job, include_results=request.args.get('results') != '0',
+                                                 include_content=request.args.get('content') == '1'))
+
+@app.route('/api/batch-analyze/<job_id>/<action>', methods=['POST'])
+def batch_analyze_control(job_id, action):
+    """暂停 (pause)、继续 (resume)、重试失败项 (retry，可选 itemIds)、取消 (cancel)"""
+    if batch_jobs.get(job_id) is None:
+        return error_response("批量任务不存在", 404)
+    if action == 'pause':
+        job = batch_jobs.pause(job_id)
+    elif action == 'resume':
+        job = batch_jobs.resume(job_id)
+    elif action == 'retry':
+        payload = request.get_json(force=True, silent=True) or {}
+        job = batch_jobs.retry(job_id, payload.get('itemIds'))
+    elif action == 'cancel':
+        job = batch_jobs.cancel(job_id)
+    else:
+        return error_response(f"未知操作 {action}", 400)
+    return success_response(batch_jobs.snapshot(job, include_results=False))
+
+@app.route('/api/batch-analyze/<job_id>/events', methods=['GET'])
+def batch_analyze_events(job_id):
+    """以 SSE 推送任务进度：每次状态变化一个 progress 帧，任务完成或取消后发送 complete 帧"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return error_response("批量任务不存在", 404)
+
+    def generate():
+        version = -1
+        while True:
+            current = batch_jobs.wait_for_update(job, version)
+            if current == version:
+                # 心跳，便于客户端检测连接
+                yield ': keep-alive\n\n'
+                continue
+            version = current
+            snapshot = batch_jobs.snapshot(job, include_results=False)
+            yield _sse({'type': 'progress', **snapshot})
+            if snapshot['state'] in ('completed', 'cancelled'):
+                yield _sse({'type': 'complete', 'jobId': job.id, 'state': snapshot['state']})
+                yield "data: [DONE]\n\n"
+                return
 
     return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
+@app.route('/api/response-cache', methods=['GET', 'DELETE'])
+def response_cache_stats():
+    """回复缓存统计；DELETE 清空缓存"""
+    if request.method == 'DELETE':
+        response_cache.clear()
+    return success_response(response_cache.info())
+
+@app.route('/api/similar-questions', methods=['POST'])
+def similar_questions():
+    """
+    查找与当前问题近似重复的已有回答，界面可在发起新生成前直接展示。
+    请求体: question, content（节点数据）或 conversationId，可选 scope / threshold / limit
+    """
+    try:
+        payload = request.get_json(force=True) or {}
+        question = payload.get('question', '')
+        if not question:
+            return error_response("缺少 question", 400)
+        node_source = payload.get('content') or ''
+        if not node_source and payload.get('conversationId'):
+            node_source = conversation_cache.node_context(payload.get('conversationId'))
+        node_key = None
+        if node_source:
+            node_key = conversation_cache.nodes.key(canonical_node_data(node_source))
+        threshold = payload.get('threshold')
+        matches = near_duplicates.query(
+            question,
+            node_hash=node_key,
+            limit=int(payload.get('limit', 3)),
+            threshold=float(threshold) if threshold is not None else None,
+            scope=payload.get('scope') if payload.get('scope') in ('node', 'global') else None
+        )
+        return success_response({'matches': matches, 'index': near_duplicates.info()})
+    except Exception as e:
+        return error_response(f"查找相似问题失败: {str(e)}", 500)
+
+@app.route('/api/provider-health', methods=['GET'])
+def get_provider_health():
+    """各 提供商/模型 的健康度（EWMA TTFT、tokens/s、错误率、429 次数、熔断状态）"""
+    return success_response(provider_health.info())
+
+@app.route('/api/memory-usage', methods=['GET'])
+def get_memory_usage():
+    """对话缓存的内存占用（对话数、消息字节数、去重后的节点数据等）"""
+    return success_response({**conversation_cache.usage(), "db": conversation_db.usage(), "summaries": summary_jobs.info()})
+
 @app.route('/api/get-messages', methods=['GET'])
 def get_messages():
-    """获取所有对话历史列表 (For sidebar)"""
+    """获取对话历史列表 (For sidebar)，按最近活动时间倒序，游标分页，不读取消息正文"""
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        limit = 50
+    cursor = request.args.get('cursor') or None
+    try:
+        items, next_cursor = conversation_db.list_conversations(limit=limit, cursor=cursor)
+    except Exception as e:
+        log.error("读取对话列表出错", exc_info=True)
+        return error_response(f"读取对话历史失败: {str(e)}")
+
     chat_list = []
-    for cid, msgs in conversations.items():
-        user_msg = next((m['content'] for m in msgs if m['role'] == 'user'), "New Chat")
-        last_resp = next((m['content'] for m in reversed(msgs) if m['role'] == 'assistant'), "")
-        
+    for item in items:
+        user_msg = item['title'] or "New Chat"
+        last_resp = item['preview']
         chat_list.append({
-            'conversationId': cid,
+            'conversationId': item['id'],
             'message': user_msg[:50] + "..." if len(user_msg) > 50 else user_msg,
-            'response': last_resp[:50] + "...", 
-            'timestamp': 'unknown'
+            'response': last_resp[:50] + "...",
+            'messageCount': item['message_count'],
+            'timestamp': datetime.datetime.fromtimestamp(item['updated_at']).isoformat(timespec='seconds')
         })
-    
-    return jsonify({'messages': chat_list})
+
+    return jsonify({'messages': chat_list, 'nextCursor': next_cursor})
+
+@app.route('/api/get-conversation-messages', methods=['GET'])
+def get_conversation_messages():
+    """按需加载单个对话的消息正文（倒序分页）；节点数据只返回引用，通过 /api/node-context 获取"""
+    conversation_id = request.args.get('conversationId', '')
+    if not conversation_id:
+        return error_response("缺少 conversationId")
+    try:
+        limit = int(request.args.get('limit', 50))
+        before = request.args.get('before')
+        before = int(before) if before not in (None, '') else None
+    except ValueError:
+        return error_response("分页参数无效")
+    include_system = request.args.get('includeSystem') in ('1', 'true')
+    try:
+        rows, next_cursor = conversation_db.get_messages_page(conversation_id, before=before, limit=limit)
+    except Exception as e:
+        log.error("读取对话消息出错", exc_info=True, conversation=conversation_id)
+        return error_response(f"读取对话失败: {str(e)}")
+    messages = []
+    for row in rows:
+        if row['role'] == 'system' and not include_system:
+            continue
+        item = {
+            'seq': row['seq'],
+            'role': row['role'],
+            'content': row['content'] + row['suffix'],
+            'timestamp': datetime.datetime.fromtimestamp(row['created_at']).isoformat(timespec='seconds')
+        }
+        if row['node_ref']:
+            # 节点数据位于 content 的 nodeOffset 处
+            item['nodeRef'] = row['node_ref']
+            item['nodeOffset'] = len(row['content'])
+        messages.append(item)
+    return success_response({
+        'conversationId': conversation_id,
+        'messages': messages,
+        'nextCursor': next_cursor
+    })
+
+@app.route('/api/node-context/<node_ref>', methods=['GET'])
+def get_node_context(node_ref):
+    """按内容哈希获取节点数据"""
+    content = conversation_db.get_node_context(node_ref)
+    if content is None:
+        return error_response("节点数据不存在", 404)
+    return success_response({'nodeRef': node_ref, 'content': content})
 
 @app.route('/api/prompt-templates', methods=['GET'])
 def get_prompt_templates():
@@ -1627,11 +2512,10 @@ def get_default_prompt_templates():
     try:
         config_path = os.path.join(addon_dir, 'config.json')
         if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                # 从配置文件中获取默认提示词模板
-                default_prompt_templates = config.get('default_prompt_templates', [])
-                return success_response(default_prompt_templates)
+            config = config_store.read()
+            # 从配置文件中获取默认提示词模板
+            default_prompt_templates = config.get('default_prompt_templates', [])
+            return success_response(default_prompt_templates)
         else:
             # 如果配置文件不存在，返回空数组
             return success_response([])
@@ -1674,13 +2558,11 @@ def test_bigmodel_api():
             test_data['top_p'] = 1.0
         
         url = f"{base_url.rstrip('/')}/chat/completions"
-        print(f"[Test BigModel] API Request URL: {url}")
-        print(f"[Test BigModel] API Request Model: {model}")
+        log.debug("测试 BigModel API", url=url, model=model)
         
-        r = requests.post(url, headers=headers, json=test_data, timeout=30)
+        r = _limited_request({'name': 'BigModel', 'provider': 'BIGMODEL', 'url': url, 'headers': headers, 'json': test_data, 'timeout': 30}, DIAGNOSTICS)
         
-        print(f"[Test BigModel] API Response Status: {r.status_code}")
-        print(f"[Test BigModel] API Response: {r.text[:500]}")
+        log.debug("BigModel 测试响应", status=r.status_code, body=r.text[:500])
         
         if r.status_code == 200:
             response_data = r.json()
@@ -1761,7 +2643,8 @@ def diagnose_bigmodel_api():
             "message": ""
         }
         try:
-            r = requests.get(base_url.replace('/api/paas/v4', ''), timeout=5)
+            with provider_scheduler.slot('BIGMODEL', DIAGNOSTICS):
+                r = requests.get(base_url.replace('/api/paas/v4', ''), timeout=5)
             if r.status_code < 500:
                 network_test["passed"] = True
                 network_test["message"] = "网络连接正常"
@@ -1798,7 +2681,7 @@ def diagnose_bigmodel_api():
             }
             
             url = f"{base_url.rstrip('/')}/chat/completions"
-            r = requests.post(url, headers=headers, json=test_data, timeout=30)
+            r = _limited_request({'name': 'BigModel', 'provider': 'BIGMODEL', 'url': url, 'headers': headers, 'json': test_data, 'timeout': 30}, DIAGNOSTICS)
             
             api_test["details"]["status_code"] = r.status_code
             
@@ -1842,19 +2725,17 @@ def get_bigmodel_model_categories():
     try:
         config_path = os.path.join(addon_dir, 'config.json')
         if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                ai = config.get('ai', {})
-                bigmodel = ai.get('bigmodel', {})
-                categories = bigmodel.get('model_categories', {})
-                
-                # 返回分类信息
-                result = {
-                    "categories": categories,
-                    "current_model": bigmodel.get('model', ''),
-                    "all_models": bigmodel.get('models', [])
-                }
-                return success_response(result, "获取BigModel模型分类成功")
+            ai = config_store.get('ai', default={})
+            bigmodel = ai.get('bigmodel', {})
+            categories = bigmodel.get('model_categories', {})
+            
+            # 返回分类信息
+            result = {
+                "categories": categories,
+                "current_model": bigmodel.get('model', ''),
+                "all_models": bigmodel.get('models', [])
+            }
+            return success_response(result, "获取BigModel模型分类成功")
         else:
             # 返回默认分类
             default_categories = {
@@ -1957,9 +2838,7 @@ def get_docs_list():
             "categories": sorted(list(categories))
         }, "获取文档列表成功")
     except Exception as e:
-        import traceback
-        print(f"获取文档列表错误: {e}")
-        print(traceback.format_exc())
+        log.error("获取文档列表错误", exc_info=True)
         return error_response(f"获取文档列表失败: {str(e)}")
 
 @app.route('/api/docs/content', methods=['POST'])
@@ -1995,9 +2874,7 @@ def get_doc_content():
             "size": len(content)
         }, "获取文档内容成功")
     except Exception as e:
-        import traceback
-        print(f"获取文档内容错误: {e}")
-        print(traceback.format_exc())
+        log.error("获取文档内容错误", exc_info=True)
         return error_response(f"获取文档内容失败: {str(e)}")
 
 @app.route('/api/docs/categories', methods=['GET'])
@@ -2039,9 +2916,7 @@ def get_docs_categories():
             "categories": sorted_categories
         }, "获取文档分类成功")
     except Exception as e:
-        import traceback
-        print(f"获取文档分类错误: {e}")
-        print(traceback.format_exc())
+        log.error("获取文档分类错误", exc_info=True)
         return error_response(f"获取文档分类失败: {str(e)}")
 
 @app.route('/api/docs/search', methods=['POST'])
@@ -2111,9 +2986,7 @@ def search_docs():
             "total": len(results)
         }, f"搜索完成，找到 {len(results)} 个结果")
     except Exception as e:
-        import traceback
-        print(f"搜索文档错误: {e}")
-        print(traceback.format_exc())
+        log.error("搜索文档错误", exc_info=True)
         return error_response(f"搜索文档失败: {str(e)}")
 
 @app.route('/api/execute-operation', methods=['POST'])
@@ -2121,43 +2994,104 @@ def execute_operation():
     return jsonify({"success": False, "error": "Not implemented in this version"}), 501
 
 class ServerManager:
-    """管理Flask服务器线程"""
+    """管理嵌入式 HTTP 服务器线程"""
     def __init__(self):
         self.thread = None
+        self.server = None
         self.port = 5000
         self.is_running = False
+        self._lock = threading.Lock()
+
+    def _server_options(self):
+        """读取 config.json 中的 server 配置"""
+        options = config_store.get('server', default={})
+        if not isinstance(options, dict):
+            options = {}
+        return options
 
     def start_server(self, port=5000):
-        if self.is_running:
-            return True
-        self.port = port
-        self.is_running = True
-        try:
-            self.thread = threading.Thread(target=self.run_server)
-            self.thread.daemon = True
-            self.thread.start()
-            print(f"AI Node Server started on port {self.port}")
-            return True
-        except Exception as e:
-            print(f"Failed to start server: {e}")
-            self.is_running = False
-            return False
+        with self._lock:
+            if self.is_running:
+                return True
+            self.port = port
+            options = self._server_options()
+            try:
+                # 在调用线程中绑定端口，端口被占用等错误可以直接返回给调用方
+                self.server = EmbeddedHTTPServer(
+                    '127.0.0.1', self.port, app,
+                    workers=options.get('workers', 16),
+                    max_connections=options.get('max_connections', 64),
+                    max_streams=options.get('max_streams'),
+                    keepalive_timeout=options.get('keepalive_timeout', 5.0)
+                )
+                self.server.start_workers()
+                # 异步流式网关：SSE 生成不再占用工作线程
+                if options.get('async_streams', True):
+                    stream_gateway.max_streams = int(options.get('max_async_streams', 64))
+                    stream_gateway.start()
+                self.thread = threading.Thread(target=self.run_server, name='ainode-http-accept')
+                self.thread.daemon = True
+                self.is_running = True
+                self.thread.start()
+                log.info("AI Node 服务已启动", port=self.port)
+                return True
+            except Exception:
+                log.error("服务启动失败", exc_info=True, port=self.port)
+                if self.server:
+                    self.server.stop(drain_timeout=0)
+                    self.server = None
+                self.is_running = False
+                return False
 
     def run_server(self):
-        # Disable Flask banner
-        import logging
-        log = logging.getLogger('werkzeug')
-        log.setLevel(logging.ERROR)
+        server = self.server
         try:
-            app.run(host='127.0.0.1', port=self.port, debug=False, use_reloader=False)
-        except Exception as e:
-            print(f"Server error: {e}")
+            server.serve_forever()
+        except Exception:
+            log.error("服务运行出错", exc_info=True)
             self.is_running = False
 
-    def stop_server(self):
-        self.is_running = False
-        # Flask server is hard to stop gracefully in a thread
-        pass
+    def is_draining(self):
+        """服务器是否正在关闭（流式响应应尽快收尾）"""
+        server = self.server
+        return bool(server and server.draining.is_set())
+
+    def stop_server(self, drain_timeout=None):
+        """停止接受新连接，等待进行中的 SSE 流结束后释放端口"""
+        with self._lock:
+            server = self.server
+            if not server:
+                self.is_running = False
+                return True
+            if drain_timeout is None:
+                drain_timeout = self._server_options().get('drain_timeout', 5.0)
+            # WSGI 服务器与流式网关同时排空，共用同一个截止时间（插件重新加载时界面最多等待 drain_timeout）
+            deadline = time.time() + drain_timeout
+            gateway_result = {}
+            gateway_thread = threading.Thread(
+                target=lambda: gateway_result.update(clean=stream_gateway.stop(timeout=drain_timeout)),
+                name='ainode-gateway-drain', daemon=True)
+            gateway_thread.start()
+            clean = server.stop(drain_timeout=drain_timeout)
+            # 网关超时后还需取消剩余任务并停止事件循环
+            gateway_thread.join(timeout=max(0.0, deadline - time.time()) + 3.0)
+            clean = gateway_result.get('clean', False) and clean
+            conversation_db.flush()
+            tracer.flush()
+            if self.thread:
+                self.thread.join(timeout=2.0)
+            self.thread = None
+            self.server = None
+            self.is_running = False
+            if not clean:
+                log.warning("服务已停止：排空超时，剩余连接被强制关闭", drain_timeout=drain_timeout)
+            return clean
+
+    def info(self):
+        server = self.server
+        if not server:
+            return {"running": False, "port": self.port}
+        return {"running": self.is_running, "port": self.port, **server.info(), "gateway": stream_gateway.info(), "single_flight": single_flight.info(), "requests": active_requests.info(), "scheduler": provider_scheduler.info(), "rate_limits": rate_limiter.info(), "batch": batch_jobs.info(), "tracing": tracer.info(), "logging": log_manager.info()}
 
 # 全局服务器管理器实例
 server_manager = ServerManager()
@@ -2171,7 +3105,7 @@ if __name__ == '__main__':
                 config = json.load(f)
                 if 'port' in config:
                     port = config['port']
-        except Exception as e:
-            print(f"Error reading config for port: {e}")
+        except Exception:
+            log.error("读取端口配置出错", exc_info=True)
             
     app.run(port=port)
@@ -0,0 +1,46 @@
+"""
+Blender 设置快照
+
+插件在主线程中读取 ainode_analyzer_settings 并发布为只读快照；
+后端线程只读取当前快照，不访问 bpy。
+发布采用写时复制：每次生成新的只读映射并整体替换引用，读取方无需加锁。
+"""
+import threading
+import time
+from types import MappingProxyType
+
+_publish_lock = threading.Lock()
+_snapshot = MappingProxyType({})
+_version = 0
+_published_at = 0.0
+
+
+def publish(values):
+    """发布新的设置快照，内容未变化时不替换，返回是否发布了新版本"""
+    global _snapshot, _version, _published_at
+    values = dict(values)
+    with _publish_lock:
+        if values == dict(_snapshot):
+            return False
+        _version += 1
+        _published_at = time.time()
+        # 单次引用赋值，读取方要么看到旧快照要么看到新快照
+        _snapshot = MappingProxyType(values)
+        return True
+
+
+def current():
+    """返回当前快照（只读映射）"""
+    return _snapshot
+
+
+def version():
+    return _version
+
+
+def info():
+    return {
+        "version": _version,
+        "published_at": _published_at,
+        "keys": sorted(_snapshot.keys())
+    }
@@ -0,0 +1,196 @@
+"""
+相同生成请求的合并 (single-flight)
+
+Blender 面板与网页端（或两个标签页）同时提出完全相同的问题时，只向提供商发起一次请求：
+- 以回复缓存的键（提供商、模型、采样参数、规范化消息）标识一次生成；
+- 第一个请求启动上游（线程模式用后台线程，网关模式用事件循环任务），之后的相同请求直接订阅；
+- 所有输出按顺序保存在 Flight 中，迟到的订阅者从头回放，每个订阅者收到相同的 SSE 内容；
+- 订阅者断开或被取消时退订，最后一个订阅者离开后才取消上游（Flight.scope，见 cancellation）。
+订阅者可以是同步生成器 (iter_sync) 或协程 (iter_async)，与上游的运行方式无关。
+"""
+import asyncio
+import threading
+
+from cancellation import CancelScope
+
+
+class Flight:
+    """一次共享的上游生成"""
+
+    def __init__(self, key, registry):
+        self.key = key
+        self.registry = registry
+        self.chunks = []
+        self.done = False
+        self.cancelled = False
+        self.subscribers = 0
+        self._cond = threading.Condition()
+        self._async_waiters = set()
+        self._cancel = None
+        # 同步上游通过它在取消时立即关闭 HTTP 连接
+        self.scope = CancelScope()
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, event in list(self._async_waiters):
+            loop.call_soon_threadsafe(event.set)
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._notify()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self._notify()
+        self.registry._finished(self)
+
+    def wake(self):
+        """唤醒等待中的订阅者（订阅者随后会检查自己是否已被取消）"""
+        with self._cond:
+            self._notify()
+
+    def cancel(self):
+        with self._cond:
+            if self.done or self.cancelled:
+                return
+            self.cancelled = True
+            cancel = self._cancel
+        self.scope.cancel('abandoned')
+        if cancel:
+            cancel()
+
+    # ---------- 上游 ----------
+
+    def start_thread(self, call, *args):
+        """在后台线程中运行同步上游 call(*args)；call 应在 self.scope 取消时尽快结束"""
+        def run():
+            upstream = call(*args)
+            try:
+                for chunk in upstream:
+                    if self.cancelled:
+                        break
+                    self.publish(chunk)
+            finally:
+                upstream.close()
+                self.finish()
+
+        threading.Thread(target=run, name='ainode-flight', daemon=True).start()
+
+    def start_task(self, loop, upstream):
+        """在事件循环中运行异步上游（须在 loop 所在线程调用）"""
+        async def run():
+            try:
+                async for chunk in upstream:
+                    self.publish(chunk)
+            finally:
+                await upstream.aclose()
+                self.finish()
+
+        task = loop.create_task(run())
+        self._cancel = lambda: loop.call_soon_threadsafe(task.cancel)
+
+    # ---------- 订阅 ----------
+
+    def iter_sync(self, tick=None):
+        """按顺序输出全部事件；tick 秒内没有新事件或被 wake() 唤醒时输出 None（供订阅者合并帧、检查取消）"""
+        index = 0
+        while True:
+            with self._cond:
+                if index >= len(self.chunks) and not self.done:
+                    self._cond.wait(tick or 1.0)
+                batch = self.chunks[index:]
+                done = self.done
+            index += len(batch)
+            for chunk in batch:
+                yield chunk
+            if batch:
+                continue
+            if done:
+                return
+            yield None
+
+    async def iter_async(self, loop, tick=None):
+        """iter_sync 的协程版本"""
+        index = 0
+        waiter = (loop, asyncio.Event())
+        with self._cond:
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                waiter[1].clear()
+                with self._cond:
+                    batch = self.chunks[index:]
+                    done = self.done
+                index += len(batch)
+                for chunk in batch:
+                    yield chunk
+                if batch:
+                    continue
+                if done:
+                    return
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), tick)
+                except asyncio.TimeoutError:
+                    pass
+                yield None
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+
+class SingleFlight:
+    """进行中生成的登记表"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {"started": 0, "coalesced": 0, "cancelled": 0}
+
+    def join(self, key, start):
+        """
+        订阅 key 对应的进行中生成，没有时新建并调用 start(flight) 启动上游。
+        返回 (flight, leader)，用完后必须调用 leave(flight)。
+        """
+        with self._lock:
+            flight = self._flights.get(key) if key else None
+            if flight is not None and not flight.done and not flight.cancelled:
+                flight.subscribers += 1
+                self.stats["coalesced"] += 1
+                return flight, False
+            flight = Flight(key, self)
+            flight.subscribers = 1
+            if key:
+                self._flights[key] = flight
+            self.stats["started"] += 1
+        start(flight)
+        return flight, True
+
+    def leave(self, flight):
+        with self._lock:
+            flight.subscribers -= 1
+            abandon = flight.subscribers <= 0 and not flight.done
+            if abandon and self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            if abandon:
+                self.stats["cancelled"] += 1
+        if abandon:
+            flight.cancel()
+
+    def _finished(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def info(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "subscribers": sum(f.subscribers for f in self._flights.values()),
+                **self.stats,
+            }
+
+
+# 全局 single-flight 登记表
+single_flight = SingleFlight()
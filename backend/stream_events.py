@@ -0,0 +1,84 @@
+"""
+进程内的流事件
+
+提供商解析结果、对冲报告、错误等以 StreamEvent 对象在进程内传递（providers -> single_flight / hedging /
+provider_health -> AnalyzeStream），只在写出 SSE 帧时编码一次 JSON，不再每个 token 先 dumps 再 loads。
+
+回复缓存写盘时使用 to_dict / from_dict；from_legacy 兼容旧版缓存中的字符串输出。
+"""
+import json
+
+CHUNK = 'chunk'
+THINKING = 'thinking'
+WEB_SEARCH = 'web_search'
+USAGE = 'usage'
+ERROR = 'error'
+HEDGE = 'hedge'
+# map-reduce 分块分析的进度（data 为该分块的结果，见 map_reduce）
+PROGRESS = 'progress'
+
+
+class StreamEvent:
+    """一条流事件：kind 为上面的常量之一，content 为文本，data 为附加字典（用量、对冲报告等）"""
+
+    __slots__ = ('kind', 'content', 'data')
+
+    def __init__(self, kind, content='', data=None):
+        self.kind = kind
+        self.content = content
+        self.data = data
+
+    @property
+    def is_token(self):
+        """正文或思考内容（用于判定首 token）"""
+        return (self.kind == CHUNK or self.kind == THINKING) and bool(self.content)
+
+    def size(self):
+        return len(self.content) + 16
+
+    def to_dict(self):
+        result = {'kind': self.kind, 'content': self.content}
+        if self.data is not None:
+            result['data'] = self.data
+        return result
+
+    @classmethod
+    def from_dict(cls, value):
+        return cls(value.get('kind', CHUNK), value.get('content') or '', value.get('data'))
+
+    @classmethod
+    def from_legacy(cls, value):
+        """旧版输出：{'kind', 'content', ...} 的 JSON 字符串，或 Ollama 的原始文本"""
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            return cls.from_dict(value)
+        try:
+            j = json.loads(value)
+            kind = j.get('kind')
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            return cls(CHUNK, str(value))
+        if kind == USAGE:
+            return cls(USAGE, '', j.get('usage') or {})
+        if kind:
+            return cls(kind, j.get('content') or '')
+        return cls(CHUNK, str(value))
+
+    def __repr__(self):
+        return f"StreamEvent({self.kind!r}, {self.content[:40]!r})"
+
+
+def chunk(content):
+    return StreamEvent(CHUNK, content)
+
+
+def thinking(content):
+    return StreamEvent(THINKING, content)
+
+
+def error(message):
+    return StreamEvent(ERROR, message)
+
+
+def progress(data):
+    return StreamEvent(PROGRESS, '', data)
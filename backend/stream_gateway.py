@@ -0,0 +1,525 @@
+"""
+异步流式网关
+
+/api/stream-analyze 在线程模式下会占用一个工作线程直到生成结束（上游超时最长 300 秒）。
+网关在一个独立线程里运行 asyncio 事件循环：
+- 工作线程完成请求解析与会话准备后，把客户端连接交给网关 (http_server 的 ainode.detach)，随即返回；
+- 网关用 asyncio 直接向提供商发起 HTTP/1.1 请求，逐行解析 SSE / NDJSON，并把 SSE 帧写回客户端；
+  与 requests 一样遵循系统代理设置（https 经 CONNECT 隧道）并优先使用 certifi 的 CA 证书，
+  asyncio 客户端不支持的代理（SOCKS 等）改用线程池中的 requests 传输；
+- 同一进程可同时处理几十个生成，线程数固定（事件循环 1 个）；对话摘要由 summary_jobs 在后台生成；
+  会话的准备与收尾（节点数据清理、分块、SQLite 读写、磁盘缓存）在小线程池中执行，事件循环上只写出帧；
+- 上游以 single_flight 的 Flight 运行，相同的并发请求只发起一次上游请求；
+- 客户端关闭连接或请求被 /api/cancel 取消时立即退订，最后一个订阅者离开时取消上游任务（关闭上游连接）。
+
+请求构造与事件解析复用 providers / stream_parser 模块，与同步路径 (server._call_provider) 输出一致。
+"""
+import asyncio
+import base64
+import functools
+import json
+import os
+import socket
+import ssl
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, unquote
+
+import requests
+
+try:
+    import certifi
+except ImportError:
+    certifi = None
+
+import metrics
+import providers
+import stream_events
+from rate_limiter import rate_limiter, estimate_request_tokens
+from single_flight import single_flight
+from stream_parser import ProviderStream
+from hedging import hedge_async
+from provider_health import provider_health
+from scheduler import provider_scheduler
+from structured_log import get_logger
+
+log = get_logger('gateway')
+
+_SSE_RESPONSE_HEAD = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream; charset=utf-8\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"X-Accel-Buffering: no\r\n"
+    b"Connection: close\r\n\r\n"
+)
+
+
+class UpstreamError(Exception):
+    pass
+
+
+_ssl_context_cache = None
+
+
+async def _read_response_head(reader, timeout):
+    status_line = await asyncio.wait_for(reader.readline(), timeout)
+    if not status_line:
+        raise UpstreamError("上游连接在返回响应前关闭")
+    parts = status_line.decode('latin-1').split(' ', 2)
+    if len(parts) < 2 or not parts[1].isdigit():
+        raise UpstreamError(f"无效的响应行: {status_line!r}")
+    status = int(parts[1])
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+async def _iter_body(reader, headers, timeout):
+    """按 chunked / Content-Length / 读到关闭 三种方式输出响应体字节块"""
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        while True:
+            size_line = await asyncio.wait_for(reader.readline(), timeout)
+            if not size_line:
+                return
+            size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+            if size == 0:
+                # 读掉 trailer
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), timeout)
+                    if line in (b'\r\n', b'\n', b''):
+                        return
+            data = await asyncio.wait_for(reader.readexactly(size), timeout)
+            await asyncio.wait_for(reader.readline(), timeout)
+            yield data
+    elif 'content-length' in headers:
+        remaining = int(headers['content-length'])
+        while remaining > 0:
+            data = await asyncio.wait_for(reader.read(min(remaining, 65536)), timeout)
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+    else:
+        while True:
+            data = await asyncio.wait_for(reader.read(65536), timeout)
+            if not data:
+                return
+            yield data
+
+
+def _ssl_context():
+    """与 requests 相同的 CA 来源：REQUESTS_CA_BUNDLE / CURL_CA_BUNDLE，其次 certifi，最后是系统证书"""
+    global _ssl_context_cache
+    if _ssl_context_cache is None:
+        bundle = os.environ.get('REQUESTS_CA_BUNDLE') or os.environ.get('CURL_CA_BUNDLE')
+        if not bundle and certifi is not None:
+            bundle = certifi.where()
+        if bundle and os.path.isdir(bundle):
+            _ssl_context_cache = ssl.create_default_context(capath=bundle)
+        else:
+            _ssl_context_cache = ssl.create_default_context(cafile=bundle or None)
+    return _ssl_context_cache
+
+
+def _proxy_for(url):
+    """按 HTTP(S)_PROXY / ALL_PROXY / NO_PROXY（及系统代理设置）选择代理；不走代理时返回 None"""
+    proxies = urllib.request.getproxies()
+    proxy = proxies.get(url.scheme) or proxies.get('all')
+    if not proxy or urllib.request.proxy_bypass(url.netloc.rpartition('@')[2]):
+        return None
+    return urlsplit(proxy if '://' in proxy else f"http://{proxy}")
+
+
+def _proxy_auth(proxy):
+    if proxy.username is None:
+        return []
+    credentials = f"{unquote(proxy.username)}:{unquote(proxy.password or '')}".encode('utf-8')
+    return [f"Proxy-Authorization: Basic {base64.b64encode(credentials).decode('ascii')}"]
+
+
+def _asyncio_supported(url, proxy):
+    """asyncio 客户端只处理直连与 HTTP 代理（https 经 CONNECT 隧道，需要 StreamWriter.start_tls）"""
+    if url.scheme not in ('http', 'https'):
+        return False
+    if proxy is None:
+        return True
+    return proxy.scheme == 'http' and (url.scheme == 'http' or hasattr(asyncio.StreamWriter, 'start_tls'))
+
+
+class _SocketResponse:
+    """asyncio 连接上的上游响应"""
+
+    def __init__(self, reader, writer, status, headers, timeout):
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        self.headers = headers
+        self.timeout = timeout
+
+    def body(self):
+        return _iter_body(self.reader, self.headers, self.timeout)
+
+    def close(self):
+        self.writer.close()
+
+
+class _ThreadedResponse:
+    """requests 传输的上游响应（SOCKS / HTTPS 代理等 asyncio 客户端不支持的情况），阻塞读取放在线程池中"""
+
+    def __init__(self, response):
+        self.response = response
+        self.status = response.status_code
+        self.headers = {k.lower(): v for k, v in response.headers.items()}
+
+    async def body(self):
+        loop = asyncio.get_running_loop()
+        chunks = self.response.iter_content(chunk_size=None)
+        while True:
+            data = await loop.run_in_executor(None, next, chunks, None)
+            if data is None:
+                return
+            yield data
+
+    def close(self):
+        self.response.close()
+
+
+async def _open_threaded(spec, timeout):
+    post = functools.partial(requests.post, spec['url'], headers=spec['headers'], json=spec['json'],
+                             timeout=timeout, stream=True)
+    return _ThreadedResponse(await asyncio.get_running_loop().run_in_executor(None, post))
+
+
+async def _open_request(spec, timeout):
+    """向提供商发送请求并读取响应头，返回带 status / headers / body() / close() 的响应"""
+    url = urlsplit(spec['url'])
+    proxy = _proxy_for(url)
+    if not _asyncio_supported(url, proxy):
+        log.debug("上游改用 requests 传输", provider=spec['name'], proxy=proxy.scheme if proxy else None)
+        return await _open_threaded(spec, timeout)
+    secure = url.scheme == 'https'
+    host = url.hostname
+    port = url.port or (443 if secure else 80)
+    body = json.dumps(spec['json']).encode('utf-8')
+    path = (url.path or '/') + (f'?{url.query}' if url.query else '')
+    extra = []
+    if proxy is None:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=_ssl_context() if secure else None,
+                                    server_hostname=host if secure else None),
+            timeout
+        )
+    else:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(proxy.hostname, proxy.port or 80), timeout)
+        try:
+            if secure:
+                # https 经 CONNECT 隧道，TLS 直接与提供商握手
+                connect = [f"CONNECT {host}:{port} HTTP/1.1", f"Host: {host}:{port}", *_proxy_auth(proxy)]
+                writer.write(("\r\n".join(connect) + "\r\n\r\n").encode('latin-1'))
+                await writer.drain()
+                status, _ = await _read_response_head(reader, timeout)
+                if status != 200:
+                    raise UpstreamError(f"代理拒绝建立隧道: {status}")
+                await asyncio.wait_for(writer.start_tls(_ssl_context(), server_hostname=host), timeout)
+            else:
+                # 经 HTTP 代理的明文请求使用绝对 URI
+                path = f"http://{url.netloc}{path}"
+                extra = _proxy_auth(proxy)
+        except BaseException:
+            writer.close()
+            raise
+    head = [
+        f"POST {path} HTTP/1.1",
+        f"Host: {url.netloc}",
+        f"Content-Length: {len(body)}",
+        "Accept: text/event-stream, application/x-ndjson, application/json",
+        "Accept-Encoding: identity",
+        "Connection: close",
+        *extra,
+    ]
+    head.extend(f"{k}: {v}" for k, v in spec['headers'].items())
+    try:
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('utf-8') + body)
+        await writer.drain()
+        status, headers = await _read_response_head(reader, timeout)
+    except BaseException:
+        writer.close()
+        raise
+    return _SocketResponse(reader, writer, status, headers, timeout)
+
+
+async def stream_provider(spec, error):
+    """异步版 server._call_provider：输出与同步路径相同的 StreamEvent，同样经过 rate_limiter 准入与重试"""
+    if error:
+        yield providers.error_output(error)
+        return
+    name = spec['name']
+    timeout = spec['timeout']
+    response = None
+    estimated = estimate_request_tokens(spec)
+    attempt = 0
+    try:
+        while True:
+            await rate_limiter.admit_async(spec, estimated)
+            response = await _open_request(spec, timeout)
+            status, headers = response.status, response.headers
+            log.debug("提供商响应", provider=name, status=status)
+            rate_limiter.observe(spec, status, headers)
+            if status == 200:
+                break
+            error_body = b''
+            async for data in response.body():
+                error_body += data
+            response.close()
+            response = None
+            error_text = error_body.decode('utf-8', errors='replace')
+            log.warning("提供商返回错误", provider=name, status=status, body=error_text[:500])
+            delay = rate_limiter.retry_delay(spec, status, headers, attempt)
+            if delay is None:
+                retried = f"（已重试 {attempt} 次）" if attempt else ""
+                yield providers.error_output(f"{name} API error: {status} - {error_text}{retried}")
+                return
+            attempt += 1
+            log.info("提供商限流，稍后重试", provider=name, status=status, delay=round(delay, 1), attempt=attempt)
+            await asyncio.sleep(delay)
+
+        stream = ProviderStream(spec)
+        done = False
+        async for data in response.body():
+            outputs, done = stream.feed(data)
+            for item in outputs:
+                if item.kind == stream_events.USAGE:
+                    usage = item.data or {}
+                    rate_limiter.settle(spec, estimated, usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0))
+                yield item
+            if done:
+                break
+        if not done:
+            for item in stream.close()[0]:
+                yield item
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log.warning("调用提供商出错", provider=name, error=str(e) or type(e).__name__)
+        yield providers.error_output(f"Error calling {name} API: {str(e) or type(e).__name__}")
+    finally:
+        if response is not None:
+            response.close()
+
+
+def _scheduled_stream(session, provider_request, name):
+    """经调度器取得 name（"提供商/模型"）的并发名额后请求提供商，并计入提供商健康度；排队与生成记入会话的 trace"""
+    queued = time.time()
+
+    def call():
+        session.trace.record('queue', queued, time.time(), provider=name, priority=session.priority)
+        return provider_health.track_async(name, stream_provider(*provider_request), trace=session.trace)
+
+    return provider_scheduler.wrap_async(name.split('/', 1)[0], session.priority, call)
+
+
+def open_upstream(session):
+    """会话的异步上游：单一提供商，或启用对冲时的主/备竞速；每一路都经过调度器并计入提供商健康度"""
+    requests_, names, delay = session.provider_requests()
+    upstreams = [lambda r=r, n=n: _scheduled_stream(session, r, n) for r, n in zip(requests_, names)]
+    if len(upstreams) == 1:
+        return upstreams[0]()
+    return hedge_async(upstreams, names, delay)
+
+
+class StreamGateway:
+    """在独立线程的事件循环中承载分离出来的 SSE 连接"""
+
+    def __init__(self, max_streams=64):
+        self.max_streams = max_streams
+        self.loop = None
+        self.thread = None
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self._accepting = False
+        # 会话的准备与收尾（节点数据清理、分块、SQLite、磁盘缓存）在这里执行，不阻塞事件循环
+        self._executor = None
+        self.stats = {"served": 0, "failed": 0, "peak_streams": 0}
+
+    def start(self):
+        with self._lock:
+            if self.thread and self.thread.is_alive():
+                self._accepting = True
+                return
+            self.loop = asyncio.new_event_loop()
+            self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ainode-gateway-io')
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(self.loop)
+                self.loop.call_soon(ready.set)
+                self.loop.run_forever()
+
+            self.thread = threading.Thread(target=run, name='ainode-stream-gateway', daemon=True)
+            self.thread.start()
+            ready.wait(2.0)
+            self._accepting = True
+
+    def accepting(self):
+        return self._accepting and len(self._tasks) < self.max_streams
+
+    def active_streams(self):
+        return len(self._tasks)
+
+    def submit(self, sock, session):
+        """由 HTTP 工作线程调用：把已分离的客户端连接交给事件循环"""
+        def schedule():
+            task = self.loop.create_task(self._serve(sock, session))
+            self._tasks.add(task)
+            self.stats["peak_streams"] = max(self.stats["peak_streams"], len(self._tasks))
+            task.add_done_callback(self._tasks.discard)
+        self.loop.call_soon_threadsafe(schedule)
+
+    async def _send(self, sock, frames):
+        for frame in frames:
+            data = frame.encode('utf-8')
+            await self.loop.sock_sendall(sock, data)
+            metrics.sse_frames.inc('gateway')
+            metrics.sse_bytes.inc('gateway', amount=len(data))
+
+    async def _blocking(self, func, *args):
+        """在后台线程中执行可能阻塞的会话步骤，事件循环只负责写出帧"""
+        return await self.loop.run_in_executor(self._executor, func, *args)
+
+    async def _watch_disconnect(self, sock, session):
+        """客户端关闭连接（读到 EOF）时取消会话；请求体已读完，之后收到的数据忽略"""
+        try:
+            while await self.loop.sock_recv(sock, 1024):
+                pass
+        except (ConnectionError, OSError):
+            pass
+        session.cancel('disconnected')
+
+    async def _follow(self, sock, session, key, start, main=False):
+        """订阅 key 对应的共享生成（没有时调用 start(flight) 启动）并写出帧；被中断时返回 True"""
+        flight, leader = single_flight.join(key, start)
+        if main:
+            session.coalesced = not leader
+        # 取消或断开时唤醒订阅循环
+        wake = session.cancel_scope.add(flight.wake)
+        subscription = flight.iter_async(self.loop, tick=session.tick_interval())
+        try:
+            async for event in subscription:
+                if session.interrupted():
+                    await self._send(sock, session.interrupt_frames())
+                    return True
+                await self._send(sock, session.tick_frames() if event is None else session.handle_chunk(event))
+        finally:
+            session.cancel_scope.remove(wake)
+            await subscription.aclose()
+            single_flight.leave(flight)
+        return False
+
+    async def _serve(self, sock, session):
+        sock.setblocking(False)
+        watcher = self.loop.create_task(self._watch_disconnect(sock, session))
+        started = time.perf_counter()
+        outcome = 'disconnected'
+        try:
+            await self.loop.sock_sendall(sock, _SSE_RESPONSE_HEAD)
+            try:
+                await self._send(sock, await self._blocking(session.start_frames))
+                interrupted = False
+                if session.map_plan is not None:
+                    # 节点数据过大：map 阶段在后台线程中并发分析各分块，完成后构造 reduce 的消息
+                    interrupted = await self._follow(
+                        sock, session, session.map_key(),
+                        lambda f: f.start_thread(session.map_upstream, f.scope)
+                    )
+                    if not interrupted:
+                        await self._send(sock, await self._blocking(session.reduce_frames))
+                cached = await self._blocking(session.cached_outputs) if not interrupted else None
+                if cached is not None:
+                    # 回复缓存命中：直接回放，不请求提供商
+                    for chunk in cached:
+                        await self._send(sock, session.handle_chunk(chunk))
+                elif not interrupted:
+                    # 相同的并发请求共用一个上游；最后一个订阅者离开时才取消上游
+                    interrupted = await self._follow(
+                        sock, session, session.cache_key,
+                        lambda f: f.start_task(self.loop, open_upstream(session)),
+                        main=True
+                    )
+                if not interrupted:
+                    await self._send(sock, await self._blocking(session.finish_frames))
+                    await self._send(sock, await self._blocking(session.summary_frames))
+                    await self._send(sock, session.complete_frames())
+                self.stats["served"] += 1
+                outcome = 'interrupted' if interrupted else 'ok'
+            except (ConnectionError, OSError):
+                raise
+            except Exception as e:
+                outcome = 'error'
+                await self._send(sock, [session.error_frame(e)])
+        except (ConnectionError, OSError):
+            # 客户端已断开
+            self.stats["failed"] += 1
+        finally:
+            metrics.stream_seconds.observe(time.perf_counter() - started, 'gateway', outcome)
+            watcher.cancel()
+            session.release()
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def stop(self, timeout=5.0):
+        """停止接收新连接，等待进行中的流结束，超时后取消"""
+        with self._lock:
+            self._accepting = False
+            loop = self.loop
+            if loop is None:
+                return True
+
+            async def drain():
+                tasks = list(self._tasks)
+                if not tasks:
+                    return True
+                done, pending = await asyncio.wait(tasks, timeout=timeout)
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    await asyncio.wait(pending, timeout=1.0)
+                return not pending
+
+            try:
+                clean = asyncio.run_coroutine_threadsafe(drain(), loop).result(timeout + 2.0)
+            except Exception:
+                clean = False
+            loop.call_soon_threadsafe(loop.stop)
+            if self.thread:
+                self.thread.join(timeout=2.0)
+            if not loop.is_running():
+                loop.close()
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            self.loop = None
+            self.thread = None
+            return clean
+
+    def info(self):
+        return {
+            "accepting": self._accepting,
+            "active_streams": len(self._tasks),
+            "max_streams": self.max_streams,
+            **self.stats,
+        }
+
+
+# 全局网关实例
+stream_gateway = StreamGateway()
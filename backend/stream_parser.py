@@ -0,0 +1,181 @@
+"""
+增量流解析器（SSE / NDJSON）
+
+同步路径 (server._call_provider) 与异步网关 (stream_gateway.stream_provider) 都把收到的原始字节块交给
+ProviderStream，不再各自按行解码、检查 'data: ' 前缀：
+- UTF-8 增量解码：多字节字符被拆在两个网络块之间时不会产生乱码；
+- SSE 按规范分帧：空行结束一个事件，多行 data 以换行拼接，注释行 (':') 忽略，支持 event 字段；
+- NDJSON（Ollama）按行输出；
+- 快速路径：块内是完整 UTF-8 时直接解码；一个块恰好是一个单行 data 事件时不经过逐行分帧；
+- 解析失败不再静默丢弃：计数并输出前几条出错的数据，统计见 parse_stats。
+
+提供商的 spec 通过 'format'（'sse' / 'ndjson'）与 parse_event(data) -> (outputs, done) 接入。
+"""
+import codecs
+
+import providers
+from structured_log import get_logger
+
+log = get_logger('stream_parser')
+
+# 全局解析统计
+parse_stats = {"events": 0, "errors": 0}
+
+# 每个流最多输出的解析错误条数
+_MAX_REPORTED_ERRORS = 3
+
+
+class _Utf8Decoder:
+    """增量 UTF-8 解码；没有被拆开的字符时直接 bytes.decode"""
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._split = False
+
+    def decode(self, chunk, final=False):
+        if not self._split and not final:
+            try:
+                return chunk.decode('utf-8')
+            except UnicodeDecodeError:
+                pass
+        text = self._decoder.decode(chunk, final)
+        self._split = bool(self._decoder.getstate()[0])
+        return text
+
+
+class SSEParser:
+    """按 SSE 规范把字节流切分为 (event, data) 事件"""
+
+    def __init__(self):
+        self._decoder = _Utf8Decoder()
+        self._tail = ''
+        self._data = []
+        self._event = ''
+
+    def _lines(self, text):
+        text = self._tail + text
+        if '\r' in text:
+            # '\r' 在块末尾时可能是被拆开的 '\r\n'，留到下一块处理
+            keep_cr = text.endswith('\r')
+            if keep_cr:
+                text = text[:-1]
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+            if keep_cr:
+                text += '\r'
+        lines = text.split('\n')
+        self._tail = lines.pop()
+        return lines
+
+    def _process(self, lines, events):
+        data = self._data
+        for line in lines:
+            if not line:
+                if data:
+                    events.append((self._event or 'message', data[0] if len(data) == 1 else '\n'.join(data)))
+                    data.clear()
+                self._event = ''
+                continue
+            if line.startswith('data:'):
+                # 快速路径：绝大多数行是 data
+                data.append(line[6:] if line.startswith('data: ') else line[5:])
+                continue
+            if line[0] == ':':
+                continue
+            field, _, value = line.partition(':')
+            if value.startswith(' '):
+                value = value[1:]
+            if field == 'event':
+                self._event = value
+            # id / retry 对单次生成没有意义，忽略
+        return events
+
+    def feed(self, chunk):
+        text = self._decoder.decode(chunk)
+        if (not self._tail and not self._data and not self._event and text.startswith('data: ')
+                and text.endswith('\n\n') and text.find('\n') == len(text) - 2 and '\r' not in text):
+            # 快速路径：一个网络块正好是一个单行 data 事件
+            return [('message', text[6:-2])]
+        return self._process(self._lines(text), [])
+
+    def close(self):
+        """流结束：处理最后一行，并派发没有以空行结束的事件"""
+        lines = self._lines(self._decoder.decode(b'', final=True))
+        lines.append(self._tail.rstrip('\r'))
+        self._tail = ''
+        lines.append('')
+        return self._process(lines, [])
+
+
+class NDJSONParser:
+    """按行切分 NDJSON，输出 ('message', 行) 事件"""
+
+    def __init__(self):
+        self._decoder = _Utf8Decoder()
+        self._tail = ''
+
+    def feed(self, chunk):
+        lines = (self._tail + self._decoder.decode(chunk)).split('\n')
+        self._tail = lines.pop()
+        return [('message', line.rstrip('\r')) for line in lines if line.strip()]
+
+    def close(self):
+        line = (self._tail + self._decoder.decode(b'', final=True)).strip()
+        self._tail = ''
+        return [('message', line)] if line else []
+
+
+class ProviderStream:
+    """字节块 -> 提供商输出，供同步与异步传输共用"""
+
+    def __init__(self, spec):
+        self.name = spec.get('name', '')
+        self.parse_event = spec['parse_event']
+        self.parser = NDJSONParser() if spec.get('format') == 'ndjson' else SSEParser()
+        self.errors = 0
+        self.done = False
+
+    def _report(self, error, data):
+        self.errors += 1
+        parse_stats["errors"] += 1
+        if self.errors <= _MAX_REPORTED_ERRORS:
+            log.warning("无法解析的流数据", provider=self.name, error=f"{type(error).__name__}: {error}", data=repr(data[:200]))
+
+    def _handle(self, events):
+        outputs = []
+        parse_stats["events"] += len(events)
+        for event, data in events:
+            if event == 'error':
+                outputs.append(providers.error_output(f"{self.name} stream error: {data}"))
+                continue
+            try:
+                items, done = self.parse_event(data)
+            except Exception as e:
+                if '\n' not in data:
+                    self._report(e, data)
+                    continue
+                # 不规范的服务端把多个 JSON 放在同一个事件里：逐行再试一次
+                items, done = [], False
+                for part in data.split('\n'):
+                    try:
+                        part_items, part_done = self.parse_event(part)
+                    except Exception as part_error:
+                        self._report(part_error, part)
+                        continue
+                    items.extend(part_items)
+                    done = done or part_done
+            outputs.extend(items)
+            if done:
+                self.done = True
+                break
+        return outputs, self.done
+
+    def feed(self, chunk):
+        """输入一个字节块，返回 (outputs, done)"""
+        if self.done:
+            return [], True
+        return self._handle(self.parser.feed(chunk))
+
+    def close(self):
+        if self.done:
+            return [], True
+        return self._handle(self.parser.close())
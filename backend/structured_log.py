@@ -0,0 +1,256 @@
+"""
+结构化日志
+
+热路径上原来到处是 print：BigModel 请求每次打印完整的请求头（含 API Key）与首尾消息，
+refresh_checker 与 MCP 的 _handle_client 每次轮询 / 每条命令都打印。控制台输出发生在 Blender 界面线程时
+会直接增加延迟。这里基于标准库 logging：
+- get_logger(name) 返回 StructuredLogger：log.info("消息", key=value, ...)，字段与消息分开，消息保持固定文本；
+- 调用方只把记录放入有界队列 (QueueHandler)，由 QueueListener 的后台线程写控制台与日志文件，队列满时丢弃并计数；
+- 入队前做两件事：同一 logger + 级别 + 消息在 window 秒内超过 burst 条的重复日志被抑制，
+  窗口结束后的下一条附带被抑制的条数；消息、字段与异常文本中的 API Key / Bearer token 等替换为 ***；
+- ai.logging 配置级别、是否写入 cache/logs/ainode.log（JSON 行，按大小轮换）以及限流参数。
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+addon_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROOT = 'ainode'
+
+_SECRET_PATTERNS = (
+    (re.compile(r'(Bearer\s+)[^\s\'",}]+', re.I), r'\1***'),
+    (re.compile(r'''((?:api[_-]?key|apikey|authorization|access[_-]?token|secret|password)['"]?\s*[:=]\s*['"]?)(?!Bearer\s)[^'"\s,}]+''', re.I), r'\1***'),
+    (re.compile(r'\bsk-[A-Za-z0-9_\-]{8,}'), 'sk-***'),
+)
+_SECRET_FIELD = re.compile(r'(?:^|_)(?:api_?key|apikey|authorization|token|secret|password)$', re.I)
+
+
+def redact(text):
+    """把文本中的 API Key、Bearer token 等替换为 ***"""
+    if not text:
+        return text
+    text = str(text)
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _redact_fields(fields):
+    result = {}
+    for key, value in fields.items():
+        if isinstance(value, (int, float, bool)) or value is None:
+            result[key] = value
+        elif _SECRET_FIELD.search(key):
+            result[key] = '***' if value else value
+        else:
+            result[key] = redact(value if isinstance(value, str) else repr(value))
+    return result
+
+
+class RateLimitFilter(logging.Filter):
+    """同一 logger + 级别 + 消息在 window 秒内最多放行 burst 条"""
+
+    def __init__(self, burst=5, window=10.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._state = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None or now - state[0] >= self.window:
+                if len(self._state) > 1000:
+                    self._state.clear()
+                suppressed = state[2] if state is not None else 0
+                self._state[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            state[1] += 1
+            if state[1] <= self.burst:
+                return True
+            state[2] += 1
+            self.suppressed += 1
+            return False
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """在调用线程中合并消息、脱敏并入队；队列满时丢弃"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = redact(record.getMessage())
+        record.args = None
+        record.fields = _redact_fields(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            record.exc_text = redact(logging.Formatter().formatException(record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class ConsoleFormatter(logging.Formatter):
+    """时间 级别 logger: 消息 key=value ..."""
+
+    def format(self, record):
+        parts = [time.strftime('%H:%M:%S', time.localtime(record.created)), record.levelname, f"{record.name}:", record.getMessage()]
+        for key, value in (getattr(record, 'fields', None) or {}).items():
+            parts.append(f"{key}={value}")
+        if getattr(record, 'suppressed', 0):
+            parts.append(f"(此前 {record.suppressed} 条重复日志已忽略)")
+        line = ' '.join(str(p) for p in parts)
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行 JSON"""
+
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName,
+        }
+        data.update(getattr(record, 'fields', None) or {})
+        if getattr(record, 'suppressed', 0):
+            data['suppressed'] = record.suppressed
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class StructuredLogger:
+    """log.info("消息", key=value)；exc_info=True 时附带当前异常"""
+
+    __slots__ = ('_logger',)
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def is_enabled(self, level):
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level, msg, exc_info, fields):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, exc_info=exc_info, extra={'fields': fields}, stacklevel=3)
+
+    def debug(self, msg, exc_info=False, **fields):
+        self._log(logging.DEBUG, msg, exc_info, fields)
+
+    def info(self, msg, exc_info=False, **fields):
+        self._log(logging.INFO, msg, exc_info, fields)
+
+    def warning(self, msg, exc_info=False, **fields):
+        self._log(logging.WARNING, msg, exc_info, fields)
+
+    def error(self, msg, exc_info=False, **fields):
+        self._log(logging.ERROR, msg, exc_info, fields)
+
+    def exception(self, msg, **fields):
+        self._log(logging.ERROR, msg, True, fields)
+
+
+class LogManager:
+    """根 logger (ainode) 的队列、后台写入线程与输出目标"""
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.queue = queue.Queue(maxsize=10000)
+        self.rate_limit = RateLimitFilter()
+        self.handler = _QueueHandler(self.queue)
+        self.handler.addFilter(self.rate_limit)
+        self.console = logging.StreamHandler(sys.stdout)
+        self.console.setFormatter(ConsoleFormatter())
+        self.file = None
+        self.listener = None
+        self._lock = threading.Lock()
+        self.root = logging.getLogger(ROOT)
+        self.root.setLevel(logging.INFO)
+        self.root.propagate = False
+        for handler in list(self.root.handlers):
+            # 插件重新加载时替换上一次安装的处理器
+            self.root.removeHandler(handler)
+        self.root.addHandler(self.handler)
+
+    def configure(self, level=None, file_enabled=None, burst=None, window=None, max_bytes=None):
+        with self._lock:
+            if level is not None:
+                self.root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+            if burst is not None:
+                self.rate_limit.burst = max(0, int(burst))
+            if window is not None:
+                self.rate_limit.window = max(0.1, float(window))
+            if file_enabled is not None and bool(file_enabled) != (self.file is not None):
+                self._stop()
+                if file_enabled:
+                    os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                    self.file = logging.handlers.RotatingFileHandler(
+                        self.log_path, maxBytes=int(max_bytes or 5 * 1024 * 1024), backupCount=2, encoding='utf-8', delay=True)
+                    self.file.setFormatter(JsonFormatter())
+                else:
+                    self.file.close()
+                    self.file = None
+            self._start()
+
+    def _start(self):
+        if self.listener is None:
+            handlers = [self.console] + ([self.file] if self.file is not None else [])
+            self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+            self.listener.start()
+
+    def _stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def shutdown(self):
+        """写完队列中剩余的日志并停止后台线程（插件注销时调用）"""
+        with self._lock:
+            self._stop()
+
+    def info(self):
+        return {
+            "level": logging.getLevelName(self.root.level),
+            "file": self.log_path if self.file is not None else None,
+            "queued": self.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "suppressed": self.rate_limit.suppressed,
+        }
+
+
+# 全局日志管理器
+log_manager = LogManager(os.path.join(addon_dir, 'cache', 'logs', 'ainode.log'))
+log_manager.configure()
+
+
+def get_logger(name):
+    """ainode.<name> 的结构化 logger"""
+    return StructuredLogger(logging.getLogger(f"{ROOT}.{name}"))
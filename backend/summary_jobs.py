@@ -0,0 +1,102 @@
+"""
+后台对话摘要任务
+
+回答结束后不再同步调用 _summarize；stream_analyze 只把摘要任务放入队列，流立即完成。
+- 每个对话同一时间最多一个排队中的任务：重复提交直接合并；
+- 任务运行中再次提交时标记为需要重跑，运行结束后用最新的对话内容再做一次；
+- 摘要生成后写入 conversation_cache，下一轮对话使用当时已就绪的摘要。
+"""
+import queue
+import threading
+import time
+
+from structured_log import get_logger
+
+log = get_logger('summary_jobs')
+
+
+class SummaryJobs:
+    """按对话去重的摘要任务队列"""
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._pending = set()
+        self._running = set()
+        self._rerun = set()
+        self._threads = []
+        self.stats = {"submitted": 0, "deduplicated": 0, "completed": 0, "failed": 0, "last_duration": 0.0}
+
+    def _ensure_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker_loop, name=f'ainode-summary-{len(self._threads)}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, cid, job):
+        """
+        提交摘要任务。job() 在后台线程执行，返回值由 job 自行写回。
+        同一对话已有任务排队时只替换为最新的 job，返回 False。
+        """
+        with self._lock:
+            self.stats["submitted"] += 1
+            self._jobs[cid] = job
+            if cid in self._pending:
+                self.stats["deduplicated"] += 1
+                return False
+            if cid in self._running:
+                self._rerun.add(cid)
+                self.stats["deduplicated"] += 1
+                return False
+            self._pending.add(cid)
+            self._ensure_workers()
+        self._queue.put(cid)
+        return True
+
+    def status(self, cid):
+        with self._lock:
+            if cid in self._running:
+                return 'running'
+            if cid in self._pending:
+                return 'pending'
+            return None
+
+    def _worker_loop(self):
+        while True:
+            cid = self._queue.get()
+            with self._lock:
+                self._pending.discard(cid)
+                self._running.add(cid)
+                job = self._jobs.get(cid)
+            started = time.time()
+            try:
+                if job:
+                    job()
+                self.stats["completed"] += 1
+            except Exception:
+                self.stats["failed"] += 1
+                log.error("生成对话摘要出错", exc_info=True, conversation=cid)
+            self.stats["last_duration"] = time.time() - started
+            with self._lock:
+                self._running.discard(cid)
+                if cid in self._rerun:
+                    self._rerun.discard(cid)
+                    self._pending.add(cid)
+                    self._queue.put(cid)
+                elif self._jobs.get(cid) is job:
+                    self._jobs.pop(cid, None)
+
+    def info(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "running": len(self._running),
+                **self.stats,
+            }
+
+
+# 全局摘要任务队列
+summary_jobs = SummaryJobs()
@@ -0,0 +1,211 @@
+"""
+请求链路追踪
+
+一次提问的耗时分散在 Blender 插件（节点序列化、过滤、文本块写入）、HTTP、后端（提示词组装、调度排队、
+提供商首 token、摘要）之间，只看总耗时无法判断慢在哪里。这里提供最简单的 trace / span：
+- 提问操作符创建根 span（trace_id），通过 /api/stream-analyze 请求体的 traceId / parentSpanId 传给后端，
+  后端的 span 再挂到会话上，提供商调用按同一 trace 记录排队与生成的 span；
+- span 结束时放入队列，由后台线程追加写入 cache/traces/traces.jsonl（每行一个 span），
+  Blender 主线程与生成线程上不做文件 I/O；文件超过 max_bytes 时轮换为 traces.jsonl.1；
+- recent() / get() 读取文件供 /api/traces 与网页中的瀑布图查看。
+
+插件与后端运行在同一个 Python 进程中，共用这里的全局 tracer，时间统一使用 time.time()。
+"""
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+from structured_log import get_logger
+
+log = get_logger('tracing')
+
+addon_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def new_id():
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+    """一段计时；end() 时写入追踪文件（只写一次）"""
+
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'start', 'attrs', '_ended')
+
+    def __init__(self, tracer, name, trace_id=None, parent_id=None, start=None, **attrs):
+        self.tracer = tracer
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time() if start is None else start
+        self.attrs = attrs
+        self._ended = False
+
+    def child(self, name, **attrs):
+        return Span(self.tracer, name, self.trace_id, self.span_id, **attrs)
+
+    def record(self, name, start, end, **attrs):
+        """记录一段已经结束的子 span（例如由其他模块测得的排队时间）"""
+        span = Span(self.tracer, name, self.trace_id, self.span_id, start, **attrs)
+        span.end(end_time=end)
+        return span
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self, end_time=None, **attrs):
+        if self._ended:
+            return
+        self._ended = True
+        self.attrs.update(attrs)
+        end_time = time.time() if end_time is None else end_time
+        self.tracer.emit({
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration': round(max(0.0, end_time - self.start), 6),
+            'attrs': self.attrs,
+        })
+
+    def context(self):
+        """传给后端的追踪上下文"""
+        return {'traceId': self.trace_id, 'parentSpanId': self.span_id}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.attrs['error'] = str(exc) or exc_type.__name__
+        self.end()
+        return False
+
+
+class Tracer:
+    """span 的异步写入与读取"""
+
+    def __init__(self, path, enabled=True, max_bytes=5 * 1024 * 1024):
+        self.path = path
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self._queue = queue.Queue(maxsize=10000)
+        self._writer = None
+        self._lock = threading.Lock()
+        self.stats = {"recorded": 0, "dropped": 0}
+
+    def configure(self, enabled=None, max_bytes=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if max_bytes is not None:
+            self.max_bytes = max(64 * 1024, int(max_bytes))
+
+    def start(self, name, trace_id=None, parent_id=None, **attrs):
+        """开始一个 span；trace_id 为空时开始新的 trace"""
+        return Span(self, name, trace_id, parent_id, **attrs)
+
+    def emit(self, record):
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name='ainode-tracer', daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            records = [self._queue.get()]
+            # 一次取完已排队的 span，合并为一次写入
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(records)
+            for _ in records:
+                self._queue.task_done()
+
+    def _write(self, records):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            try:
+                if os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+            except OSError:
+                pass
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            self.stats["recorded"] += len(records)
+        except OSError:
+            self.stats["dropped"] += len(records)
+            log.error("写入链路文件失败", exc_info=True, dropped=len(records))
+
+    def flush(self, timeout=2.0):
+        """等待已排队的 span 写完（最多 timeout 秒）"""
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    # ---------- 读取 ----------
+
+    def _spans(self):
+        spans = []
+        for path in (self.path + '.1', self.path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            spans.append(json.loads(line))
+                        except ValueError:
+                            continue
+            except OSError:
+                continue
+        return spans
+
+    def recent(self, limit=30):
+        """最近的 trace 概要（按开始时间倒序）"""
+        traces = {}
+        for span in self._spans():
+            traces.setdefault(span.get('trace_id'), []).append(span)
+        result = []
+        for trace_id, spans in traces.items():
+            ids = {s.get('span_id') for s in spans}
+            roots = [s for s in spans if s.get('parent_id') not in ids]
+            root = min(roots or spans, key=lambda s: s.get('start', 0))
+            start = min(s.get('start', 0) for s in spans)
+            end = max(s.get('start', 0) + s.get('duration', 0) for s in spans)
+            result.append({
+                'traceId': trace_id,
+                'name': root.get('name'),
+                'start': start,
+                'duration': round(end - start, 6),
+                'spans': len(spans),
+                'attrs': root.get('attrs') or {},
+                'error': any((s.get('attrs') or {}).get('error') for s in spans),
+            })
+        result.sort(key=lambda t: t['start'], reverse=True)
+        return result[:max(1, int(limit))]
+
+    def get(self, trace_id):
+        """一个 trace 的全部 span，按开始时间排序"""
+        spans = [s for s in self._spans() if s.get('trace_id') == trace_id]
+        spans.sort(key=lambda s: s.get('start', 0))
+        return spans
+
+    def info(self):
+        return {"enabled": self.enabled, "path": self.path, "queued": self._queue.qsize(), **self.stats}
+
+
+# 全局追踪器
+tracer = Tracer(os.path.join(addon_dir, 'cache', 'traces', 'traces.jsonl'))
@@ -0,0 +1,389 @@
+"""
+/api/stream-analyze 端到端基准：经模拟 LLM 服务测量后端引入的开销
+
+用法（在插件根目录）:
+    blender -b --factory-startup --python benchmarks/bench_stream_analyze.py -- [选项]
+    python benchmarks/bench_stream_analyze.py --backend http://127.0.0.1:5000 [选项]
+
+默认在当前进程内启动后端（后端导入 bpy，需要用 Blender 运行），使用临时配置文件把三个提供商的地址指向
+子进程中的 benchmarks/mock_llm.py，并关闭限流与对话摘要、按并发数放宽调度并发上限，不修改插件的 config.json。
+指定 --backend 时驱动已运行的后端，需要事先把该后端中所用提供商的地址设置为模拟服务（见 mock_llm.py 的输出），
+此时不统计 CPU。
+
+每个场景先由客户端直接请求模拟服务作为基线，再经后端请求同样次数，输出：
+- TTFT：发出请求到收到第一个正文帧的时间，开销 = 经后端 - 直连（p50 / p95）；
+- 帧/秒：每个流收到的正文帧速率（后端按 ai.streaming 合并帧，通常少于上游事件数）与全部流的总速率；
+- CPU/流：经后端运行的进程 CPU 时间减去直连基线（客户端本身）的 CPU 时间，按流平均。
+"""
+import argparse
+import copy
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+addon_dir = os.path.dirname(bench_dir)
+sys.path.insert(0, os.path.join(addon_dir, 'backend'))
+
+# 场景：模拟服务参数与并发数
+SCENARIOS = {
+    'baseline': {'concurrency': 1, 'mock': {'ttft': 0.3, 'tps': 60, 'tokens': 200, 'chunk_tokens': 1}},
+    'fast': {'concurrency': 1, 'mock': {'ttft': 0.05, 'tps': 2000, 'tokens': 2000, 'chunk_tokens': 1}},
+    'fragmented': {'concurrency': 1, 'mock': {'ttft': 0.05, 'tps': 500, 'tokens': 500, 'chunk_tokens': 1, 'write_bytes': 16}},
+    'concurrent': {'concurrency': 16, 'mock': {'ttft': 0.3, 'tps': 100, 'tokens': 300, 'chunk_tokens': 1}},
+    'faults': {'concurrency': 4, 'mock': {'ttft': 0.1, 'tps': 200, 'tokens': 200, 'chunk_tokens': 1,
+                                          'error_rate': 0.1, 'disconnect_rate': 0.1, 'malformed_rate': 0.01}},
+}
+
+PROVIDERS = ('DEEPSEEK', 'BIGMODEL', 'OLLAMA')
+
+# 上游失败时后端把错误信息作为正文帧输出（providers.error_output），按这些片段识别
+_ERROR_MARKERS = (' API error: ', 'Error calling ', ' stream error: ')
+
+# 直连模拟服务时各提供商的请求路径与格式
+_DIRECT = {
+    'DEEPSEEK': ('/chat/completions', 'sse'),
+    'BIGMODEL': ('/api/paas/v4/chat/completions', 'sse'),
+    'OLLAMA': ('/api/chat', 'ndjson'),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=10.0):
+    parts = urlsplit(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((parts.hostname, parts.port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def http_json(url, path, payload=None):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+    try:
+        if payload is None:
+            conn.request('GET', path)
+        else:
+            conn.request('POST', path, body=json.dumps(payload), headers={'Content-Type': 'application/json'})
+        return json.loads(conn.getresponse().read() or b'{}')
+    finally:
+        conn.close()
+
+
+class Result:
+    """一个流的测量结果"""
+
+    __slots__ = ('ttft', 'duration', 'frames', 'chars', 'ok', 'error')
+
+    def __init__(self):
+        self.ttft = None
+        self.duration = 0.0
+        self.frames = 0
+        self.chars = 0
+        self.ok = False
+        self.error = ''
+
+
+def _post_stream(url, path, payload, on_line, timeout):
+    """POST 后按行读取流式响应，on_line(行, 开始时间) 返回 True 时结束"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    started = time.perf_counter()
+    try:
+        conn.request('POST', path, body=json.dumps(payload), headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        if response.status != 200:
+            return started, f"HTTP {response.status}"
+        buffer = b''
+        while True:
+            data = response.read1(65536)
+            if not data:
+                return started, ''
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                if line and on_line(line, started):
+                    return started, ''
+    except (OSError, http.client.HTTPException) as e:
+        return started, str(e) or type(e).__name__
+    finally:
+        conn.close()
+
+
+def stream_direct(mock_url, provider, index, timeout):
+    """直接请求模拟服务（基线）"""
+    path, fmt = _DIRECT[provider]
+    result = Result()
+
+    def on_line(line, started):
+        if fmt == 'sse':
+            if not line.startswith(b'data: '):
+                return False
+            if line == b'data: [DONE]':
+                result.ok = True
+                return True
+            try:
+                choices = json.loads(line[6:]).get('choices') or [{}]
+            except ValueError:
+                return False
+            content = (choices[0].get('delta') or {}).get('content')
+        else:
+            try:
+                j = json.loads(line)
+            except ValueError:
+                return False
+            content = (j.get('message') or {}).get('content')
+            if j.get('done'):
+                result.ok = True
+                return True
+        if content:
+            if result.ttft is None:
+                result.ttft = time.perf_counter() - started
+            result.frames += 1
+            result.chars += len(content)
+        return False
+
+    payload = {'model': 'mock-model', 'stream': True, 'messages': [{'role': 'user', 'content': f'bench {index}'}]}
+    started, result.error = _post_stream(mock_url, path, payload, on_line, timeout)
+    result.duration = time.perf_counter() - started
+    return result
+
+
+def stream_backend(backend_url, provider, index, timeout):
+    """经后端 /api/stream-analyze 请求"""
+    result = Result()
+
+    def on_line(line, started):
+        if not line.startswith(b'data: '):
+            return False
+        if line == b'data: [DONE]':
+            return True
+        try:
+            frame = json.loads(line[6:])
+        except ValueError:
+            return False
+        kind = frame.get('type')
+        if kind == 'chunk' and frame.get('content'):
+            if any(marker in frame['content'] for marker in _ERROR_MARKERS):
+                result.error = frame['content'].strip()[:120]
+            if result.ttft is None:
+                result.ttft = time.perf_counter() - started
+            result.frames += 1
+            result.chars += len(frame['content'])
+        elif kind == 'complete':
+            result.ok = True
+        elif kind == 'error':
+            result.error = frame.get('message') or 'error'
+        return False
+
+    payload = {
+        # 每个流使用不同的问题与对话，避免命中回复缓存或被 single_flight 合并
+        'question': f'benchmark question {index} {uuid.uuid4().hex}',
+        'content': '',
+        'conversationId': str(uuid.uuid4()),
+        'ai_provider': provider,
+        'noCache': True,
+        'priority': 'interactive',
+    }
+    started, error = _post_stream(backend_url, '/api/stream-analyze', payload, on_line, timeout)
+    result.duration = time.perf_counter() - started
+    result.error = result.error or error
+    if result.error or not result.chars:
+        result.ok = False
+    return result
+
+
+def run_batch(func, streams, concurrency):
+    """并发运行 streams 个流，返回 (结果, 墙钟时间, 进程 CPU 时间)"""
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(func, range(streams)))
+    return results, time.perf_counter() - started, time.process_time() - cpu_started
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def summarize(results, wall, cpu):
+    ok = [r for r in results if r.ok]
+    ttfts = [r.ttft for r in ok if r.ttft is not None]
+    rates = [r.frames / (r.duration - r.ttft) for r in ok if r.ttft is not None and r.duration > r.ttft]
+    return {
+        'ok': len(ok),
+        'failed': len(results) - len(ok),
+        'ttft_p50': percentile(ttfts, 0.5),
+        'ttft_p95': percentile(ttfts, 0.95),
+        'frames_per_stream': statistics.mean(r.frames for r in ok) if ok else 0.0,
+        'frames_per_second': statistics.median(rates) if rates else 0.0,
+        'total_frames_per_second': sum(r.frames for r in ok) / wall if wall > 0 else 0.0,
+        'cpu': cpu,
+        'errors': sorted({r.error for r in results if r.error})[:3],
+    }
+
+
+# ---------- 进程内后端 ----------
+
+def bench_config(mock_url, concurrency, transport, coalesce_ms):
+    """基于 config.example.json 的临时配置：提供商指向模拟服务，关闭限流与摘要"""
+    with open(os.path.join(addon_dir, 'config.example.json'), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    config = copy.deepcopy(config)
+    ai = config.setdefault('ai', {})
+    ai.setdefault('deepseek', {}).update({'url': mock_url, 'api_key': 'bench', 'model': 'deepseek-chat'})
+    ai.setdefault('bigmodel', {}).update({'url': f"{mock_url}/api/paas/v4", 'api_key': 'bench', 'model': 'glm-4-flash'})
+    ai.setdefault('ollama', {}).update({'url': mock_url, 'model': 'mock-model'})
+    ai['rate_limits'] = dict(ai.get('rate_limits') or {}, enabled=False)
+    ai['memory'] = dict(ai.get('memory') or {}, enabled=False)
+    ai['hedging'] = dict(ai.get('hedging') or {}, enabled=False)
+    ai['logging'] = dict(ai.get('logging') or {}, level='WARNING', file=False)
+    scheduler = dict(ai.get('scheduler') or {})
+    scheduler['limits'] = {provider: concurrency for provider in PROVIDERS}
+    scheduler['max_queue'] = max(int(scheduler.get('max_queue', 32)), concurrency * 2)
+    ai['scheduler'] = scheduler
+    if coalesce_ms is not None:
+        ai['streaming'] = dict(ai.get('streaming') or {}, coalesce_ms=coalesce_ms)
+    server_options = dict(config.get('server') or {})
+    server_options['async_streams'] = transport == 'gateway'
+    server_options['max_streams'] = max(int(server_options.get('max_streams') or 12), concurrency + 4)
+    server_options['workers'] = max(int(server_options.get('workers', 16)), concurrency + 4)
+    server_options['max_async_streams'] = max(int(server_options.get('max_async_streams', 64)), concurrency + 4)
+    config['server'] = server_options
+    return config
+
+
+def start_backend(mock_url, concurrency, transport, coalesce_ms):
+    """在当前进程内启动后端，返回 (地址, 停止函数)"""
+    try:
+        import bpy  # noqa: F401
+    except ImportError:
+        sys.exit("后端依赖 bpy：请用 blender -b --python benchmarks/bench_stream_analyze.py -- ... 运行，"
+                 "或用 --backend 指定已运行的后端")
+    from config_store import config_store
+    fd, config_path = tempfile.mkstemp(prefix='ainode-bench-', suffix='.json')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(bench_config(mock_url, concurrency, transport, coalesce_ms), f, ensure_ascii=False)
+    # 在导入 server 之前切换配置文件，后端按 CONFIG_SECTIONS 应用的各项配置读取的都是临时配置
+    config_store.path = config_path
+    import server
+    port = free_port()
+    if not server.server_manager.start_server(port=port):
+        sys.exit("后端启动失败")
+
+    def stop():
+        server.server_manager.stop_server(drain_timeout=2.0)
+        config_store.stop()
+        try:
+            os.remove(config_path)
+        except OSError:
+            pass
+
+    return f"http://127.0.0.1:{port}", stop
+
+
+def start_mock():
+    """在子进程中启动模拟服务，它的 CPU 时间不计入本进程"""
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.join(bench_dir, 'mock_llm.py'), '--port', str(port)],
+                               stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    if not wait_for(url):
+        process.kill()
+        sys.exit("模拟 LLM 服务启动失败")
+    return url, process
+
+
+def format_ms(seconds):
+    return f"{seconds * 1000:8.1f}" if seconds == seconds else '     n/a'
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='/api/stream-analyze 端到端基准')
+    parser.add_argument('--provider', default='DEEPSEEK', help='逗号分隔：DEEPSEEK,BIGMODEL,OLLAMA，或 all')
+    parser.add_argument('--scenario', default='all', help='逗号分隔：' + ','.join(SCENARIOS))
+    parser.add_argument('--streams', type=int, default=20, help='每个场景的流数')
+    parser.add_argument('--concurrency', type=int, default=None, help='覆盖场景的并发数')
+    parser.add_argument('--transport', choices=('gateway', 'thread'), default='gateway',
+                        help='进程内后端使用异步网关或工作线程输出流')
+    parser.add_argument('--coalesce-ms', type=float, default=None, help='覆盖 ai.streaming.coalesce_ms')
+    parser.add_argument('--backend', default=None, help='已运行的后端地址（不在进程内启动）')
+    parser.add_argument('--mock', default=None, help='已运行的模拟服务地址（不启动子进程）')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args(argv)
+
+    providers_list = PROVIDERS if args.provider.lower() == 'all' else [p.strip().upper() for p in args.provider.split(',') if p.strip()]
+    for provider in providers_list:
+        if provider not in PROVIDERS:
+            sys.exit(f"未知提供商: {provider}")
+    names = list(SCENARIOS) if args.scenario == 'all' else [n.strip() for n in args.scenario.split(',') if n.strip()]
+    for name in names:
+        if name not in SCENARIOS:
+            sys.exit(f"未知场景: {name}")
+    max_concurrency = args.concurrency or max(SCENARIOS[n]['concurrency'] for n in names)
+
+    mock_process = None
+    if args.mock:
+        mock_url = args.mock.rstrip('/')
+    else:
+        mock_url, mock_process = start_mock()
+    stop_backend = None
+    if args.backend:
+        backend_url = args.backend.rstrip('/')
+    else:
+        backend_url, stop_backend = start_backend(mock_url, max_concurrency, args.transport, args.coalesce_ms)
+
+    print(f"模拟服务 {mock_url}  后端 {backend_url}  每场景 {args.streams} 个流"
+          + ('' if args.backend else f"  传输 {args.transport}"))
+    print(f"{'场景':<12}{'提供商':<10}{'并发':>4}{'成功':>7}{'TTFT直连':>10}{'TTFT后端':>10}"
+          f"{'开销p50':>10}{'开销p95':>10}{'帧/流':>8}{'帧/s':>9}{'总帧/s':>9}{'CPU/流ms':>10}")
+    try:
+        for name in names:
+            scenario = SCENARIOS[name]
+            concurrency = args.concurrency or scenario['concurrency']
+            for provider in providers_list:
+                http_json(mock_url, '/mock/config', scenario['mock'])
+                direct = summarize(*run_batch(lambda i: stream_direct(mock_url, provider, i, args.timeout), args.streams, concurrency))
+                http_json(mock_url, '/mock/config', scenario['mock'])
+                backend = summarize(*run_batch(lambda i: stream_backend(backend_url, provider, i, args.timeout), args.streams, concurrency))
+                cpu = '       n/a' if args.backend else f"{max(0.0, backend['cpu'] - direct['cpu']) / args.streams * 1000:10.2f}"
+                print(f"{name:<12}{provider:<10}{concurrency:>4}{backend['ok']:>4}/{args.streams:<2}"
+                      f"{format_ms(direct['ttft_p50']):>10}{format_ms(backend['ttft_p50']):>10}"
+                      f"{format_ms(backend['ttft_p50'] - direct['ttft_p50']):>10}{format_ms(backend['ttft_p95'] - direct['ttft_p95']):>10}"
+                      f"{backend['frames_per_stream']:>8.0f}{backend['frames_per_second']:>9.0f}{backend['total_frames_per_second']:>9.0f}{cpu}")
+                if backend['errors']:
+                    print(f"{'':<12}错误: {'; '.join(backend['errors'])}")
+        stats = http_json(mock_url, '/mock/stats')['stats']
+        print(f"模拟服务统计: {json.dumps(stats, ensure_ascii=False)}")
+    finally:
+        if stop_backend is not None:
+            stop_backend()
+        if mock_process is not None:
+            mock_process.terminate()
+            mock_process.wait(timeout=5)
+
+
+if __name__ == '__main__':
+    # blender -b --python ... -- [选项]：只解析 -- 之后的参数
+    main(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:])
@@ -0,0 +1,103 @@
+"""
+stream_parser 微基准：ProviderStream 每秒可处理的内容增量数
+
+用法（在插件根目录）:
+    python benchmarks/bench_stream_parser.py [事件数]
+
+分别按「每个网络块一个事件」和「固定 64 字节切块」两种方式输入 DeepSeek 风格的 SSE 流与 Ollama NDJSON 流，
+并与原来逐行 decode + 前缀检查 + json.loads 的写法对比。
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+import providers  # noqa: E402
+from stream_parser import ProviderStream  # noqa: E402
+
+
+def sse_body(count):
+    events = []
+    for i in range(count):
+        payload = {'id': 'bench', 'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'content': f'节点{i} '}, 'finish_reason': None}]}
+        events.append(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+    events.append(b"data: [DONE]\n\n")
+    return events
+
+
+def ndjson_body(count):
+    lines = [(json.dumps({'model': 'bench', 'message': {'role': 'assistant', 'content': f'节点{i} '}, 'done': False}, ensure_ascii=False) + "\n").encode('utf-8') for i in range(count)]
+    lines.append(b'{"model": "bench", "message": {"role": "assistant", "content": ""}, "done": true}\n')
+    return lines
+
+
+def split_fixed(chunks, size):
+    data = b''.join(chunks)
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def run_parser(spec, chunks):
+    stream = ProviderStream(spec)
+    produced = 0
+    for chunk in chunks:
+        outputs, done = stream.feed(chunk)
+        produced += len(outputs)
+        if done:
+            break
+    return produced
+
+
+def run_legacy(chunks):
+    """原实现：按行切分后逐行 decode，检查 'data: ' 前缀再 json.loads"""
+    buffer = b''
+    produced = 0
+    for data in chunks:
+        buffer += data
+        while b'\n' in buffer:
+            line, buffer = buffer.split(b'\n', 1)
+            if not line:
+                continue
+            text = line.decode('utf-8')
+            if not text.startswith('data: '):
+                continue
+            if text == 'data: [DONE]':
+                return produced
+            j = json.loads(text[6:])
+            delta = j['choices'][0].get('delta', {})
+            if 'content' in delta and delta['content']:
+                json.dumps({'kind': 'chunk', 'content': delta['content']})
+                produced += 1
+    return produced
+
+
+def measure(label, func, count, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        produced = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<40} {produced:>8} 增量  {count / best:>12,.0f} 增量/秒")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    deepseek_spec = providers.deepseek_request([], {'deepseek_api_key': 'bench'})[0]
+    ollama_spec = providers.ollama_request([], {})[0]
+    sse = sse_body(count)
+    sse_64 = split_fixed(sse, 64)
+    ndjson = ndjson_body(count)
+    ndjson_64 = split_fixed(ndjson, 64)
+
+    measure("SSE  ProviderStream (每块一个事件)", lambda: run_parser(deepseek_spec, sse), count)
+    measure("SSE  ProviderStream (64 字节切块)", lambda: run_parser(deepseek_spec, sse_64), count)
+    measure("SSE  原逐行实现 (每块一个事件)", lambda: run_legacy(sse), count)
+    measure("SSE  原逐行实现 (64 字节切块)", lambda: run_legacy(sse_64), count)
+    measure("NDJSON ProviderStream (每块一行)", lambda: run_parser(ollama_spec, ndjson), count)
+    measure("NDJSON ProviderStream (64 字节切块)", lambda: run_parser(ollama_spec, ndjson_64), count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+本地模拟 LLM 服务：不花钱、不依赖网络地测试 /api/stream-analyze
+
+用法（在插件根目录）:
+    python benchmarks/mock_llm.py [--port 8765] [--ttft 0.3] [--tps 60] ...
+
+按路径区分三种协议，与 providers 模块构造的请求地址一致：
+- POST /chat/completions、/v1/chat/completions：DeepSeek / OpenAI 风格的 SSE，最后一个数据块携带用量
+  （含 prompt_cache_hit_tokens / prompt_cache_miss_tokens），以 data: [DONE] 结束；
+- POST /api/paas/v4/chat/completions：BigModel 风格的 SSE，用量与 finish_reason 在最后一个数据块中；
+- POST /api/chat：Ollama NDJSON，最后一行 done: true 并携带 prompt_eval_count / eval_count。
+响应使用 HTTP/1.1 chunked 编码。
+
+可调参数（命令行设置默认值，运行中可 POST /mock/config 修改，GET /mock/stats 查看统计）:
+- ttft：首 token 延迟（秒）；tps：之后每秒输出的 token 数；tokens：每次回复的 token 数；
+- chunk_tokens：每个事件包含的 token 数；write_bytes：每次网络写入的字节数（0 为每个事件写一次，
+  较小的值模拟事件被拆在多个 TCP 包中的情况）；
+- error_rate：返回 HTTP 500 的比例；rate_limit_rate：返回 429 (Retry-After) 的比例；
+  disconnect_rate：输出一半后断开连接的比例；malformed_rate：每个事件被替换为无法解析的数据的概率；
+- seed：随机数种子。
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULTS = {
+    'ttft': 0.3,
+    'tps': 60.0,
+    'tokens': 200,
+    'chunk_tokens': 1,
+    'write_bytes': 0,
+    'error_rate': 0.0,
+    'rate_limit_rate': 0.0,
+    'disconnect_rate': 0.0,
+    'malformed_rate': 0.0,
+    'seed': None,
+}
+
+# 回复文本的 token：中英文混合，覆盖多字节字符
+_WORDS = ('节点', '几何', ' Mix', ' Shader', '输入', '输出', ' value', ' 0.5', '，', '。', ' the', ' node', '连接', '\n')
+
+
+class MockState:
+    """当前参数与统计"""
+
+    def __init__(self, options):
+        self.options = dict(DEFAULTS, **options)
+        self.random = random.Random(self.options['seed'])
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'completed': 0, 'errors': 0, 'rate_limited': 0, 'disconnected': 0, 'malformed': 0, 'tokens': 0}
+
+    def configure(self, values):
+        with self.lock:
+            for key, value in values.items():
+                if key in DEFAULTS:
+                    self.options[key] = value
+            if 'seed' in values:
+                self.random = random.Random(values['seed'])
+            return dict(self.options)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.options)
+
+    def roll(self, rate):
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < float(rate)
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+
+def _openai_chunk(model, content, finish=None, usage=None, bigmodel=False):
+    data = {
+        'id': 'mock',
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': content}, 'finish_reason': finish}],
+    }
+    if usage is not None:
+        if bigmodel:
+            data['usage'] = usage
+        else:
+            # DeepSeek：用量单独作为最后一个数据块（choices 为空）
+            data = {'id': 'mock', 'object': 'chat.completion.chunk', 'model': model, 'choices': [], 'usage': usage}
+    return data
+
+
+class Dialect:
+    """一种响应格式：事件编码与结束标记"""
+
+    content_type = 'text/event-stream'
+
+    def __init__(self, model, prompt_tokens):
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+
+    def event(self, content):
+        return b'data: ' + json.dumps(_openai_chunk(self.model, content), ensure_ascii=False).encode('utf-8') + b'\n\n'
+
+    def malformed(self):
+        return b'data: {"choices": [{"delta": {"content": "\n\n'
+
+    def finish(self, completion_tokens):
+        usage = {
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': self.prompt_tokens + completion_tokens,
+            'prompt_cache_hit_tokens': 0,
+            'prompt_cache_miss_tokens': self.prompt_tokens,
+        }
+        return (b'data: ' + json.dumps(_openai_chunk(self.model, '', 'stop'), ensure_ascii=False).encode('utf-8') + b'\n\n'
+                + b'data: ' + json.dumps(_openai_chunk(self.model, '', usage=usage), ensure_ascii=False).encode('utf-8') + b'\n\n'
+                + b'data: [DONE]\n\n')
+
+
+class BigModelDialect(Dialect):
+
+    def finish(self, completion_tokens):
+        usage = {'prompt_tokens': self.prompt_tokens, 'completion_tokens': completion_tokens,
+                 'total_tokens': self.prompt_tokens + completion_tokens}
+        last = _openai_chunk(self.model, '', 'stop', usage=usage, bigmodel=True)
+        return b'data: ' + json.dumps(last, ensure_ascii=False).encode('utf-8') + b'\n\ndata: [DONE]\n\n'
+
+
+class OllamaDialect(Dialect):
+
+    content_type = 'application/x-ndjson'
+
+    def event(self, content):
+        line = {'model': self.model, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'message': {'role': 'assistant', 'content': content}, 'done': False}
+        return json.dumps(line, ensure_ascii=False).encode('utf-8') + b'\n'
+
+    def malformed(self):
+        return b'{"message": {"content": \n'
+
+    def finish(self, completion_tokens):
+        line = {'model': self.model, 'message': {'role': 'assistant', 'content': ''}, 'done': True,
+                'done_reason': 'stop', 'prompt_eval_count': self.prompt_tokens, 'eval_count': completion_tokens}
+        return json.dumps(line, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def _dialect_for(path):
+    if path.endswith('/api/chat'):
+        return OllamaDialect
+    if path.endswith('/api/paas/v4/chat/completions'):
+        return BigModelDialect
+    if path.endswith('/chat/completions'):
+        return Dialect
+    return None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockLLM/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return {}
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path == '/mock/stats':
+            with state.lock:
+                return self._json(200, {'options': dict(state.options), 'stats': dict(state.stats)})
+        if self.path.endswith('/models') or self.path == '/api/tags':
+            return self._json(200, {'data': [{'id': 'mock-model'}], 'models': [{'name': 'mock-model'}]})
+        return self._json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        state = self.server.state
+        body = self._read_json()
+        if self.path == '/mock/config':
+            return self._json(200, state.configure(body if isinstance(body, dict) else {}))
+        if self.path == '/mock/reset':
+            with state.lock:
+                state.stats = dict.fromkeys(state.stats, 0)
+            return self._json(200, {'ok': True})
+        dialect_class = _dialect_for(self.path)
+        if dialect_class is None:
+            return self._json(404, {'error': {'message': f'unknown endpoint {self.path}'}})
+        state.count('requests')
+        options = state.snapshot()
+        if state.roll(options['rate_limit_rate']):
+            state.count('rate_limited')
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Type', 'application/json')
+            payload = b'{"error": {"message": "rate limited (mock)", "code": "1302"}}'
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        if state.roll(options['error_rate']):
+            state.count('errors')
+            return self._json(500, {'error': {'message': 'internal error (mock)', 'code': '500'}})
+        messages = body.get('messages') or []
+        prompt_tokens = sum(len(str(m.get('content', ''))) for m in messages if isinstance(m, dict)) // 4
+        self._stream(dialect_class(body.get('model') or 'mock-model', prompt_tokens), options, state)
+
+    def _write_chunk(self, data, write_bytes):
+        """按 HTTP chunked 编码写出；write_bytes > 0 时拆成多次写入"""
+        pieces = [data[i:i + write_bytes] for i in range(0, len(data), write_bytes)] if write_bytes > 0 else [data]
+        for piece in pieces:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(piece), piece))
+            self.wfile.flush()
+
+    def _stream(self, dialect, options, state):
+        total = max(1, int(options['tokens']))
+        per_event = max(1, int(options['chunk_tokens']))
+        interval = per_event / float(options['tps']) if float(options['tps']) > 0 else 0.0
+        write_bytes = int(options['write_bytes'])
+        disconnect_at = total // 2 if state.roll(options['disconnect_rate']) else None
+
+        self.send_response(200)
+        self.send_header('Content-Type', dialect.content_type)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.wfile.flush()
+
+        started = time.perf_counter()
+        deadline = started + float(options['ttft'])
+        sent = 0
+        words = _WORDS
+        try:
+            while sent < total:
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                count = min(per_event, total - sent)
+                content = ''.join(words[(sent + i) % len(words)] for i in range(count))
+                if state.roll(options['malformed_rate']):
+                    state.count('malformed')
+                    self._write_chunk(dialect.malformed(), write_bytes)
+                else:
+                    self._write_chunk(dialect.event(content), write_bytes)
+                sent += count
+                deadline += interval
+                if disconnect_at is not None and sent >= disconnect_at:
+                    state.count('disconnected')
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+            self._write_chunk(dialect.finish(sent), write_bytes)
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+            state.count('completed')
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端（后端的取消）提前关闭连接
+            self.close_connection = True
+        finally:
+            state.count('tokens', sent)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        super().__init__((host, port), MockHandler)
+        self.state = MockState(options)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # 客户端（后端取消生成、基准测试结束）断开连接属于正常情况
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def start(self):
+        """在后台线程中运行（供基准测试在同一进程内使用）"""
+        self.thread = threading.Thread(target=self.serve_forever, name='mock-llm', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟 LLM 服务（DeepSeek / BigModel SSE、Ollama NDJSON）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ttft', type=float, default=DEFAULTS['ttft'], help='首 token 延迟（秒）')
+    parser.add_argument('--tps', type=float, default=DEFAULTS['tps'], help='首 token 之后每秒的 token 数')
+    parser.add_argument('--tokens', type=int, default=DEFAULTS['tokens'], help='每次回复的 token 数')
+    parser.add_argument('--chunk-tokens', type=int, default=DEFAULTS['chunk_tokens'], help='每个事件的 token 数')
+    parser.add_argument('--write-bytes', type=int, default=DEFAULTS['write_bytes'], help='每次网络写入的字节数，0 为每个事件写一次')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 HTTP 500 的比例')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='返回 HTTP 429 的比例')
+    parser.add_argument('--disconnect-rate', type=float, default=0.0, help='输出一半后断开连接的比例')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='事件被替换为无法解析的数据的概率')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    options = {key: getattr(args, key) for key in DEFAULTS}
+    server = MockLLMServer(args.host, args.port, **options)
+    print(f"模拟 LLM 服务: {server.url}")
+    print(f"  DeepSeek: 设置 ai.deepseek.url = {server.url}（任意 api_key）")
+    print(f"  BigModel: 设置 ai.bigmodel.url = {server.url}/api/paas/v4（任意 api_key）")
+    print(f"  Ollama:   设置 ai.ollama.url = {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
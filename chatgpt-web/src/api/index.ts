@@ -203,3 +203,18 @@ export function searchDocs<T = any>(keyword: string) {
     data: { keyword },
   })
 }
+
+// ==================== 链路追踪 API ====================
+
+export function fetchTraces<T = any>(limit = 30) {
+  return get<T>({
+    url: '/traces',
+    data: { limit },
+  })
+}
+
+export function fetchTrace<T = any>(traceId: string) {
+  return get<T>({
+    url: `/traces/${traceId}`,
+  })
+}
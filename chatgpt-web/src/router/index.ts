@@ -21,6 +21,11 @@ const routes: RouteRecordRaw[] = [
         name: 'Docs',
         component: () => import('@/views/docs/index.vue'),
       },
+      {
+        path: '/traces/:traceId?',
+        name: 'Traces',
+        component: () => import('@/views/traces/index.vue'),
+      },
     ],
   },
 
@@ -169,12 +169,20 @@
         return res.json();
     }
 
-    async function fetchMessages() {
-        const res = await fetch(`${API_BASE}/api/get-messages`);
+    async function fetchMessages(cursor = null) {
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        const res = await fetch(`${API_BASE}/api/get-messages${query}`);
         if (!res.ok) throw new Error('Failed to fetch history');
         return res.json();
     }
 
+    async function fetchConversationMessages(conversationId) {
+        const res = await fetch(`${API_BASE}/api/get-conversation-messages?conversationId=${encodeURIComponent(conversationId)}`);
+        if (!res.ok) throw new Error('Failed to fetch conversation');
+        const json = await res.json();
+        return json.data || { messages: [] };
+    }
+
     async function getBlenderData() {
         const res = await fetch(`${API_BASE}/api/blender-data`, {
             method: 'GET',
@@ -233,10 +241,12 @@
         }
     }
 
-    async function loadHistory() {
+    async function loadHistory(cursor = null) {
         try {
-            const data = await fetchMessages();
-            els.historyList.innerHTML = '';
+            const data = await fetchMessages(cursor);
+            if (!cursor) els.historyList.innerHTML = '';
+            const moreBtn = els.historyList.querySelector('[data-load-more]');
+            if (moreBtn) moreBtn.remove();
             
             if (data.messages && data.messages.length > 0) {
                 data.messages.forEach(msg => {
@@ -246,7 +256,16 @@
                     li.onclick = () => loadChatSession(msg);
                     els.historyList.appendChild(li);
                 });
-            } else {
+                // 分页：还有更早的对话时显示“加载更多”
+                if (data.nextCursor) {
+                    const more = document.createElement('li');
+                    more.dataset.loadMore = '1';
+                    more.className = 'px-3 py-2 text-xs text-gray-500 rounded cursor-pointer hover:bg-gray-800 text-center';
+                    more.textContent = '加载更多';
+                    more.onclick = () => loadHistory(data.nextCursor);
+                    els.historyList.appendChild(more);
+                }
+            } else if (!cursor) {
                 els.historyList.innerHTML = '<li class="px-3 py-2 text-sm text-gray-500 italic">暂无历史记录</li>';
             }
         } catch (e) {
@@ -254,20 +273,41 @@
         }
     }
 
-    function loadChatSession(msg) {
+    async function loadChatSession(msg) {
         hideWelcomeScreen();
         els.chatContainer.innerHTML = ''; // Clear current view
         
         currentConversationId = msg.conversationId;
 
-        // Re-render user message
-        const userEl = createMessageElement(true, msg.message);
-        els.chatContainer.appendChild(userEl.wrapper);
-        
-        // Re-render AI message
-        const aiEl = createMessageElement(false);
-        renderMarkdown(aiEl.bubble, msg.response || '(No response)');
-        els.chatContainer.appendChild(aiEl.wrapper);
+        // 点击时才加载消息正文
+        let messages = [];
+        try {
+            const data = await fetchConversationMessages(msg.conversationId);
+            messages = data.messages || [];
+        } catch (e) {
+            console.error('Conversation load error', e);
+        }
+        if (messages.length === 0) {
+            messages = [
+                { role: 'user', content: msg.message },
+                { role: 'assistant', content: msg.response || '(No response)' }
+            ];
+        }
+
+        messages.forEach(m => {
+            let content = m.content || '';
+            if (m.nodeRef) {
+                content = content.slice(0, m.nodeOffset) + '[节点数据]' + content.slice(m.nodeOffset);
+            }
+            if (m.role === 'user') {
+                const userEl = createMessageElement(true, content);
+                els.chatContainer.appendChild(userEl.wrapper);
+            } else if (m.role === 'assistant') {
+                const aiEl = createMessageElement(false);
+                renderMarkdown(aiEl.bubble, content || '(No response)');
+                els.chatContainer.appendChild(aiEl.wrapper);
+            }
+        });
         
         autoScroll = true;
         scrollToBottom();
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+测试请求取消（backend/cancellation.py）：CancelScope 回调顺序与取消后注册、子作用域、按 requestId / conversationId 取消
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from cancellation import CancelScope, RequestRegistry
+
+
+def test_callbacks_run_in_registration_order_once():
+    """cancel() 按注册顺序调用回调，只生效一次"""
+    scope = CancelScope()
+    order = []
+    for i in range(3):
+        scope.add(lambda i=i: order.append(i))
+    assert scope.cancel('stop')
+    assert not scope.cancel('again')
+    assert order == [0, 1, 2]
+    assert scope.cancelled and scope.reason == 'stop'
+
+
+def test_add_after_cancel_fires_immediately():
+    """已取消的作用域上注册的回调立即调用"""
+    scope = CancelScope()
+    scope.cancel()
+    fired = []
+    callback = scope.add(lambda: fired.append(True))
+    assert fired == [True]
+    assert callable(callback)
+
+
+def test_removed_callback_not_called_and_errors_isolated():
+    """移除的回调不再调用；某个回调出错不影响后面的回调"""
+    scope = CancelScope()
+    fired = []
+    removed = scope.add(lambda: fired.append('removed'))
+
+    def broken():
+        raise RuntimeError("boom")
+
+    scope.add(broken)
+    scope.add(lambda: fired.append('last'))
+    scope.remove(removed)
+    scope.cancel()
+    assert fired == ['last']
+
+
+def test_child_cancelled_with_parent_only():
+    """子作用域随父作用域取消，取消子作用域不影响父作用域"""
+    parent = CancelScope()
+    first, second = parent.child(), parent.child()
+    first.cancel()
+    assert not parent.cancelled and not second.cancelled
+    parent.cancel()
+    assert second.cancelled
+    late = parent.child()
+    assert late.cancelled
+
+
+def test_registry_cancel_by_request_id():
+    """按 requestId 只取消对应请求"""
+    registry = RequestRegistry()
+    rid_a, scope_a = registry.register('a', 'conv')
+    rid_b, scope_b = registry.register('b', 'conv')
+    assert registry.cancel(request_id='a') == ['a']
+    assert scope_a.cancelled and not scope_b.cancelled
+    assert registry.cancel(request_id='a') == []
+    assert registry.cancel(request_id='missing') == []
+
+
+def test_registry_cancel_by_conversation_id():
+    """按 conversationId 取消该对话所有进行中的请求"""
+    registry = RequestRegistry()
+    _, scope_a = registry.register('a', 'conv-1')
+    _, scope_b = registry.register('b', 'conv-1')
+    _, scope_c = registry.register('c', 'conv-2')
+    assert sorted(registry.cancel(conversation_id='conv-1', reason='user')) == ['a', 'b']
+    assert scope_a.reason == 'user' and scope_b.cancelled
+    assert not scope_c.cancelled
+    assert registry.info()['cancelled'] == 2
+
+
+def test_registry_reused_request_id_and_unregister():
+    """重用 requestId 时取消旧请求；unregister 只移除自己登记的作用域"""
+    registry = RequestRegistry()
+    _, old = registry.register('a', 'conv')
+    _, new = registry.register('a', 'conv')
+    assert old.cancelled and old.reason == 'replaced'
+    registry.unregister('a', old)
+    assert registry.info()['active'] == 1
+    registry.unregister('a', new)
+    assert registry.info()['active'] == 0
+    assert registry.cancel(conversation_id='conv') == []
+    generated, _ = registry.register()
+    assert generated
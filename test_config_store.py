@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+测试 config.json 统一读写器（backend/config_store.py）：并发修改合并落盘、临时文件 + os.replace 原子写入、写后读与 flush 之后的修改
+"""
+
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from config_store import ConfigStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps({'ai': {'provider': 'DEEPSEEK'}}), encoding='utf-8')
+    store = ConfigStore(str(path), flush_delay=0.1)
+    yield store
+    store.stop()
+
+
+def _load(store):
+    with open(store.path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _set(key, value):
+    def mutator(config):
+        config.setdefault('ai', {})[key] = value
+    return mutator
+
+
+def test_concurrent_updates_coalesce_into_one_write(store):
+    """合并窗口内来自多个线程的修改只落盘一次，且全部保留"""
+    start = threading.Barrier(8)
+
+    def worker(i):
+        start.wait()
+        store.update(_set(f'k{i}', i), source=f'worker-{i}')
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(2.0)
+    assert store.version == 8
+    assert store.flush()
+    assert store.write_count == 1
+    saved = _load(store)['ai']
+    assert saved['provider'] == 'DEEPSEEK'
+    assert {saved[f'k{i}'] for i in range(8)} == set(range(8))
+
+
+def test_read_after_write_before_flush(store):
+    """修改立即对读取方可见，不必等待落盘"""
+    store.update(_set('model', 'deepseek-chat'))
+    assert store.get('ai', 'model') == 'deepseek-chat'
+    assert _load(store)['ai'].get('model') is None
+    assert store.flush()
+    assert _load(store)['ai']['model'] == 'deepseek-chat'
+
+
+def test_read_returns_copy(store):
+    """read() / get() 返回深拷贝，修改返回值不影响存储"""
+    config = store.read()
+    config['ai']['provider'] = 'OLLAMA'
+    store.get('ai')['provider'] = 'OLLAMA'
+    assert store.get('ai', 'provider') == 'DEEPSEEK'
+
+
+def test_failed_mutator_leaves_config_unchanged(store):
+    """mutator 抛出异常时配置和版本号保持不变"""
+    def broken(config):
+        config['ai']['provider'] = 'OLLAMA'
+        raise ValueError("bad")
+
+    with pytest.raises(ValueError):
+        store.update(broken)
+    assert store.version == 0
+    assert store.get('ai', 'provider') == 'DEEPSEEK'
+
+
+def test_writes_after_flush(store):
+    """flush 之后的修改再次落盘，订阅者按版本收到每次落盘的配置"""
+    seen = []
+    store.subscribe(lambda version, config: seen.append((version, config['ai'].get('n'))))
+    first = store.update(_set('n', 1))
+    assert store.flush(first)
+    second = store.update(_set('n', 2))
+    assert store.flush(second)
+    assert store.write_count == 2
+    assert _load(store)['ai']['n'] == 2
+    assert seen == [(1, 1), (2, 2)]
+
+
+def test_atomic_replace_keeps_old_file_on_failure(store, monkeypatch):
+    """写入经临时文件 + os.replace；替换失败时原文件保持完整，临时文件被清理"""
+    replaced = []
+    real_replace = os.replace
+
+    def failing_replace(src, dst):
+        replaced.append((os.path.basename(src), dst))
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    store.update(_set('model', 'x'))
+    assert not store.flush(timeout=0.5)
+    assert replaced and replaced[0][0].startswith('.config.') and replaced[0][1] == store.path
+    assert _load(store) == {'ai': {'provider': 'DEEPSEEK'}}
+    assert [name for name in os.listdir(os.path.dirname(store.path)) if name.endswith('.tmp')] == []
+    monkeypatch.setattr(os, 'replace', real_replace)
+    assert store.flush(timeout=3.0)
+    assert _load(store)['ai']['model'] == 'x'
+
+
+def test_external_edit_reloaded_when_nothing_pending(store):
+    """没有待写修改时，文件被外部修改后重新读取"""
+    assert store.get('ai', 'provider') == 'DEEPSEEK'
+    with open(store.path, 'w', encoding='utf-8') as f:
+        json.dump({'ai': {'provider': 'OLLAMA'}}, f)
+    os.utime(store.path, (os.path.getmtime(store.path) + 5,) * 2)
+    assert store.get('ai', 'provider') == 'OLLAMA'
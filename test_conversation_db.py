@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+测试对话持久化（backend/conversation_db.py）：游标分页在插入新数据时保持稳定、最后一页边界、缓存淘汰后从数据库回填
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from conversation_db import ConversationDB
+from conversation_cache import ConversationCache
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = ConversationDB(str(tmp_path / 'conversations.db'))
+    yield db
+    db.close()
+
+
+def _ids(items):
+    return [item['id'] for item in items]
+
+
+def _all_conversations(db, limit, cursor=None):
+    """从 cursor 开始翻到最后一页，返回所有对话 id"""
+    items, cursor = db.list_conversations(limit=limit, cursor=cursor)
+    ids = _ids(items)
+    while cursor is not None:
+        items, cursor = db.list_conversations(limit=limit, cursor=cursor)
+        ids += _ids(items)
+    return ids
+
+
+def test_conversation_cursor_stable_across_inserts(db):
+    """翻页过程中新建的对话出现在首页，不会让后续页重复或遗漏已有对话"""
+    for i in range(7):
+        db.create(f'c{i}')
+    assert db.flush()
+    expected = _all_conversations(db, limit=100)
+    assert len(expected) == 7
+    first, cursor = db.list_conversations(limit=3)
+    for i in range(3):
+        db.create(f'new{i}')
+    assert db.flush()
+    rest = _all_conversations(db, limit=3, cursor=cursor)
+    assert _ids(first) + rest == expected
+    assert _all_conversations(db, limit=100)[:3] == ['new2', 'new1', 'new0']
+
+
+def test_conversation_last_page_boundary(db):
+    """总数恰好是页大小的整数倍时，最后一页不返回游标，也不会多出一页空页"""
+    for i in range(6):
+        db.create(f'c{i}')
+    assert db.flush()
+    items, cursor = db.list_conversations(limit=6)
+    assert len(items) == 6 and cursor is None
+    items, cursor = db.list_conversations(limit=3)
+    assert len(items) == 3 and cursor is not None
+    items, cursor = db.list_conversations(limit=3, cursor=cursor)
+    assert len(items) == 3 and cursor is None
+
+
+def test_message_pages_stable_across_appends(db):
+    """消息按 seq 翻页，翻页过程中追加的新消息不影响更早的页"""
+    for i in range(5):
+        db.append_message('c', {'role': 'user', 'content': f'm{i}'})
+    assert db.flush()
+    page, before = db.get_messages_page('c', limit=2)
+    assert [m['content'] for m in page] == ['m3', 'm4']
+    db.append_message('c', {'role': 'assistant', 'content': 'late'})
+    assert db.flush()
+    page, before = db.get_messages_page('c', before=before, limit=2)
+    assert [m['content'] for m in page] == ['m1', 'm2']
+    page, before = db.get_messages_page('c', before=before, limit=2)
+    assert [m['content'] for m in page] == ['m0'] and before is None
+    page, before = db.get_messages_page('c', before=3, limit=3)
+    assert [m['content'] for m in page] == ['m0', 'm1', 'm2'] and before is None
+
+
+def test_reload_after_cache_eviction(db):
+    """缓存淘汰的对话从数据库回填，节点数据、摘要与统计保持不变"""
+    cache = ConversationCache(max_conversations=1)
+    cache.attach(db)
+    node_text = '{"nodes": [{"name": "Noise Texture"}]}'
+    cache.append('a', 'system', f"节点数据:\n{node_text}\n请分析", node_text)
+    cache.append('a', 'user', '这个节点做什么？')
+    cache.set_summary('a', '讨论噪声纹理', upto=1)
+    cache.set_stats('a', {'requests': 2})
+    before = cache.messages('a')
+    cache.append('b', 'user', 'hi')
+    assert cache.evictions == 1
+    assert db.flush()
+    assert cache.usage()['conversations'] == 1
+    assert cache.messages('a') == before
+    assert cache.node_context('a') == node_text
+    assert cache.get_summary_state('a') == ('讨论噪声纹理', 1)
+    assert cache.get_stats('a') == {'requests': 2}
+    assert cache.db_loads == 1
+
+
+def test_reload_rebuilds_missing_node_context(db):
+    """node_contexts 中缺少节点数据时，用仍在内存中的同一份节点数据回填并补写数据库"""
+    cache = ConversationCache(max_conversations=2)
+    cache.attach(db)
+    node_text = '{"nodes": [{"name": "Principled BSDF"}]}'
+    cache.append('a', 'system', f"节点数据:\n{node_text}", node_text)
+    before = cache.messages('a')
+    cache.append('b', 'system', f"节点数据:\n{node_text}", node_text)
+    cache.append('c', 'user', 'hi')
+    assert cache.evictions == 1 and cache.db_loads == 0
+    assert db.flush()
+    node_ref = cache.nodes.key(node_text)
+    conn = db._reader()
+    conn.execute("DELETE FROM node_contexts WHERE hash = ?", (node_ref,))
+    conn.commit()
+    assert db.get_node_context(node_ref) is None
+    assert cache.messages('a') == before
+    assert db.flush()
+    assert db.get_node_context(node_ref) == node_text
+
+
+def test_reload_without_node_context_keeps_message_text(db):
+    """节点数据无处可补时，消息按不含节点数据加载"""
+    cache = ConversationCache(max_conversations=1)
+    cache.attach(db)
+    node_text = '{"nodes": []}'
+    cache.append('a', 'system', f"节点数据:\n{node_text}\n请分析", node_text)
+    cache.append('b', 'user', 'hi')
+    assert db.flush()
+    conn = db._reader()
+    conn.execute("DELETE FROM node_contexts")
+    conn.commit()
+    assert cache.messages('a') == [{'role': 'system', 'content': "节点数据:\n\n请分析"}]
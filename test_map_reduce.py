@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+测试超大节点树的分块 (backend/map_reduce.py)：按框与连通分量分组、跨分块连线、分块数超过上限时放大分块
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import map_reduce
+
+
+def _node(name, parent=None, size=700, node_type='ShaderNodeMath'):
+    node = {'name': name, 'type': node_type, 'pad': 'x' * size}
+    if parent:
+        node['parent'] = parent
+    return node
+
+
+def _link(a, b):
+    return {'from_node': a, 'from_socket': 'Value', 'to_node': b, 'to_socket': 'Value'}
+
+
+def _tree(nodes, links=()):
+    return json.dumps({'node_tree_type': 'ShaderNodeTree', 'nodes': nodes, 'links': list(links)})
+
+
+def _names(chunk):
+    return {n['name'] for n in chunk.nodes}
+
+
+def test_frames_stay_together():
+    """同一个顶层框（含嵌套框）中的节点在同一块"""
+    nodes = [
+        _node('Frame A', size=10, node_type='NodeFrame'),
+        _node('Frame A.inner', parent='Frame A', size=10, node_type='NodeFrame'),
+        _node('a1', parent='Frame A'),
+        _node('b1', parent='Frame B'),
+        _node('a2', parent='Frame A.inner'),
+        _node('Frame B', size=10, node_type='NodeFrame'),
+        _node('b2', parent='Frame B'),
+    ]
+    plan = map_reduce.partition(_tree(nodes), chunk_chars=2000)
+    assert plan is not None
+    groups = [_names(chunk) for chunk in plan.chunks]
+    assert {'Frame A', 'Frame A.inner', 'a1', 'a2'} in groups
+    assert {'Frame B', 'b1', 'b2'} in groups
+    assert plan.total_nodes == len(nodes)
+    assert [chunk.index for chunk in plan.chunks] == list(range(len(plan.chunks)))
+
+
+def test_unframed_nodes_grouped_by_component():
+    """未分框的节点按连线合并为连通分量"""
+    nodes = [_node('c1'), _node('d1'), _node('c2'), _node('d2')]
+    plan = map_reduce.partition(_tree(nodes, [_link('c1', 'c2'), _link('d1', 'd2')]), chunk_chars=2000)
+    groups = [_names(chunk) for chunk in plan.chunks]
+    assert sorted(groups, key=sorted) == [{'c1', 'c2'}, {'d1', 'd2'}]
+    assert plan.cross_links == []
+
+
+def test_small_units_packed_in_order():
+    """相邻的小单元打包到同一块"""
+    nodes = [_node(f'n{i}', size=250) for i in range(6)]
+    plan = map_reduce.partition(_tree(nodes), chunk_chars=1000)
+    assert [[n['name'] for n in chunk.nodes] for chunk in plan.chunks] == [['n0', 'n1', 'n2'], ['n3', 'n4', 'n5']]
+
+
+def test_cross_links_recorded_on_both_chunks():
+    """跨分块的连线记入 cross_links 和两端分块的 external_links；另一端不在数据中的连线留在块内"""
+    nodes = [_node('a1', parent='Frame A'), _node('a2', parent='Frame A'), _node('b1', parent='Frame B'),
+             _node('b2', parent='Frame B'), _node('Frame A', size=10, node_type='NodeFrame'),
+             _node('Frame B', size=10, node_type='NodeFrame')]
+    inner, cross, dangling = _link('a1', 'a2'), _link('a2', 'b1'), _link('b2', 'Group Output')
+    plan = map_reduce.partition(_tree(nodes, [inner, cross, dangling]), chunk_chars=2000)
+    assert len(plan.chunks) == 2
+    chunk_a = next(c for c in plan.chunks if 'a1' in _names(c))
+    chunk_b = next(c for c in plan.chunks if 'b1' in _names(c))
+    assert plan.cross_links == [(chunk_a, cross, chunk_b)]
+    assert chunk_a.external_links == [cross] and chunk_b.external_links == [cross]
+    assert chunk_a.links == [inner]
+    assert chunk_b.links == [dangling]
+    overview = plan.overview({chunk_a.index: ('A 部分负责噪声', '')})
+    assert 'A 部分负责噪声' in overview
+    assert '该部分分析失败' in overview
+    assert f"[Part {chunk_a.index + 1}] a2.Value -> [Part {chunk_b.index + 1}] b1.Value" in overview
+
+
+def test_oversized_unit_split():
+    """超过 chunk_chars 的连通分量按连线顺序切成多段"""
+    nodes = [_node(f'n{i}') for i in range(4)]
+    links = [_link('n0', 'n1'), _link('n1', 'n2'), _link('n2', 'n3')]
+    plan = map_reduce.partition(_tree(nodes, links), chunk_chars=1800)
+    assert len(plan.chunks) == 2
+    assert plan.chunks[0].label.endswith('(1/2)')
+    assert len(plan.cross_links) == 1
+
+
+def test_max_chunks_grows_chunk_size():
+    """分块数超过 max_chunks 时放大 chunk_chars 重新拆分"""
+    nodes = [_node(f'n{i}', size=1200) for i in range(10)]
+    assert len(map_reduce.partition(_tree(nodes), chunk_chars=1000, max_chunks=16).chunks) == 10
+    plan = map_reduce.partition(_tree(nodes), chunk_chars=1000, max_chunks=4)
+    assert 2 <= len(plan.chunks) <= 4
+    assert plan.total_nodes == 10
+    assert sorted(n['name'] for chunk in plan.chunks for n in chunk.nodes) == sorted(n['name'] for n in nodes)
+
+
+def test_not_partitioned():
+    """无法解析或只有一块时返回 None"""
+    assert map_reduce.partition('not json') is None
+    assert map_reduce.partition(json.dumps({'nodes': []})) is None
+    assert map_reduce.partition(_tree([_node('a'), _node('b')]), chunk_chars=12000) is None
+
+
+def test_selected_nodes_format():
+    """选中节点格式 {selected_nodes, connections} 同样支持"""
+    data = json.dumps({'selected_nodes': [_node('a'), _node('b')], 'connections': [_link('a', 'b')]})
+    plan = map_reduce.partition(data, chunk_chars=1000)
+    assert len(plan.chunks) == 2
+    assert len(plan.cross_links) == 1
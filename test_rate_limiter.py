@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+测试按 API Key 的速率限制（backend/rate_limiter.py）：时长与 Retry-After 解析、令牌桶等待时间、限流头与重试退避
+"""
+
+import os
+import sys
+import time
+from email.utils import formatdate
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from rate_limiter import RateLimiter, TokenBucket, parse_duration, parse_retry_after, estimate_tokens
+
+
+def _spec(provider='DEEPSEEK', api_key='sk-test', content='hello'):
+    return {
+        'name': provider.title(),
+        'provider': provider,
+        'headers': {'Authorization': f'Bearer {api_key}'},
+        'json': {'messages': [{'role': 'user', 'content': content}]},
+    }
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('20', 20.0),
+    ('1.5', 1.5),
+    ('6m0s', 360.0),
+    ('1h2m3s', 3723.0),
+    ('250ms', 0.25),
+    ('-3', 0.0),
+    ('soon', None),
+    (None, None),
+])
+def test_parse_duration(value, expected):
+    if expected is None:
+        assert parse_duration(value) is None
+    else:
+        assert parse_duration(value) == pytest.approx(expected)
+
+
+def test_parse_retry_after_seconds_and_case():
+    """头名称不区分大小写"""
+    assert parse_retry_after({'Retry-After': '7'}) == 7.0
+    assert parse_retry_after({'retry-after': '0.5'}) == 0.5
+    assert parse_retry_after({}) is None
+
+
+def test_parse_retry_after_http_date():
+    """HTTP 日期格式换算成距离现在的秒数；过去的日期为 0"""
+    delay = parse_retry_after({'Retry-After': formatdate(time.time() + 30, usegmt=True)})
+    assert 25 <= delay <= 31
+    assert parse_retry_after({'Retry-After': formatdate(time.time() - 30, usegmt=True)}) == 0.0
+    assert parse_retry_after({'Retry-After': 'not a date'}) is None
+
+
+def test_estimate_tokens():
+    """中文约 1 token/字，ASCII 约 4 字符/token"""
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('节点') == 2
+    assert estimate_tokens('a' * 40) == 10
+
+
+def test_token_bucket_wait():
+    """预占超过余额时返回补足差额所需的秒数"""
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    assert bucket.reserve(60, now) == 0.0
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+    assert bucket.reserve(2, now) == pytest.approx(3.0)
+    # 过 3 秒补回 3 个令牌，余额回到 0
+    assert bucket.reserve(0, now + 3.0) == 0.0
+
+
+def test_token_bucket_caps_reservation_at_rate():
+    """单次预占最多一分钟的额度，超大请求也不会等待超过一分钟"""
+    bucket = TokenBucket(100)
+    now = bucket.updated
+    assert bucket.reserve(1000, now) == 0.0
+    assert bucket.reserve(1000, now) == pytest.approx(60.0)
+
+
+def test_admit_waits_per_key():
+    """rpm 用完后同一 Key 需要等待，另一个 Key 不受影响"""
+    limiter = RateLimiter(limits={'DEEPSEEK': {'rpm': 60}})
+    for _ in range(60):
+        assert limiter._reserve(_spec(), 0) == 0.0
+    assert limiter._reserve(_spec(), 0) == pytest.approx(1.0, abs=0.05)
+    assert limiter._reserve(_spec(api_key='sk-other'), 0) == 0.0
+    keys = limiter.info()['keys']
+    assert keys['DEEPSEEK/…test']['throttled'] == 1
+
+
+def test_unconfigured_provider_not_limited():
+    """没有配置上限的提供商（如 Ollama）不限速"""
+    limiter = RateLimiter(limits={'DEEPSEEK': {'rpm': 1}})
+    for _ in range(5):
+        assert limiter._reserve(_spec(provider='OLLAMA'), 1000) == 0.0
+
+
+def test_observe_429_slows_down_and_blocks():
+    """429 时降低速率并按 Retry-After 暂停"""
+    limiter = RateLimiter(limits={'DEEPSEEK': {'rpm': 60, 'tpm': 1000}})
+    spec = _spec()
+    limiter._reserve(spec, 10)
+    limiter.observe(spec, 429, {'Retry-After': '2'})
+    info = limiter.info()['keys']['DEEPSEEK/…test']
+    assert info['factor'] == 0.5
+    assert info['rpm'] == 30.0
+    assert info['rate_limited'] == 1
+    assert 1.5 < limiter._reserve(spec, 0) <= 2.0
+    # 成功请求逐步恢复
+    limiter.observe(spec, 200, {})
+    assert limiter.info()['keys']['DEEPSEEK/…test']['factor'] == 0.55
+
+
+def test_observe_remaining_headers():
+    """剩余额度为 0 且给出重置时间时暂停到重置"""
+    limiter = RateLimiter(limits={'DEEPSEEK': {'rpm': 60}})
+    spec = _spec()
+    limiter.observe(spec, 200, {'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '5s'})
+    assert 4.5 < limiter._reserve(spec, 0) <= 5.0
+
+
+def test_retry_delay():
+    """Retry-After 优先，否则指数退避；非重试状态或重试用尽时返回 None"""
+    limiter = RateLimiter(max_retries=2, backoff_base=1.0, backoff_max=30.0, max_wait=60.0)
+    spec = _spec()
+    assert limiter.retry_delay(spec, 429, {'Retry-After': '3'}, 0) == 3.0
+    assert 1.0 <= limiter.retry_delay(spec, 503, {}, 0) <= 2.0
+    assert 2.0 <= limiter.retry_delay(spec, 503, {}, 1) <= 3.0
+    assert limiter.retry_delay(spec, 429, {}, 2) is None
+    assert limiter.retry_delay(spec, 500, {}, 0) is None
+    assert RateLimiter(max_wait=5.0).retry_delay(spec, 429, {'Retry-After': '120'}, 0) == 5.0
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+测试回复缓存（backend/response_cache.py）：缓存键的规范化与区分、内存 LRU 层、磁盘层回填与 TTL、磁盘总大小上限
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import response_cache as response_cache_module
+from response_cache import ResponseCache, make_key
+from stream_events import StreamEvent, chunk
+
+SETTINGS = {'deepseek_model': 'deepseek-chat', 'temperature': 0.7, 'top_p': 0.9}
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("等待超时")
+        time.sleep(0.005)
+
+
+def _outputs(text):
+    return [chunk(text), StreamEvent('usage', '', {'prompt_tokens': 1, 'completion_tokens': 2})]
+
+
+def _cached_files(cache):
+    return sorted(name for name in os.listdir(cache.directory) if name.endswith('.json'))
+
+
+def test_key_ignores_whitespace_differences():
+    """行尾空白、连续空格与 CRLF 不影响缓存键"""
+    a = make_key('DEEPSEEK', SETTINGS, [{'role': 'user', 'content': 'Noise  Texture\r\nscale \n'}])
+    b = make_key('DEEPSEEK', SETTINGS, [{'role': 'user', 'content': 'Noise Texture\nscale'}])
+    assert a == b
+
+
+@pytest.mark.parametrize('provider, settings, messages', [
+    ('OLLAMA', SETTINGS, [{'role': 'user', 'content': 'hi'}]),
+    ('DEEPSEEK', {**SETTINGS, 'deepseek_model': 'deepseek-reasoner'}, [{'role': 'user', 'content': 'hi'}]),
+    ('DEEPSEEK', {**SETTINGS, 'temperature': 0.2}, [{'role': 'user', 'content': 'hi'}]),
+    ('DEEPSEEK', {**SETTINGS, 'thinking_enabled': True}, [{'role': 'user', 'content': 'hi'}]),
+    ('DEEPSEEK', SETTINGS, [{'role': 'system', 'content': 'hi'}]),
+    ('DEEPSEEK', SETTINGS, [{'role': 'user', 'content': 'hi'}, {'role': 'user', 'content': ''}]),
+])
+def test_key_distinguishes_generation_parameters(provider, settings, messages):
+    """提供商、模型、采样参数、能力开关、角色与消息数不同时键不同"""
+    base = make_key('DEEPSEEK', SETTINGS, [{'role': 'user', 'content': 'hi'}])
+    assert make_key(provider, settings, messages) != base
+
+
+def test_memory_lru_by_entries_and_bytes(tmp_path):
+    """内存层按最近使用淘汰，条目数与字节数都有上限"""
+    cache = ResponseCache(str(tmp_path), max_entries=2, disk_max_bytes=0)
+    cache.put('a', _outputs('a'))
+    cache.put('b', _outputs('b'))
+    assert cache.get('a')[0].content == 'a'
+    cache.put('c', _outputs('c'))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    cache.configure(max_bytes=_outputs('x')[0].size() + _outputs('x')[1].size())
+    assert cache.info()['memory_entries'] == 1
+    assert cache.stats['evictions'] == 2
+
+
+def test_disk_tier_refills_memory(tmp_path):
+    """另一个实例（如重启后）从磁盘层读到缓存并回填内存层"""
+    writer = ResponseCache(str(tmp_path))
+    writer.put('k', _outputs('节点'), meta={'provider': 'DEEPSEEK'})
+    _wait_until(lambda: _cached_files(writer) == ['k.json'])
+    reader = ResponseCache(str(tmp_path))
+    outputs = reader.get('k')
+    assert [(o.kind, o.content, o.data) for o in outputs] == [(o.kind, o.content, o.data) for o in _outputs('节点')]
+    assert reader.get('k') is not None
+    assert reader.stats['disk_hits'] == 1 and reader.stats['memory_hits'] == 1
+
+
+def test_ttl_expires_both_tiers(tmp_path):
+    """超过 TTL 的条目在内存层与磁盘层都视为未命中"""
+    cache = ResponseCache(str(tmp_path), ttl=0.05)
+    cache.put('k', _outputs('a'))
+    _wait_until(lambda: _cached_files(cache) == ['k.json'])
+    time.sleep(0.1)
+    assert cache.get('k') is None
+    assert cache.stats['misses'] == 1
+    assert cache.info()['memory_entries'] == 0
+
+
+def test_disk_prunes_oldest_only_when_over_limit(tmp_path, monkeypatch):
+    """磁盘层累计写入大小，未超过上限时不扫描目录；超过上限时从最旧的文件开始删除"""
+    listed = []
+    real_listdir = os.listdir
+    monkeypatch.setattr(response_cache_module.os, 'listdir', lambda path: listed.append(path) or real_listdir(path))
+    cache = ResponseCache(str(tmp_path), disk_max_bytes=10 ** 6)
+    for i in range(5):
+        cache.put(f'k{i}', _outputs('x' * 100))
+        _wait_until(lambda: cache.info()['disk_entries'] == i + 1)
+    assert len(listed) == 1
+    size = cache.info()['disk_bytes'] // 5
+
+    cache.configure(disk_max_bytes=size * 5)
+    cache.put('k5', _outputs('x' * 100))
+    _wait_until(lambda: len(listed) == 2)
+    _wait_until(lambda: 'k5.json' in _cached_files(cache))
+    files = _cached_files(cache)
+    assert 'k0.json' not in files and 'k5.json' in files
+    assert cache.info()['disk_bytes'] <= size * 5
+    assert cache.info()['disk_entries'] == len(files)
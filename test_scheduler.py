@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+测试提供商请求调度（backend/scheduler.py）：优先级出队、队列满时挤掉最低优先级、排队超时
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from scheduler import ProviderScheduler, SchedulerBusy, INTERACTIVE, SUMMARIZATION, DIAGNOSTICS, BATCH
+
+
+def _queued(scheduler, provider):
+    """排队中的请求数加上被拒绝的次数：每个新请求入队（或挤掉别人）都会使它增加"""
+    lane = scheduler.info()['providers'].get(provider)
+    if lane is None:
+        return 0
+    return lane['queue_depth'] + sum(c['rejected'] for c in lane['classes'].values())
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("等待超时")
+        time.sleep(0.005)
+
+
+class _Queued:
+    """在线程中排队申请名额，记录放行顺序或拒绝原因"""
+
+    def __init__(self, scheduler, provider, priority, order):
+        self.error = None
+        before = _queued(scheduler, provider)
+
+        def run():
+            try:
+                scheduler.acquire(provider, priority)
+            except SchedulerBusy as e:
+                self.error = e
+                return
+            order.append(priority)
+            scheduler.release(provider)
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        # 按启动顺序入队
+        _wait_until(lambda: _queued(scheduler, provider) > before or not self.thread.is_alive())
+
+
+def test_priority_order():
+    """名额释放后按优先级出队，同一优先级先到先得"""
+    scheduler = ProviderScheduler(limits={'DEEPSEEK': 1}, queue_timeout=5.0)
+    assert scheduler.acquire('DEEPSEEK', INTERACTIVE)
+    order = []
+    waiters = [_Queued(scheduler, 'DEEPSEEK', priority, order) for priority in (BATCH, DIAGNOSTICS, SUMMARIZATION, INTERACTIVE, BATCH)]
+    scheduler.release('DEEPSEEK')
+    for waiter in waiters:
+        waiter.thread.join(2.0)
+    assert order == [INTERACTIVE, SUMMARIZATION, DIAGNOSTICS, BATCH, BATCH]
+    classes = scheduler.info()['providers']['DEEPSEEK']['classes']
+    assert classes[BATCH]['granted'] == 2
+
+
+def test_full_queue_evicts_lowest_priority():
+    """队列满时更高优先级的请求挤掉队尾优先级最低的请求"""
+    scheduler = ProviderScheduler(limits={'OLLAMA': 1}, max_queue=2, queue_timeout=5.0)
+    assert scheduler.acquire('OLLAMA', INTERACTIVE)
+    order = []
+    batch = _Queued(scheduler, 'OLLAMA', BATCH, order)
+    diagnostics = _Queued(scheduler, 'OLLAMA', DIAGNOSTICS, order)
+    interactive = _Queued(scheduler, 'OLLAMA', INTERACTIVE, order)
+    batch.thread.join(2.0)
+    assert isinstance(batch.error, SchedulerBusy)
+    assert diagnostics.error is None and interactive.error is None
+    scheduler.release('OLLAMA')
+    diagnostics.thread.join(2.0)
+    interactive.thread.join(2.0)
+    assert order == [INTERACTIVE, DIAGNOSTICS]
+    assert scheduler.info()['providers']['OLLAMA']['classes'][BATCH]['rejected'] == 1
+
+
+def test_full_queue_rejects_equal_or_lower_priority():
+    """队列满且没有更低优先级的请求可挤时，新请求直接被拒绝"""
+    scheduler = ProviderScheduler(limits={'OLLAMA': 1}, max_queue=1, queue_timeout=5.0)
+    assert scheduler.acquire('OLLAMA', INTERACTIVE)
+    order = []
+    queued = _Queued(scheduler, 'OLLAMA', SUMMARIZATION, order)
+    with pytest.raises(SchedulerBusy):
+        scheduler.acquire('OLLAMA', BATCH)
+    with pytest.raises(SchedulerBusy):
+        scheduler.acquire('OLLAMA', SUMMARIZATION)
+    scheduler.release('OLLAMA')
+    queued.thread.join(2.0)
+    assert order == [SUMMARIZATION]
+
+
+def test_queue_timeout():
+    """排队超过 queue_timeout 抛出 SchedulerBusy，并从队列中移除"""
+    scheduler = ProviderScheduler(limits={'BIGMODEL': 1}, queue_timeout=0.05)
+    assert scheduler.acquire('BIGMODEL', INTERACTIVE)
+    started = time.time()
+    with pytest.raises(SchedulerBusy):
+        scheduler.acquire('BIGMODEL', DIAGNOSTICS)
+    assert time.time() - started >= 0.05
+    info = scheduler.info()['providers']['BIGMODEL']
+    assert info['queue_depth'] == 0
+    assert info['classes'][DIAGNOSTICS]['rejected'] == 1
+    scheduler.release('BIGMODEL')
+    assert scheduler.info()['providers']['BIGMODEL']['active'] == 0
+
+
+def test_slot_releases_on_error():
+    """slot 内抛出异常也会释放名额"""
+    scheduler = ProviderScheduler(limits={'DEEPSEEK': 1})
+    with pytest.raises(RuntimeError):
+        with scheduler.slot('deepseek', SUMMARIZATION):
+            raise RuntimeError("boom")
+    assert scheduler.info()['providers']['DEEPSEEK']['active'] == 0
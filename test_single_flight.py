@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+测试相同生成请求的合并（backend/single_flight.py）：并发相同请求只调用一次上游、迟到订阅者回放、退订与取消上游
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from single_flight import SingleFlight
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("等待超时")
+        time.sleep(0.005)
+
+
+class _Upstream:
+    """同步上游：每次 release() 放行一个事件，调用次数记在 calls"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.calls = 0
+        self.closed = False
+        self.gate = threading.Semaphore(0)
+
+    def release(self, n=1):
+        for _ in range(n):
+            self.gate.release()
+
+    def start(self, flight):
+        self.calls += 1
+        flight.scope.add(lambda: self.release(len(self.chunks)))
+        flight.start_thread(self._run, flight)
+
+    def _run(self, flight):
+        try:
+            for chunk in self.chunks:
+                self.gate.acquire()
+                if flight.scope.cancelled:
+                    return
+                yield chunk
+        finally:
+            self.closed = True
+
+
+def _collect(flight):
+    return [chunk for chunk in flight.iter_sync(tick=0.05) if chunk is not None]
+
+
+def test_concurrent_identical_keys_share_one_upstream():
+    """N 个并发的相同请求只启动一次上游，每个订阅者收到完整且相同的输出"""
+    registry = SingleFlight()
+    upstream = _Upstream(['a', 'b', 'c'])
+    barrier = threading.Barrier(8)
+    results = {}
+
+    def subscriber(i):
+        barrier.wait()
+        flight, leader = registry.join('key', upstream.start)
+        try:
+            results[i] = (leader, _collect(flight))
+        finally:
+            registry.leave(flight)
+
+    threads = [threading.Thread(target=subscriber, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    _wait_until(lambda: registry.info()['subscribers'] == 8)
+    upstream.release(3)
+    for t in threads:
+        t.join(2.0)
+    assert upstream.calls == 1
+    assert sorted(leader for leader, _ in results.values()) == [False] * 7 + [True]
+    assert all(chunks == ['a', 'b', 'c'] for _, chunks in results.values())
+    assert registry.stats == {"started": 1, "coalesced": 7, "cancelled": 0}
+    assert registry.info()['in_flight'] == 0
+
+
+def test_late_joiner_replays_earlier_chunks():
+    """上游已输出部分事件后加入的订阅者从头回放"""
+    registry = SingleFlight()
+    upstream = _Upstream(['a', 'b', 'c'])
+    first, leader = registry.join('key', upstream.start)
+    assert leader
+    upstream.release(2)
+    _wait_until(lambda: len(first.chunks) == 2)
+    late, leader = registry.join('key', upstream.start)
+    assert late is first and not leader
+    upstream.release()
+    assert _collect(late) == ['a', 'b', 'c']
+    registry.leave(late)
+    registry.leave(first)
+    assert upstream.calls == 1
+
+
+def test_finished_flight_not_joined():
+    """已结束的生成不再合并，新请求重新调用上游"""
+    registry = SingleFlight()
+    upstream = _Upstream(['a'])
+    flight, _ = registry.join('key', upstream.start)
+    upstream.release()
+    assert _collect(flight) == ['a']
+    registry.leave(flight)
+    again, leader = registry.join('key', upstream.start)
+    assert leader and again is not flight
+    upstream.release()
+    registry.leave(again)
+    assert upstream.calls == 2
+
+
+def test_leaving_subscriber_keeps_shared_upstream():
+    """一个订阅者退订时上游继续运行；最后一个订阅者离开时才取消上游"""
+    registry = SingleFlight()
+    upstream = _Upstream(['a', 'b', 'c'])
+    first, _ = registry.join('key', upstream.start)
+    second, _ = registry.join('key', upstream.start)
+    upstream.release()
+    _wait_until(lambda: len(first.chunks) == 1)
+    registry.leave(first)
+    assert not first.cancelled and not first.scope.cancelled
+    upstream.release()
+    _wait_until(lambda: len(second.chunks) == 2)
+    registry.leave(second)
+    assert second.cancelled and second.scope.reason == 'abandoned'
+    _wait_until(lambda: upstream.closed and second.done)
+    assert second.chunks == ['a', 'b']
+    assert registry.stats['cancelled'] == 1
+    assert registry.info()['in_flight'] == 0
+
+
+def test_async_upstream_cancelled_when_abandoned():
+    """事件循环中的上游任务在最后一个订阅者离开后被取消"""
+    registry = SingleFlight()
+    state = {'calls': 0, 'cancelled': False}
+
+    async def upstream():
+        state['calls'] += 1
+        try:
+            yield 'a'
+            await asyncio.sleep(10)
+            yield 'b'
+        except asyncio.CancelledError:
+            state['cancelled'] = True
+            raise
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        start = lambda flight: flight.start_task(loop, upstream())
+        first, _ = registry.join('key', start)
+        second, _ = registry.join('key', start)
+        received = []
+        async for chunk in second.iter_async(loop, tick=0.05):
+            if chunk is not None:
+                received.append(chunk)
+                break
+        registry.leave(first)
+        await asyncio.sleep(0.05)
+        assert not state['cancelled']
+        registry.leave(second)
+        for _ in range(100):
+            if second.done:
+                break
+            await asyncio.sleep(0.01)
+        return received, second
+
+    received, flight = asyncio.run(main())
+    assert received == ['a']
+    assert state == {'calls': 1, 'cancelled': True}
+    assert flight.done and flight.cancelled
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+测试增量流解析器（backend/stream_parser.py）：跨块拆分、SSE 分帧与解析错误统计
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import providers
+from stream_parser import SSEParser, NDJSONParser, ProviderStream, parse_stats
+
+
+def _deepseek_spec():
+    spec, error = providers.deepseek_request([{'role': 'user', 'content': 'hi'}], {'deepseek_api_key': 'k'})
+    assert error is None
+    return spec
+
+
+def _chunk(text):
+    return 'data: ' + json.dumps({'choices': [{'delta': {'content': text}}]}, ensure_ascii=False) + '\n\n'
+
+
+def _parts(outputs):
+    return [(o.kind, o.content) for o in outputs]
+
+
+def _feed_all(stream, chunks):
+    outputs = []
+    for chunk in chunks:
+        items, done = stream.feed(chunk)
+        outputs.extend(items)
+        if done:
+            return outputs, True
+    items, done = stream.close()
+    outputs.extend(items)
+    return outputs, done
+
+
+def test_multibyte_character_split_across_chunks():
+    """多字节字符被拆在两个网络块之间时不产生乱码"""
+    raw = _chunk('节点分析').encode('utf-8')
+    cut = raw.index('节'.encode('utf-8')) + 1
+    outputs, _ = _feed_all(ProviderStream(_deepseek_spec()), [raw[:cut], raw[cut:]])
+    assert ''.join(content for kind, content in _parts(outputs) if kind == 'chunk') == '节点分析'
+
+
+def test_multibyte_split_on_every_byte():
+    """逐字节输入也能还原完整正文"""
+    raw = (_chunk('你好') + _chunk('，世界') + 'data: [DONE]\n\n').encode('utf-8')
+    outputs, done = _feed_all(ProviderStream(_deepseek_spec()), [raw[i:i + 1] for i in range(len(raw))])
+    assert done
+    assert ''.join(content for kind, content in _parts(outputs) if kind == 'chunk') == '你好，世界'
+
+
+def test_crlf_split_across_chunks():
+    """'\\r\\n' 被拆在两个块之间时不会多出一个空行（否则会提前结束事件）"""
+    parser = SSEParser()
+    events = parser.feed(b'data: a\r')
+    events += parser.feed(b'\ndata: b\r\n\r')
+    events += parser.feed(b'\n')
+    assert events == [('message', 'a\nb')]
+
+
+def test_multiline_data_joined_with_newline():
+    """同一事件的多行 data 以换行拼接，注释行忽略"""
+    parser = SSEParser()
+    events = parser.feed(b': keep-alive\ndata: first\ndata:second\n\n')
+    assert events == [('message', 'first\nsecond')]
+
+
+def test_event_field_and_close_without_blank_line():
+    """支持 event 字段；流结束时派发没有以空行结束的事件"""
+    parser = SSEParser()
+    assert parser.feed(b'event: error\ndata: quota exceeded') == []
+    assert parser.close() == [('error', 'quota exceeded')]
+
+
+def test_error_event_becomes_error_output():
+    """event: error 输出为 error 事件，不交给 parse_event"""
+    outputs, _ = _feed_all(ProviderStream(_deepseek_spec()), [b'event: error\ndata: overloaded\n\n'])
+    [(kind, content)] = _parts(outputs)
+    assert kind == 'error'
+    assert 'overloaded' in content
+
+
+def test_malformed_json_is_counted():
+    """无法解析的数据计入错误数，后续事件照常解析"""
+    before = parse_stats['errors']
+    stream = ProviderStream(_deepseek_spec())
+    outputs, _ = _feed_all(stream, [b'data: {not json\n\n', _chunk('ok').encode('utf-8')])
+    assert stream.errors == 1
+    assert parse_stats['errors'] == before + 1
+    assert _parts(outputs) == [('chunk', 'ok')]
+
+
+def test_multiple_json_in_one_event_retried_per_line():
+    """一个事件里放了多个 JSON 时逐行再解析"""
+    data = 'data: ' + json.dumps({'choices': [{'delta': {'content': 'a'}}]}) + '\ndata: ' + json.dumps({'choices': [{'delta': {'content': 'b'}}]}) + '\n\n'
+    stream = ProviderStream(_deepseek_spec())
+    outputs, _ = _feed_all(stream, [data.encode('utf-8')])
+    assert _parts(outputs) == [('chunk', 'a'), ('chunk', 'b')]
+    assert stream.errors == 0
+
+
+def test_done_stops_stream():
+    """[DONE] 之后的数据不再输出"""
+    stream = ProviderStream(_deepseek_spec())
+    outputs, done = stream.feed(('data: [DONE]\n\n' + _chunk('late')).encode('utf-8'))
+    assert done and outputs == []
+    assert stream.feed(_chunk('later').encode('utf-8')) == ([], True)
+
+
+def test_ndjson_lines_and_tail():
+    """NDJSON 按行输出，CRLF 去掉 '\\r'，最后一行在 close 时输出"""
+    parser = NDJSONParser()
+    assert parser.feed(b'{"a": 1}\r\n{"b"') == [('message', '{"a": 1}')]
+    assert parser.feed(b': 2}\n\n{"c": 3}') == [('message', '{"b": 2}')]
+    assert parser.close() == [('message', '{"c": 3}')]